@@ -0,0 +1,16 @@
+import time
+
+__all__ = ['benchmark', 'state_dict_bytes']
+
+
+def benchmark(fn, n_iter=5):
+    """:return: seconds per call, after one untimed call"""
+    fn()
+    begin = time.perf_counter()
+    for _ in range(n_iter):
+        fn()
+    return (time.perf_counter() - begin) / n_iter
+
+
+def state_dict_bytes(model):
+    return sum(v.numel() * v.element_size() for v in model.state_dict().values())
@@ -0,0 +1,32 @@
+"""
+Complexity of a calibrated ResNet-152: the real forward (get_model_complexity_info) against the meta-device
+forward (get_model_complexity_info_meta).
+
+    python -m benchmarks.complexity_meta
+"""
+import time
+
+import torch
+
+import models._modules as my_nn
+from models.imagenet.resnetQ import resnet152
+from utils.ptflops import get_model_complexity_info, get_model_complexity_info_meta
+
+__all__ = ['report']
+
+
+def report():
+    model = resnet152()
+    model.train()
+    my_nn.calibrate(model, torch.randn(2, 3, 224, 224))
+    for name, fn in (('forward', lambda: get_model_complexity_info(model, (3, 224, 224), print_per_layer_stat=False,
+                                                                   with_bops=True)),
+                     ('meta', lambda: get_model_complexity_info_meta(model, (3, 224, 224),
+                                                                     print_per_layer_stat=False))):
+        begin = time.perf_counter()
+        result = fn()
+        print('{:<10}{:>10.1f} ms  {}'.format(name, (time.perf_counter() - begin) * 1e3, result))
+
+
+if __name__ == '__main__':
+    report()
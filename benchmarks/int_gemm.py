@@ -0,0 +1,63 @@
+"""
+Inference of the integer GEMM models (convert_to_int) against their fake-quant and fp32 versions, in
+images/s on CPU.
+
+    python -m benchmarks.int_gemm
+"""
+import copy
+
+import torch
+import torch.nn as nn
+import torchvision
+
+import models._modules as my_nn
+from models.imagenet import resnet18_lsq, alexnet_lsq
+from utils.wrapper import convert_to_int
+from benchmarks.common import benchmark
+
+__all__ = ['cases', 'make_model', 'get_converted', 'report']
+
+
+def make_model(nbits_a):
+    return nn.Sequential(
+        nn.Conv2d(3, 8, 3), nn.ReLU(),
+        my_nn.ActLSQ(nbits=nbits_a), my_nn.Conv2dLSQ(8, 16, 3, padding=1, stride=2, nbits=4,
+                                                     mode=my_nn.Qmodes.kernel_wise),
+        nn.BatchNorm2d(16), nn.ReLU(), nn.MaxPool2d(2),
+        my_nn.ActLLSQ(nbits=nbits_a), my_nn.Conv2dLLSQ(16, 16, 1, nbits=8), nn.ReLU(),
+        my_nn.ActLSQ(nbits=nbits_a), nn.Flatten(), nn.Dropout(), my_nn.LinearLSQ(16 * 4 * 4, 10, nbits=4))
+
+
+def get_converted(model_fn, shape):
+    torch.manual_seed(0)
+    model = model_fn()
+    x = torch.randn(shape)
+    model.train()
+    my_nn.calibrate(model, x)
+    model.eval()
+    return model, convert_to_int(copy.deepcopy(model)), x
+
+
+# name: model, input shape, number of integer layers after the conversion
+cases = {
+    'a4': (lambda: make_model(4), (4, 3, 18, 18), 3),
+    'a8': (lambda: make_model(8), (4, 3, 18, 18), 3),
+    'resnet18_lsq': (lambda: resnet18_lsq(nbits_w=4, nbits_a=4), (2, 3, 224, 224), 18),
+    'alexnet_lsq': (lambda: alexnet_lsq(nbits_w=4, nbits_a=4), (2, 3, 224, 224), 6),
+}
+
+
+def report(batch_size=32):
+    print('{:<20}{:>12}{:>12}{:>12}  (images/s, {} threads)'.format('model', 'fp32', 'fake-quant', 'int8',
+                                                                    torch.get_num_threads()))
+    for name, fp_fn in (('resnet18_lsq', torchvision.models.resnet18), ('alexnet_lsq', torchvision.models.alexnet)):
+        model_fn, shape, _ = cases[name]
+        model, model_int, _ = get_converted(model_fn, shape)
+        x = torch.randn(batch_size, *shape[1:])
+        with torch.no_grad():
+            speed = [batch_size / benchmark(lambda: m(x)) for m in (fp_fn().eval(), model, model_int)]
+        print('{:<20}{:>12.1f}{:>12.1f}{:>12.1f}'.format(name, *speed))
+
+
+if __name__ == '__main__':
+    report()
@@ -0,0 +1,24 @@
+"""
+1-D k-means of a weight: sklearn (k_means_cpu) against the sorted torch implementation (k_means_1d).
+
+    python -m benchmarks.kmeans_1d
+"""
+import torch
+
+from models._modules.cluster_quant import k_means_1d, k_means_cpu
+from benchmarks.common import benchmark
+
+__all__ = ['report']
+
+
+def report(shape=(512, 512, 3, 3)):
+    print('{:<8}{:>14}{:>14}{:>10}'.format('nbits', 'sklearn (ms)', 'torch (ms)', 'speedup'))
+    weight = torch.randn(shape)
+    for nbits in (2, 4, 8):
+        t_sklearn = benchmark(lambda: k_means_cpu(weight.numpy(), 2 ** nbits), 3)
+        t_torch = benchmark(lambda: k_means_1d(weight, 2 ** nbits), 3)
+        print('{:<8}{:>14.1f}{:>14.1f}{:>10.1f}'.format(nbits, t_sklearn * 1e3, t_torch * 1e3, t_sklearn / t_torch))
+
+
+if __name__ == '__main__':
+    report()
@@ -0,0 +1,47 @@
+"""
+Backward of the k-means STE: the per-centroid loops against the scatter-add means (cluster_mean).
+
+    python -m benchmarks.kmeans_ste
+"""
+import torch
+
+from models._modules.cluster_quant import cluster_mean
+from benchmarks.common import benchmark
+
+__all__ = ['reference_backward', 'get_data', 'report']
+
+
+# the per-centroid loops, one full-size mask per centroid
+def reference_backward(grad_weight, centroids, labels):
+    grad_weight_ = torch.zeros_like(grad_weight)
+    grad_centroids = torch.zeros_like(centroids)
+    for j in range(centroids.size(0)):
+        mask_cl = (labels == j).float()
+        grad_weight_ += (grad_weight * mask_cl).sum() / mask_cl.sum() * mask_cl
+        grad_centroids[j] += (grad_weight * mask_cl).sum() / mask_cl.sum()
+    return grad_weight_, grad_centroids
+
+
+def get_data(nbits, shape=(64, 32, 3, 3)):
+    torch.manual_seed(0)
+    num_centroids = 2 ** nbits
+    centroids = torch.randn(num_centroids)
+    # every cluster is used
+    numel = torch.Size(shape).numel()
+    labels = torch.cat([torch.arange(num_centroids), torch.randint(0, num_centroids, (numel - num_centroids,))])
+    labels = labels[torch.randperm(labels.numel())].reshape(shape).float()
+    return centroids, labels
+
+
+def report(shape=(512, 512, 3, 3)):
+    print('{:<8}{:>14}{:>14}{:>10}'.format('nbits', 'loop (ms)', 'scatter (ms)', 'speedup'))
+    for nbits in (2, 4, 8):
+        centroids, labels = get_data(nbits, shape)
+        grad = torch.randn(shape)
+        t_loop = benchmark(lambda: reference_backward(grad, centroids, labels), 3)
+        t_new = benchmark(lambda: cluster_mean(grad, labels, centroids.numel())[labels.long()], 3)
+        print('{:<8}{:>14.2f}{:>14.2f}{:>10.1f}'.format(nbits, t_loop * 1e3, t_new * 1e3, t_loop / t_new))
+
+
+if __name__ == '__main__':
+    report()
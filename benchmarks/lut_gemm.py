@@ -0,0 +1,60 @@
+"""
+Size and inference of the clustered models converted to lookup-table convolutions (convert_to_lut, decode
+and accumulate) against their fake-quant version, in MB and images/s on CPU.
+
+    python -m benchmarks.lut_gemm
+"""
+import copy
+
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from models.cifar10 import cifar10_vggsmall_cluster_q
+from models.cifar100 import cifar100_vggsmall_cluster_q
+from utils.wrapper import convert_to_lut
+from benchmarks.common import benchmark, state_dict_bytes
+
+__all__ = ['cases', 'make_model', 'get_model', 'report']
+
+
+def make_model():
+    return nn.Sequential(
+        my_nn.Conv2dClusterQ(3, 8, 3, padding=1, nbits=2), nn.ReLU(),
+        my_nn.Conv2dClusterQ(8, 8, 3, stride=2, groups=2, bias=False, nbits=4), nn.Flatten(), nn.Linear(8 * 4 * 4, 10))
+
+
+# name: model, input shape, number of lookup-table layers after the conversion
+cases = {
+    'modules': (make_model, (4, 3, 10, 10), 2),
+    'cifar10_vggsmall_cluster_q': (lambda: cifar10_vggsmall_cluster_q(nbits_w=4), (2, 3, 32, 32), 6),
+    'cifar100_vggsmall_cluster_q': (lambda: cifar100_vggsmall_cluster_q(nbits_w=4), (2, 3, 32, 32), 6),
+}
+
+
+def get_model(model_fn, shape):
+    torch.manual_seed(0)
+    model = model_fn()
+    x = torch.randn(shape)
+    model.train()
+    my_nn.calibrate(model, x)
+    model.eval()
+    return model, x
+
+
+def report(batch_size=128):
+    print('{:<28}{:>12}{:>12}{:>12}  (MB / images/s, {} threads)'.format('model', 'fake-quant', 'lut', 'lut-acc',
+                                                                       torch.get_num_threads()))
+    for name in ('cifar10_vggsmall_cluster_q', 'cifar100_vggsmall_cluster_q'):
+        model_fn, shape, _ = cases[name]
+        model, _ = get_model(model_fn, shape)
+        models = (model, convert_to_lut(copy.deepcopy(model)), convert_to_lut(copy.deepcopy(model), accumulate=True))
+        x = torch.randn(batch_size, *shape[1:])
+        with torch.no_grad():
+            speed = [batch_size / benchmark(lambda: m(x)) for m in models]
+        print('{:<28}{:>12.2f}{:>12.2f}{:>12.2f}'.format(name, *[state_dict_bytes(m) / 2 ** 20 for m in models]))
+        print('{:<28}{:>12.1f}{:>12.1f}{:>12.1f}'.format('', *speed))
+
+
+if __name__ == '__main__':
+    report()
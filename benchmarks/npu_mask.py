@@ -0,0 +1,50 @@
+"""
+NPU structured-sparsity mask of the ResNet-50 conv shapes: one topk per 32-channel partition against the
+batched mask (get_npu_structured_sparsity_mask).
+
+    python -m benchmarks.npu_mask
+"""
+import math
+
+import torch
+
+from models._modules.npu_structured_pruner import get_npu_structured_sparsity_mask
+from benchmarks.common import benchmark
+
+__all__ = ['RESNET50_SHAPES', 'reference_mask', 'report']
+
+# the distinct conv shapes of ResNet-50
+RESNET50_SHAPES = [(64, 64, 1, 1), (64, 64, 3, 3), (256, 64, 1, 1), (128, 256, 1, 1), (128, 128, 3, 3),
+                   (512, 128, 1, 1), (256, 512, 1, 1), (256, 256, 3, 3), (1024, 256, 1, 1), (512, 1024, 1, 1),
+                   (512, 512, 3, 3), (2048, 512, 1, 1)]
+
+
+# one topk per 32-channel partition
+def reference_mask(param, non_zero_num, pe_size=32):
+    (out_channel, in_channel, k, k) = param.shape
+    part = math.ceil(in_channel / pe_size)
+    param_reshape = param.transpose(0, 1).reshape(in_channel, -1)
+    mask = torch.zeros_like(param_reshape)
+    for i in range(part):
+        param_reshape_part = param_reshape[i * pe_size: (i + 1) * pe_size, :]
+        bottomk, _ = torch.topk(param_reshape_part.abs().transpose(0, 1), non_zero_num + 1, largest=True, sorted=True)
+        threshold = bottomk.data[:, -1]
+        mask[i * pe_size: (i + 1) * pe_size, :] = torch.gt(torch.abs(param_reshape_part), threshold).float()
+    return mask.reshape(in_channel, out_channel, k, k).transpose(0, 1)
+
+
+def report(non_zero_num=16):
+    print('{:<22}{:>12}{:>12}{:>10}'.format('shape', 'loop (ms)', 'batch (ms)', 'speedup'))
+    total_loop, total_new = 0, 0
+    for shape in RESNET50_SHAPES:
+        weight = torch.randn(shape)
+        t_loop = benchmark(lambda: reference_mask(weight, non_zero_num))
+        t_new = benchmark(lambda: get_npu_structured_sparsity_mask(weight, non_zero_num))
+        total_loop, total_new = total_loop + t_loop, total_new + t_new
+        print('{:<22}{:>12.2f}{:>12.2f}{:>10.1f}'.format(str(shape), t_loop * 1e3, t_new * 1e3, t_loop / t_new))
+    print('{:<22}{:>12.2f}{:>12.2f}{:>10.1f}'.format('total', total_loop * 1e3, total_new * 1e3,
+                                                     total_loop / total_new))
+
+
+if __name__ == '__main__':
+    report()
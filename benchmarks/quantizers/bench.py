@@ -0,0 +1,271 @@
+"""
+Forward+backward time and memory of every quantizer of models/_modules on CPU, at several shapes,
+bit-widths and q-modes (the repeatable version of the LSQ "Method1 vs Method2" comparison).
+
+    python -m benchmarks.quantizers run --out bench.json [--quick] [--family LSQ DNQ]
+    python -m benchmarks.quantizers compare baseline.json bench.json [--threshold 0.2]
+    python -m benchmarks.quantizers report [--name int_gemm kmeans_1d]
+
+compare exits with 1 when a case is slower (median time) or saves more tensors for backward than the baseline
+by more than threshold.
+Memory of a case:
+    saved_bytes: the tensors kept by autograd from the forward to the backward (unique storages);
+    peak_bytes: the peak of the allocated CPU memory during forward+backward, at op granularity (torch.profiler).
+report prints the speedups of the optimized kernels over their reference implementations (REPORTS); the
+reports of the kernels that have one live in benchmarks/<name>.py, with the references their tests reuse.
+"""
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import time
+
+import torch
+
+import models._modules as my_nn
+from models._modules.wage import WAGEQuantizer
+from benchmarks import complexity_meta, int_gemm, kmeans_1d, kmeans_ste, lut_gemm, npu_mask, sign_gemm, torch_compile
+
+__all__ = ['CASES', 'SHAPES', 'QUICK_SHAPES', 'REPORTS', 'iter_cases', 'bench_case', 'run', 'compare']
+
+# (batch, in_channels, H, W, out_channels): conv k=3; linear in_channels -> out_channels on the
+# (batch*H*W, in_channels) pixels; act on the input
+SHAPES = {
+    'small': (16, 32, 16, 16, 32),
+    'medium': (32, 64, 28, 28, 64),
+    'large': (32, 128, 56, 56, 128),
+}
+QUICK_SHAPES = {'tiny': (2, 32, 4, 4, 32)}
+NBITS = (2, 4, 8)
+MODES = (my_nn.Qmodes.layer_wise, my_nn.Qmodes.kernel_wise)
+
+# (family, class, kind, kwarg of the bit-width or None (fixed), takes a q-mode, extra kwargs)
+CASES = [
+    ('LSQ', my_nn.Conv2dLSQ, 'conv', 'nbits', True, {}),
+    ('LSQ', my_nn.LinearLSQ, 'linear', 'nbits', False, {}),
+    ('LSQ', my_nn.ActLSQ, 'act', 'nbits', False, {}),
+    ('LLSQ', my_nn.Conv2dLLSQ, 'conv', 'nbits', True, {}),
+    ('LLSQ', my_nn.LinearLLSQ, 'linear', 'nbits', False, {}),
+    ('LLSQ', my_nn.ActLLSQ, 'act', 'nbits', False, {}),
+    ('LLSQS', my_nn.ActLLSQS, 'act', 'nbits', False, {}),
+    ('DNQ', my_nn.Conv2dDNQ, 'conv', 'nbits', True, {}),
+    ('DNQ', my_nn.LinearDNQ, 'linear', 'nbits', False, {}),
+    ('DNQ', my_nn.ActDNQ, 'act', 'nbits', False, {}),
+    ('DNQv2', my_nn.Conv2dDNQv2, 'conv', 'nbits', True, {}),
+    ('DNQv2', my_nn.LinearDNQv2, 'linear', 'nbits', False, {}),
+    ('DNQv2', my_nn.ActDNQv2, 'act', 'nbits', False, {}),
+    ('Q', my_nn.Conv2dQ, 'conv', 'nbits', True, {}),
+    ('Q', my_nn.LinearQ, 'linear', 'nbits', True, {}),
+    ('Q', my_nn.ActQ, 'act', 'nbits', False, {}),
+    ('Qv2', my_nn.Conv2dQv2, 'conv', 'nbits', True, {}),
+    ('Qv2', my_nn.LinearQv2, 'linear', 'nbits', True, {}),
+    ('Qv2', my_nn.ActQv2, 'act', 'nbits', False, {}),
+    ('BWN', my_nn.Conv2dBWN, 'conv', None, True, {'nbits': 1}),
+    ('BWN', my_nn.LinearBWN, 'linear', None, False, {'nbits': 1}),
+    ('BWNS', my_nn.Conv2dBWNS, 'conv', None, True, {'nbits': 1}),
+    ('BWNS', my_nn.LinearBWNS, 'linear', None, False, {'nbits': 1}),
+    ('TTQ', my_nn.TTQ_CNN, 'conv', None, True, {}),
+    ('TTQ', my_nn.TTQ_Linear, 'linear', None, False, {}),
+    ('ClusterQ', my_nn.Conv2dClusterQ, 'conv', 'nbits', False, {}),
+    ('ClusterQ', my_nn.Conv2dShareQ, 'conv_share', 'nbits', False, {'share_num': 2}),
+    ('ClusterQ', my_nn.ActShareQ, 'act_share', 'nbits', False, {'share_num': 2}),
+    ('SQ', my_nn.Conv2dSQ, 'conv', 'nbits_w', False, {'sparsity': 0.5}),
+    ('NPU', my_nn.Conv2dNPU, 'conv', None, False, {'non_zero_num': 8}),
+    ('WAGE', WAGEQuantizer, 'act', 'bits_A', False, {'bits_E': 8}),
+]
+
+
+def iter_cases(shapes=None, families=None):
+    """
+    :return: (key, family, cls, kind, shape, kwargs) of every combination
+    """
+    shapes = SHAPES if shapes is None else shapes
+    for (family, cls, kind, nbits_key, with_mode, extra), (shape_name, shape) in itertools.product(
+            CASES, shapes.items()):
+        if families is not None and family not in families:
+            continue
+        for nbits in (NBITS if nbits_key is not None else (None,)):
+            for mode in (MODES if with_mode else (None,)):
+                kwargs = dict(extra)
+                name = [cls.__name__, shape_name]
+                if nbits is not None:
+                    kwargs[nbits_key] = nbits
+                    if nbits_key == 'nbits_w':
+                        kwargs['nbits_a'] = nbits
+                    name.append('{}bit'.format(nbits))
+                if mode is not None:
+                    kwargs['mode'] = mode
+                    name.append(mode.name)
+                yield '/'.join(name), family, cls, kind, shape, kwargs
+
+
+def make_case(cls, kind, shape, kwargs):
+    n, c, h, w, out = shape
+    x = torch.randn(n, c, h, w)
+    if kind in ('conv', 'conv_share'):
+        m = cls(c, out, 3, padding=1, **kwargs)
+    elif kind == 'linear':
+        m = cls(c, out, **kwargs)
+        x = x.permute(0, 2, 3, 1).reshape(n * h * w, c)
+    else:
+        m = cls(**kwargs)
+    if kind.endswith('_share'):
+        x = [x, torch.randn_like(x)]
+        for t in x:
+            t.requires_grad_(True)
+    else:
+        x.requires_grad_(True)
+    return m.train(), x
+
+
+def _backward(m, x):
+    y = m(x)
+    if isinstance(y, (list, tuple)):
+        y = sum(t.sum() for t in y)
+    else:
+        y = y.sum()
+    y.backward()
+
+
+def _storage_bytes(t):
+    """:return: address and size of the storage of t"""
+    if hasattr(t, 'untyped_storage'):
+        storage = t.untyped_storage()
+        return storage.data_ptr(), storage.nbytes()
+    # torch < 2.0
+    storage = t.storage()
+    return storage.data_ptr(), storage.size() * storage.element_size()
+
+
+def saved_bytes(m, x):
+    storages = {}
+
+    def pack(t):
+        ptr, nbytes = _storage_bytes(t)
+        storages[ptr] = nbytes
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        _backward(m, x)
+    return sum(storages.values())
+
+
+def peak_bytes(m, x):
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True) as prof:
+        _backward(m, x)
+    current, peak = 0, 0
+    for event in sorted(prof.events(), key=lambda e: e.time_range.start):
+        current += event.self_cpu_memory_usage
+        peak = max(peak, current)
+    return peak
+
+
+def bench_case(cls, kind, shape, kwargs, iters=10, warmup=2):
+    """
+    :param warmup: untimed iterations first, the lazy initialization of the quantizers happens there
+    :return: dict, times in ms
+    """
+    torch.manual_seed(0)
+    m, x = make_case(cls, kind, shape, kwargs)
+    for _ in range(warmup):
+        _backward(m, x)
+    times = []
+    for _ in range(iters):
+        begin = time.perf_counter()
+        _backward(m, x)
+        times.append((time.perf_counter() - begin) * 1e3)
+    return {
+        'median_ms': statistics.median(times),
+        'min_ms': min(times),
+        'saved_bytes': saved_bytes(m, x),
+        'peak_bytes': peak_bytes(m, x),
+    }
+
+
+def run(shapes=None, families=None, iters=10, warmup=2, verbose=True):
+    results = {}
+    for key, family, cls, kind, shape, kwargs in iter_cases(shapes, families):
+        result = bench_case(cls, kind, shape, kwargs, iters=iters, warmup=warmup)
+        result['family'] = family
+        results[key] = result
+        if verbose:
+            print('{:<45}{:>10.2f} ms{:>14d} B saved{:>14d} B peak'.format(
+                key, result['median_ms'], result['saved_bytes'], result['peak_bytes']))
+    return {
+        'env': {'torch': torch.__version__, 'threads': torch.get_num_threads(), 'machine': platform.machine(),
+                'processor': platform.processor(), 'iters': iters},
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=0.2, verbose=True):
+    """
+    :return: the regressions, [(key, metric, baseline, current)]
+    """
+    regressions = []
+    for key, cur in current['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        for metric in ('median_ms', 'saved_bytes'):
+            if cur[metric] > base[metric] * (1 + threshold):
+                regressions.append((key, metric, base[metric], cur[metric]))
+        if verbose:
+            print('{:<45}{:>10.2f} ->{:>10.2f} ms  ({:+.0%})'.format(
+                key, base['median_ms'], cur['median_ms'], cur['median_ms'] / max(base['median_ms'], 1e-9) - 1))
+    if verbose:
+        if baseline['env'] != current['env']:
+            print('=> different environments: {} vs {}'.format(baseline['env'], current['env']))
+        for key, metric, base, cur in regressions:
+            print('=> regression {} {}: {} -> {}'.format(key, metric, base, cur))
+    return regressions
+
+
+REPORTS = {
+    'kmeans_ste': kmeans_ste.report,
+    'kmeans_1d': kmeans_1d.report,
+    'npu_mask': npu_mask.report,
+    'complexity_meta': complexity_meta.report,
+    'compile': torch_compile.report,
+    'int_gemm': int_gemm.report,
+    'lut_gemm': lut_gemm.report,
+    'sign_gemm': sign_gemm.report,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Quantizer microbenchmarks (CPU)')
+    subparsers = parser.add_subparsers(dest='command')
+    parser_run = subparsers.add_parser('run')
+    parser_run.add_argument('--out', default='bench_quantizers.json', type=str)
+    parser_run.add_argument('--family', nargs='+', default=None, help='e.g. LSQ DNQ (default: all)')
+    parser_run.add_argument('--quick', action='store_true', default=False, help='one tiny shape')
+    parser_run.add_argument('--iters', default=10, type=int)
+    parser_run.add_argument('--warmup', default=2, type=int)
+    parser_cmp = subparsers.add_parser('compare')
+    parser_cmp.add_argument('baseline', type=str)
+    parser_cmp.add_argument('current', type=str)
+    parser_cmp.add_argument('--threshold', default=0.2, type=float, help='allowed relative increase')
+    parser_report = subparsers.add_parser('report')
+    parser_report.add_argument('--name', nargs='+', default=list(REPORTS), choices=list(REPORTS),
+                               help='default: all')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        report = run(QUICK_SHAPES if args.quick else SHAPES, args.family, args.iters, args.warmup)
+        with open(args.out, 'w') as wf:
+            json.dump(report, wf, indent=2)
+        return 0
+    if args.command == 'compare':
+        with open(args.baseline) as rf:
+            baseline = json.load(rf)
+        with open(args.current) as rf:
+            current = json.load(rf)
+        return 1 if compare(baseline, current, args.threshold) else 0
+    if args.command == 'report':
+        for name in args.name:
+            print('=> {}'.format(name))
+            REPORTS[name]()
+        return 0
+    parser.print_help()
+    return 2
@@ -0,0 +1,63 @@
+"""
+Size and inference of the binary-weight models converted to sign convolutions (convert_to_sign) against
+their fake-quant and fp32 versions, in MB and images/s on CPU.
+
+    python -m benchmarks.sign_gemm
+"""
+import copy
+
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from models._modules import Qmodes
+from models.cifar10 import cifar10_vggtiny, cifar10_vggtiny_bwn, cifar10_vggtiny_f_bwn, cifar10_vggtiny_llsqs_bwns
+from utils.wrapper import convert_to_sign
+from benchmarks.common import benchmark, state_dict_bytes
+
+__all__ = ['cases', 'make_model', 'get_converted', 'report']
+
+
+def make_model():
+    return nn.Sequential(
+        my_nn.Conv2dBWN(3, 8, 3, padding=1, nbits=1, mode=Qmodes.layer_wise), nn.ReLU(),
+        my_nn.Conv2dBWNS(8, 8, 3, stride=2, nbits=1, mode=Qmodes.kernel_wise), nn.ReLU(),
+        my_nn.Conv2dBWNS(8, 8, 1, groups=2, bias=False, nbits=1), nn.Flatten(),
+        my_nn.LinearBWN(8 * 4 * 4, 16, nbits=1), my_nn.LinearBWNS(16, 10, nbits=1))
+
+
+# name: model, input shape, number of sign layers after the conversion
+cases = {
+    'modules': (make_model, (4, 3, 10, 10), 5),
+    'cifar10_vggtiny_bwn': (lambda: cifar10_vggtiny_bwn(nbits_w=1, nbits_a=-1), (2, 3, 32, 32), 5),
+    'cifar10_vggtiny_f_bwn': (lambda: cifar10_vggtiny_f_bwn(nbits_w=1, nbits_a=-1), (2, 3, 32, 32), 7),
+    'cifar10_vggtiny_llsqs_bwns': (lambda: cifar10_vggtiny_llsqs_bwns(nbits_w=1, nbits_a=4), (2, 3, 32, 32), 7),
+}
+
+
+def get_converted(model_fn, shape):
+    torch.manual_seed(0)
+    model = model_fn()
+    x = torch.randn(shape)
+    model.train()
+    my_nn.calibrate(model, x)
+    model.eval()
+    return model, convert_to_sign(copy.deepcopy(model)), x
+
+
+def report(batch_size=128):
+    print('{:<28}{:>12}{:>12}{:>12}  (MB / images/s, {} threads)'.format('model', 'fp32', 'fake-quant', 'sign',
+                                                                       torch.get_num_threads()))
+    for name in ('cifar10_vggtiny_bwn', 'cifar10_vggtiny_f_bwn'):
+        model_fn, shape, _ = cases[name]
+        model, model_sign, _ = get_converted(model_fn, shape)
+        models = (cifar10_vggtiny().eval(), model, model_sign)
+        x = torch.randn(batch_size, *shape[1:])
+        with torch.no_grad():
+            speed = [batch_size / benchmark(lambda: m(x)) for m in models]
+        print('{:<28}{:>12.2f}{:>12.2f}{:>12.2f}'.format(name, *[state_dict_bytes(m) / 2 ** 20 for m in models]))
+        print('{:<28}{:>12.1f}{:>12.1f}{:>12.1f}'.format('', *speed))
+
+
+if __name__ == '__main__':
+    report()
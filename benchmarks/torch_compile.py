@@ -0,0 +1,61 @@
+"""
+torch.compile against eager of the quantized models in compile mode (set_compile_mode), train and eval.
+torch.compile needs torch >= 2.0.
+
+    python -m benchmarks.torch_compile
+"""
+import torch
+import torchvision
+
+import models._modules as my_nn
+from models.cifar10 import cifar10_vggtiny_llsqs_bwns
+from models.imagenet import resnet18_lsq, mobilenetv2_q
+from utils.wrapper import replace_conv_recursively
+from benchmarks.common import benchmark
+
+__all__ = ['cases', 'get_compile_ready', 'report']
+
+
+def resnet18_sq():
+    model = torchvision.models.resnet18(num_classes=10)
+    replace_conv_recursively(model, 'Conv2dSQ', nbits_a=4, nbits_w=4, sparsity=0.5)
+    return model
+
+
+cases = {
+    'resnet18_lsq': (lambda: resnet18_lsq(nbits_w=4, nbits_a=4), (1, 3, 224, 224)),
+    'mobilenetv2_q': (lambda: mobilenetv2_q(input_size=64), (2, 3, 64, 64)),
+    'cifar10_vggtiny_llsqs_bwns': (lambda: cifar10_vggtiny_llsqs_bwns(nbits_w=1, nbits_a=4), (2, 3, 32, 32)),
+    'resnet18_sq': (resnet18_sq, (2, 3, 64, 64)),
+}
+
+
+def get_compile_ready(name):
+    torch.manual_seed(0)
+    model_fn, shape = cases[name]
+    model = model_fn()
+    x = torch.randn(shape)
+    model.train()
+    my_nn.calibrate(model, x)
+    my_nn.set_compile_mode(model)
+    return model, x
+
+
+def report(names=tuple(cases)):
+    print('{:<30}{:>12}{:>12}'.format('model', 'train', 'eval'))
+    for name in names:
+        model, x = get_compile_ready(name)
+        torch._dynamo.reset()
+        compiled = torch.compile(model)
+        speedup = []
+        for training in (True, False):
+            model.train(training)
+            with torch.set_grad_enabled(training):
+                eager = benchmark(lambda: model(x).sum().backward() if training else model(x))
+                fast = benchmark(lambda: compiled(x).sum().backward() if training else compiled(x))
+            speedup.append(eager / fast)
+        print('{:<30}{:>11.2f}x{:>11.2f}x'.format(name, *speedup))
+
+
+if __name__ == '__main__':
+    report()
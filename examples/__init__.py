@@ -2,6 +2,7 @@ import argparse
 import json
 import os
 import shutil
+import sys
 import time
 import warnings
 from collections import OrderedDict
@@ -14,16 +15,21 @@ import torch.utils.data
 import torch.utils.data.distributed
 import torchvision
 import torchvision.transforms as transforms
-from tensorboardX import SummaryWriter
 from warmup_scheduler import GradualWarmupScheduler
 
 import models._modules as my_nn
 from utils import wrapper
+from utils.custom_datasets.imagenet_shards import get_shard_loaders
+from utils.custom_datasets.manifest import ManifestDataset, load_manifest
+from utils.custom_datasets.tensor_loader import DEFAULT_IMAGE_CACHE, get_image_folder_loaders, get_tensor_loaders
 from utils.dnq import dnq_scheduler
-from utils.ptflops import get_model_complexity_info
+from utils.event_writer import AsyncSummaryWriter, parse_sample_rates
+from utils.loader_tuner import load_tuned, save_tuned, tune_loader
+from utils.ptflops import get_model_complexity_info, get_model_complexity_info_meta, get_npu_cost
 
 str_q_mode_map = {'layer_wise': my_nn.Qmodes.layer_wise,
                   'kernel_wise': my_nn.Qmodes.kernel_wise}
+DEFAULT_WORKERS = 16
 
 
 def get_base_parser():
@@ -37,8 +43,12 @@ def get_base_parser():
     parser = argparse.ArgumentParser(description='PyTorch Training')
     parser.add_argument('data', metavar='DIR',
                         help='path to dataset')
-    parser.add_argument('-j', '--workers', default=16, type=int, metavar='N',
-                        help='number of data loading workers (default: 4)')
+    parser.add_argument('-j', '--workers', default=None, type=int, metavar='N',
+                        help='number of data loading workers '
+                             '(default: the --tune-loader result of this host and dataset, else 16)')
+    parser.add_argument('--tune-loader', action='store_true', default=False,
+                        help='measure the data loading alone with several workers/prefetch/persistent settings, '
+                             'save the best one for this host and dataset, and exit')
     parser.add_argument('-b', '--batch-size', default=256, type=int,
                         metavar='N',
                         help='mini-batch size (default: 256), this is the total '
@@ -105,6 +115,23 @@ def get_base_parser():
     parser.add_argument('--resave', action='store_true', default=False,
                         help='resave the model')
 
+    parser.add_argument('--freeze-quantized', action='store_true', default=False,
+                        help='bake the quantized weights into plain conv/linear for evaluation (with -e)')
+    parser.add_argument('--int-inference', action='store_true', default=False,
+                        help='run LSQ/LLSQ conv/linear as int8 GEMM on CPU for evaluation (with -e)')
+    parser.add_argument('--int-shift-inference', action='store_true', default=False,
+                        help='run LLSQS/BWNS models on integers and shifts only on CPU for evaluation (with -e)')
+    parser.add_argument('--sign-inference', action='store_true', default=False,
+                        help='store BWN/BWNS weights as packed sign bits for evaluation '
+                             '(with -e, or after the last epoch)')
+    parser.add_argument('--lut-inference', action='store_true', default=False,
+                        help='store k-means cluster-quantized convs as packed labels + centroids '
+                             'for evaluation (with -e)')
+    parser.add_argument('--kmeans-workers', default=-1, type=int,
+                        help='k-means of all cluster-quantized convs before training, in a pool of N processes '
+                             '(0: in this process, -1: lazily in the first forward)')
+    parser.add_argument('--kmeans-cache', default=None, type=str,
+                        help='directory of the k-means results, reused on a restart (with --kmeans-workers)')
     parser.add_argument('--quant-bias-scale', action='store_true', default=False,
                         help='Add Qcode for scale and quantize bias')
     parser.add_argument('--extract-inner-data', action='store_true', default=False,
@@ -148,7 +175,31 @@ def get_base_parser():
                         help='Use l1 error to optimize parameter of quantizer (default: l2)')
     parser.add_argument('--debug', action='store_true', default=False,
                         help='save running scale in tensorboard')
+    parser.add_argument('--log-queue', default=1000, type=int,
+                        help='events queued for the tensorboard writer thread, dropped when full (default: 1000)')
+    parser.add_argument('--log-sample', nargs='+', default=None, metavar='PATTERN=N',
+                        help='write every N-th event of the matching tags, e.g. train/*/alpha=10')
+    parser.add_argument('--log-histogram-samples', default=10000, type=int,
+                        help='histograms of at most N random values (default: 10000)')
+    parser.add_argument('--log-max-mb', default=None, type=float,
+                        help='above this event file size, no more events are written')
     parser.add_argument('--freeze-bn', action='store_true', default=False, help='Freeze BN')
+    parser.add_argument('--tensor-loader', action='store_true', default=False,
+                        help='cifar: keep the dataset in memory as a uint8 tensor, augment whole batches '
+                             'without worker processes')
+    parser.add_argument('--image-cache', default=DEFAULT_IMAGE_CACHE, type=str, metavar='DIR',
+                        help='caltech101/flower102: directory of the resized images, decoded once '
+                             '(empty: decode the JPEGs every epoch)')
+    parser.add_argument('--manifest', default=None, type=str,
+                        help='imagenet/caltech101/flower102: the images and splits of utils/split_dataset.py '
+                             'instead of walking DIR')
+    parser.add_argument('--imagenet-shards', action='store_true', default=False,
+                        help='DIR holds the memory-mapped shards of utils/custom_datasets/imagenet_shards.py')
+    parser.add_argument('--profile-layers', default=0, type=int, metavar='N',
+                        help='profile the time/memory of every module over N iterations of the first epoch '
+                             '(of the evaluation with -e), written to the log directory (default: 0, off)')
+    parser.add_argument('--profile-skip', default=2, type=int, metavar='N',
+                        help='iterations before the profiled ones (default: 2)')
     return parser
 
 
@@ -236,6 +287,16 @@ def set_bn_eval(m):
     return
 
 
+def get_layer_profiler(model, args, stage, writer=None, global_step=0):
+    if args.profile_layers <= 0 or args.rank > 0:
+        return None
+    os.makedirs(args.log_name, exist_ok=True)
+    profiler = wrapper.LayerProfiler(model, args.profile_layers, skip=args.profile_skip,
+                                     prefix='{}/{}_profile_{}'.format(args.log_name, args.arch, stage),
+                                     writer=writer, global_step=global_step)
+    return profiler.start()
+
+
 def validate(val_loader, model, criterion, args):
     batch_time = AverageMeter('Time', ':6.3f')
     losses = AverageMeter('Loss', ':.4e')
@@ -246,31 +307,38 @@ def validate(val_loader, model, criterion, args):
 
     # switch to evaluate mode
     model.eval()
+    profiler = get_layer_profiler(model, args, 'validate') if args.evaluate else None
     with torch.no_grad():
         end = time.time()
         for i, (input, target) in enumerate(val_loader):
-            if args.gpu is not None:
+            if args.gpu is not None and not cpu_inference(args):
                 input = input.cuda(args.gpu, non_blocking=True)
-            target = target.cuda(args.gpu, non_blocking=True)
+            if not cpu_inference(args):
+                target = target.cuda(args.gpu, non_blocking=True)
             # compute output
             output = model(input)
             loss = criterion(output, target)
 
             # measure accuracy and record loss
             acc1, acc5 = accuracy(output, target, topk=(1, 5))
-            losses.update(loss.item(), input.size(0))
+            losses.update(loss, input.size(0))
             top1.update(acc1[0], input.size(0))
             top5.update(acc5[0], input.size(0))
 
             # measure elapsed time
             batch_time.update(time.time() - end)
             end = time.time()
+            if profiler is not None:
+                profiler.step()
             if args.extract_inner_data:
                 print('early stop evaluation')
                 break
             if i % args.print_freq == 0:
                 progress.print(i)
 
+        if profiler is not None:
+            profiler.stop()
+        synchronize_meters(batch_time, losses, top1, top5)
         print(' *Time {time.sum:.0f}s Acc@1 {top1.avg:.3f} Acc@5 {top5.avg:.3f}'
               .format(time=batch_time, top1=top1, top5=top5))
 
@@ -299,8 +367,15 @@ def train(train_loader, model, criterion, optimizer, epoch, args, writer, criter
 
     if args.freeze_bn:
         model.apply(set_bn_eval)
+    if epoch == args.start_epoch:
+        calibrate_model(model, train_loader, args)
     end = time.time()
     base_step = epoch * args.batch_num
+    # the metrics stay on the device until the next print
+    scalars = ScalarBuffer(writer) if writer is not None else None
+    profiler = None
+    if epoch == args.start_epoch and writer is not None:
+        profiler = get_layer_profiler(model, args, 'train', writer, base_step)
     for i, data in enumerate(train_loader):
         # measure data loading time
         data_time.update(time.time() - end)
@@ -319,13 +394,13 @@ def train(train_loader, model, criterion, optimizer, epoch, args, writer, criter
             loss += criterion_admm(model, admm_scheduler.Z, admm_scheduler.U)
         # measure accuracy and record loss
         acc1, acc5 = accuracy(output, targets, topk=(1, 5))
-        losses.update(loss.item(), inputs.size(0))
+        losses.update(loss, inputs.size(0))
         top1.update(acc1[0], inputs.size(0))
         top5.update(acc5[0], inputs.size(0))
-        if writer is not None:
-            writer.add_scalar('train/lr', optimizer.param_groups[0]['lr'], base_step + i)
-            writer.add_scalar('train/acc1', top1.avg, base_step + i)
-            writer.add_scalar('train/acc5', top5.avg, base_step + i)
+        if scalars is not None:
+            scalars.add_scalar('train/lr', optimizer.param_groups[0]['lr'], base_step + i)
+            scalars.add_scalar('train/acc1', top1.avg, base_step + i)
+            scalars.add_scalar('train/acc5', top5.avg, base_step + i)
         # compute gradient and do SGD step
         # optimizer.param_groups[0]['params']:
         loss.backward()
@@ -335,21 +410,46 @@ def train(train_loader, model, criterion, optimizer, epoch, args, writer, criter
         # measure elapsed time
         batch_time.update(time.time() - end)
         end = time.time()
+        if profiler is not None:
+            profiler.step()
 
         if i % args.print_freq == 0:
             progress.print(i)
+            if scalars is not None:
+                scalars.flush()
             if writer is not None and args.debug:
                 for k, v in model.state_dict().items():
                     if 'module.' in k and args.gpus is not None:
                         k = k[7:]
                     if 'alpha' in k or 'scale' in k:
                         if v.shape[0] == 1:
-                            writer.add_scalar('train/{}/{}'.format(args.arch, k), v.item(), base_step + i)
+                            writer.add_scalar('train/{}/{}'.format(args.arch, k), v, base_step + i)
                         else:
                             writer.add_histogram('train/{}/{}'.format(args.arch, k), v, base_step + i)
+    if profiler is not None:
+        profiler.stop()
+    if scalars is not None:
+        scalars.flush()
     return
 
 
+def calibrate_model(model, train_loader, args):
+    """
+    Initializes the quantizers that are not initialized yet from the first training batch (my_nn.calibrate)
+    before the first step, on the wrapped module instead of in the DataParallel replicas.
+    """
+    if all(getattr(m, 'initialized', True) for m in model.modules()):
+        return
+    inputs = next(iter(train_loader))[0]
+    if args.gpu is not None:
+        inputs = inputs.cuda(args.gpu, non_blocking=True)
+    elif torch.cuda.is_available():
+        inputs = inputs.cuda(non_blocking=True)
+    print('=> calibrate the quantizers')
+    with torch.no_grad():
+        my_nn.calibrate(model, inputs)
+
+
 def get_summary_writer(args, ngpus_per_node):
     if not args.multiprocessing_distributed or (args.multiprocessing_distributed
                                                 and args.rank % ngpus_per_node == 0):
@@ -359,7 +459,10 @@ def get_summary_writer(args, ngpus_per_node):
         else:
             args.log_name = 'logger/{}_{}'.format(args.arch,
                                                   args.log_name)
-        writer = SummaryWriter(args.log_name)
+        max_bytes = None if args.log_max_mb is None else int(args.log_max_mb * 2 ** 20)
+        writer = AsyncSummaryWriter(args.log_name, queue_size=args.log_queue,
+                                    sample_rates=parse_sample_rates(args.log_sample),
+                                    histogram_samples=args.log_histogram_samples, max_bytes=max_bytes)
         return writer
     return None
 
@@ -385,19 +488,35 @@ def main_gen_key_map(args, model, models):
 
 
 def get_model_info(model, args, input_size=(3, 224, 224)):
+    """:param input_size: (C, H, W), e.g. DataloaderFactory.input_sizes[data_type]"""
     print('Inference for complexity summary')
-    if isinstance(input_size, torch.utils.data.DataLoader):
-        input_size = input_size.dataset.__getitem__(0)[0].shape
-        input_size = (input_size[0], input_size[1], input_size[2])
     with open('{}/{}_flops.txt'.format(args.log_name, args.arch), 'w') as f:
         try:
-            flops, params = get_model_complexity_info(model, input_size, as_strings=True, print_per_layer_stat=True,
-                                                      ost=f)
-        except:
-            print('get model info error')
-            return None
+            # shapes only, on the meta device
+            flops, params, bops, act_memory = get_model_complexity_info_meta(model, input_size, as_strings=True,
+                                                                             print_per_layer_stat=True, ost=f)
+        except Exception as e:
+            print('meta complexity analysis failed ({}), run a real forward'.format(e))
+            act_memory = None
+            try:
+                flops, params, bops = get_model_complexity_info(model, input_size, as_strings=True,
+                                                                print_per_layer_stat=True, ost=f, with_bops=True)
+            except:
+                print('get model info error')
+                return None
     print('{:<30}  {:<8}'.format('Computational complexity: ', flops))
     print('{:<30}  {:<8}'.format('Number of parameters: ', params))
+    print('{:<30}  {:<8}'.format('Bit operations: ', bops))
+    if act_memory is not None:
+        print('{:<30}  {:<8}'.format('Activation memory: ', act_memory))
+    try:
+        npu_cost = get_npu_cost(model, input_size)
+        with open('{}/{}_npu_cost.json'.format(args.log_name, args.arch), 'w') as wf:
+            json.dump(npu_cost, wf, indent=2)
+        print('{:<30}  {:.3f} ms ({} cycles)'.format('Predicted NPU latency: ', npu_cost['total']['latency'] * 1e3,
+                                                    npu_cost['total']['cycles']))
+    except Exception as e:
+        print('get npu cost error: {}'.format(e))
     with open('{}/{}.txt'.format(args.log_name, args.arch), 'w') as wf:
         wf.write(str(model))
     # summary(model, input_size)
@@ -423,6 +542,9 @@ def save_checkpoint(state, is_best, prefix, filename='checkpoint.pth.tar'):
 
 
 def process_model(model, optimizer, args, conv_name=None, **kwargs_conv):
+    """
+    :return: the model, unwrapped from DataParallel and on the CPU with --int-inference/--int-shift-inference
+    """
     # optionally resume from a checkpoint
     if args.resume:
         if os.path.isfile(args.resume):
@@ -478,6 +600,51 @@ def process_model(model, optimizer, args, conv_name=None, **kwargs_conv):
         else:
             print("=> no checkpoint found at '{}'".format(args.resume))
 
+    if args.kmeans_workers >= 0:
+        print('k-means of the cluster-quantized convs')
+        my_nn.cluster_all_layers(model, workers=args.kmeans_workers, cache_dir=args.kmeans_cache)
+
+    if args.freeze_quantized:
+        if not args.evaluate:
+            warnings.warn('The frozen model can not be trained, -e is recommended')
+        print('freeze quantized modules')
+        wrapper.freeze_quantized(model)
+        print('after freezing')
+        print(model)
+
+    if args.int_inference:
+        if not args.evaluate:
+            warnings.warn('The integer model can not be trained, -e is recommended')
+        print('convert to integer inference')
+        model = unwrap_parallel(model).cpu()
+        wrapper.convert_to_int(model)
+        print('after conversion')
+        print(model)
+
+    if args.int_shift_inference:
+        if not args.evaluate:
+            warnings.warn('The integer model can not be trained, -e is recommended')
+        print('convert to integer-only shift inference')
+        model = unwrap_parallel(model).cpu()
+        wrapper.convert_to_shift(model)
+        print('after conversion')
+        print(model)
+
+    if args.sign_inference and args.evaluate:
+        # when training, the model is converted after the last epoch
+        print('convert binary weights to sign bits')
+        wrapper.convert_to_sign(model)
+        print('after conversion')
+        print(model)
+
+    if args.lut_inference:
+        if not args.evaluate:
+            warnings.warn('The lookup-table model can not be trained, -e is recommended')
+        print('convert cluster-quantized convs to lookup tables')
+        wrapper.convert_to_lut(model)
+        print('after conversion')
+        print(model)
+
     if args.extract_inner_data:
         print('extract inner feature map and weight')
         wrapper.save_inner_hooks(model)
@@ -487,7 +654,24 @@ def process_model(model, optimizer, args, conv_name=None, **kwargs_conv):
         for k, v in model.state_dict().items():
             print('saving {}'.format(k))
             np.save('{}'.format(k), v.cpu().numpy())
-    return
+    return model
+
+
+def cpu_inference(args):
+    # the integer kernels of --int-inference/--int-shift-inference run on the CPU
+    return getattr(args, 'int_inference', False) or getattr(args, 'int_shift_inference', False)
+
+
+def unwrap_parallel(model):
+    """
+    :return: the model without its (Distributed)DataParallel wrappers (also of submodules, e.g. alexnet.features)
+    """
+    parallel = (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)
+    while isinstance(model, parallel):
+        model = model.module
+    for name, child in list(model.named_children()):
+        setattr(model, name, unwrap_parallel(child))
+    return model
 
 
 class DataloaderFactory(object):
@@ -497,9 +681,15 @@ class DataloaderFactory(object):
     caltech101 = 7
     cifar100 = 8
     flower102 = 9
+    tensor_datasets = {cifar10: 'cifar10', cifar10_positive_shift: 'cifar10_positive_shift', cifar100: 'cifar100'}
+    image_folder_datasets = {caltech101: 'caltech101', flower102: 'flower102'}
+    # (C, H, W) of the val inputs, see get_model_info
+    input_sizes = {cifar10: (3, 32, 32), cifar10_positive_shift: (3, 32, 32), imagenet2012: (3, 224, 224),
+                   caltech101: (3, 32, 32), cifar100: (3, 32, 32), flower102: (3, 32, 32)}
 
     def __init__(self, args):
         self.args = args
+        self.manifest = load_manifest(args.manifest) if args.manifest else None
         self.cifar10_transform_train = transforms.Compose([
             transforms.RandomCrop(32, padding=4),
             transforms.RandomHorizontalFlip(),
@@ -521,10 +711,67 @@ class DataloaderFactory(object):
             transforms.Normalize((0, 0, 0), (0.25, 0.25, 0.25)),
         ])
 
+    def image_folder(self, root, transform):
+        """
+        ImageFolder(root), or the split of the manifest named as the folder (the others: 'val')
+        """
+        if self.manifest is None:
+            return torchvision.datasets.ImageFolder(root, transform)
+        split = os.path.basename(os.path.normpath(root))
+        if split not in self.manifest['split_names']:
+            split = 'val'
+        return ManifestDataset(self.manifest, split, transform)
+
+    def data_type_name(self, data_type):
+        return {v: k for k, v in vars(DataloaderFactory).items() if isinstance(v, int)}[data_type]
+
+    def loader_kwargs(self, data_type):
+        """
+        DataLoader settings: --workers, else the --tune-loader result of this host, else DEFAULT_WORKERS
+        The tuned workers are the ones of a single process: the processes of a node (distributed_model) share them.
+        """
+        args = self.args
+        if args.workers is None:
+            tuned = load_tuned(self.data_type_name(data_type))
+            if tuned is not None:
+                tuned = dict(tuned)
+                procs = getattr(args, 'procs_per_node', 1)
+                tuned['num_workers'] = (tuned['num_workers'] + procs - 1) // procs
+                return tuned
+        workers = DEFAULT_WORKERS if args.workers is None else args.workers
+        return {'num_workers': workers, 'pin_memory': torch.cuda.is_available()}
+
     def product_train_val_loader(self, data_type):
+        loaders = self._product_train_val_loader(data_type)
+        if self.args.tune_loader:
+            name = self.data_type_name(data_type)
+            if not isinstance(loaders[0], torch.utils.data.DataLoader):
+                print('=> {}: {} has no workers to tune'.format(name, type(loaders[0]).__name__))
+            else:
+                print('=> tuning the data loading of {}'.format(name))
+                settings, results = tune_loader(loaders[0])
+                save_tuned(name, settings, results, batch_size=self.args.batch_size)
+                print('=> best for {}: {}'.format(name, settings))
+            sys.exit(0)
+        return loaders
+
+    def _product_train_val_loader(self, data_type):
         args = self.args
         train_loader = None
         val_loader = None
+        loader_kwargs = self.loader_kwargs(data_type)
+        if args.tensor_loader and data_type in self.tensor_datasets:
+            train_loader, val_loader, _ = get_tensor_loaders(self.tensor_datasets[data_type], args.data,
+                                                             args.batch_size,
+                                                             distributed=getattr(args, 'distributed', False))
+            args.batch_num = len(train_loader)
+            return train_loader, val_loader
+        if args.image_cache and self.manifest is None and data_type in self.image_folder_datasets:
+            train_loader, val_loader = get_image_folder_loaders(self.image_folder_datasets[data_type], args.data,
+                                                                args.batch_size, cache_dir=args.image_cache,
+                                                                workers=max(loader_kwargs['num_workers'], 1))
+            args.batch_num = len(train_loader)
+            return train_loader, val_loader
         if data_type == self.cifar10:
             trainset = torchvision.datasets.CIFAR10(root=args.data, train=True, download=True,
                                                     transform=self.cifar10_transform_train)
@@ -534,27 +781,32 @@ class DataloaderFactory(object):
                 train_sampler = None
             train_loader = torch.utils.data.DataLoader(trainset, batch_size=args.batch_size,
                                                        shuffle=(train_sampler is None),
-                                                       num_workers=args.workers, sampler=train_sampler)
+                                                       sampler=train_sampler, **loader_kwargs)
             testset = torchvision.datasets.CIFAR10(root=args.data, train=False, download=True,
                                                    transform=self.cifar10_transform_val)
             val_loader = torch.utils.data.DataLoader(testset, batch_size=args.batch_size, shuffle=False,
-                                                     num_workers=args.workers)
+                                                     **loader_kwargs)
         elif data_type == self.cifar10_positive_shift:
             trainset = torchvision.datasets.CIFAR10(root=args.data, train=True, download=True,
                                                     transform=self.cifar10_positive_shift_transform_train)
             train_loader = torch.utils.data.DataLoader(trainset, batch_size=args.batch_size, shuffle=True,
-                                                       num_workers=args.workers)
+                                                       **loader_kwargs)
             testset = torchvision.datasets.CIFAR10(root=args.data, train=False, download=True,
                                                    transform=self.cifar10_positive_shift_transform_val)
             val_loader = torch.utils.data.DataLoader(testset, batch_size=args.batch_size, shuffle=False,
-                                                     num_workers=args.workers)
+                                                     **loader_kwargs)
+        elif data_type == self.imagenet2012 and args.imagenet_shards:
+            train_loader, val_loader, train_sampler = get_shard_loaders(args.data, args.batch_size,
+                                                                        distributed=args.distributed)
+            args.batch_num = len(train_loader)
+            return train_loader, val_loader, train_sampler
         elif data_type == self.imagenet2012:
             # Data loading code
             traindir = os.path.join(args.data, 'train')
             valdir = os.path.join(args.data, 'val')
             normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406],
                                              std=[0.229, 0.224, 0.225])
-            train_dataset = torchvision.datasets.ImageFolder(
+            train_dataset = self.image_folder(
                 traindir,
                 transforms.Compose([
                     transforms.RandomResizedCrop(224),
@@ -570,18 +822,18 @@ class DataloaderFactory(object):
 
             train_loader = torch.utils.data.DataLoader(
                 train_dataset, batch_size=args.batch_size, shuffle=(train_sampler is None),
-                num_workers=args.workers, pin_memory=True, sampler=train_sampler)
+                sampler=train_sampler, **loader_kwargs)
             args.batch_num = len(train_loader)
 
             val_loader = torch.utils.data.DataLoader(
-                torchvision.datasets.ImageFolder(valdir, transforms.Compose([
+                self.image_folder(valdir, transforms.Compose([
                     transforms.Resize(256),
                     transforms.CenterCrop(224),
                     transforms.ToTensor(),
                     normalize,
                 ])),
                 batch_size=64, shuffle=False,
-                num_workers=args.workers, pin_memory=True)
+                **loader_kwargs)
             # todo: args.batch_size
             return train_loader, val_loader, train_sampler
 
@@ -603,12 +855,12 @@ class DataloaderFactory(object):
                 transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
             ])
 
-            train_data = torchvision.datasets.ImageFolder(args.data + '/train', transform=transform_train)
-            valid_data = torchvision.datasets.ImageFolder(args.data + '/val', transform=transform_test)
+            train_data = self.image_folder(args.data + '/train', transform_train)
+            valid_data = self.image_folder(args.data + '/val', transform_test)
 
             train_loader = torch.utils.data.DataLoader(train_data, batch_size=args.batch_size, shuffle=True,
-                                                       num_workers=args.workers)
-            val_loader = torch.utils.data.DataLoader(valid_data, batch_size=args.batch_size, num_workers=args.workers)
+                                                       **loader_kwargs)
+            val_loader = torch.utils.data.DataLoader(valid_data, batch_size=args.batch_size, **loader_kwargs)
         elif data_type == self.cifar100:
             transform_train = transforms.Compose([
                 transforms.RandomCrop(32, padding=4),
@@ -625,12 +877,12 @@ class DataloaderFactory(object):
             trainset = torchvision.datasets.CIFAR100(root=args.data, train=True, download=True,
                                                      transform=transform_train)
             train_loader = torch.utils.data.DataLoader(trainset, batch_size=args.batch_size, shuffle=True,
-                                                       num_workers=args.workers)
+                                                       **loader_kwargs)
             args.batch_num = len(train_loader)
             testset = torchvision.datasets.CIFAR100(root=args.data, train=False, download=True,
                                                     transform=transform_test)
             val_loader = torch.utils.data.DataLoader(testset, batch_size=args.batch_size, shuffle=False,
-                                                     num_workers=args.workers)
+                                                     **loader_kwargs)
         elif data_type == self.flower102:
             # The input size can be set to 224
             # https://github.com/MiguelAMartinez/flowers-image-classifier/blob/master/utils_ic.py#L19
@@ -663,14 +915,14 @@ class DataloaderFactory(object):
                 transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
             ])
 
-            train_data = torchvision.datasets.ImageFolder(args.data + '/train', transform=transform_train)
-            test_data = torchvision.datasets.ImageFolder(args.data + '/valid', transform=transform_test)
-            valid_data = torchvision.datasets.ImageFolder(args.data + '/test', transform=transform_test)
+            train_data = self.image_folder(args.data + '/train', transform_train)
+            test_data = self.image_folder(args.data + '/valid', transform_test)
+            valid_data = self.image_folder(args.data + '/test', transform_test)
 
             train_loader = torch.utils.data.DataLoader(train_data, batch_size=args.batch_size, shuffle=True,
-                                                       num_workers=args.workers)
-            test_loader = torch.utils.data.DataLoader(test_data, batch_size=args.batch_size, num_workers=args.workers)
-            val_loader = torch.utils.data.DataLoader(valid_data, batch_size=args.batch_size, num_workers=args.workers)
+                                                       **loader_kwargs)
+            test_loader = torch.utils.data.DataLoader(test_data, batch_size=args.batch_size, **loader_kwargs)
+            val_loader = torch.utils.data.DataLoader(valid_data, batch_size=args.batch_size, **loader_kwargs)
         else:
             assert NotImplementedError
         return train_loader, val_loader
@@ -683,6 +935,7 @@ class ProgressMeter(object):
         self.prefix = prefix
 
     def print(self, batch):
+        synchronize_meters(*self.meters)
         entries = [self.prefix + self.batch_fmtstr.format(batch)]
         entries += [str(meter) for meter in self.meters]
         print('\t'.join(entries))
@@ -694,7 +947,9 @@ class ProgressMeter(object):
 
 
 class AverageMeter(object):
-    """Computes and stores the average and current value"""
+    """Computes and stores the average and current value
+    Tensor values stay on their device: no host synchronization until synchronize() or printing.
+    """
 
     def __init__(self, name, fmt=':f'):
         self.count = 0
@@ -705,16 +960,63 @@ class AverageMeter(object):
         self.fmt = fmt
 
     def update(self, val, n=1):
+        if torch.is_tensor(val):
+            val = val.detach().reshape(())
         self.val = val
         self.sum += val * n
         self.count += n
         self.avg = self.sum / self.count
 
+    def synchronize(self):
+        synchronize_meters(self)
+
     def __str__(self):
+        self.synchronize()
         fmtstr = '{name} {val' + self.fmt + '} ({avg' + self.fmt + '})'
         return fmtstr.format(**self.__dict__)
 
 
+def to_host(values):
+    """
+    :param values: Python numbers and one-element tensors
+    :return: floats, all the tensors copied to the host at once
+    """
+    tensors = [v for v in values if torch.is_tensor(v)]
+    if len(tensors) == 0:
+        return [float(v) for v in values]
+    host = iter(torch.stack([t.detach().float().reshape(()) for t in tensors]).tolist())
+    return [next(host) if torch.is_tensor(v) else float(v) for v in values]
+
+
+def synchronize_meters(*meters):
+    keys = ('val', 'sum', 'avg')
+    values = to_host([getattr(m, k) for m in meters for k in keys])
+    for i, m in enumerate(meters):
+        for j, k in enumerate(keys):
+            setattr(m, k, values[i * len(keys) + j])
+
+
+class ScalarBuffer(object):
+    """
+    SummaryWriter.add_scalar calls kept until flush(): one host synchronization for all the tensor values.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.scalars = []
+
+    def add_scalar(self, tag, value, global_step):
+        if torch.is_tensor(value):
+            value = value.detach()
+        self.scalars.append((tag, value, global_step))
+
+    def flush(self):
+        values = to_host([value for _, value, _ in self.scalars])
+        for (tag, _, global_step), value in zip(self.scalars, values):
+            self.writer.add_scalar(tag, value, global_step)
+        self.scalars = []
+
+
 def distributed_model(model, ngpus_per_node, args):
     if not torch.cuda.is_available():
         print('using CPU, this will be slow')
@@ -730,7 +1032,9 @@ def distributed_model(model, ngpus_per_node, args):
             # DistributedDataParallel, we need to divide the batch size
             # ourselves based on the total number of GPUs we have
             args.batch_size = int(args.batch_size / ngpus_per_node)
-            args.workers = int((args.workers + ngpus_per_node - 1) / ngpus_per_node)
+            args.procs_per_node = ngpus_per_node
+            if args.workers is not None:
+                args.workers = int((args.workers + ngpus_per_node - 1) / ngpus_per_node)
             model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[args.gpu])
         else:
             model.cuda()
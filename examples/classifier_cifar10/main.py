@@ -107,7 +107,7 @@ def main_worker(gpu, ngpus_per_node, args):
     optimizer = torch.optim.SGD(params, args.lr,
                                 momentum=args.momentum,
                                 weight_decay=args.weight_decay)
-    process_model(model, optimizer, args)
+    model = process_model(model, optimizer, args)
 
     cudnn.benchmark = True
 
@@ -118,7 +118,7 @@ def main_worker(gpu, ngpus_per_node, args):
     writer = get_summary_writer(args, ngpus_per_node)
     if (args.qw <= 0 and args.qa <= 0) or args.evaluate:
         if writer is not None:
-            get_model_info(model, args, val_loader)
+            get_model_info(model, args, df.input_sizes[df.cifar10])
     args.batch_num = len(train_loader)
 
     scheduler_warmup = get_lr_scheduler(optimizer, args)
@@ -154,6 +154,10 @@ def main_worker(gpu, ngpus_per_node, args):
                 'best_acc1': best_acc1,
                 'optimizer': optimizer.state_dict(),
             }, is_best, prefix='{}/{}_'.format(args.log_name, args.arch))
+    if args.sign_inference:
+        print('convert binary weights to sign bits')
+        wrapper.convert_to_sign(model)
+        validate(val_loader, model, criterion, args)
 
 
 classes = ('plane', 'car', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck')
@@ -98,7 +98,7 @@ def main_worker(gpu, args):
     optimizer = torch.optim.SGD(params, args.lr,
                                 momentum=args.momentum,
                                 weight_decay=args.weight_decay)
-    process_model(model, optimizer, args)
+    model = process_model(model, optimizer, args)
 
     cudnn.benchmark = True
 
@@ -108,7 +108,7 @@ def main_worker(gpu, args):
     train_loader, val_loader = df.product_train_val_loader(df.cifar10)
     writer = get_summary_writer(args)
     if (args.qw <= 0 and args.qa <= 0) or args.evaluate:
-        get_model_info(model, args, val_loader)
+        get_model_info(model, args, df.input_sizes[df.cifar10])
     args.batch_num = len(train_loader)
 
     scheduler_lr = get_lr_scheduler(optimizer, args)
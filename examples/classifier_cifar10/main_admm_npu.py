@@ -131,7 +131,7 @@ def main_worker(gpu, ngpus_per_node, args):
     optimizer = torch.optim.SGD(params, args.lr,
                                 momentum=args.momentum,
                                 weight_decay=args.weight_decay)
-    process_model(model, optimizer, args)
+    model = process_model(model, optimizer, args)
 
     cudnn.benchmark = True
 
@@ -141,7 +141,7 @@ def main_worker(gpu, ngpus_per_node, args):
     train_loader, val_loader = df.product_train_val_loader(df.cifar10)
     writer = get_summary_writer(args, ngpus_per_node)
     if (args.qw <= 0 and args.qa <= 0) or args.evaluate:
-        get_model_info(model, args, val_loader)
+        get_model_info(model, args, df.input_sizes[df.cifar10])
     args.batch_num = len(train_loader)
 
     scheduler_lr = get_lr_scheduler(optimizer, args)
@@ -220,7 +220,7 @@ def retrain(model, train_loader, val_loader, criterion, optimizer, scheduler_lr,
         writer.add_scalar('val/acc1', acc1, epoch)
         writer.add_scalar('val/lr', optimizer.param_groups[0]['lr'], epoch)
         if args.debug:
-            get_model_info(model, args, val_loader)
+            get_model_info(model, args, DataloaderFactory.input_sizes[DataloaderFactory.cifar10])
             for module_name, module in model.named_modules():
                 if isinstance(module, my_nn.Conv2dDNQ):
                     writer.add_scalar('val/nbits', module.nbits, epoch)
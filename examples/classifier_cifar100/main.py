@@ -82,7 +82,7 @@ def main_worker(gpu, args):
                                 momentum=args.momentum,
                                 weight_decay=args.weight_decay)
 
-    process_model(model, optimizer, args)
+    model = process_model(model, optimizer, args)
     cudnn.benchmark = True
 
     # Data loading code
@@ -91,7 +91,7 @@ def main_worker(gpu, args):
     train_loader, val_loader = df.product_train_val_loader(df.cifar100)
     writer = get_summary_writer(args)
     if (args.qw <= 0 and args.qa <= 0) or args.evaluate:
-        get_model_info(model, args, val_loader)
+        get_model_info(model, args, df.input_sizes[df.cifar100])
     args.batch_num = len(train_loader)
 
     print('length of train_loader {}'.format(len(train_loader)))
@@ -83,7 +83,7 @@ def main_worker(gpu, args):
     optimizer = torch.optim.SGD(model.parameters(), args.lr,
                                 momentum=args.momentum,
                                 weight_decay=args.weight_decay)
-    process_model(model, optimizer, args)
+    model = process_model(model, optimizer, args)
 
     cudnn.benchmark = True
     # Data loading code
@@ -92,7 +92,7 @@ def main_worker(gpu, args):
     train_loader, val_loader = df.product_train_val_loader(df.flower102)
     writer = get_summary_writer(args)
     if (args.qw <= 0 and args.qa <= 0) or args.evaluate:
-        get_model_info(model, args, val_loader)
+        get_model_info(model, args, df.input_sizes[df.flower102])
     args.batch_num = len(train_loader)
 
     print('length of train_loader {}'.format(len(train_loader)))
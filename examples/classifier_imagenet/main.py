@@ -112,7 +112,7 @@ def main_worker(gpu, ngpus_per_node, args):
     optimizer = torch.optim.SGD(params, args.lr,
                                 momentum=args.momentum)
 
-    process_model(model, optimizer, args)
+    model = process_model(model, optimizer, args)
 
     cudnn.benchmark = True
 
@@ -121,7 +121,7 @@ def main_worker(gpu, ngpus_per_node, args):
     writer = get_summary_writer(args, ngpus_per_node)
     if (args.qw <= 0 and args.qa <= 0) or args.evaluate:
         if writer is not None:
-            get_model_info(model, args, val_loader)
+            get_model_info(model, args, df.input_sizes[df.imagenet2012])
     args.batch_num = len(train_loader)
 
     scheduler = get_lr_scheduler(optimizer, args)
@@ -113,7 +113,7 @@ def main_worker(gpu, ngpus_per_node, args):
     train_loader, val_loader, train_sampler = df.product_train_val_loader(df.imagenet2012)
     args.batch_num = len(train_loader)
     if writer is not None:
-        get_model_info(model, args, val_loader)
+        get_model_info(model, args, df.input_sizes[df.imagenet2012])
 
     # define loss function (criterion) and optimizer
     criterion = nn.CrossEntropyLoss().cuda(args.gpu)
@@ -121,10 +121,10 @@ def main_worker(gpu, ngpus_per_node, args):
     optimizer = torch.optim.SGD(params, args.lr,
                                 momentum=args.momentum)
     if args.admm:
-        process_model(model, optimizer, args)
+        model = process_model(model, optimizer, args)
     else:
-        process_model(model, optimizer, args, 'Conv2dNPU', non_zero_num=args.non_zero_num,
-                      total_iter=args.batch_num * args.epochs, INS=args.INS, beta=args.beta)
+        model = process_model(model, optimizer, args, 'Conv2dNPU', non_zero_num=args.non_zero_num,
+                              total_iter=args.batch_num * args.epochs, INS=args.INS, beta=args.beta)
 
     cudnn.benchmark = True
 
@@ -132,7 +132,7 @@ def main_worker(gpu, ngpus_per_node, args):
 
     if args.evaluate:
         validate(val_loader, model, criterion, args)
-        get_model_info(model, args, val_loader)
+        get_model_info(model, args, df.input_sizes[df.imagenet2012])
         return
 
     for epoch in range(0, args.start_epoch):
@@ -201,7 +201,7 @@ def main_worker(gpu, ngpus_per_node, args):
             writer.add_scalar('val/acc1', acc1, epoch)
             writer.add_scalar('val/acc5', acc5, epoch)
             if args.debug:
-                get_model_info(model, args, val_loader)
+                get_model_info(model, args, df.input_sizes[df.imagenet2012])
             # remember best acc@1 and save checkpoint
             is_best = acc1 > best_acc1
             best_acc1 = max(acc1, best_acc1)
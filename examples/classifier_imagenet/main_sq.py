@@ -109,7 +109,7 @@ def main_worker(gpu, args):
     train_loader, val_loader, train_sampler = df.product_train_val_loader(df.imagenet2012)
     args.batch_num = len(train_loader)
 
-    get_model_info(model, args, val_loader)
+    get_model_info(model, args, df.input_sizes[df.imagenet2012])
 
     # define loss function (criterion) and optimizer
     criterion = nn.CrossEntropyLoss().cuda(args.gpu)
@@ -117,7 +117,7 @@ def main_worker(gpu, args):
     optimizer = torch.optim.SGD(params, args.lr,
                                 momentum=args.momentum)
 
-    process_model(model, optimizer, args)
+    model = process_model(model, optimizer, args)
 
     cudnn.benchmark = True
 
@@ -125,7 +125,7 @@ def main_worker(gpu, args):
 
     if args.evaluate:
         validate(val_loader, model, criterion, args)
-        get_model_info(model, args, val_loader)
+        get_model_info(model, args, df.input_sizes[df.imagenet2012])
         print('s: {} w{}a{}'.format(args.sparsity, args.qw, args.qa))
         return
 
@@ -196,7 +196,7 @@ def main_worker(gpu, args):
                 writer.add_scalar('val/acc1', acc1, epoch)
                 writer.add_scalar('val/acc5', acc5, epoch)
                 if args.debug:
-                    get_model_info(model, args, val_loader)
+                    get_model_info(model, args, df.input_sizes[df.imagenet2012])
                 # remember best acc@1 and save checkpoint
                 is_best = acc1 > best_acc1
                 best_acc1 = max(acc1, best_acc1)
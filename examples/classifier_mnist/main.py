@@ -23,6 +23,7 @@ import models.mnist as mnist_models
 from examples import gen_key_map, accuracy, set_bn_eval
 from models.modules import q_modes
 from utils import wrapper
+from utils.custom_datasets.tensor_loader import get_tensor_loaders
 
 model_names = sorted(name for name in mnist_models.__dict__
                      if name.islower() and not name.startswith("__")
@@ -82,6 +83,8 @@ parser.add_argument('--quant-bias-scale', action='store_true', default=False,
                     help='Add Qcode for scale and quantize bias')
 parser.add_argument('--extract-inner-data', action='store_true', default=False,
                     help='Extract inner feature map and weights')
+parser.add_argument('--tensor-loader', action='store_true', default=False,
+                    help='keep the dataset in memory as a uint8 tensor, augment whole batches without worker processes')
 
 parser.add_argument('--gpu', default=None, type=int,
                     help='GPU id to use.')
@@ -232,22 +235,25 @@ def main_worker(gpu, args):
     # Data loading code
     print('==> Preparing data..')
 
-    train_loader = torch.utils.data.DataLoader(
-        torchvision.datasets.MNIST(args.data, train=True, download=True,
-                                   transform=transforms.Compose([
-                                       transforms.Resize([32, 32]),
-                                       transforms.ToTensor(),
-                                       transforms.Normalize((0.1307,), (0.3081,))
-                                   ])),
-        batch_size=args.batch_size, shuffle=True)
+    if args.tensor_loader:
+        train_loader, val_loader, _ = get_tensor_loaders('mnist', args.data, args.batch_size)
+    else:
+        train_loader = torch.utils.data.DataLoader(
+            torchvision.datasets.MNIST(args.data, train=True, download=True,
+                                       transform=transforms.Compose([
+                                           transforms.Resize([32, 32]),
+                                           transforms.ToTensor(),
+                                           transforms.Normalize((0.1307,), (0.3081,))
+                                       ])),
+            batch_size=args.batch_size, shuffle=True)
+        val_loader = torch.utils.data.DataLoader(
+            torchvision.datasets.MNIST(args.data, train=False, transform=transforms.Compose([
+                transforms.Resize([32, 32]),
+                transforms.ToTensor(),
+                transforms.Normalize((0.1307,), (0.3081,))
+            ])),
+            batch_size=args.batch_size, shuffle=False)
     args.batch_num = len(train_loader)
-    val_loader = torch.utils.data.DataLoader(
-        torchvision.datasets.MNIST(args.data, train=False, transform=transforms.Compose([
-            transforms.Resize([32, 32]),
-            transforms.ToTensor(),
-            transforms.Normalize((0.1307,), (0.3081,))
-        ])),
-        batch_size=args.batch_size, shuffle=False)
 
     scheduler_cosine = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
     scheduler_step = torch.optim.lr_scheduler.MultiStepLR(optimizer, milestones=[20, 40, 60])
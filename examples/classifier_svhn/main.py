@@ -20,6 +20,7 @@ from warmup_scheduler import GradualWarmupScheduler
 import models.svhn as svhn_models
 from examples import accuracy
 from models.modules import q_modes
+from utils.custom_datasets.tensor_loader import get_tensor_loaders
 
 model_names = sorted(name for name in svhn_models.__dict__
                      if name.islower() and not name.startswith("__")
@@ -86,6 +87,8 @@ parser.add_argument('--qw', default=4, type=int,
                     help='quantized weight bit')
 parser.add_argument('--debug', action='store_true', default=False,
                     help='save running scale in tensorboard')
+parser.add_argument('--tensor-loader', action='store_true', default=False,
+                    help='keep the dataset in memory as a uint8 tensor, augment whole batches without worker processes')
 best_acc1 = 0
 
 
@@ -182,28 +185,31 @@ def main_worker(gpu, args):
     # Data loading code
     print('==> Preparing data..')
 
-    transform_train = transforms.Compose([
-        transforms.Resize(36),
-        transforms.RandomCrop(32),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
-    ])
-
-    transform_test = transforms.Compose([
-        transforms.Resize(32),
-        transforms.ToTensor(),
-        transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
-    ])
-
-    train_data = torchvision.datasets.SVHN(args.data, split='train', transform=transform_train, target_transform=None,
-                                           download=True)
-    test_data = torchvision.datasets.SVHN(args.data, split='test', transform=transform_test, target_transform=None,
-                                          download=True)
-
-    train_loader = torch.utils.data.DataLoader(train_data, batch_size=args.batch_size, shuffle=True,
-                                               num_workers=args.workers)
-    val_loader = torch.utils.data.DataLoader(test_data, batch_size=args.batch_size, num_workers=args.workers)
+    if args.tensor_loader:
+        train_loader, val_loader, _ = get_tensor_loaders('svhn', args.data, args.batch_size)
+    else:
+        transform_train = transforms.Compose([
+            transforms.Resize(36),
+            transforms.RandomCrop(32),
+            transforms.RandomHorizontalFlip(),
+            transforms.ToTensor(),
+            transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
+        ])
+
+        transform_test = transforms.Compose([
+            transforms.Resize(32),
+            transforms.ToTensor(),
+            transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
+        ])
+
+        train_data = torchvision.datasets.SVHN(args.data, split='train', transform=transform_train,
+                                               target_transform=None, download=True)
+        test_data = torchvision.datasets.SVHN(args.data, split='test', transform=transform_test, target_transform=None,
+                                              download=True)
+
+        train_loader = torch.utils.data.DataLoader(train_data, batch_size=args.batch_size, shuffle=True,
+                                                   num_workers=args.workers)
+        val_loader = torch.utils.data.DataLoader(test_data, batch_size=args.batch_size, num_workers=args.workers)
 
     args.batch_num = len(train_loader)
 
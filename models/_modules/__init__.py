@@ -16,6 +16,10 @@ from .dnq import *
 from .sq import *
 from .npu_structured_pruner import *
 from .admm_loss import *
+from .int_gemm import *
+from .int_shift import *
+from .sign_gemm import *
+from .lut_gemm import *
 
 
 class QuantizationFactory(object):
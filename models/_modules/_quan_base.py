@@ -8,8 +8,9 @@ from torch.nn.parameter import Parameter
 import math
 from enum import Enum
 
-__all__ = ['Qmodes', 'log_shift', '_Conv2dQ', '_LinearQ', '_ActQ',
-           'update_running_scale', 'ln_error', 'truncation', 'round_cus',
+__all__ = ['Qmodes', 'log_shift', '_Conv2dQ', '_LinearQ', '_ActQ', '_InitStateMixin', 'ActFixedQ', 'calibrate',
+           'set_compile_mode',
+           'update_running_scale', 'ln_error', 'search_scale', 'is_search_step', 'truncation', 'round_cus',
            'get_sparsity_mask', 'FunStopGradient', 'round_pass', 'grad_scale']
 
 
@@ -90,8 +91,8 @@ def linear_dequantize(input, scale_factor, inplace=False):
 
 def truncation(fp_data, nbits=8):
     il = torch.log2(torch.max(fp_data.max(), fp_data.min().abs())) + 1
-    il = math.ceil(il - 1e-5)
-    qcode = nbits - il
+    # torch.ceil instead of math.ceil: qcode stays on the device (no host sync)
+    qcode = nbits - torch.ceil(il - 1e-5)
     scale_factor = 2 ** qcode
     clamp_min, clamp_max = get_quantized_range(nbits, signed=True)
     q_data = linear_quantize_clamp(fp_data, scale_factor, clamp_min, clamp_max)
@@ -152,6 +153,39 @@ def ln_error(x, scale, Qn, Qp, qmode=Qmodes.layer_wise, is_l2=True):
     return error
 
 
+def search_scale(x, scale, Qn, Qp, qmode=Qmodes.layer_wise, is_l2=True, factors=(0.5, 2.)):
+    """
+    Evaluate the quantization error of all candidate scales (scale * factor) and of the current scale in one pass.
+    With factors=(0.5, 2.) the decision is the same as `ln_error` + `update_running_scale`:
+    ties prefer the candidates in the given order, the current scale is kept only when it is strictly the best.
+    :param x: layer_wise: any shape; kernel_wise: (-1, scale.numel())
+    :return: the best factor for every element of scale (1 means keep).
+    """
+    with torch.no_grad():
+        f = torch.tensor(tuple(factors) + (1.,), dtype=x.dtype, device=x.device)
+        candidates = scale.reshape(1, -1) * f.view(-1, 1)  # K + 1, C
+        candidates = candidates.view(-1, *([1] * (x.dim() - 1)), candidates.shape[-1])
+        diff = (x / candidates).clamp_(Qn, Qp).round_().mul_(candidates).sub_(x)
+        diff = diff.pow_(2) if is_l2 else diff.abs_()
+        if qmode == Qmodes.layer_wise:
+            error = diff.reshape(f.numel(), -1).sum(dim=1, keepdim=True) / x.numel()
+        else:
+            error = diff.sum(dim=1) / x.shape[0]
+        return f[error.argmin(dim=0)].reshape(scale.shape)
+
+
+def is_search_step(module, search_interval):
+    """Amortized scale search: only every `search_interval` training steps."""
+    if not module.training:
+        return False
+    if getattr(module, 'compile_mode', False):
+        # no step counter in the compiled graph
+        return True
+    search = module.n_iter % search_interval == 0
+    module.n_iter += 1
+    return search
+
+
 def get_default_kwargs_q(kwargs_q, layer_type):
     default = {
         'nbits': 4
@@ -173,7 +207,123 @@ def get_default_kwargs_q(kwargs_q, layer_type):
     return kwargs_q
 
 
-class _Conv2dQ(nn.Conv2d):
+def _search_interval(module):
+    # quantize.py modules keep it as an attribute, the LLSQ modules in kwargs_q
+    interval = getattr(module, 'search_interval', None)
+    if interval is None:
+        interval = (getattr(module, 'kwargs_q', None) or {}).get('search_interval', 1)
+    return interval
+
+
+def set_compile_mode(model, enable=True):
+    """
+    Compile-ready execution mode for torch.compile and torch.jit.trace.
+    The forward of the quantized modules then has no step-dependent Python state:
+    step counters are not advanced and the running-scale search runs on every training step
+    (`search_interval` only amortizes the search in eager mode, a warning lists the modules that set it).
+    All quantizers that are used have to be initialized before (see `calibrate`), this includes the incremental
+    sparsity phase (INS) of Conv2dSQ and Conv2dNPU, which updates the mask on a schedule in eager mode.
+    """
+    if enable:
+        uninitialized = [name or type(m).__name__ for name, m in model.named_modules()
+                         if not getattr(m, 'initialized', True)]
+        if len(uninitialized) > 0:
+            # not an error: modules that are never called (e.g. an unused out_actq) are never initialized
+            print('Warning: not initialized, the forward is not compile-ready if they are used '
+                  '(see calibrate): {}'.format(', '.join(uninitialized)))
+        amortized = [name or type(m).__name__ for name, m in model.named_modules()
+                     if _search_interval(m) > 1]
+        if len(amortized) > 0:
+            print('Warning: search_interval is ignored in compile mode, the running scale is searched on every '
+                  'training step: {}'.format(', '.join(amortized)))
+    for m in model.modules():
+        if isinstance(m, _InitStateMixin) or hasattr(m, 'n_iter'):
+            m.compile_mode = enable
+
+
+class _InitStateMixin(object):
+    """
+    Python-side copy of the `init_state` buffer.
+    Reading the buffer in forward (`if self.init_state == 0`) is a device-to-host sync on every call,
+    so forward only checks `self.initialized`.
+    The buffer is still what goes into the state dict; loading a state dict refreshes the flag.
+    nn.DataParallel replicas shallow-copy the module __dict__ but get their own buffer tensors: the copied flag
+    is stale there, a replica reads its buffer once (replica 0 aliases the buffer of the wrapped module), and an
+    initialization in a replica marks the wrapped module initialized.
+    """
+
+    def _init_state_flag(self):
+        # (buffer the flag belongs to, flag); the list is shared with the replicas
+        self._init_cache = (self.init_state, False)
+        self._init_shared = [False]
+        self._register_load_state_dict_pre_hook(self._load_init_state)
+
+    @property
+    def initialized(self):
+        cache = self.__dict__.get('_init_cache')
+        if cache is None:
+            raise AttributeError('initialized')
+        if cache[0] is not self.init_state:
+            # a replica or moved buffers (.cuda()): one sync
+            self._init_cache = cache = (self.init_state, bool((self.init_state != 0).all()))
+            return cache[1]
+        return cache[1] or self._init_shared[0]
+
+    @initialized.setter
+    def initialized(self, initialized):
+        self._init_cache = (self.init_state, initialized)
+        self._init_shared[0] = initialized
+
+    def _load_init_state(self, state_dict, prefix, *args):
+        key = prefix + 'init_state'
+        if key in state_dict:
+            # one sync at load time instead of one per forward
+            self.initialized = bool((state_dict[key] != 0).all())
+
+    def set_init_state(self, initialized=True):
+        self.init_state.fill_(1 if initialized else 0)
+        self.initialized = initialized
+
+
+def _data_parallel_types():
+    types = [nn.DataParallel]
+    if hasattr(nn.parallel, 'DistributedDataParallel'):
+        types.append(nn.parallel.DistributedDataParallel)
+    return tuple(types)
+
+
+def calibrate(model, *inputs):
+    """
+    Explicit one-time initialization of all quantizers, instead of the lazy init in the first training step.
+    Every module that is not initialized yet is initialized from its own input of one forward pass.
+    The forward runs in the current mode of the model: in training mode the result is the same as the lazy init
+    (BN layers also see the batch), in eval mode BN running statistics are used and left untouched.
+    (Distributed)DataParallel wrappers are bypassed: the wrapped modules themselves are initialized, on the device
+    of their parameters, instead of per-step replicas.
+    :param inputs: one calibration batch, as passed to model(*inputs)
+    """
+
+    def init_hook(module, module_inputs):
+        if not module.initialized:
+            module.initialize(module_inputs[0])
+
+    handles = []
+    wrappers = [m for m in model.modules() if isinstance(m, _data_parallel_types())]
+    for m in model.modules():
+        if hasattr(m, 'initialize') and not getattr(m, 'initialized', True):
+            handles.append(m.register_forward_pre_hook(init_hook))
+    for w in wrappers:
+        w.forward = w.module.forward
+    try:
+        model(*inputs)
+    finally:
+        for h in handles:
+            h.remove()
+        for w in wrappers:
+            del w.forward
+
+
+class _Conv2dQ(_InitStateMixin, nn.Conv2d):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1,
                  padding=0, dilation=1, groups=1, bias=True, **kwargs_q):
         super(_Conv2dQ, self).__init__(in_channels, out_channels, kernel_size, stride=stride,
@@ -189,6 +339,18 @@ class _Conv2dQ(nn.Conv2d):
         else:  # layer-wise quantization
             self.alpha = Parameter(torch.Tensor(1))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
+
+    @property
+    def nbits(self):
+        return self._nbits
+
+    @nbits.setter
+    def nbits(self, nbits):
+        # quantization constants only change with nbits, not per forward
+        self._nbits = nbits
+        self.Qn, self.Qp = get_quantized_range(nbits, signed=True)
+        self.g = 1.0 / math.sqrt(self.weight.numel() * self.Qp) if self.Qp > 0 else 0.
 
     def add_param(self, param_k, param_v):
         self.kwargs_q[param_k] = param_v
@@ -200,7 +362,7 @@ class _Conv2dQ(nn.Conv2d):
         return '{}, {}'.format(s_prefix, self.kwargs_q)
 
 
-class _LinearQ(nn.Linear):
+class _LinearQ(_InitStateMixin, nn.Linear):
     def __init__(self, in_features, out_features, bias=True, **kwargs_q):
         super(_LinearQ, self).__init__(in_features=in_features, out_features=out_features, bias=bias)
         self.kwargs_q = get_default_kwargs_q(kwargs_q, layer_type=self)
@@ -210,6 +372,18 @@ class _LinearQ(nn.Linear):
             return
         self.alpha = Parameter(torch.Tensor(1))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
+
+    @property
+    def nbits(self):
+        return self._nbits
+
+    @nbits.setter
+    def nbits(self, nbits):
+        # quantization constants only change with nbits, not per forward
+        self._nbits = nbits
+        self.Qn, self.Qp = get_quantized_range(nbits, signed=True)
+        self.g = 1.0 / math.sqrt(self.weight.numel() * self.Qp) if self.Qp > 0 else 0.
 
     def add_param(self, param_k, param_v):
         self.kwargs_q[param_k] = param_v
@@ -221,17 +395,29 @@ class _LinearQ(nn.Linear):
         return '{}, {}'.format(s_prefix, self.kwargs_q)
 
 
-class _ActQ(nn.Module):
+class _ActQ(_InitStateMixin, nn.Module):
     def __init__(self, **kwargs_q):
         super(_ActQ, self).__init__()
         self.kwargs_q = get_default_kwargs_q(kwargs_q, layer_type=self)
+        self.signed = kwargs_q['signed']
         self.nbits = kwargs_q['nbits']
         if self.nbits < 0:
             self.register_parameter('alpha', None)
             return
-        self.signed = kwargs_q['signed']
-        self.alpha = Parameter(torch.Tensor(1))
+        # finite until initialize(): ActDNQ/ActLLSQS skip the initialization on an all-zero batch
+        self.alpha = Parameter(torch.ones(1))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
+
+    @property
+    def nbits(self):
+        return self._nbits
+
+    @nbits.setter
+    def nbits(self, nbits):
+        # quantization constants only change with nbits, not per forward
+        self._nbits = nbits
+        self.Qn, self.Qp = get_quantized_range(nbits, signed=self.signed)
 
     def add_param(self, param_k, param_v):
         self.kwargs_q[param_k] = param_v
@@ -241,3 +427,42 @@ class _ActQ(nn.Module):
         if self.alpha is None:
             return 'fake'
         return '{}'.format(self.kwargs_q)
+
+
+class ActFixedQ(nn.Module):
+    """
+    Activation quantizer with a fixed scale, the inference form of the activation quantizers (see freeze_quantized).
+    No parameters, no init state and no scale search: x_q = round(clamp(x / scale, Qn, Qp)) * scale
+    """
+
+    def __init__(self, scale, Qn, Qp, rounding='round', zero_pass=False, out_scale=False):
+        """
+        :param scale: the (already quantized) step size
+        :param rounding: 'round', 'floor' or 'round_cus'
+        :param zero_pass: an all-zero input passes through unchanged (ActLLSQS, ActDNQ)
+        :param out_scale: output = [output, scale]
+        """
+        super(ActFixedQ, self).__init__()
+        assert rounding in ('round', 'floor', 'round_cus')
+        self.register_buffer('scale', scale.detach().clone().reshape(1))
+        self.Qn = Qn
+        self.Qp = Qp
+        self.rounding = rounding
+        self.zero_pass = zero_pass
+        self.out_scale = out_scale
+
+    def forward(self, x):
+        x_q = (x / self.scale).clamp(self.Qn, self.Qp)
+        if self.rounding == 'floor':
+            x_q = x_q.floor()
+        elif self.rounding == 'round_cus':
+            x_q = round_cus(x_q)
+        else:
+            x_q = x_q.round()
+        x_q = x_q * self.scale
+        if self.zero_pass:
+            x_q = torch.where(x.max() < 1e-6, x, x_q)
+        return [x_q, self.scale] if self.out_scale else x_q
+
+    def extra_repr(self):
+        return 'Qn={}, Qp={}, rounding={}'.format(self.Qn, self.Qp, self.rounding)
@@ -3,9 +3,39 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from models._modules import Qmodes, _Conv2dQ, _LinearQ, log_shift
+from models._modules import Qmodes, _Conv2dQ, _LinearQ, log_shift, truncation
 
-__all__ = ['Conv2dBWN', 'LinearBWN', 'Conv2dBWNS', 'LinearBWNS', 'Conv2dBNBWNS', 'FunSign']
+__all__ = ['Conv2dBWN', 'LinearBWN', 'Conv2dBWNS', 'LinearBWNS', 'Conv2dBNBWNS', 'FunSign', 'shift_bias']
+
+
+def init_shift_alpha(module, w_reshape):
+    """
+    alpha = 1/2^n, the closest power of two above mean(|w|), halved once if it is >= 1.
+    The >= 1 check is elementwise on the device (kernel_wise halves only the channels that need it).
+    """
+    layer_wise = module.alpha.numel() == 1
+    if layer_wise:
+        alpha_fp = torch.mean(torch.abs(w_reshape.data))
+    else:
+        alpha_fp = torch.mean(torch.abs(w_reshape.data), dim=0)
+    alpha_s = log_shift(alpha_fp)
+    alpha_s = torch.where(alpha_s >= 1, alpha_s / 2, alpha_s)
+    if layer_wise:
+        print('{}==>{}'.format(alpha_fp.item(), alpha_s.item()))
+    module.alpha.data.copy_(alpha_s)
+    module.set_init_state()
+
+
+def shift_bias(module):
+    """
+    The bias of the shift layers (Conv2dBWNS, LinearBWNS, Conv2dBNBWNS) with `bias_bits` > 0 is quantized
+    on the power-of-two grid of truncation, i.e. b_q = qcode_b * 2^-qcode.
+    """
+    if module.bias is None or module.bias_bits <= 0:
+        return module.bias
+    bias_q, _ = truncation(module.bias, module.bias_bits)
+    # straight-through; b_q and b are within a factor of 2, so b + (b_q - b) is exactly b_q
+    return module.bias + (bias_q - module.bias).detach()
 
 
 class Conv2dBNBWNS(_Conv2dQ):
@@ -27,10 +57,14 @@ class Conv2dBNBWNS(_Conv2dQ):
             self.nbits = 1
             # if self.q_mode is Qmodes.kernel_wise:
             #     raise NotImplementedError
+        self.bias_bits = -1
+
+    def set_bias_bits(self, nbits=8):
+        self.bias_bits = nbits
 
     def forward(self, x):
         if self._bn.training:
-            if self.alpha is not None and self.init_state != 0:
+            if self.alpha is not None and self.initialized:
                 w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
                 alpha = self.alpha.detach()
                 pre_quantized_weight = w_reshape / alpha
@@ -68,28 +102,15 @@ class Conv2dBNBWNS(_Conv2dQ):
             return F.conv2d(x, weight_fold, bias_fold, self.stride,
                             self.padding, self.dilation, self.groups)
         w_reshape = weight_fold.reshape([self.weight.shape[0], -1]).transpose(0, 1)
-        if self.training and self.init_state == 0:
-            # self.alpha.data.copy_(torch.ones(1))
-            if self.q_mode == Qmodes.layer_wise:
-                alpha_fp = torch.mean(torch.abs(w_reshape.data))
-                alpha_s = log_shift(alpha_fp)
-                if alpha_s >= 1:
-                    alpha_s /= 2
-                print('{}==>{}'.format(alpha_fp.item(), alpha_s.item()))
-            else:
-                alpha_fp = torch.mean(torch.abs(w_reshape.data), dim=0)
-                alpha_s = log_shift(alpha_fp)
-                for i in range(len(alpha_s)):
-                    if alpha_s[i] >= 1:
-                        alpha_s /= 2
-            self.alpha.data.copy_(alpha_s)
-            self.init_state.fill_(1)
+        if self.training and not self.initialized:
+            # the folded weight depends on the batch statistics, so it is initialized here instead of `initialize`
+            init_shift_alpha(self, w_reshape)
 
         alpha = self.alpha.detach()
         pre_quantized_weight = w_reshape / alpha
         quantized_weight = alpha * FunSign.apply(pre_quantized_weight)
         w_q = quantized_weight.transpose(0, 1).reshape(self.weight.shape)
-        return F.conv2d(x, w_q, self.bias, self.stride,
+        return F.conv2d(x, w_q, shift_bias(self), self.stride,
                         self.padding, self.dilation, self.groups)
 
 
@@ -110,34 +131,27 @@ class Conv2dBWNS(_Conv2dQ):
             self.nbits = 1
             # if self.q_mode is Qmodes.kernel_wise:
             #     raise NotImplementedError
+        self.bias_bits = -1
+
+    def set_bias_bits(self, nbits=8):
+        self.bias_bits = nbits
+
+    def initialize(self, x):
+        init_shift_alpha(self, self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1))
 
     def forward(self, x):
         if self.alpha is None:
             return F.conv2d(x, self.weight, self.bias, self.stride,
                             self.padding, self.dilation, self.groups)
         w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
-        if self.training and self.init_state == 0:
-            # self.alpha.data.copy_(torch.ones(1))
-            if self.q_mode == Qmodes.layer_wise:
-                alpha_fp = torch.mean(torch.abs(w_reshape.data))
-                alpha_s = log_shift(alpha_fp)
-                if alpha_s >= 1:
-                    alpha_s /= 2
-                print('{}==>{}'.format(alpha_fp.item(), alpha_s.item()))
-            else:
-                alpha_fp = torch.mean(torch.abs(w_reshape.data), dim=0)
-                alpha_s = log_shift(alpha_fp)
-                for i in range(len(alpha_s)):
-                    if alpha_s[i] >= 1:
-                        alpha_s /= 2
-            self.alpha.data.copy_(alpha_s)
-            self.init_state.fill_(1)
+        if self.training and not self.initialized:
+            self.initialize(x)
 
         alpha = self.alpha.detach()
         pre_quantized_weight = w_reshape / alpha
         quantized_weight = alpha * FunSign.apply(pre_quantized_weight)
         w_q = quantized_weight.transpose(0, 1).reshape(self.weight.shape)
-        return F.conv2d(x, w_q, self.bias, self.stride,
+        return F.conv2d(x, w_q, shift_bias(self), self.stride,
                         self.padding, self.dilation, self.groups)
         # todo: no bias
         # return F.conv2d(x, w_q, None, self.stride,
@@ -159,15 +173,18 @@ class Conv2dBWN(_Conv2dQ):
             if self.q_mode is Qmodes.kernel_wise:
                 raise NotImplementedError
 
+    def initialize(self, x):
+        # self.alpha.data.copy_(torch.ones(1))
+        self.alpha.data.copy_(torch.mean(torch.abs(self.weight.data)))
+        # alpha = torch.mean(torch.abs(self.weight.data))
+        self.set_init_state()
+
     def forward(self, x):
         if self.alpha is None:
             return F.conv2d(x, self.weight, self.bias, self.stride,
                             self.padding, self.dilation, self.groups)
-        if self.training and self.init_state == 0:
-            # self.alpha.data.copy_(torch.ones(1))
-            self.alpha.data.copy_(torch.mean(torch.abs(self.weight.data)))
-            # alpha = torch.mean(torch.abs(self.weight.data))
-            self.init_state.fill_(1)
+        if self.training and not self.initialized:
+            self.initialize(x)
 
         alpha = self.alpha.detach()
         pre_quantized_weight = self.weight / alpha
@@ -182,6 +199,10 @@ class LinearBWNS(_LinearQ):
         if self.nbits > 0:
             print('Only support 1 or -1, change the nbits to 1')
             self.nbits = 1
+        self.bias_bits = -1
+
+    def set_bias_bits(self, nbits=8):
+        self.bias_bits = nbits
 
     def save_inner_data(self, save, prefix, name, tensor):
         if not save:
@@ -189,24 +210,22 @@ class LinearBWNS(_LinearQ):
         print('saving {}_{} shape: {}'.format(prefix, name, tensor.size()))
         np.save('{}_{}'.format(prefix, name), tensor.detach().cpu().numpy())
 
+    def initialize(self, x):
+        init_shift_alpha(self, self.weight)
+
     def forward(self, x, save=False):
         if self.alpha is None:
             return F.linear(x, self.weight, self.bias)
-        if self.training and self.init_state == 0:
-            alpha_fp = torch.mean(torch.abs(self.weight.data))
-            alpha_s = log_shift(alpha_fp)
-            if alpha_s >= 1:
-                alpha_s /= 2
-            print('{}==>{}'.format(alpha_fp.item(), alpha_s.item()))
-            self.alpha.data.copy_(alpha_s)
-            self.init_state.fill_(1)
+        if self.training and not self.initialized:
+            self.initialize(x)
         alpha = self.alpha.detach()
         pre_quantized_weight = self.weight / alpha
         quantized_weight = alpha * FunSign.apply(pre_quantized_weight)
         self.save_inner_data(save, 'fc', 'alpha', alpha)
         self.save_inner_data(save, 'fc', 'weight', quantized_weight)
-        self.save_inner_data(save, 'fc', 'bias', self.bias)
-        return F.linear(x, quantized_weight, self.bias)
+        bias = shift_bias(self)
+        self.save_inner_data(save, 'fc', 'bias', bias)
+        return F.linear(x, quantized_weight, bias)
         # todo: no bias
         # return F.linear(x, quantized_weight)
 
@@ -218,12 +237,15 @@ class LinearBWN(_LinearQ):
             print('Only support 1 or -1, change the nbits to 1')
             self.nbits = 1
 
+    def initialize(self, x):
+        self.alpha.data.copy_(torch.mean(torch.abs(self.weight.data)))
+        self.set_init_state()
+
     def forward(self, x):
         if self.alpha is None:
             return F.linear(x, self.weight, self.bias)
-        if self.training and self.init_state == 0:
-            self.alpha.data.copy_(torch.mean(torch.abs(self.weight.data)))
-            self.init_state.fill_(1)
+        if self.training and not self.initialized:
+            self.initialize(x)
         alpha = self.alpha.detach()
         pre_quantized_weight = self.weight / alpha
         quantized_weight = alpha * FunSign.apply(pre_quantized_weight)
@@ -248,15 +270,18 @@ class Conv2dBWV(_Conv2dQ):
             if self.q_mode is Qmodes.kernel_wise:
                 raise NotImplementedError
 
+    def initialize(self, x):
+        # self.alpha.data.copy_(torch.ones(1))
+        self.alpha.data.copy_(torch.mean(torch.abs(self.weight.data)))
+        # alpha = torch.mean(torch.abs(self.weight.data))
+        self.set_init_state()
+
     def forward(self, x):
         if self.alpha is None:
             return F.conv2d(x, self.weight, self.bias, self.stride,
                             self.padding, self.dilation, self.groups)
-        if self.training and self.init_state == 0:
-            # self.alpha.data.copy_(torch.ones(1))
-            self.alpha.data.copy_(torch.mean(torch.abs(self.weight.data)))
-            # alpha = torch.mean(torch.abs(self.weight.data))
-            self.init_state.fill_(1)
+        if self.training and not self.initialized:
+            self.initialize(x)
 
         alpha = self.alpha.detach()
         pre_quantized_weight = self.weight / alpha
@@ -2,15 +2,19 @@
 # Kuan Wang*, Zhijian Liu*, Yujun Lin*, Ji Lin, Song Han
 # {kuanwang, zhijian, yujunlin, jilin, songhan}@mit.edu
 # Adopted from https://github.com/mit-han-lab/haq-release/blob/master/lib/utils/quantize_utils.py
+import hashlib
+import os
 from abc import ABC
 
 import torch
+import torch.multiprocessing as mp
 import torch.nn as nn
 import torch.nn.functional as F
-from sklearn.cluster import KMeans
 
-__all__ = ['Conv2dClusterQ', 'Conv2dShareQ', 'ActShareQ', 'k_means_cpu', 'reconstruct_weight_from_k_means_result',
-           'FuncKmeansSTE']
+from models._modules import _InitStateMixin
+
+__all__ = ['Conv2dClusterQ', 'Conv2dShareQ', 'ActShareQ', 'k_means_cpu', 'k_means_1d', 'cluster_all_layers',
+           'reconstruct_weight_from_k_means_result', 'FuncKmeansSTE']
 
 
 class FuncKmeansSTE(torch.autograd.Function):
@@ -23,46 +27,33 @@ class FuncKmeansSTE(torch.autograd.Function):
     @staticmethod
     def backward(ctx, grad_weight):
         centroids, labels = ctx.saved_tensors
-        grad_weight_ = torch.zeros_like(grad_weight)
-        grad_centroids = torch.zeros_like(centroids)
-        num_centroids = centroids.size(0)
-        for j in range(num_centroids):
-            mask_cl = (labels == j).float()
-            grad_weight_ += (grad_weight * mask_cl).sum() / mask_cl.sum() * mask_cl
-            grad_centroids[j] += (grad_weight * mask_cl).sum() / mask_cl.sum()
-
-        return grad_weight_, grad_centroids, None
+        # every weight gets the mean gradient of its cluster
+        grad_centroids = cluster_mean(grad_weight, labels, centroids.size(0))
+        grad_weight_ = grad_centroids[labels.long()]
+        return grad_weight_, grad_centroids.to(centroids.dtype), None
 
 
 class FuncKmeansActSTE(torch.autograd.Function):
     @staticmethod
     def forward(ctx, activation, centroids):
         centroid_sort, index = centroids.sort()
-        centroid_thresh = [-10000] + [(centroid_sort[i] + centroid_sort[i + 1]) / 2
-                                      for i in range(len(centroid_sort) - 1)] + [10000]
-        label = torch.zeros_like(activation)
-        for i in range(len(centroid_sort)):
-            case = (centroid_thresh[i] <= activation) * (activation < centroid_thresh[i + 1])
-            activation = torch.where(case, torch.zeros_like(activation).fill_(centroid_sort[i]), activation)
-            label = torch.where(case, torch.zeros_like(activation).fill_(index[i]), label)
+        # the nearest centroid: the interval between the midpoints, in one pass
+        centroid_thresh = (centroid_sort[:-1] + centroid_sort[1:]) / 2
+        bucket = torch.bucketize(activation, centroid_thresh, right=True)
+        # activations outside of [-10000, 10000) are kept, with label 0
+        in_range = (activation >= -10000) & (activation < 10000)
+        label = torch.where(in_range, index[bucket], torch.zeros_like(bucket))
         ctx.save_for_backward(centroids, label)
-        return activation
+        return torch.where(in_range, centroid_sort[bucket].to(activation.dtype), activation)
 
     @staticmethod
     def backward(ctx, grad_act):
         centroids, labels = ctx.saved_tensors
-        # grad_act_ = torch.zeros_like(grad_act)
-        grad_centroids = torch.zeros_like(centroids)
-        num_centroids = centroids.size(0)
-        for j in range(num_centroids):
-            mask_cl = (labels == j).float()
-            # grad_act_ += (grad_act * mask_cl).sum() / mask_cl.sum() * mask_cl
-            grad_centroids[j] += (grad_act * mask_cl).sum() / mask_cl.sum()
+        grad_centroids = cluster_mean(grad_act, labels, centroids.size(0))
+        return grad_act, grad_centroids.to(centroids.dtype)
 
-        return grad_act, grad_centroids
 
-
-class Conv2dClusterQ(nn.Conv2d):
+class Conv2dClusterQ(_InitStateMixin, nn.Conv2d):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1,
                  padding=0, dilation=1, groups=1, bias=True, nbits=4, fix_zero=True):
         super(Conv2dClusterQ, self).__init__(in_channels, out_channels, kernel_size, stride=stride,
@@ -76,19 +67,26 @@ class Conv2dClusterQ(nn.Conv2d):
         self.centroids = nn.Parameter(torch.zeros(2 ** self.nbits))
         self.register_buffer('labels', torch.zeros_like(self.weight))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
+
+    def cluster_weight(self):
+        return self.weight.data
+
+    def set_clusters(self, centroids, labels):
+        with torch.no_grad():
+            self.centroids.copy_(centroids)
+            self.labels.copy_(labels)
+            self.weight.data.copy_(reconstruct_weight_from_k_means_result(centroids, labels))
+        self.set_init_state()
+
+    def initialize(self, x):
+        self.set_clusters(*k_means_1d(self.cluster_weight(), 2 ** self.nbits))
 
     def forward(self, input):
-        w = self.weight.data
-        if self.init_state == 0:
-            if self.training and self.mode == 'cpu':
-                with torch.no_grad():
-                    centroids, labels = k_means_cpu(w.cpu().numpy(), 2 ** self.nbits)
-                    self.centroids.copy_(centroids)
-                    self.labels.copy_(labels)
-                    self.weight.data.copy_(reconstruct_weight_from_k_means_result(centroids, labels))
-            else:
+        if not self.initialized:
+            if not self.training:
                 raise NotImplementedError
-            self.init_state.fill_(1)
+            self.initialize(input)
         weight = FuncKmeansSTE.apply(self.weight, self.centroids, self.labels)
         return F.conv2d(input, weight, self.bias, self.stride,
                         self.padding, self.dilation, self.groups)
@@ -101,7 +99,7 @@ class Conv2dClusterQ(nn.Conv2d):
             s_prefix, self.nbits)
 
 
-class ActShareQ(nn.Module):
+class ActShareQ(_InitStateMixin, nn.Module):
     def __init__(self, nbits=4, share_num=2):
         super(ActShareQ, self).__init__()
         self.share_num = share_num
@@ -113,25 +111,26 @@ class ActShareQ(nn.Module):
         self.mode = 'cpu'
         self.centroids = nn.Parameter(torch.zeros(2 ** self.nbits))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
+
+    def initialize(self, input):
+        with torch.no_grad():
+            input_cat = []
+            for i in range(self.share_num):
+                input_cat.append(input[i])
+            input_cat = torch.cat(input_cat)
+            centroids, labels = k_means_1d(input_cat, 2 ** self.nbits)
+            self.centroids.copy_(centroids)
+            # input = reconstruct_weight_from_k_means_result(centroids, labels)
+        print('act kmeans processing.')
+        self.set_init_state()
 
     def forward(self, input):
         if self.nbits < 0:
             return input
         split = [input[i].size(0) for i in range(self.share_num)]
-        if self.init_state == 0 and self.training:
-            if self.mode == 'cpu':
-                with torch.no_grad():
-                    input_cat = []
-                    for i in range(self.share_num):
-                        input_cat.append(input[i])
-                    input_cat = torch.cat(input_cat)
-                    centroids, labels = k_means_cpu(input_cat.cpu().numpy(), 2 ** self.nbits)
-                    self.centroids.copy_(centroids)
-                    # input = reconstruct_weight_from_k_means_result(centroids, labels)
-            else:
-                raise NotImplementedError
-            print('act kmeans processing.')
-            self.init_state.fill_(1)
+        if not self.initialized and self.training:
+            self.initialize(input)
         input_cat = []
         for i in range(self.share_num):
             input_cat.append(input[i])
@@ -151,7 +150,7 @@ class ActShareQ(nn.Module):
             s_prefix, self.nbits, self.share_num)
 
 
-class Conv2dShareQ(nn.Module):
+class Conv2dShareQ(_InitStateMixin, nn.Module):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1,
                  padding=0, dilation=1, groups=1, bias=True, nbits=4, share_num=2):
         super(Conv2dShareQ, self).__init__()
@@ -174,6 +173,28 @@ class Conv2dShareQ(nn.Module):
 
         self.register_buffer('labels', torch.zeros_like(torch.cat(weight)))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
+
+    def cluster_weight(self):
+        weight = []
+        for i in range(self.share_num):
+            weight.append(self.convs[i].weight.data)
+        return torch.cat(weight)
+
+    def set_clusters(self, centroids, labels):
+        with torch.no_grad():
+            self.centroids.copy_(centroids)
+            self.labels.copy_(labels)
+            wq = reconstruct_weight_from_k_means_result(centroids, labels)
+            split = int(wq.size(0) / self.share_num)
+            for i in range(self.share_num):
+                wqi = wq[i * split: (i + 1) * split, :, :, :]
+                self.convs[i].weight.data.copy_(wqi)
+        self.set_init_state()
+
+    def initialize(self, input):
+        self.set_clusters(*k_means_1d(self.cluster_weight(), 2 ** self.nbits))
+        print('conv kmeans processing.')
 
     def forward(self, input):
         if self.nbits < 0:
@@ -183,25 +204,8 @@ class Conv2dShareQ(nn.Module):
                                     self.convs[i].padding, self.convs[i].dilation, self.convs[i].groups))
             return ret
 
-        if self.init_state == 0 and self.training:
-            if self.mode == 'cpu':
-                with torch.no_grad():
-                    weight = []
-                    for i in range(self.share_num):
-                        weight.append(self.convs[i].weight.data)
-                    weight = torch.cat(weight)
-                    centroids, labels = k_means_cpu(weight.cpu().numpy(), 2 ** self.nbits)
-                    self.centroids.copy_(centroids)
-                    self.labels.copy_(labels)
-                    wq = reconstruct_weight_from_k_means_result(centroids, labels)
-                    split = int(weight.size(0) / self.share_num)
-                    for i in range(self.share_num):
-                        wqi = wq[i * split: (i + 1) * split, :, :, :]
-                        self.convs[i].weight.data.copy_(wqi)
-                print('conv kmeans processing.')
-            else:
-                raise NotImplementedError
-            self.init_state.fill_(1)
+        if not self.initialized and self.training:
+            self.initialize(input)
         weight = []
         for i in range(self.share_num):
             weight.append(self.convs[i].weight.data)
@@ -229,6 +233,7 @@ class Conv2dShareQ(nn.Module):
 
 
 def k_means_cpu(weight, n_clusters, init='k-means++', max_iter=50):
+    from sklearn.cluster import KMeans
     # flatten the weight for computing k-means
     org_shape = weight.shape
     weight = weight.reshape(-1, 1)  # single feature
@@ -241,14 +246,105 @@ def k_means_cpu(weight, n_clusters, init='k-means++', max_iter=50):
     centroids = k_means.cluster_centers_
     labels = k_means.labels_
     labels = labels.reshape(org_shape)
-    return torch.from_numpy(centroids).cuda().view(-1), torch.from_numpy(labels).int().cuda()
+    # on the CPU, the callers copy them to the device of the module
+    return torch.from_numpy(centroids).view(-1), torch.from_numpy(labels).int()
+
+
+def k_means_1d(x, n_clusters, max_iter=50):
+    """
+    Lloyd's k-means of scalars, with torch on the device of x (replaces the sklearn k_means_cpu).
+    The values are sorted once: every cluster is then a contiguous range of them, so an iteration is a
+    searchsorted of the midpoints between the centroids and a difference of prefix sums, O(k log n).
+    The centroids start at the quantiles; empty clusters keep their centroid.
+    :return: centroids in ascending order [n_clusters], labels (int, the shape of x)
+    """
+    with torch.no_grad():
+        values = x.detach().reshape(-1).double().sort()[0]
+        n = values.numel()
+        prefix = torch.cat([values.new_zeros(1), values.cumsum(0)])
+        quantiles = (torch.arange(n_clusters, dtype=torch.float64, device=x.device) + 0.5) * n / n_clusters
+        centroids = values[quantiles.long().clamp_(max=n - 1)]
+        for _ in range(max_iter):
+            # cluster j: centroid_thresh[j - 1] <= value < centroid_thresh[j]
+            centroid_thresh = (centroids[:-1] + centroids[1:]) / 2
+            bounds = torch.cat([prefix.new_zeros(1, dtype=torch.long), torch.searchsorted(values, centroid_thresh),
+                                prefix.new_full((1,), n, dtype=torch.long)])
+            counts = bounds[1:] - bounds[:-1]
+            means = (prefix[bounds[1:]] - prefix[bounds[:-1]]) / counts.clamp(min=1)
+            updated = torch.where(counts > 0, means, centroids).sort()[0]
+            if torch.equal(updated, centroids):
+                break
+            centroids = updated
+        centroids = centroids.to(x.dtype)
+        labels = torch.bucketize(x.detach(), (centroids[:-1] + centroids[1:]) / 2, right=True)
+    return centroids, labels.int()
+
+
+def _weight_key(weight, n_clusters, max_iter):
+    digest = hashlib.sha1(weight.detach().cpu().contiguous().numpy().tobytes()).hexdigest()
+    return '{}_{}_{}'.format(digest, n_clusters, max_iter)
+
+
+def cluster_all_layers(model, nbits=None, workers=0, cache_dir=None, max_iter=50):
+    """
+    Initialize all the Conv2dClusterQ/Conv2dShareQ layers that are not initialized yet at once, instead of
+    one by one in the first training forward. ActShareQ still clusters its first batch.
+    :param nbits: the bits of all the layers (build the optimizer after), None: keep the bits of every layer
+    :param workers: the size of the process pool, 0: one layer after the other, on the device of the weights
+    :param cache_dir: the results are saved there, keyed on the hash of the weight, and loaded on a restart
+    :return: the model
+    """
+    layers = [m for m in model.modules() if isinstance(m, (Conv2dClusterQ, Conv2dShareQ))
+              and m.centroids is not None and not m.initialized]
+    if nbits is not None:
+        for m in layers:
+            m.nbits = nbits
+            m.centroids = nn.Parameter(torch.zeros(2 ** nbits, device=m.centroids.device))
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    results = [None] * len(layers)
+    jobs = []
+    for i, m in enumerate(layers):
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, _weight_key(m.cluster_weight(), 2 ** m.nbits, max_iter) + '.pth')
+            if os.path.isfile(path):
+                results[i] = torch.load(path)
+                continue
+        jobs.append((i, path))
+    if workers > 0 and len(jobs) > 1:
+        # spawn: a forked child may hang in the OpenMP pool of the parent
+        with mp.get_context('spawn').Pool(workers) as pool:
+            clusters = pool.starmap(k_means_1d, [(layers[i].cluster_weight().cpu(), 2 ** layers[i].nbits, max_iter)
+                                                 for i, _ in jobs])
+        for (i, _), result in zip(jobs, clusters):
+            results[i] = result
+    else:
+        for i, _ in jobs:
+            results[i] = k_means_1d(layers[i].cluster_weight(), 2 ** layers[i].nbits, max_iter)
+    for i, path in jobs:
+        if path is not None:
+            torch.save(tuple(r.cpu() for r in results[i]), path)
+    for m, (centroids, labels) in zip(layers, results):
+        m.set_clusters(centroids, labels)
+    return model
+
+
+def cluster_mean(values, labels, num_centroids):
+    """
+    Mean of `values` per cluster, in one scatter_add pass instead of a full-size mask per centroid.
+    Empty clusters get 0.
+    """
+    index = labels.reshape(-1).long()
+    values = values.reshape(-1)
+    sums = torch.zeros(num_centroids, dtype=values.dtype, device=values.device).scatter_add_(0, index, values)
+    counts = torch.bincount(index, minlength=num_centroids).clamp_(min=1)
+    return sums / counts.to(values.dtype)
 
 
 def reconstruct_weight_from_k_means_result(centroids, labels):
-    weight = torch.zeros_like(labels).float().cuda()
-    for i, c in enumerate(centroids.cpu().numpy().squeeze()):
-        weight[labels == i] = c.item()
-    return weight
+    # a table lookup on the device of labels
+    return centroids.to(labels.device)[labels.long()].float()
 
 
 def kmeans_update_model(model, quantizable_idx, centroid_label_dict, free_high_bit=False):
@@ -262,7 +358,6 @@ def kmeans_update_model(model, quantizable_idx, centroid_label_dict, free_high_b
         if num_centroids > 2 ** 6 and free_high_bit:
             # quantize weight with high bit will not lead accuracy loss, so we can omit them to save time
             continue
-        for j in range(num_centroids):
-            mask_cl = (this_cl_list[0][1] == j).float()
-            new_weight_data += (layer.weight.data * mask_cl).sum() / mask_cl.sum() * mask_cl
+        labels = this_cl_list[0][1].to(layer.weight.device)
+        new_weight_data += cluster_mean(layer.weight.data, labels, num_centroids)[labels.long()]
         layer.weight.data = new_weight_data
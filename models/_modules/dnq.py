@@ -37,28 +37,29 @@ class ActDNQ(_ActQ):
             self.fixed = True
             self.nbits = 2 * self.nbits
 
+    def initialize(self, x):
+        if x.max() < 1e-6:
+            # all-zero input, initialize on the next batch
+            return
+        # Please select a init_rate for activation.
+        alpha_fp = 2 * x.detach().abs().mean() / math.sqrt(self.Qp)
+        self.alpha.data.copy_(alpha_fp)
+        self.set_init_state()
+
     def forward(self, x):
-        if self.alpha is None or x.max() < 1e-6:
-            assert ValueError
+        if self.alpha is None:
             return x
-        if self.signed:
-            Qn = -2 ** (self.nbits - 1)
-            Qp = 2 ** (self.nbits - 1) - 1
-        else:
-            Qn = 0
-            Qp = 2 ** self.nbits - 1
-        if self.training and self.init_state == 0:
-            # Please select a init_rate for activation.
-            alpha_fp = 2 * x.abs().mean() / math.sqrt(Qp)
-            self.alpha.data.copy_(alpha_fp)
-            self.init_state.fill_(1)
+        Qn, Qp = self.Qn, self.Qp
+        if self.training and not self.initialized:
+            self.initialize(x)
         g = 1.0 / math.sqrt(x.numel() * Qp)
         alpha = grad_shift_scale(self.alpha, g)
         if self.fixed:
             alpha = alpha.detach()
         self.alpha_s.data.copy_(alpha)
         x_q = round_pass((x / alpha).clamp(Qn, Qp)) * alpha
-        return x_q
+        # all-zero input passes through, selected on the device instead of `if x.max() < 1e-6`
+        return torch.where(x.max() < 1e-6, x, x_q)
 
 
 class LinearDNQ(_LinearQ):
@@ -76,18 +77,20 @@ class LinearDNQ(_LinearQ):
             self.fixed = True
             self.nbits = 2 * self.nbits
 
+    def initialize(self, x):
+        self.set_init_state()
+        # alpha_fp = self.weight.detach().abs().max() / (Qp + 1)
+        alpha_fp = 2 * self.weight.detach().abs().mean() / (self.Qp ** 0.5)
+        # print('{}==>{}'.format(alpha_fp.item(), alpha_s.item()))
+        self.alpha.data.copy_(alpha_fp)
+
     def forward(self, x):
         if self.alpha is None:
             return F.linear(x, self.weight, self.bias)
-        Qn = -2 ** (self.nbits - 1)
-        Qp = 2 ** (self.nbits - 1) - 1
-        if self.training and self.init_state == 0:
-            self.init_state.fill_(1)
-            # alpha_fp = self.weight.detach().abs().max() / (Qp + 1)
-            alpha_fp = 2 * self.weight.abs().mean() / (Qp ** 0.5)
-            # print('{}==>{}'.format(alpha_fp.item(), alpha_s.item()))
-            self.alpha.data.copy_(alpha_fp)
-        g = 1.0 / math.sqrt(self.weight.numel() * Qp)
+        Qn, Qp = self.Qn, self.Qp
+        if self.training and not self.initialized:
+            self.initialize(x)
+        g = self.g
         alpha = grad_shift_scale(self.alpha, g)
         if self.fixed:
             alpha = alpha.detach()
@@ -116,25 +119,27 @@ class Conv2dDNQ(_Conv2dQ):
             self.fixed = True
             self.nbits = 2 * self.nbits
 
+    def initialize(self, x):
+        if self.q_mode == Qmodes.layer_wise:
+            # alpha_fp = w_reshape.detach().abs().max() / (Qp + 1)
+            alpha_fp = 2 * self.weight.detach().abs().mean() / (self.Qp ** 0.5)
+        else:
+            assert NotImplementedError
+            # alpha_fp = w_reshape.detach().abs().max(dim=0)[0] / Qp
+            # alpha_s = log_shift(alpha_fp)
+            print('-----')
+        self.alpha.data.copy_(alpha_fp)
+        self.set_init_state()
+
     def forward(self, x):
         if self.alpha is None:
             return F.conv2d(x, self.weight, self.bias, self.stride,
                             self.padding, self.dilation, self.groups)
-        Qn = -2 ** (self.nbits - 1)
-        Qp = 2 ** (self.nbits - 1) - 1
+        Qn, Qp = self.Qn, self.Qp
         # w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
-        if self.training and self.init_state == 0:
-            if self.q_mode == Qmodes.layer_wise:
-                # alpha_fp = w_reshape.detach().abs().max() / (Qp + 1)
-                alpha_fp = 2 * self.weight.abs().mean() / (Qp ** 0.5)
-            else:
-                assert NotImplementedError
-                # alpha_fp = w_reshape.detach().abs().max(dim=0)[0] / Qp
-                # alpha_s = log_shift(alpha_fp)
-                print('-----')
-            self.alpha.data.copy_(alpha_fp)
-            self.init_state.fill_(1)
-        g = 1.0 / math.sqrt(self.weight.numel() * Qp)
+        if self.training and not self.initialized:
+            self.initialize(x)
+        g = self.g
         alpha = grad_shift_scale(self.alpha, g)
         if self.fixed:
             alpha = alpha.detach()
@@ -160,10 +165,6 @@ class FunLLSQS(torch.autograd.Function):
     @staticmethod
     def backward(ctx, grad_x):
         x, alpha = ctx.saved_tensors
-        if alpha.shape[0] == 1:
-            assert alpha > 0, 'alpha = {}'.format(alpha)
-        else:
-            assert (alpha >= 0).sum() == alpha.shape[0]
         Qn, Qp, Qmode, is_l2, is_act = ctx.other
         if is_act:
             zeros_x = torch.zeros_like(grad_x).to(alpha.device)
@@ -187,26 +188,24 @@ class ActDNQv2(_ActQ):
         else:
             self.nbits = 2 * self.nbits
 
+    def initialize(self, x):
+        self.set_init_state()
+        # empirical value
+        if self.nbits >= 4:
+            init_value = (self.Qp + 1)
+        elif self.nbits == 3:
+            init_value = 2 * self.Qp
+        else:
+            # TODO
+            init_value = 2 * self.Qp
+        self.alpha.data.copy_(x.detach().abs().max() / init_value)
+
     def forward(self, x):
         if self.alpha is None:
             return x
-        if self.signed:
-            Qn = -2 ** (self.nbits - 1)
-            Qp = 2 ** (self.nbits - 1) - 1
-        else:
-            Qn = 0
-            Qp = 2 ** self.nbits - 1
-        if self.training and self.init_state == 0:
-            self.init_state.fill_(1)
-            # empirical value
-            if self.nbits >= 4:
-                init_value = (Qp + 1)
-            elif self.nbits == 3:
-                init_value = 2 * Qp
-            else:
-                # TODO
-                init_value = 2 * Qp
-            self.alpha.data.fill_(x.detach().abs().max() / init_value)
+        Qn, Qp = self.Qn, self.Qp
+        if self.training and not self.initialized:
+            self.initialize(x)
 
         y = FunLLSQS.apply(x, self.alpha, Qn, Qp, Qmodes.layer_wise, self.kwargs_q['is_l2'], True)
         return y
@@ -223,15 +222,17 @@ class LinearDNQv2(_LinearQ):
         else:
             self.nbits = 2 * self.nbits
 
+    def initialize(self, x):
+        self.set_init_state()
+        self.alpha.data.copy_(self.weight.detach().abs().max() / (self.Qp + 1))
+
     def forward(self, x):
         if self.alpha is None:
             return F.linear(x, self.weight, self.bias)
-        Qn = -2 ** (self.nbits - 1)
-        Qp = 2 ** (self.nbits - 1) - 1
+        Qn, Qp = self.Qn, self.Qp
         w_reshape = self.weight.transpose(0, 1)
-        if self.training and self.init_state == 0:
-            self.init_state.fill_(1)
-            self.alpha.data.fill_(w_reshape.detach().abs().max() / (Qp + 1))
+        if self.training and not self.initialized:
+            self.initialize(x)
         w_reshape_q = FunLLSQS.apply(w_reshape, self.alpha, Qn, Qp, Qmodes.layer_wise, self.kwargs_q['is_l2'], False)
         w_q = w_reshape_q.transpose(0, 1)
         return F.linear(x, w_q, self.bias)
@@ -253,19 +254,22 @@ class Conv2dDNQv2(_Conv2dQ):
         else:
             self.nbits = 2 * self.nbits
 
+    def initialize(self, x):
+        w_reshape = self.weight.detach().reshape([self.weight.shape[0], -1]).transpose(0, 1)
+        if self.q_mode == Qmodes.layer_wise:
+            self.alpha.data.copy_(w_reshape.abs().max() / (self.Qp + 1))
+        else:
+            self.alpha.data.copy_(w_reshape.abs().max(dim=0)[0] / self.Qp)
+        self.set_init_state()
+
     def forward(self, x):
         if self.alpha is None:
             return F.conv2d(x, self.weight, self.bias, self.stride,
                             self.padding, self.dilation, self.groups)
-        Qn = -2 ** (self.nbits - 1)
-        Qp = 2 ** (self.nbits - 1) - 1
+        Qn, Qp = self.Qn, self.Qp
         w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
-        if self.training and self.init_state == 0:
-            if self.q_mode == Qmodes.layer_wise:
-                self.alpha.data.copy_(w_reshape.detach().abs().max() / (Qp + 1))
-            else:
-                self.alpha.data.copy_(w_reshape.detach().abs().max(dim=0)[0] / Qp)
-            self.init_state.fill_(1)
+        if self.training and not self.initialized:
+            self.initialize(x)
         w_reshape_q = FunLLSQS.apply(w_reshape, self.alpha, Qn, Qp, self.q_mode, self.kwargs_q['is_l2'], False)
         w_q = w_reshape_q.transpose(0, 1).reshape(self.weight.shape)
         return F.conv2d(x, w_q, self.bias, self.stride,
@@ -0,0 +1,186 @@
+"""
+    Integer inference of LSQ/LLSQ quantized Conv2d and Linear (see utils.wrapper.convert_to_int).
+    The input is quantized to int8 codes, the layer runs as an int8 x int8 -> int32 GEMM and
+    the int32 accumulator is rescaled once: y = acc * (scale_a * scale_w) + bias
+"""
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+__all__ = ['Conv2dInt', 'LinearInt', 'pack_int4', 'unpack_int4', 'HAS_INT_MM']
+
+
+def _has_int_mm():
+    try:
+        # torch._int_mm exists from torch 2.1, its CPU kernel only in later versions
+        ones = torch.ones(32, 32, dtype=torch.int8)
+        return bool((torch._int_mm(ones, ones) == 32).all())
+    except (AttributeError, RuntimeError, NotImplementedError):
+        return False
+
+
+# int8 x int8 -> int32 kernel, else an int32 matmul
+HAS_INT_MM = _has_int_mm()
+
+
+def pack_int4(codes):
+    """
+    Two int4 codes per byte: the even columns in the low nibble, the odd columns in the high nibble.
+    :param codes: int8 tensor [rows, K], values in [-8, 7]
+    :return: int8 tensor [rows, ceil(K / 2)]
+    """
+    if codes.shape[1] % 2 == 1:
+        codes = F.pad(codes, (0, 1))
+    return (codes[:, 0::2] & 0x0F) | (codes[:, 1::2] << 4)
+
+
+def unpack_int4(packed, K):
+    """Inverse of pack_int4, the arithmetic shifts restore the sign."""
+    low = (packed << 4) >> 4
+    high = packed >> 4
+    return torch.stack([low, high], dim=-1).reshape(packed.shape[0], -1)[:, :K]
+
+
+class _GemmInt(nn.Module):
+    def __init__(self, weight_codes, Qn_a, Qp_a, pack=False):
+        """
+        :param weight_codes: integer weight codes, [out, K]
+        :param Qn_a: smallest input code
+        :param Qp_a: largest input code
+        :param pack: store two int4 codes per byte (weights of nbits <= 4)
+        """
+        super(_GemmInt, self).__init__()
+        self.K = weight_codes.shape[1]
+        self.Qn_a = Qn_a
+        self.Qp_a = Qp_a
+        # uint8 codes do not fit into int8: shift them by 128 and add 128 * sum(w) back to the accumulator
+        self.zero_point = 128 if Qp_a > 127 else 0
+        assert -128 <= Qn_a - self.zero_point and Qp_a - self.zero_point <= 127, 'Only support 8 bits inputs'
+        weight_int = weight_codes.to(torch.int8)
+        self.packed = pack
+        if pack:
+            assert weight_codes.min() >= -8 and weight_codes.max() <= 7, 'Only 4 bits weights can be packed'
+            weight_int = pack_int4(weight_int)
+        self.register_buffer('weight_int', weight_int)
+        if self.zero_point == 0:
+            self.register_buffer('weight_sum', None)
+        else:
+            self.register_buffer('weight_sum', weight_codes.sum(dim=1).int() * self.zero_point)
+        self._weight_cache = None
+        self._register_load_state_dict_pre_hook(self._clear_cache)
+
+    def _clear_cache(self, *args):
+        self._weight_cache = None
+
+    def weight_codes(self):
+        """int8 [out, K], the int4 codes are unpacked once per device (kept out of the state dict)"""
+        if not self.packed:
+            return self.weight_int
+        cache = self._weight_cache
+        if cache is None or cache.device != self.weight_int.device:
+            cache = self._weight_cache = unpack_int4(self.weight_int, self.K)
+        return cache
+
+    def quantize_input(self, x, memory_format=torch.contiguous_format):
+        x_int = (x / self.scale_a).round_().clamp_(self.Qn_a, self.Qp_a)
+        return self.input_codes(x_int, memory_format=memory_format)
+
+    def input_codes(self, x_int, memory_format=torch.contiguous_format):
+        """:param x_int: input codes (any dtype) ==> int8 operand of the GEMM"""
+        if self.zero_point != 0:
+            x_int = x_int - self.zero_point
+        return x_int.to(torch.int8, memory_format=memory_format)
+
+    def gemm(self, x_int):
+        """:param x_int: int8 [M, K] ==> int32 [M, out]"""
+        weight_int = self.weight_codes()
+        if HAS_INT_MM:
+            acc = torch._int_mm(x_int, weight_int.t())
+        else:
+            acc = torch.mm(x_int.int(), weight_int.t().int())
+        if self.weight_sum is not None:
+            acc += self.weight_sum
+        return acc
+
+
+class _Conv2dGemm(_GemmInt):
+    """
+    The convolution is an im2col GEMM. The patches are gathered from the channels last int8 input
+    (contiguous runs of C), padding is the code of zero.
+    """
+
+    def __init__(self, in_channels, out_channels, kernel_size, stride, padding,
+                 weight_codes, Qn_a, Qp_a, pack=False):
+        # K is ordered (kh, kw, C), as the channels last patches
+        super(_Conv2dGemm, self).__init__(weight_codes.permute(0, 2, 3, 1).reshape(out_channels, -1),
+                                          Qn_a, Qp_a, pack=pack)
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.kernel_size = kernel_size
+        self.stride = stride
+        self.padding = padding
+
+    def conv_int(self, x_int):
+        """:param x_int: channels last int8 [N, C, H, W] ==> int32 accumulator [N, out, Ho, Wo] (a view)"""
+        # N, H, W, C
+        x_int = x_int.permute(0, 2, 3, 1)
+        (kh, kw), (sh, sw), (ph, pw) = self.kernel_size, self.stride, self.padding
+        if ph > 0 or pw > 0:
+            x_int = F.pad(x_int, (0, 0, pw, pw, ph, ph), value=-self.zero_point)
+        # N, Ho, Wo, C, kh, kw
+        patches = x_int.unfold(1, kh, sh).unfold(2, kw, sw)
+        N, Ho, Wo, C = patches.shape[:4]
+        cols = patches.permute(0, 1, 2, 4, 5, 3).reshape(N * Ho * Wo, kh * kw * C)
+        return self.gemm(cols).reshape(N, Ho, Wo, self.out_channels).permute(0, 3, 1, 2)
+
+    def extra_repr(self):
+        return '{}, {}, kernel_size={}, stride={}, padding={}, packed={}'.format(
+            self.in_channels, self.out_channels, self.kernel_size, self.stride, self.padding, self.packed)
+
+
+def _register_scales(module, scale_w, scale_a):
+    module.register_buffer('scale_a', scale_a.detach().reshape(1).clone())
+    # the only requantization of the layer
+    module.register_buffer('scale', (scale_a.detach() * scale_w.detach()).reshape(-1).clone())
+
+
+class Conv2dInt(_Conv2dGemm):
+    def __init__(self, in_channels, out_channels, kernel_size, stride, padding,
+                 weight_codes, scale_w, scale_a, Qn_a, Qp_a, bias=None, pack=False):
+        """
+        :param scale_w: step size of the weights, one or one per output channel
+        :param scale_a: step size of the input, i.e. of the activation quantizer in front of the layer
+        """
+        super(Conv2dInt, self).__init__(in_channels, out_channels, kernel_size, stride, padding,
+                                        weight_codes, Qn_a, Qp_a, pack=pack)
+        _register_scales(self, scale_w, scale_a)
+        self.register_buffer('bias', None if bias is None else bias.detach().clone())
+
+    def forward(self, x):
+        acc = self.conv_int(self.quantize_input(x, memory_format=torch.channels_last))
+        # the rescale writes the NCHW output
+        out = torch.empty(acc.shape, device=x.device)
+        torch.mul(acc, self.scale.view(-1, 1, 1), out=out)
+        if self.bias is not None:
+            out += self.bias.view(-1, 1, 1)
+        return out
+
+
+class LinearInt(_GemmInt):
+    def __init__(self, in_features, out_features, weight_codes, scale_w, scale_a, Qn_a, Qp_a,
+                 bias=None, pack=False):
+        super(LinearInt, self).__init__(weight_codes, Qn_a, Qp_a, pack=pack)
+        _register_scales(self, scale_w, scale_a)
+        self.register_buffer('bias', None if bias is None else bias.detach().clone())
+        self.in_features = in_features
+        self.out_features = out_features
+
+    def forward(self, x):
+        x_int = self.quantize_input(x)
+        out = self.gemm(x_int.reshape(-1, self.in_features)) * self.scale
+        if self.bias is not None:
+            out += self.bias
+        return out.reshape(*x.shape[:-1], self.out_features)
+
+    def extra_repr(self):
+        return 'in_features={}, out_features={}, packed={}'.format(self.in_features, self.out_features, self.packed)
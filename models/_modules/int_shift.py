@@ -0,0 +1,157 @@
+"""
+    Integer-only inference of the shift models: ActLLSQS + Conv2dBWNS/LinearBWNS/Conv2dBNBWNS
+    (see utils.wrapper.convert_to_shift). All step sizes are powers of two, a tensor is carried as
+    integers x_int with an exponent e: x = x_int * 2^e. Every rescale is an arithmetic shift.
+"""
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.modules.utils import _pair
+
+from models._modules import round_cus
+from models._modules.int_gemm import _GemmInt, _Conv2dGemm
+
+__all__ = ['ActShift', 'Conv2dShift', 'LinearShift', 'MaxPool2dInt', 'shift_round']
+
+
+def shift_round(x, shift, rounding='round'):
+    """
+    x * 2^shift rounded to an integer, with integer ops only.
+    :param x: integer tensor
+    :param shift: > 0: left shift, < 0: rounding arithmetic right shift
+    :param rounding: 'round' (half to even, as torch.round), 'floor' or 'round_cus' (half up)
+    """
+    if shift >= 0:
+        return x << shift
+    r = -shift
+    q = x >> r
+    if rounding == 'floor':
+        return q
+    rem = x - (q << r)
+    half = 1 << (r - 1)
+    if rounding == 'round_cus':
+        return q + (rem >= half)
+    return q + ((rem > half) | ((rem == half) & ((q & 1) == 1)))
+
+
+def _output(module, x):
+    # the last module of the model dequantizes its output
+    if module.out_float:
+        return x.float() * 2. ** module.scale_exp
+    return x
+
+
+class ActShift(nn.Module):
+    """
+    The activation quantizer: integers of exponent exp_in ==> int32 codes of exponent scale_exp.
+    The first one quantizes the float input of the model with the same float ops as ActLLSQS.
+    The all-zero pass-through of ActLLSQS gives the same codes after a ReLU.
+    """
+
+    def __init__(self, exp_in, exp, Qn, Qp, rounding='round'):
+        """
+        :param exp_in: exponent of the input, None: the float input of the model
+        :param exp: exponent of the codes, i.e. log2 of the step size
+        """
+        super(ActShift, self).__init__()
+        assert rounding in ('round', 'floor', 'round_cus')
+        self.exp_in = exp_in
+        self.scale_exp = exp
+        self.Qn = Qn
+        self.Qp = Qp
+        self.rounding = rounding
+        self.out_float = False
+
+    def forward(self, x):
+        if self.exp_in is None:
+            x_q = (x / 2. ** self.scale_exp).clamp(self.Qn, self.Qp)
+            if self.rounding == 'floor':
+                x_q = x_q.floor()
+            elif self.rounding == 'round_cus':
+                x_q = round_cus(x_q)
+            else:
+                x_q = x_q.round()
+            x_q = x_q.to(torch.int32)
+        else:
+            x_q = shift_round(x, self.exp_in - self.scale_exp, self.rounding).clamp_(self.Qn, self.Qp).int()
+        return _output(self, x_q)
+
+    def extra_repr(self):
+        return 'exp_in={}, exp={}, Qn={}, Qp={}, rounding={}'.format(self.exp_in, self.scale_exp, self.Qn,
+                                                                     self.Qp, self.rounding)
+
+
+def _register_shifts(module, exp_w, exp_in, bias_codes, exp_b):
+    """
+    acc = sum(x_int * w_int) has the exponent exp_in + exp_w (per output channel), the bias has exp_b.
+    The output exponent is the finest of them, so both are aligned with left shifts only.
+    """
+    exp_acc = exp_w.long().reshape(-1) + exp_in
+    scale_exp = int(exp_acc.min())
+    if bias_codes is not None:
+        scale_exp = min(scale_exp, exp_b)
+        module.register_buffer('bias_int', bias_codes.long().reshape(-1) << (exp_b - scale_exp))
+    else:
+        module.register_buffer('bias_int', None)
+    module.register_buffer('shift', exp_acc - scale_exp)
+    module.scale_exp = scale_exp
+    module.out_float = False
+
+
+class Conv2dShift(_Conv2dGemm):
+    def __init__(self, in_channels, out_channels, kernel_size, stride, padding,
+                 weight_codes, exp_w, exp_in, Qn_a, Qp_a, bias_codes=None, exp_b=None):
+        """
+        :param weight_codes: the signs of the weights, [out, C, kh, kw]
+        :param exp_w: exponent of the weights, one or one per output channel
+        :param exp_in: exponent of the input codes
+        :param bias_codes: integer bias, bias = bias_codes * 2^exp_b
+        """
+        super(Conv2dShift, self).__init__(in_channels, out_channels, kernel_size, stride, padding,
+                                          weight_codes, Qn_a, Qp_a)
+        _register_shifts(self, exp_w, exp_in, bias_codes, exp_b)
+
+    def forward(self, x):
+        acc = self.conv_int(self.input_codes(x, memory_format=torch.channels_last)).long()
+        acc = acc << self.shift.view(-1, 1, 1)
+        if self.bias_int is not None:
+            acc += self.bias_int.view(-1, 1, 1)
+        return _output(self, acc)
+
+
+class LinearShift(_GemmInt):
+    def __init__(self, in_features, out_features, weight_codes, exp_w, exp_in, Qn_a, Qp_a,
+                 bias_codes=None, exp_b=None):
+        super(LinearShift, self).__init__(weight_codes, Qn_a, Qp_a)
+        _register_shifts(self, exp_w, exp_in, bias_codes, exp_b)
+        self.in_features = in_features
+        self.out_features = out_features
+
+    def forward(self, x):
+        acc = self.gemm(self.input_codes(x.reshape(-1, self.in_features))).long()
+        acc = acc << self.shift
+        if self.bias_int is not None:
+            acc += self.bias_int
+        return _output(self, acc.reshape(*x.shape[:-1], self.out_features))
+
+    def extra_repr(self):
+        return 'in_features={}, out_features={}'.format(self.in_features, self.out_features)
+
+
+class MaxPool2dInt(nn.Module):
+    """max_pool2d has no integer kernel on CPU: the maximum of the unfolded windows."""
+
+    def __init__(self, kernel_size, stride=None, padding=0):
+        super(MaxPool2dInt, self).__init__()
+        self.kernel_size = _pair(kernel_size)
+        self.stride = _pair(stride if stride is not None else kernel_size)
+        self.padding = _pair(padding)
+
+    def forward(self, x):
+        (kh, kw), (sh, sw), (ph, pw) = self.kernel_size, self.stride, self.padding
+        if ph > 0 or pw > 0:
+            x = F.pad(x, (pw, pw, ph, ph), value=torch.iinfo(x.dtype).min)
+        return x.unfold(2, kh, sh).unfold(3, kw, sw).amax(dim=(-2, -1))
+
+    def extra_repr(self):
+        return 'kernel_size={}, stride={}, padding={}'.format(self.kernel_size, self.stride, self.padding)
@@ -10,7 +10,7 @@
 """
 import torch
 import torch.nn.functional as F
-from models._modules import _ActQ, log_shift, ln_error, update_running_scale, _Conv2dQ, Qmodes, _LinearQ, round_cus
+from models._modules import _ActQ, log_shift, search_scale, is_search_step, _Conv2dQ, Qmodes, _LinearQ, round_cus
 
 __all__ = ['ActLLSQS', 'ActLLSQ', 'Conv2dLLSQ', 'LinearLLSQ']
 
@@ -18,8 +18,8 @@ __all__ = ['ActLLSQS', 'ActLLSQ', 'Conv2dLLSQ', 'LinearLLSQ']
 class FunLLSQ(torch.autograd.Function):
     # TODO:
     @staticmethod
-    def forward(ctx, x, alpha, Qn, Qp, Qmode, is_l2, is_act=True):
-        ctx.other = Qn, Qp, Qmode, is_l2, is_act
+    def forward(ctx, x, alpha, Qn, Qp, Qmode, is_l2, is_act=True, search=True, factors=(0.5, 2.)):
+        ctx.other = Qn, Qp, Qmode, is_l2, is_act, search, factors
         q_x = (x / alpha).round().clamp(Qn, Qp)
         x_q = q_x * alpha
         ctx.save_for_backward(x, alpha)
@@ -28,73 +28,83 @@ class FunLLSQ(torch.autograd.Function):
     @staticmethod
     def backward(ctx, grad_x):
         x, alpha = ctx.saved_tensors
-        if alpha.shape[0] == 1:
-            assert alpha > 0, 'alpha = {}'.format(alpha)
-        else:
-            assert (alpha >= 0).sum() == alpha.shape[0]
-        Qn, Qp, Qmode, is_l2, is_act = ctx.other
+        Qn, Qp, Qmode, is_l2, is_act, search, factors = ctx.other
         if is_act:
             zeros_x = torch.zeros_like(grad_x).to(alpha.device)
             grad_x = torch.where(((Qn * alpha < x) + (x < Qp * alpha)) == 2, grad_x, zeros_x)
-        error = ln_error(x, alpha, Qn, Qp, Qmode, is_l2)
-        b, s = update_running_scale(x, alpha, error, Qn, Qp, Qmode, is_l2)
-        grad_alpha = torch.zeros_like(alpha).to(alpha.device)
-        grad_alpha = torch.where(b, -(alpha ** 2), grad_alpha) + \
-                     torch.where(s, alpha ** 2, grad_alpha)
-        return grad_x, grad_alpha, None, None, None, None, None
+        if not search:
+            return grad_x, torch.zeros_like(alpha), None, None, None, None, None, None, None
+        # bigger scale (factor 2) ==> -alpha^2; smaller scale (factor 0.5) ==> alpha^2
+        factor = search_scale(x, alpha, Qn, Qp, Qmode, is_l2, factors)
+        grad_alpha = -torch.log2(factor) * (alpha ** 2)
+        return grad_x, grad_alpha, None, None, None, None, None, None, None
 
 
 class ActLLSQ(_ActQ):
-    def __init__(self, nbits=4, signed=False, is_l2=True):
+    def __init__(self, nbits=4, signed=False, is_l2=True, search_interval=1, search_factors=(0.5, 2.)):
+        """
+        :param search_interval: search the scale every `search_interval` training steps.
+        :param search_factors: candidate scales are alpha * factor.
+        """
         super(ActLLSQ, self).__init__(nbits=nbits, signed=signed)
         self.add_param('is_l2', is_l2)
+        self.add_param('search_interval', search_interval)
+        self.add_param('search_factors', search_factors)
+        self.n_iter = 0
+
+    def initialize(self, x):
+        self.set_init_state()
+        # empirical value
+        if self.nbits >= 4:
+            init_value = (self.Qp + 1)
+        elif self.nbits == 3:
+            init_value = 2 * self.Qp
+        else:
+            # TODO
+            init_value = 2 * self.Qp
+        self.alpha.data.copy_(x.detach().abs().max() / init_value)
 
     def forward(self, x):
         if self.alpha is None:
             return x
-        if self.signed:
-            Qn = -2 ** (self.nbits - 1)
-            Qp = 2 ** (self.nbits - 1) - 1
-        else:
-            Qn = 0
-            Qp = 2 ** self.nbits - 1
-        if self.training and self.init_state == 0:
-            self.init_state.fill_(1)
-            # empirical value
-            if self.nbits >= 4:
-                init_value = (Qp + 1)
-            elif self.nbits == 3:
-                init_value = 2 * Qp
-            else:
-                # TODO
-                init_value = 2 * Qp
-            self.alpha.data.fill_(x.detach().abs().max() / init_value)
+        Qn, Qp = self.Qn, self.Qp
+        if self.training and not self.initialized:
+            self.initialize(x)
 
         # scale = self.alpha.detach()
         # TODO
         # if self.scale_bits > 0:
         #     scale, _ = truncation(scale, nbits=self.scale_bits)
         # error, x_clip, y = ln_error(x, self.nbits, scale, is_act=True, l2=self.is_l2)
-        y = FunLLSQ.apply(x, self.alpha, Qn, Qp, Qmodes.layer_wise, self.kwargs_q['is_l2'], True)
+        y = FunLLSQ.apply(x, self.alpha, Qn, Qp, Qmodes.layer_wise, self.kwargs_q['is_l2'], True,
+                          is_search_step(self, self.kwargs_q['search_interval']), self.kwargs_q['search_factors'])
         # output = y.detach() + x_clip - x_clip.detach()
         return y
 
 
 class LinearLLSQ(_LinearQ):
-    def __init__(self, in_features, out_features, bias=True, nbits=4, is_l2=True):
+    def __init__(self, in_features, out_features, bias=True, nbits=4, is_l2=True,
+                 search_interval=1, search_factors=(0.5, 2.)):
         super(LinearLLSQ, self).__init__(in_features=in_features, out_features=out_features, bias=bias, nbits=nbits)
         self.add_param('is_l2', is_l2)
+        self.add_param('search_interval', search_interval)
+        self.add_param('search_factors', search_factors)
+        self.n_iter = 0
+
+    def initialize(self, x):
+        self.set_init_state()
+        self.alpha.data.copy_(self.weight.detach().abs().max() / (self.Qp + 1))
 
     def forward(self, x):
         if self.alpha is None:
             return F.linear(x, self.weight, self.bias)
-        Qn = -2 ** (self.nbits - 1)
-        Qp = 2 ** (self.nbits - 1) - 1
+        Qn, Qp = self.Qn, self.Qp
         w_reshape = self.weight.transpose(0, 1)
-        if self.training and self.init_state == 0:
-            self.init_state.fill_(1)
-            self.alpha.data.fill_(w_reshape.detach().abs().max() / (Qp + 1))
-        w_reshape_q = FunLLSQ.apply(w_reshape, self.alpha, Qn, Qp, Qmodes.layer_wise, self.kwargs_q['is_l2'], False)
+        if self.training and not self.initialized:
+            self.initialize(x)
+        w_reshape_q = FunLLSQ.apply(w_reshape, self.alpha, Qn, Qp, Qmodes.layer_wise, self.kwargs_q['is_l2'], False,
+                                    is_search_step(self, self.kwargs_q['search_interval']),
+                                    self.kwargs_q['search_factors'])
         w_q = w_reshape_q.transpose(0, 1)
         return F.linear(x, w_q, self.bias)
 
@@ -102,27 +112,35 @@ class LinearLLSQ(_LinearQ):
 class Conv2dLLSQ(_Conv2dQ):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1,
                  padding=0, dilation=1, groups=1, bias=True, nbits=4,
-                 mode=Qmodes.layer_wise, is_l2=True):
+                 mode=Qmodes.layer_wise, is_l2=True, search_interval=1, search_factors=(0.5, 2.)):
         super(Conv2dLLSQ, self).__init__(
             in_channels=in_channels, out_channels=out_channels, kernel_size=kernel_size,
             stride=stride, padding=padding, dilation=dilation, groups=groups, bias=bias,
             nbits=nbits, mode=mode)
         self.add_param('is_l2', is_l2)
+        self.add_param('search_interval', search_interval)
+        self.add_param('search_factors', search_factors)
+        self.n_iter = 0
+
+    def initialize(self, x):
+        w_reshape = self.weight.detach().reshape([self.weight.shape[0], -1]).transpose(0, 1)
+        if self.q_mode == Qmodes.layer_wise:
+            self.alpha.data.copy_(w_reshape.abs().max() / (self.Qp + 1))
+        else:
+            self.alpha.data.copy_(w_reshape.abs().max(dim=0)[0] / self.Qp)
+        self.set_init_state()
 
     def forward(self, x):
         if self.alpha is None:
             return F.conv2d(x, self.weight, self.bias, self.stride,
                             self.padding, self.dilation, self.groups)
-        Qn = -2 ** (self.nbits - 1)
-        Qp = 2 ** (self.nbits - 1) - 1
+        Qn, Qp = self.Qn, self.Qp
         w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
-        if self.training and self.init_state == 0:
-            if self.q_mode == Qmodes.layer_wise:
-                self.alpha.data.copy_(w_reshape.detach().abs().max() / (Qp + 1))
-            else:
-                self.alpha.data.copy_(w_reshape.detach().abs().max(dim=0)[0] / Qp)
-            self.init_state.fill_(1)
-        w_reshape_q = FunLLSQ.apply(w_reshape, self.alpha, Qn, Qp, self.q_mode, self.kwargs_q['is_l2'], False)
+        if self.training and not self.initialized:
+            self.initialize(x)
+        w_reshape_q = FunLLSQ.apply(w_reshape, self.alpha, Qn, Qp, self.q_mode, self.kwargs_q['is_l2'], False,
+                                    is_search_step(self, self.kwargs_q['search_interval']),
+                                    self.kwargs_q['search_factors'])
         w_q = w_reshape_q.transpose(0, 1).reshape(self.weight.shape)
         return F.conv2d(x, w_q, self.bias, self.stride,
                         self.padding, self.dilation, self.groups)
@@ -134,25 +152,28 @@ class ActLLSQS(_ActQ):
         self.add_param('floor', floor)
         self.add_param('custom', custom)
 
+    def initialize(self, x):
+        if x.max() < 1e-6:
+            # all-zero input, initialize on the next batch
+            return
+        # Please select a init_rate for activation.
+        # self.alpha.data.copy_(x.max() / 2 ** (self.nbits - 1) * self.init_rate)
+        if self.signed:
+            alpha_fp = x.detach().abs().max() / 2 ** (self.nbits - 1)
+        else:
+            alpha_fp = x.detach().abs().max() / 2 ** self.nbits
+        alpha_s = log_shift(alpha_fp)
+        print('{}==>{}'.format(alpha_fp.item(), alpha_s.item()))
+        self.alpha.data.copy_(alpha_s)
+        self.set_init_state()
+
     def forward(self, x):
-        if self.alpha is None or x.max() < 1e-6:
+        if self.alpha is None:
             return x
-        if self.training and self.init_state == 0:
-            # Please select a init_rate for activation.
-            # self.alpha.data.copy_(x.max() / 2 ** (self.nbits - 1) * self.init_rate)
-            if self.signed:
-                alpha_fp = x.detach().abs().max() / 2 ** (self.nbits - 1)
-            else:
-                alpha_fp = x.detach().abs().max() / 2 ** self.nbits
-            alpha_s = log_shift(alpha_fp)
-            print('{}==>{}'.format(alpha_fp.item(), alpha_s.item()))
-            self.alpha.data.copy_(alpha_s)
-            self.init_state.fill_(1)
+        if self.training and not self.initialized:
+            self.initialize(x)
         alpha = self.alpha.detach()
-        if self.signed:
-            x_clip = (x / alpha).clamp(- 2 ** (self.nbits - 1), 2 ** (self.nbits - 1) - 1)
-        else:
-            x_clip = (x / alpha).clamp(0, 2 ** self.nbits - 1)
+        x_clip = (x / alpha).clamp(self.Qn, self.Qp)
         if self.kwargs_q['floor']:
             x_round = x_clip.floor()
         elif self.kwargs_q['custom']:
@@ -162,4 +183,5 @@ class ActLLSQS(_ActQ):
         x_round = x_round * alpha
         x_clip = x_clip * alpha
         x_q = x_clip - x_clip.detach() + x_round.detach()
-        return x_q
\ No newline at end of file
+        # all-zero input (e.g. after ReLU) passes through, selected on the device instead of `if x.max() < 1e-6`
+        return torch.where(x.max() < 1e-6, x, x_q)
\ No newline at end of file
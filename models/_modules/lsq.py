@@ -15,13 +15,12 @@ import math
 from models._modules import _Conv2dQ, Qmodes, _LinearQ, _ActQ
 
 
-__all__ = ['Conv2dLSQ', 'LinearLSQ', 'ActLSQ']
+__all__ = ['Conv2dLSQ', 'LinearLSQ', 'ActLSQ', 'FunLSQFused']
 
 
 class FunLSQ(torch.autograd.Function):
     @staticmethod
     def forward(ctx, weight, alpha, g, Qn, Qp):
-        assert alpha > 0, 'alpha = {}'.format(alpha)
         ctx.save_for_backward(weight, alpha)
         ctx.other = g, Qn, Qp
         q_w = (weight / alpha).round().clamp(Qn, Qp)
@@ -45,6 +44,33 @@ class FunLSQ(torch.autograd.Function):
         return grad_weight, grad_alpha, None, None, None
 
 
+class FunLSQFused(torch.autograd.Function):
+    """
+        Fused quantize/dequantize of LSQ.
+        Only the input and a bool in-range mask are saved for backward, the gradients w.r.t. the input and
+        the step size are both computed in a single pass. Numerically the same as Method1.
+    """
+
+    @staticmethod
+    def forward(ctx, x, alpha, g, Qn, Qp):
+        x_s = x / alpha
+        mask = (x_s >= Qn) & (x_s <= Qp)
+        ctx.save_for_backward(x, alpha, mask)
+        ctx.other = g, Qn, Qp
+        return x_s.clamp_(Qn, Qp).round_().mul_(alpha)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        x, alpha, mask = ctx.saved_tensors
+        g, Qn, Qp = ctx.other
+        x_s = x / alpha
+        # in range: round(x/alpha) - x/alpha; out of range: Qn or Qp
+        grad_alpha = torch.where(mask, x_s.round() - x_s, x_s.clamp_(Qn, Qp))
+        grad_alpha = grad_alpha.mul_(grad_output).sum_to_size(alpha.shape) * g
+        grad_x = grad_output * mask
+        return grad_x, grad_alpha, None, None, None
+
+
 def grad_scale(x, scale):
     y = x
     y_grad = x * scale
@@ -66,18 +92,20 @@ class Conv2dLSQ(_Conv2dQ):
             stride=stride, padding=padding, dilation=dilation, groups=groups, bias=bias,
             nbits=nbits, mode=mode)
 
+    def initialize(self, x):
+        # self.alpha.data.copy_(self.weight.abs().max() / 2 ** (self.nbits - 1))
+        self.alpha.data.copy_(2 * self.weight.abs().mean() / math.sqrt(self.Qp))
+        # self.alpha.data.copy_(self.weight.abs().max() * 2)
+        self.set_init_state()
+
     def forward(self, x):
         if self.alpha is None:
             return F.conv2d(x, self.weight, self.bias, self.stride,
                             self.padding, self.dilation, self.groups)
         # w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
-        Qn = -2 ** (self.nbits - 1)
-        Qp = 2 ** (self.nbits - 1) - 1
-        if self.training and self.init_state == 0:
-            # self.alpha.data.copy_(self.weight.abs().max() / 2 ** (self.nbits - 1))
-            self.alpha.data.copy_(2 * self.weight.abs().mean() / math.sqrt(Qp))
-            # self.alpha.data.copy_(self.weight.abs().max() * 2)
-            self.init_state.fill_(1)
+        Qn, Qp = self.Qn, self.Qp
+        if self.training and not self.initialized:
+            self.initialize(x)
         """  
         Implementation according to paper. 
         Feels wrong ...
@@ -88,17 +116,21 @@ class Conv2dLSQ(_Conv2dQ):
        
         Please see jupyter/STE_LSQ.ipynb fo detailed comparison.
         """
-        g = 1.0 / math.sqrt(self.weight.numel() * Qp)
+        g = self.g
 
         # Method1: 31GB GPU memory (AlexNet w4a4 bs 2048) 17min/epoch
-        alpha = grad_scale(self.alpha, g)
-        w_q = round_pass((self.weight / alpha).clamp(Qn, Qp)) * alpha
+        # alpha = grad_scale(self.alpha, g)
+        # w_q = round_pass((self.weight / alpha).clamp(Qn, Qp)) * alpha
         # w = w.clamp(Qn, Qp)
         # q_w = round_pass(w)
         # w_q = q_w * alpha
 
         # Method2: 25GB GPU memory (AlexNet w4a4 bs 2048) 32min/epoch
         # w_q = FunLSQ.apply(self.weight, self.alpha, g, Qn, Qp)
+
+        # Method3: fused, saves only the weight and a bool mask.
+        alpha = self.alpha.view(-1, 1, 1, 1) if self.q_mode == Qmodes.kernel_wise else self.alpha
+        w_q = FunLSQFused.apply(self.weight, alpha, g, Qn, Qp)
         # wq = y.transpose(0, 1).reshape(self.weight.shape).detach() + self.weight - self.weight.detach()
         return F.conv2d(x, w_q, self.bias, self.stride,
                         self.padding, self.dilation, self.groups)
@@ -108,20 +140,22 @@ class LinearLSQ(_LinearQ):
     def __init__(self, in_features, out_features, bias=True, nbits=4):
         super(LinearLSQ, self).__init__(in_features=in_features, out_features=out_features, bias=bias, nbits=nbits)
 
+    def initialize(self, x):
+        self.alpha.data.copy_(2 * self.weight.abs().mean() / math.sqrt(self.Qp))
+        # self.alpha.data.copy_(self.weight.abs().max() / 2 ** (self.nbits - 1))
+        self.set_init_state()
+
     def forward(self, x):
         if self.alpha is None:
             return F.linear(x, self.weight, self.bias)
-        Qn = -2 ** (self.nbits - 1)
-        Qp = 2 ** (self.nbits - 1) - 1
-        if self.training and self.init_state == 0:
-            self.alpha.data.copy_(2 * self.weight.abs().mean() / math.sqrt(Qp))
-            # self.alpha.data.copy_(self.weight.abs().max() / 2 ** (self.nbits - 1))
-            self.init_state.fill_(1)
-        g = 1.0 / math.sqrt(self.weight.numel() * Qp)
+        Qn, Qp = self.Qn, self.Qp
+        if self.training and not self.initialized:
+            self.initialize(x)
+        g = self.g
 
         # Method1:
-        alpha = grad_scale(self.alpha, g)
-        w_q = round_pass((self.weight / alpha).clamp(Qn, Qp)) * alpha
+        # alpha = grad_scale(self.alpha, g)
+        # w_q = round_pass((self.weight / alpha).clamp(Qn, Qp)) * alpha
         # w = self.weight / alpha
         # w = w.clamp(Qn, Qp)
         # q_w = round_pass(w)
@@ -129,6 +163,9 @@ class LinearLSQ(_LinearQ):
 
         # Method2:
         # w_q = FunLSQ.apply(self.weight, self.alpha, g, Qn, Qp)
+
+        # Method3:
+        w_q = FunLSQFused.apply(self.weight, self.alpha, g, Qn, Qp)
         return F.linear(x, w_q, self.bias)
 
 
@@ -136,27 +173,25 @@ class ActLSQ(_ActQ):
     def __init(self, nbits=4, signed=False):
         super(ActLSQ, self).__init(nbits=nbits, signed=signed)
 
+    def initialize(self, x):
+        # The init alpha for activation is very very important as the experimental results shows.
+        # Please select a init_rate for activation.
+        # self.alpha.data.copy_(x.max() / 2 ** (self.nbits - 1) * self.init_rate)
+        self.alpha.data.copy_(2 * x.abs().mean() / math.sqrt(self.Qp))
+        self.set_init_state()
+
     def forward(self, x):
         if self.alpha is None:
             return x
-        if self.signed:
-            Qn = -2 ** (self.nbits - 1)
-            Qp = 2 ** (self.nbits - 1) - 1
-        else:
-            Qn = 0
-            Qp = 2 ** self.nbits - 1
-        if self.training and self.init_state == 0:
-            # The init alpha for activation is very very important as the experimental results shows.
-            # Please select a init_rate for activation.
-            # self.alpha.data.copy_(x.max() / 2 ** (self.nbits - 1) * self.init_rate)
-            self.alpha.data.copy_(2 * x.abs().mean() / math.sqrt(Qp))
-            self.init_state.fill_(1)
+        Qn, Qp = self.Qn, self.Qp
+        if self.training and not self.initialized:
+            self.initialize(x)
 
         g = 1.0 / math.sqrt(x.numel() * Qp)
 
         # Method1:
-        alpha = grad_scale(self.alpha, g)
-        x = round_pass((x / alpha).clamp(Qn, Qp)) * alpha
+        # alpha = grad_scale(self.alpha, g)
+        # x = round_pass((x / alpha).clamp(Qn, Qp)) * alpha
         # x = x / alpha
         # x = x.clamp(Qn, Qp)
         # q_x = round_pass(x)
@@ -164,4 +199,7 @@ class ActLSQ(_ActQ):
 
         # Method2:
         # x_q = FunLSQ.apply(x, self.alpha, g, Qn, Qp)
-        return x
+
+        # Method3:
+        x_q = FunLSQFused.apply(x, self.alpha, g, Qn, Qp)
+        return x_q
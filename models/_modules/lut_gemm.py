@@ -0,0 +1,124 @@
+"""
+    Lookup-table inference of the k-means cluster-quantized convolutions (Conv2dClusterQ, Conv2dShareQ),
+    see utils.wrapper.convert_to_lut. Only the labels, packed to nbits, and the 2^nbits centroids are stored.
+    decode: the weight is looked up in the centroid table once, kept in memory (not in the state dict), and the
+    convolution runs as usual (fastest on CPU).
+    accumulate: the inputs are summed per centroid index first, then each output needs only 2^nbits multiplies:
+    y = sum_j centroids[j] * (sum of the inputs whose weight has label j)
+    The sums are a sparse product (one addition per weight and output pixel) of the unfolded input with the
+    0/1 label matrix, built at every forward; no float weight is kept.
+"""
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+__all__ = ['Conv2dLUT', 'Conv2dShareLUT', 'pack_codes', 'unpack_codes']
+
+
+def pack_codes(codes, nbits):
+    """
+    8 // nbits unsigned codes per byte, code i of a byte in bits [i * nbits, (i + 1) * nbits).
+    :param codes: integer tensor [rows, K], values in [0, 2^nbits)
+    :return: uint8 tensor [rows, ceil(K / (8 // nbits))]
+    """
+    assert 0 < nbits <= 8, 'Only support codes of up to 8 bits'
+    per_byte = 8 // nbits
+    codes = codes.to(torch.uint8)
+    if codes.shape[1] % per_byte != 0:
+        codes = F.pad(codes, (0, per_byte - codes.shape[1] % per_byte))
+    shifts = torch.arange(per_byte, dtype=torch.uint8, device=codes.device) * nbits
+    return (codes.reshape(codes.shape[0], -1, per_byte) << shifts).sum(dim=-1, dtype=torch.uint8)
+
+
+def unpack_codes(packed, nbits, K):
+    """Inverse of pack_codes."""
+    per_byte = 8 // nbits
+    shifts = torch.arange(per_byte, dtype=torch.uint8, device=packed.device) * nbits
+    codes = (packed.unsqueeze(-1) >> shifts) & (2 ** nbits - 1)
+    return codes.reshape(packed.shape[0], -1)[:, :K]
+
+
+class Conv2dLUT(nn.Module):
+    def __init__(self, in_channels, out_channels, kernel_size, stride, padding, dilation, groups,
+                 labels, centroids, nbits, bias=None, accumulate=False):
+        """
+        :param labels: centroid index of every weight, [out, C / groups, kh, kw]
+        :param centroids: 2^nbits weight values
+        :param accumulate: sum the inputs per centroid, instead of decoding the weight
+        """
+        super(Conv2dLUT, self).__init__()
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.kernel_size = kernel_size
+        self.stride = stride
+        self.padding = padding
+        self.dilation = dilation
+        self.groups = groups
+        self.nbits = nbits
+        self.accumulate = accumulate
+        self.weight_shape = tuple(labels.shape)
+        self.K = labels[0].numel()
+        self.register_buffer('labels_packed', pack_codes(labels.reshape(out_channels, -1), nbits))
+        self.register_buffer('centroids', centroids.detach().reshape(-1).float().clone())
+        self.register_buffer('bias', None if bias is None else bias.detach().clone())
+        self._weight_cache = None
+        self._register_load_state_dict_pre_hook(self._clear_cache)
+
+    def _clear_cache(self, *args):
+        self._weight_cache = None
+
+    def labels(self):
+        return unpack_codes(self.labels_packed, self.nbits, self.K).long()
+
+    def decoded_weight(self):
+        """the decoded weight, decoded once per device"""
+        cache = self._weight_cache
+        if cache is None or cache.device != self.centroids.device:
+            cache = self._weight_cache = self.centroids[self.labels()].view(self.weight_shape)
+        return cache
+
+    def label_matrix(self, dtype):
+        """
+        :return: sparse [out * 2^nbits, groups * K], 1 at (o * 2^nbits + label of weight k of o, column of weight k
+            in the unfolded input)
+        """
+        labels = self.labels()
+        channels = torch.arange(self.out_channels, device=labels.device).unsqueeze(1)
+        rows = channels * self.centroids.numel() + labels
+        columns = channels // (self.out_channels // self.groups) * self.K + torch.arange(self.K, device=labels.device)
+        indices = torch.stack([rows.reshape(-1), columns.reshape(-1)])
+        return torch.sparse_coo_tensor(indices, torch.ones(indices.shape[1], dtype=dtype, device=labels.device),
+                                       (self.out_channels * self.centroids.numel(), self.groups * self.K))
+
+    def forward(self, x):
+        if not self.accumulate:
+            return F.conv2d(x, self.decoded_weight(), self.bias, self.stride, self.padding, self.dilation, self.groups)
+        n, _, h, w = x.shape
+        h_out, w_out = [(size + 2 * p - d * (k - 1) - 1) // s + 1 for size, p, d, k, s in
+                        zip((h, w), self.padding, self.dilation, self.kernel_size, self.stride)]
+        # [groups * K, N * L]
+        columns = F.unfold(x, self.kernel_size, self.dilation, self.padding, self.stride).transpose(0, 1)
+        sums = torch.sparse.mm(self.label_matrix(x.dtype), columns.reshape(columns.shape[0], -1))
+        # one multiply per centroid
+        out = torch.einsum('ojm,j->om', sums.view(self.out_channels, self.centroids.numel(), -1),
+                           self.centroids.to(x.dtype))
+        out = out.view(self.out_channels, n, h_out, w_out).transpose(0, 1).contiguous()
+        if self.bias is not None:
+            out = out + self.bias.view(-1, 1, 1)
+        return out
+
+    def extra_repr(self):
+        return '{}, {}, kernel_size={}, stride={}, padding={}, nbits={}, accumulate={}'.format(
+            self.in_channels, self.out_channels, self.kernel_size, self.stride, self.padding, self.nbits,
+            self.accumulate)
+
+
+class Conv2dShareLUT(nn.Module):
+    """Conv2dShareQ: a list of inputs, one convolution each, all with the same centroids."""
+
+    def __init__(self, convs):
+        super(Conv2dShareLUT, self).__init__()
+        self.convs = nn.ModuleList(convs)
+
+    def forward(self, input):
+        return [conv(x) for conv, x in zip(self.convs, input)]
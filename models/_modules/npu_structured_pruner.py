@@ -15,6 +15,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 import math
 
+from models._modules import _InitStateMixin
+
 __all__ = ['Conv2dNPU']
 
 
@@ -34,22 +36,25 @@ def get_default_kwargs_q(kwargs_q):
 
 
 def get_npu_structured_sparsity_mask(param, non_zero_num: int, pe_size=32):
-    if non_zero_num >= 32:
-        return torch.ones_like(param)
-    (out_channel, in_channel, k, k) = param.shape
+    """
+    Keep the non_zero_num largest |w| of every pe_size input channels, for every (out, kh, kw).
+    All the partitions at once: the input channels are zero-padded to a multiple of pe_size and
+    one kthvalue gives the threshold of every partition.
+    :return: bool mask, the shape of param
+    """
+    if non_zero_num >= pe_size:
+        return torch.ones_like(param, dtype=torch.bool)
+    (out_channel, in_channel, kh, kw) = param.shape
     part = math.ceil(in_channel / pe_size)
-    param_reshape = param.transpose(0, 1).reshape(in_channel, -1)  # in, out * k * k
-    mask = torch.zeros_like(param_reshape)  # in, out * k * k
-    for i in range(part):
-        param_reshape_part = param_reshape[i * pe_size: (i + 1) * pe_size, :]  # in, out * k * k
-        bottomk, _ = torch.topk(param_reshape_part.abs().transpose(0, 1), non_zero_num + 1, largest=True, sorted=True)
-        threshold = bottomk.data[:, -1]
-        mask_part = torch.gt(torch.abs(param_reshape_part), threshold).type(param.type())
-        mask[i * pe_size: (i + 1) * pe_size, :] = mask_part
-    return mask.reshape(in_channel, out_channel, k, k).transpose(0, 1)  # out, in, k, k
-
-
-class Conv2dNPU(nn.Conv2d):
+    magnitude = F.pad(param.detach().abs(), (0, 0, 0, 0, 0, part * pe_size - in_channel))
+    magnitude = magnitude.view(out_channel, part, pe_size, kh * kw)
+    # the (non_zero_num + 1)-th largest of every partition
+    threshold, _ = magnitude.kthvalue(pe_size - non_zero_num, dim=2, keepdim=True)
+    mask = torch.gt(magnitude, threshold)
+    return mask.view(out_channel, part * pe_size, kh, kw)[:, :in_channel]  # out, in, k, k
+
+
+class Conv2dNPU(_InitStateMixin, nn.Conv2d):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1,
                  padding=0, dilation=1, groups=1, bias=True, **kwargs_q):
         super(Conv2dNPU, self).__init__(
@@ -57,6 +62,7 @@ class Conv2dNPU(nn.Conv2d):
             stride=stride, padding=padding, dilation=dilation, groups=groups, bias=bias)
         self.kwargs_q = get_default_kwargs_q(kwargs_q)
         self.register_buffer('init_state', torch.zeros(1))  # sparsity
+        self._init_state_flag()
         self.register_buffer('mask', torch.ones_like(self.weight))
         self.iter = 0
         self.total_iter = self.kwargs_q['total_iter']
@@ -65,33 +71,48 @@ class Conv2dNPU(nn.Conv2d):
         self.ins_iter = self.total_iter * self.beta
         if self.INS:
             self.register_buffer('non_zero_num_ins', torch.zeros(1).fill_(15))
+            # Python-side copy of non_zero_num_ins, compared on every step of the ins phase
+            self.ins_num = 15
+            self._register_load_state_dict_pre_hook(self._load_non_zero_num_ins)
+
+    def _load_non_zero_num_ins(self, state_dict, prefix, *args):
+        key = prefix + 'non_zero_num_ins'
+        if key in state_dict:
+            self.ins_num = int(state_dict[key].item())
+
+    def initialize(self, x):
+        if self.INS:
+            # the incremental mask is built during training
+            return
+        # todo: npu_structured_sparsity_mask
+        print('{} init mask {}/32'.format(self._get_name(), self.kwargs_q['non_zero_num']))
+        self.mask.copy_(
+            get_npu_structured_sparsity_mask(self.weight, self.kwargs_q['non_zero_num'],
+                                             pe_size=self.kwargs_q['pe_size']))
+        self.weight.data.mul_(self.mask)
+        self.set_init_state()
 
     def forward(self, x):
         # 1. pruning weights
         if self.INS:
-            if self.init_state[0] == 0 and self.training:  # lazy fix+incremental mask for pruning
-                if self.iter % int(self.ins_iter / 10) == 0 and self.non_zero_num_ins >= self.kwargs_q['non_zero_num']:
-                    print('{} init mask {}/32'.format(self._get_name(), int(self.non_zero_num_ins.item())))
+            if not self.initialized and self.training:  # lazy fix+incremental mask for pruning
+                if self.iter % int(self.ins_iter / 10) == 0 and self.ins_num >= self.kwargs_q['non_zero_num']:
+                    print('{} init mask {}/32'.format(self._get_name(), self.ins_num))
                     self.mask.copy_(
-                        get_npu_structured_sparsity_mask(self.weight, int(self.non_zero_num_ins.item()),
+                        get_npu_structured_sparsity_mask(self.weight, self.ins_num,
                                                          pe_size=self.kwargs_q['pe_size']))
                     self.weight.data.mul_(self.mask)
-                    if self.non_zero_num_ins == self.kwargs_q['non_zero_num']:
-                        self.init_state[0] += 1
-                        print('End of the ins phase. non_zero_num:{}'.format(self.non_zero_num_ins.item()))
+                    if self.ins_num == self.kwargs_q['non_zero_num']:
+                        self.set_init_state()
+                        print('End of the ins phase. non_zero_num:{}'.format(self.ins_num))
                     else:
-                        self.non_zero_num_ins -= 1
+                        self.ins_num -= 1
+                        self.non_zero_num_ins.fill_(self.ins_num)
                 self.iter += 1
-            elif self.init_state[0] == 0 and self.iter == 0 and not self.training:  # post-training sparsity
+            elif not self.initialized and self.iter == 0 and not self.training:  # post-training sparsity
                 raise NotImplementedError('Please set INS = False')
-        elif self.init_state[0] == 0:
-            # todo: npu_structured_sparsity_mask
-            print('{} init mask {}/32'.format(self._get_name(), self.kwargs_q['non_zero_num']))
-            self.mask.copy_(
-                get_npu_structured_sparsity_mask(self.weight, self.kwargs_q['non_zero_num'],
-                                                 pe_size=self.kwargs_q['pe_size']))
-            self.weight.data.mul_(self.mask)
-            self.init_state[0] += 1
+        elif not self.initialized:
+            self.initialize(x)
 
         w_s = self.weight * self.mask
         return F.conv2d(x, w_s, self.bias, self.stride,
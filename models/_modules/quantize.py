@@ -4,7 +4,7 @@ import torch.nn.functional as F
 from torch.nn.modules import Module
 import math
 from torch.nn.modules.dropout import _DropoutNd
-from models._modules import Qmodes
+from models._modules import Qmodes, search_scale, is_search_step, _InitStateMixin
 # from .config import config
 
 
@@ -13,10 +13,11 @@ __all__ = [
     'DropoutScale']
 
 
-class Conv2dQ(nn.Conv2d):
+class Conv2dQ(_InitStateMixin, nn.Conv2d):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1,
                  padding=0, dilation=1, groups=1, bias=True, nbits=4,
-                 mode=Qmodes.kernel_wise, l2=True, scale_bits=-1, bias_bits=-1, ema_decay=0.99):
+                 mode=Qmodes.kernel_wise, l2=True, scale_bits=-1, bias_bits=-1, ema_decay=0.99,
+                 search_interval=1, search_factors=(0.5, 2.)):
         """
         Quantize Conv2d
         :param in_channels:
@@ -32,6 +33,8 @@ class Conv2dQ(nn.Conv2d):
         :param l2:
         :param scale_bits: scale bits
         :param bias_bits:  bias bits(need upper actq's scale)
+        :param search_interval: search the running scale every `search_interval` training steps
+        :param search_factors: candidate scales are running_scale * factor
         """
         super(Conv2dQ, self).__init__(in_channels, out_channels, kernel_size, stride=stride,
                                       padding=padding, dilation=dilation, groups=groups, bias=bias)
@@ -43,6 +46,9 @@ class Conv2dQ(nn.Conv2d):
         self.l2 = l2
         self.scale_bits = scale_bits
         self.bias_bits = bias_bits
+        self.search_interval = search_interval
+        self.search_factors = search_factors
+        self.n_iter = 0
         self.ema_decay = ema_decay
         if mode == Qmodes.kernel_wise:
             self.register_buffer('running_scale', torch.zeros(out_channels))
@@ -51,6 +57,7 @@ class Conv2dQ(nn.Conv2d):
             self.register_buffer('running_scale', torch.zeros(1))
             self.is_layer_wise = True
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
         self.reset_running_stats()
 
     def set_scale_bits(self, nbits=8):
@@ -62,16 +69,20 @@ class Conv2dQ(nn.Conv2d):
     def reset_running_stats(self):
         self.running_scale.fill_(0.5)
 
+    def initialize(self, x):
+        # init running scale
+        self.running_scale.data.copy_(self.weight.detach().abs().max() / 2 ** (self.nbits - 1))
+        self.set_init_state()
+
     def forward(self, input):
         if self.running_scale is None:
             return F.conv2d(input, self.weight, self.bias, self.stride,
                             self.padding, self.dilation, self.groups)
         w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
-        if self.training and self.init_state == 0:
-            # init running scale
-            self.running_scale.data.copy_(w_reshape.abs().max() / 2 ** (self.nbits - 1))
-            self.init_state.fill_(1)
-        scale = self.running_scale.detach()
+        if self.training and not self.initialized:
+            self.initialize(input)
+        # a copy: running_scale is updated in place below, scale is still needed for backward
+        scale = self.running_scale.clone()
         if self.scale_bits > 0:
             scale, _ = truncation(scale, self.scale_bits)
         if self.bias_bits > 0:
@@ -87,13 +98,13 @@ class Conv2dQ(nn.Conv2d):
             bq = bias_q.detach() + self.bias - self.bias.detach()
         else:
             bq = self.bias
-        error, _, y = ln_error(w_reshape, self.nbits, scale, is_act=self.is_layer_wise, l2=self.l2)
-        if self.training:
+        _, y = clip_quantize(w_reshape, self.nbits, scale)
+        if is_search_step(self, self.search_interval):
             with torch.no_grad():
-                b, s = update_running_scale(w_reshape, self.nbits, scale, error, self.is_layer_wise, l2=self.l2)
-                self.running_scale = torch.where(b, scale * self.ema_decay + (1 - self.ema_decay) * scale * 2, scale)
-                self.running_scale = torch.where(s, scale * self.ema_decay + (1 - self.ema_decay) * scale / 2,
-                                                 self.running_scale)
+                factor = search_running_scale(w_reshape, self.nbits, scale, self.is_layer_wise, self.l2,
+                                              self.search_factors)
+                self.running_scale.copy_(torch.where(factor != 1, scale * self.ema_decay +
+                                                     (1 - self.ema_decay) * scale * factor, scale))
 
         wq = y.transpose(0, 1).reshape(self.weight.shape).detach() + self.weight - self.weight.detach()
         return F.conv2d(input, wq, bq, self.stride,
@@ -109,14 +120,15 @@ class Conv2dQ(nn.Conv2d):
             'l2' if self.l2 else 'l1')
 
 
-class Conv2dQv2(nn.Conv2d):
+class Conv2dQv2(_InitStateMixin, nn.Conv2d):
     """
         Update running scale using simulated grad.
     """
 
     def __init__(self, in_channels, out_channels, kernel_size, stride=1,
                  padding=0, dilation=1, groups=1, bias=True, nbits=4,
-                 mode=Qmodes.kernel_wise, l2=True, scale_bits=-1, bias_bits=-1):
+                 mode=Qmodes.kernel_wise, l2=True, scale_bits=-1, bias_bits=-1,
+                 search_interval=1, search_factors=(0.5, 2.)):
 
         super(Conv2dQv2, self).__init__(in_channels, out_channels, kernel_size, stride=stride,
                                         padding=padding, dilation=dilation, groups=groups, bias=bias)
@@ -128,6 +140,9 @@ class Conv2dQv2(nn.Conv2d):
         self.l2 = l2
         self.scale_bits = scale_bits
         self.bias_bits = bias_bits
+        self.search_interval = search_interval
+        self.search_factors = search_factors
+        self.n_iter = 0
         # self.ema_decay = scale_decay
         if mode == Qmodes.kernel_wise:
             self.running_scale = nn.Parameter(torch.Tensor(out_channels))
@@ -136,6 +151,7 @@ class Conv2dQv2(nn.Conv2d):
             self.running_scale = nn.Parameter(torch.Tensor(1))
             self.is_layer_wise = True
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
         self.reset_running_stats()
 
     def set_scale_bits(self, nbits=8):
@@ -147,22 +163,22 @@ class Conv2dQv2(nn.Conv2d):
     def reset_running_stats(self):
         self.running_scale.data.fill_(0.5)
 
+    def initialize(self, x):
+        # init running scale
+        w_reshape = self.weight.detach().reshape([self.weight.shape[0], -1]).transpose(0, 1)
+        if self.is_layer_wise:
+            self.running_scale.data.copy_(w_reshape.abs().max() / 2 ** (self.nbits - 1))
+        else:
+            self.running_scale.data.copy_(w_reshape.abs().max(dim=0)[0] / 2 ** (self.nbits - 1))
+        self.set_init_state()
+
     def forward(self, input):
         if self.running_scale is None:
             return F.conv2d(input, self.weight, self.bias, self.stride,
                             self.padding, self.dilation, self.groups)
         w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
-        if self.training and self.init_state == 0:
-            # init running scale
-            if self.is_layer_wise:
-                self.running_scale.data.copy_(w_reshape.detach().abs().max() / 2 ** (self.nbits - 1))
-            else:
-                self.running_scale.data.copy_(w_reshape.detach().abs().max(dim=0)[0] / 2 ** (self.nbits - 1))
-            self.init_state.fill_(1)
-        if self.training and self.running_scale.grad is None:
-            loss = self.running_scale.sum()
-            loss.backward()
-            self.running_scale.grad.zero_()
+        if self.training and not self.initialized:
+            self.initialize(input)
         # self.running_scale.data.abs_()
         scale = self.running_scale.detach()
         if self.scale_bits > 0:
@@ -180,18 +196,15 @@ class Conv2dQv2(nn.Conv2d):
             bq = bias_q.detach() + self.bias - self.bias.detach()
         else:
             bq = self.bias
-        error, _, y = ln_error(w_reshape, self.nbits, scale, is_act=self.is_layer_wise, l2=self.l2)
-        if self.training and self.running_scale.grad is not None:
-            with torch.no_grad():
-                b, s = update_running_scale(w_reshape, self.nbits, scale, error, self.is_layer_wise, l2=self.l2)
-                self.running_scale.grad.data.add_(
-                    torch.where(b, -1 * (self.running_scale ** 2),
-                                torch.zeros_like(self.running_scale)))
-                self.running_scale.grad.data.add_(
-                    torch.where(s, self.running_scale ** 2,
-                                torch.zeros_like(self.running_scale)))
-
+        _, y = clip_quantize(w_reshape, self.nbits, scale)
         wq = y.transpose(0, 1).reshape(self.weight.shape).detach() + self.weight - self.weight.detach()
+        if is_search_step(self, self.search_interval):
+            with torch.no_grad():
+                # bigger scale (factor 2) ==> -scale^2; smaller scale (factor 0.5) ==> scale^2
+                factor = search_running_scale(w_reshape, self.nbits, scale, self.is_layer_wise, self.l2,
+                                              self.search_factors)
+                scale_grad = -torch.log2(factor) * (self.running_scale ** 2)
+            wq = FunScaleGrad.apply(wq, self.running_scale, scale_grad)
         return F.conv2d(input, wq, bq, self.stride,
                         self.padding, self.dilation, self.groups)
 
@@ -207,7 +220,7 @@ class Conv2dQv2(nn.Conv2d):
 
 class LinearQ(nn.Linear):
     def __init__(self, in_features, out_features, bias=True, nbits=4, mode=Qmodes.layer_wise, l2=True,
-                 scale_bits=-1, bias_bits=-1, ema_decay=0.9):
+                 scale_bits=-1, bias_bits=-1, ema_decay=0.9, search_interval=1, search_factors=(0.5, 2.)):
         """
         Quantize Linear
         :param in_features:
@@ -218,6 +231,8 @@ class LinearQ(nn.Linear):
         :param l2:
         :param scale_bits:
         :param bias_bits: bias bits(need upper actq's scale)
+        :param search_interval: search the running scale every `search_interval` training steps
+        :param search_factors: candidate scales are running_scale * factor
         """
         super(LinearQ, self).__init__(in_features, out_features, bias=bias)
         if nbits < 0:
@@ -228,6 +243,9 @@ class LinearQ(nn.Linear):
         self.l2 = l2
         self.scale_bits = scale_bits
         self.bias_bits = bias_bits
+        self.search_interval = search_interval
+        self.search_factors = search_factors
+        self.n_iter = 0
         self.ema_decay = ema_decay
         if mode == Qmodes.kernel_wise:
             self.register_buffer('running_scale', torch.zeros(out_features))
@@ -250,7 +268,8 @@ class LinearQ(nn.Linear):
         if self.running_scale is None:
             return F.linear(input, self.weight, self.bias)
         w_reshape = self.weight.transpose(0, 1)
-        scale = self.running_scale.detach()
+        # a copy: running_scale is updated in place below, scale is still needed for backward
+        scale = self.running_scale.clone()
 
         if self.scale_bits > 0:
             scale, _ = truncation(scale, self.scale_bits)
@@ -268,13 +287,13 @@ class LinearQ(nn.Linear):
         else:
             bq = self.bias
 
-        error, _, y = ln_error(w_reshape, self.nbits, scale, is_act=self.is_layer_wise, l2=self.l2)
-        if self.training:
+        _, y = clip_quantize(w_reshape, self.nbits, scale)
+        if is_search_step(self, self.search_interval):
             with torch.no_grad():
-                b, s = update_running_scale(w_reshape, self.nbits, scale, error, self.is_layer_wise, l2=self.l2)
-                self.running_scale = torch.where(b, scale * self.ema_decay + (1 - self.ema_decay) * scale * 2, scale)
-                self.running_scale = torch.where(s, scale * self.ema_decay + (1 - self.ema_decay) * scale / 2,
-                                                 self.running_scale)
+                factor = search_running_scale(w_reshape, self.nbits, scale, self.is_layer_wise, self.l2,
+                                              self.search_factors)
+                self.running_scale.copy_(torch.where(factor != 1, scale * self.ema_decay +
+                                                     (1 - self.ema_decay) * scale * factor, scale))
         wq = y.transpose(0, 1).detach() + self.weight - self.weight.detach()
         return F.linear(input, wq, bq)
 
@@ -288,9 +307,9 @@ class LinearQ(nn.Linear):
             'l2' if self.l2 else 'l1')
 
 
-class LinearQv2(nn.Linear):
+class LinearQv2(_InitStateMixin, nn.Linear):
     def __init__(self, in_features, out_features, bias=True, nbits=4, mode=Qmodes.layer_wise, l2=True,
-                 scale_bits=-1, bias_bits=-1):
+                 scale_bits=-1, bias_bits=-1, search_interval=1, search_factors=(0.5, 2.)):
 
         super(LinearQv2, self).__init__(in_features, out_features, bias=bias)
         if nbits < 0:
@@ -301,6 +320,9 @@ class LinearQv2(nn.Linear):
         self.l2 = l2
         self.scale_bits = scale_bits
         self.bias_bits = bias_bits
+        self.search_interval = search_interval
+        self.search_factors = search_factors
+        self.n_iter = 0
         if mode == Qmodes.kernel_wise:
             self.running_scale = nn.Parameter(torch.Tensor(out_features))
             self.is_layer_wise = False
@@ -308,6 +330,7 @@ class LinearQv2(nn.Linear):
             self.running_scale = nn.Parameter(torch.Tensor(1))
             self.is_layer_wise = True
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
         self.reset_running_stats()
 
     def set_scale_bits(self, nbits=8):
@@ -319,17 +342,16 @@ class LinearQv2(nn.Linear):
     def reset_running_stats(self):
         self.running_scale.data.fill_(0.5)
 
+    def initialize(self, x):
+        self.set_init_state()
+        self.running_scale.data.fill_(self.weight.detach().abs().max() / 2 ** (self.nbits - 1))
+
     def forward(self, input):
         if self.running_scale is None:
             return F.linear(input, self.weight, self.bias)
         w_reshape = self.weight.transpose(0, 1)
-        if self.training and self.init_state == 0:
-            self.init_state.fill_(1)
-            self.running_scale.data.fill_(w_reshape.detach().abs().max() / 2 ** (self.nbits - 1))
-        if self.training and self.running_scale.grad is None:
-            loss = self.running_scale.sum()
-            loss.backward()
-            self.running_scale.grad.zero_()
+        if self.training and not self.initialized:
+            self.initialize(input)
         scale = self.running_scale.detach()
 
         if self.scale_bits > 0:
@@ -348,15 +370,15 @@ class LinearQv2(nn.Linear):
         else:
             bq = self.bias
 
-        error, _, y = ln_error(w_reshape, self.nbits, scale, is_act=self.is_layer_wise, l2=self.l2)
-        if self.training and self.running_scale.grad is not None:
-            with torch.no_grad():
-                b, s = update_running_scale(w_reshape, self.nbits, scale, error, self.is_layer_wise, l2=self.l2)
-                self.running_scale.grad.data.add_(
-                    torch.where(b, -(self.running_scale ** 2), torch.zeros_like(self.running_scale)))
-                self.running_scale.grad.data.add_(
-                    torch.where(s, self.running_scale ** 2, torch.zeros_like(self.running_scale)))
+        _, y = clip_quantize(w_reshape, self.nbits, scale)
         wq = y.transpose(0, 1).detach() + self.weight - self.weight.detach()
+        if is_search_step(self, self.search_interval):
+            with torch.no_grad():
+                # bigger scale (factor 2) ==> -scale^2; smaller scale (factor 0.5) ==> scale^2
+                factor = search_running_scale(w_reshape, self.nbits, scale, self.is_layer_wise, self.l2,
+                                              self.search_factors)
+                scale_grad = -torch.log2(factor) * (self.running_scale ** 2)
+            wq = FunScaleGrad.apply(wq, self.running_scale, scale_grad)
         return F.linear(input, wq, bq)
 
     def extra_repr(self):
@@ -369,7 +391,7 @@ class LinearQv2(nn.Linear):
             'l2' if self.l2 else 'l1')
 
 
-class PACT(Module):
+class PACT(_InitStateMixin, Module):
     # TODO: signed
     def __init__(self, nbits=4, signed=False, inplace=False):
         super(PACT, self).__init__()
@@ -383,13 +405,17 @@ class PACT(Module):
         self.inplace = inplace
         self.clip_value = nn.Parameter(torch.Tensor(1))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
+
+    def initialize(self, x):
+        self.set_init_state()
+        self.clip_value.data.copy_(x.max())
 
     def forward(self, input):
         if self.clip_value is None:
             return input
-        if self.init_state == 0:
-            self.init_state = torch.ones(1)
-            self.clip_value.data.copy_(input.max())
+        if not self.initialized:
+            self.initialize(input)
 
         input = LearnedClippedLinearQuantizeSTE.apply(input, self.clip_value, self.nbits, True, self.inplace)
         return input
@@ -433,9 +459,9 @@ def asymmetric_linear_quantization_scale_factor(num_bits, saturation_min, satura
     return n / (saturation_max - saturation_min)
 
 
-class ActQv2(Module):
+class ActQv2(_InitStateMixin, Module):
     def __init__(self, nbits=4, signed=False, l2=True, expand=False, split=False,
-                 scale_bits=-1, out_scale=False):
+                 scale_bits=-1, out_scale=False, search_interval=1, search_factors=(0.5, 2.)):
         """
         Quantize activation
         :param nbits:
@@ -445,6 +471,8 @@ class ActQv2(Module):
         :param split:
         :param scale_bits: if scale bits > 0, then use qcode method to quantize scale
         :param out_scale: output = [output, scale]
+        :param search_interval: search the running scale every `search_interval` training steps
+        :param search_factors: candidate scales are running_scale * factor
         """
         # we can expand 8bit to high4 and low4
         super(ActQv2, self).__init__()
@@ -458,12 +486,16 @@ class ActQv2(Module):
         self.l2 = l2
         self.scale_bits = scale_bits
         self.out_scale = out_scale
+        self.search_interval = search_interval
+        self.search_factors = search_factors
+        self.n_iter = 0
         if not signed:
             # We use signed to represent unsigned numbers.
             # e.g. int5 == uint4 when ActFun==ReLU
             self.nbits = nbits + 1
         self.running_scale = nn.Parameter(torch.Tensor(1))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
         self.reset_running_stats()
 
     def set_scale_bits(self, nbits=8):
@@ -475,31 +507,26 @@ class ActQv2(Module):
     def reset_running_stats(self):
         self.running_scale.data.fill_(0.5)
 
+    def initialize(self, x):
+        self.set_init_state()
+        self.running_scale.data.fill_(x.detach().abs().max() / 2 ** (self.nbits - 1))
+
     def forward(self, input):
         if self.running_scale is None:
             return input
-        if self.training and self.init_state == 0:
-            self.init_state.fill_(1)
-            self.running_scale.data.fill_(input.detach().abs().max() / 2 ** (self.nbits - 1))
-        if self.training and self.running_scale.grad is None:
-            loss = self.running_scale.sum()
-            loss.backward()
-            self.running_scale.grad.zero_()
+        if self.training and not self.initialized:
+            self.initialize(input)
         scale = self.running_scale.detach()
         if self.scale_bits > 0:
             scale, _ = truncation(scale, nbits=self.scale_bits)
-        error, x_clip, y = ln_error(input, self.nbits, scale, is_act=True, l2=self.l2)
-        if self.training and self.running_scale.grad is not None:
-            with torch.no_grad():
-                b, s = update_running_scale(input, self.nbits, scale, error, is_act=True, l2=self.l2)
-                self.running_scale.grad.data.add_(
-                    torch.where(b, -(self.running_scale ** 2),
-                                torch.zeros_like(self.running_scale)))
-                self.running_scale.grad.data.add_(
-                    torch.where(s, self.running_scale ** 2,
-                                torch.zeros_like(self.running_scale)))
-
+        x_clip, y = clip_quantize(input, self.nbits, scale)
         output = y.detach() + x_clip - x_clip.detach()
+        if is_search_step(self, self.search_interval):
+            with torch.no_grad():
+                # bigger scale (factor 2) ==> -scale^2; smaller scale (factor 0.5) ==> scale^2
+                factor = search_running_scale(input, self.nbits, scale, True, self.l2, self.search_factors)
+                scale_grad = -torch.log2(factor) * (self.running_scale ** 2)
+            output = FunScaleGrad.apply(output, self.running_scale, scale_grad)
         if self.expand is False and self.split is False:
             return [output, scale] if self.out_scale else output
         assert (self.expand and self.split) is False, \
@@ -589,14 +616,14 @@ class DropoutScale(_DropoutNd):
     """
 
     def forward(self, input):
-        if len(input) == 2:
+        if isinstance(input, (list, tuple)):  # [output, scale]
             return [F.dropout(input[0], self.p, self.training, self.inplace), input[1]]
         return F.dropout(input, self.p, self.training, self.inplace)
 
 
-class ActQ(Module):
+class ActQ(_InitStateMixin, Module):
     def __init__(self, nbits=4, signed=False, l2=True, expand=False, split=False,
-                 scale_bits=-1, out_scale=False, ema_decay=0.999):
+                 scale_bits=-1, out_scale=False, ema_decay=0.999, search_interval=1, search_factors=(0.5, 2.)):
         """
         Quantize activation
         :param nbits:
@@ -606,6 +633,8 @@ class ActQ(Module):
         :param split:
         :param scale_bits: if scale bits > 0, then use qcode method to quantize scale
         :param out_scale: output = [output, scale]
+        :param search_interval: search the running scale every `search_interval` training steps
+        :param search_factors: candidate scales are running_scale * factor
         """
         # we can expand 8bit to high4 and low4
         super(ActQ, self).__init__()
@@ -619,6 +648,9 @@ class ActQ(Module):
         self.l2 = l2
         self.scale_bits = scale_bits
         self.out_scale = out_scale
+        self.search_interval = search_interval
+        self.search_factors = search_factors
+        self.n_iter = 0
         self.ema_decay = ema_decay
         if not signed:
             # We use signed to represent unsigned numbers.
@@ -626,6 +658,7 @@ class ActQ(Module):
             self.nbits = nbits + 1
         self.register_buffer('running_scale', torch.zeros(1))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
         self.reset_running_stats()
 
     def set_scale_bits(self, nbits=8):
@@ -637,26 +670,29 @@ class ActQ(Module):
     def reset_running_stats(self):
         self.running_scale.fill_(0.5)
 
+    def initialize(self, x):
+        # init running scale
+        if self.signed:
+            self.running_scale.data.copy_(x.max() / 2 ** (self.nbits - 1))
+        else:
+            self.running_scale.data.copy_(x.max() / 2 ** self.nbits)
+        self.set_init_state()
+
     def forward(self, input):
         if self.running_scale is None:
             return input
-        if self.training and self.init_state == 0:
-            # init running scale
-            if self.signed:
-                self.running_scale.data.copy_(input.max() / 2 ** (self.nbits - 1))
-            else:
-                self.running_scale.data.copy_(input.max() / 2 ** self.nbits)
-            self.init_state.fill_(1)
-        scale = self.running_scale.detach()
+        if self.training and not self.initialized:
+            self.initialize(input)
+        # a copy: running_scale is updated in place below, scale is still needed for backward
+        scale = self.running_scale.clone()
         if self.scale_bits > 0:
             scale, _ = truncation(scale, nbits=self.scale_bits)
-        error, x_clip, y = ln_error(input, self.nbits, scale, is_act=True, l2=self.l2)
-        if self.training:
+        x_clip, y = clip_quantize(input, self.nbits, scale)
+        if is_search_step(self, self.search_interval):
             with torch.no_grad():
-                b, s = update_running_scale(input, self.nbits, scale, error, is_act=True, l2=self.l2)
-                self.running_scale = torch.where(b, scale * self.ema_decay + (1 - self.ema_decay) * scale * 2, scale)
-                self.running_scale = torch.where(s, scale * self.ema_decay + (1 - self.ema_decay) * scale / 2,
-                                                 self.running_scale)
+                factor = search_running_scale(input, self.nbits, scale, True, self.l2, self.search_factors)
+                self.running_scale.copy_(torch.where(factor != 1, scale * self.ema_decay +
+                                                     (1 - self.ema_decay) * scale * factor, scale))
         output = y.detach() + x_clip - x_clip.detach()
         if self.expand is False and self.split is False:
             return [output, scale] if self.out_scale else output
@@ -714,6 +750,32 @@ class ActQ(Module):
             self.split)
 
 
+class FunScaleGrad(torch.autograd.Function):
+    """
+        Identity on x. The backward pass hands the simulated gradient to the running scale,
+        instead of writing running_scale.grad inside forward.
+    """
+
+    @staticmethod
+    def forward(ctx, x, running_scale, scale_grad):
+        ctx.save_for_backward(scale_grad)
+        return x.view_as(x)
+
+    @staticmethod
+    def backward(ctx, grad_x):
+        scale_grad, = ctx.saved_tensors
+        return grad_x, scale_grad, None
+
+
+def search_running_scale(data_fp, nbits, scale, is_act, l2=True, factors=(0.5, 2.)):
+    """
+    Batched version of `ln_error` + `update_running_scale`: all candidates are evaluated in one pass.
+    :return: the chosen factor of every scale (1 means keep)
+    """
+    return search_scale(data_fp, scale, - 2 ** (nbits - 1), 2 ** (nbits - 1) - 1,
+                        Qmodes.layer_wise if is_act else Qmodes.kernel_wise, l2, factors)
+
+
 def update_running_scale(data_fp, nbits, scale_old, error, is_act, l2=True):
     s_error, _, _ = ln_error(data_fp, nbits, scale_old / 2, is_act=is_act,
                              l2=l2)
@@ -740,6 +802,15 @@ def update_running_scale(data_fp, nbits, scale_old, error, is_act, l2=True):
     return b, s
 
 
+def clip_quantize(x, nbits, scale):
+    """
+    :return: x_clip (clipped, not rounded) and x_q, both in the float domain
+    """
+    x_clip = (x / scale).clamp(- 2 ** (nbits - 1), 2 ** (nbits - 1) - 1)
+    x_q = x_clip.round() * scale
+    return x_clip * scale, x_q
+
+
 def ln_error(x, nbits, scale, is_act, l2=True):
     x_clip = (x / scale).clamp(- 2 ** (nbits - 1), 2 ** (nbits - 1) - 1)
     x_q = x_clip.round()
@@ -3,7 +3,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.nn.modules.rnn import LSTMCell
 
-from models._modules import log_shift, FunSign
+from models._modules import log_shift, FunSign, _InitStateMixin
 from .activation import TanhQ, SigmoidQ
 from .eltwise import EltwiseAdd, EltwiseMult
 from .llsq import ActLLSQS
@@ -12,7 +12,7 @@ import numpy as np
 __all__ = ['LSTMCellQ']
 
 
-class LSTMCellQ(LSTMCell):
+class LSTMCellQ(_InitStateMixin, LSTMCell):
     r"""
       Examples::
 
@@ -69,6 +69,16 @@ class LSTMCellQ(LSTMCell):
             return
         self.alpha = nn.Parameter(torch.Tensor(1))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
+
+    def initialize(self, x):
+        weight_ih_hh = torch.cat((self.weight_ih, self.weight_hh), dim=1)
+        alpha_fp = torch.mean(torch.abs(weight_ih_hh.detach()))
+        alpha_s = log_shift(alpha_fp)
+        alpha_s = torch.where(alpha_s >= 1, alpha_s / 2, alpha_s)
+        print('{}==>{}'.format(alpha_fp.item(), alpha_s.item()))
+        self.alpha.data.copy_(alpha_s)
+        self.set_init_state()
 
     def save_inner_data(self, save, prefix, name, loop_id, tensor):
         if not save:
@@ -77,12 +87,12 @@ class LSTMCellQ(LSTMCell):
         np.save('{}_{}_{}'.format(prefix, name, loop_id), tensor.detach().cpu().numpy())
 
     def forward(self, x, hx=None, prefix='', loop_id=-1, save=False):
-        self.check_forward_input(x)
+        if x.size(1) != self.input_size:
+            raise RuntimeError('input has inconsistent input_size: got {}, expected {}'.format(
+                x.size(1), self.input_size))
         if hx is None:
             hx = x.new_zeros(x.size(0), self.hidden_size, requires_grad=False)
             hx = (hx, hx)
-        self.check_forward_hidden(x, hx[0], '[0]')
-        self.check_forward_hidden(x, hx[1], '[1]')
         h_prev, c_prev = hx
         x_h_prev = torch.cat((x, h_prev), dim=1)
         x_h_prev_q = self.actq1(x_h_prev)
@@ -92,14 +102,8 @@ class LSTMCellQ(LSTMCell):
         if self.alpha is None:  # don't quantize weight and bias
             fc_gate = F.linear(x_h_prev_q, weight_ih_hh, bias_ih_hh)
         else:
-            if self.training and self.init_state == 0:
-                alpha_fp = torch.mean(torch.abs(weight_ih_hh))
-                alpha_s = log_shift(alpha_fp)
-                if alpha_s >= 1:
-                    alpha_s /= 2
-                print('{}==>{}'.format(alpha_fp.item(), alpha_s.item()))
-                self.alpha.data.copy_(alpha_s)
-                self.init_state.fill_(1)
+            if self.training and not self.initialized:
+                self.initialize(x)
 
             alpha = self.alpha.detach()
             self.save_inner_data(save, prefix, 'alpha', 0, alpha)
@@ -0,0 +1,94 @@
+"""
+    Binary-weight (BWN/BWNS) Conv2d and Linear stored as packed sign bits (see utils.wrapper.convert_to_sign).
+    The weights are alpha * sign(w): one bit per weight is stored (the state dict and checkpoints), and the layer
+    computes y = alpha * conv(x, sign(w)) + bias, alpha applied once per output.
+    Storage only, there is no +-1 accumulation kernel: every forward unpacks the signs into a +-1 weight of the
+    input dtype, runs the float conv/matmul and frees it. Resident memory is 1 bit per weight (32x less than the
+    BWN float weight); the float weight of one layer only exists during its forward. The speed is the one of the
+    BWN float model plus the unpack, one pass over the weight (python -m benchmarks.sign_gemm).
+"""
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+__all__ = ['Conv2dSign', 'LinearSign', 'pack_sign', 'unpack_sign']
+
+
+def pack_sign(codes):
+    """
+    Eight signs per byte, bit i of byte j is the sign of column 8 * j + i (1: +, 0: -).
+    :param codes: tensor [rows, K] of +-1
+    :return: uint8 tensor [rows, ceil(K / 8)]
+    """
+    bits = (codes > 0).to(torch.uint8)
+    if bits.shape[1] % 8 != 0:
+        bits = F.pad(bits, (0, 8 - bits.shape[1] % 8))
+    shifts = torch.arange(8, dtype=torch.uint8, device=codes.device)
+    return (bits.reshape(bits.shape[0], -1, 8) << shifts).sum(dim=-1, dtype=torch.uint8)
+
+
+def unpack_sign(packed, K, dtype=torch.float32):
+    """Inverse of pack_sign: +-1 of the given dtype, [rows, K]"""
+    shifts = torch.arange(8, dtype=torch.uint8, device=packed.device)
+    bits = (packed.unsqueeze(-1) >> shifts) & 1
+    return (bits.reshape(packed.shape[0], -1)[:, :K].to(dtype) * 2 - 1)
+
+
+class _SignGemm(nn.Module):
+    def __init__(self, weight_codes, alpha, bias=None):
+        """
+        :param weight_codes: the signs of the weights, [out, K]
+        :param alpha: one or one per output channel
+        """
+        super(_SignGemm, self).__init__()
+        self.K = weight_codes.shape[1]
+        self.register_buffer('weight_bits', pack_sign(weight_codes))
+        self.register_buffer('alpha', alpha.detach().reshape(-1).clone())
+        self.register_buffer('bias', None if bias is None else bias.detach().clone())
+
+    def weight_sign(self, dtype):
+        """the +-1 weight [out, K], not kept: only the bits stay in memory"""
+        return unpack_sign(self.weight_bits, self.K, dtype)
+
+
+class Conv2dSign(_SignGemm):
+    def __init__(self, in_channels, out_channels, kernel_size, stride, padding, dilation, groups,
+                 weight_codes, alpha, bias=None):
+        """:param weight_codes: [out, C / groups, kh, kw]"""
+        super(Conv2dSign, self).__init__(weight_codes.reshape(out_channels, -1), alpha, bias=bias)
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.kernel_size = kernel_size
+        self.stride = stride
+        self.padding = padding
+        self.dilation = dilation
+        self.groups = groups
+
+    def forward(self, x):
+        weight = self.weight_sign(x.dtype).view(self.out_channels, -1, *self.kernel_size)
+        out = F.conv2d(x, weight, None, self.stride, self.padding, self.dilation, self.groups)
+        out = out * self.alpha.view(-1, 1, 1)
+        if self.bias is not None:
+            out += self.bias.view(-1, 1, 1)
+        return out
+
+    def extra_repr(self):
+        return '{}, {}, kernel_size={}, stride={}, padding={}, dilation={}, groups={}'.format(
+            self.in_channels, self.out_channels, self.kernel_size, self.stride, self.padding, self.dilation,
+            self.groups)
+
+
+class LinearSign(_SignGemm):
+    def __init__(self, in_features, out_features, weight_codes, alpha, bias=None):
+        super(LinearSign, self).__init__(weight_codes, alpha, bias=bias)
+        self.in_features = in_features
+        self.out_features = out_features
+
+    def forward(self, x):
+        out = F.linear(x, self.weight_sign(x.dtype)) * self.alpha
+        if self.bias is not None:
+            out += self.bias
+        return out
+
+    def extra_repr(self):
+        return 'in_features={}, out_features={}'.format(self.in_features, self.out_features)
@@ -61,16 +61,58 @@ class Conv2dSQ(nn.Conv2d):
         else:
             self.scale_w = Parameter(torch.Tensor(1))
         self.register_buffer('init_state', torch.zeros(3))  # [sparsity, qa, qw]
+        # Python-side copy of init_state: forward reads these instead of the buffer (no host sync).
+        # The sign of the activation is fixed when qa is initialized (init_state[1] == 2 means signed).
+        self.init_flags = [False, False, False]
+        self.signed_a = False
+        self._register_load_state_dict_pre_hook(self._load_init_state)
         if self.sparsity <= 1e-5:
             self.register_buffer('mask', None)
         else:
             self.register_buffer('mask', torch.ones_like(self.weight))
 
+    def _load_init_state(self, state_dict, prefix, *args):
+        key = prefix + 'init_state'
+        if key in state_dict:
+            init_state = state_dict[key].tolist()
+            self.init_flags = [v != 0 for v in init_state]
+            self.signed_a = init_state[1] == 2
+
+    @property
+    def initialized(self):
+        return ((self.sparsity <= 1e-5 or self.init_flags[0]) and (self.nbits_a <= 0 or self.init_flags[1]) and
+                (self.nbits_w <= 0 or self.init_flags[2]))
+
+    def set_init_state(self, i, value=1):
+        self.init_flags[i] = value != 0
+        self.init_state[i] = value
+
+    def initialize(self, x):
+        if self.sparsity > 1e-5 and not self.INS and not self.init_flags[0]:  # post-training sparsity
+            self.mask.copy_(get_sparsity_mask(self.weight, self.sparsity))
+            self.weight.data.mul_(self.mask)
+            self.set_init_state(0)
+        if self.nbits_a > 0 and not self.init_flags[1]:
+            self.signed_a = bool(x.min() <= -1e-5)
+            Qp = 2 ** (self.nbits_a - 1) - 1 if self.signed_a else 2 ** self.nbits_a - 1
+            if self.nbits_a < 8:
+                self.scale_a.data.copy_(2 * x.detach().abs().mean() / math.sqrt(Qp))
+            else:  # todo: initial value for post-training quantization; outlier value
+                self.scale_a.data.copy_(x.detach().abs().max() / Qp)
+            self.set_init_state(1, 2 if self.signed_a else 1)
+        if self.nbits_w > 0 and not self.init_flags[2]:
+            Qp = 2 ** (self.nbits_w - 1) - 1
+            if self.nbits_w < 8:
+                self.scale_w.data.copy_(2 * self.weight.detach().abs().mean() / math.sqrt(Qp))
+            else:  # todo: initial value for post-training quantization
+                self.scale_w.data.copy_(self.weight.detach().abs().max() / Qp)
+            self.set_init_state(2)
+
     def forward(self, x):
         # 1. pruning weights
         if self.sparsity > 1e-5:
             if self.INS:
-                if self.init_state[0] == 0 and self.training:  # lazy fix+incremental mask for pruning
+                if not self.init_flags[0] and self.training:  # lazy fix+incremental mask for pruning
                     if self.iter % int(self.ins_iter / 10) == 0 or self.iter == self.ins_iter:
                         # self.weight.data.mul_(self.mask)
                         # self.old_mask.copy_(self.mask)  # debug
@@ -80,19 +122,17 @@ class Conv2dSQ(nn.Conv2d):
                         #     print('dynamic!!!')
                         self.weight.data.mul_(self.mask)
                     if self.iter >= self.ins_iter:
-                        self.init_state[0] += 1
+                        self.set_init_state(0)
                     self.iter += 1
-                elif self.init_state[0] == 0 and self.iter == 0 and not self.training:  # post-training sparsity
+                elif not self.init_flags[0] and self.iter == 0 and not self.training:  # post-training sparsity
                     # Please set INS = False
                     raise NotImplementedError('Please set INS = False')
                     # self.mask.copy_(get_sparsity_mask(self.weight, self.sparsity))
                     # self.weight.data.mul_(self.mask)
                     # self.init_state[0] += 1
             else:
-                if self.init_state[0] == 0:  # post-training sparsity
-                    self.mask.copy_(get_sparsity_mask(self.weight, self.sparsity))
-                    self.weight.data.mul_(self.mask)
-                    self.init_state[0] += 1
+                if not self.init_flags[0]:  # post-training sparsity
+                    self.initialize(x)
 
             w_s = self.weight * self.mask
         else:
@@ -115,24 +155,21 @@ class Conv2dSQ(nn.Conv2d):
             x_q = (((x / self.scale_a).round() - self.zero_point_a).clamp(
                 Qn, Qp) + self.zero_point_a) * self.scale_a
             """
-            if x.min() > -1e-5:
-                Qn = 0
-                Qp = 2 ** self.nbits_a - 1
-            else:
+            if not self.init_flags[1]:
+                self.initialize(x)
+            if self.signed_a:
                 Qn = -2 ** (self.nbits_a - 1)
                 Qp = 2 ** (self.nbits_a - 1) - 1
-            if self.init_state[1] == 0:
-                if self.nbits_a < 8:
-                    self.scale_a.data.copy_(2 * x.abs().mean() / math.sqrt(Qp))
-                else:  # todo: initial value for post-training quantization; outlier value
-                    self.scale_a.data.copy_(x.abs().max() / Qp)
-                self.init_state[1] += 1
+            else:
+                Qn = 0
+                Qp = 2 ** self.nbits_a - 1
             g = 1.0 / math.sqrt(x.numel() * Qp)
             # Method1:
-            scale_a = grad_scale(self.scale_a, g)
-            x_q = round_pass((x / scale_a).clamp(Qn, Qp)) * scale_a
+            # scale_a = grad_scale(self.scale_a, g)
+            # x_q = round_pass((x / scale_a).clamp(Qn, Qp)) * scale_a
 
             # x_q = FunLSQ.apply(x, self.scale_a, g, Qn, Qp)
+            x_q = FunLSQFused.apply(x, self.scale_a, g, Qn, Qp)
         # 3. quantize weight
         if self.nbits_w <= 0:
             w_q = w_s
@@ -152,18 +189,15 @@ class Conv2dSQ(nn.Conv2d):
 
             Qn = -2 ** (self.nbits_w - 1)
             Qp = 2 ** (self.nbits_w - 1) - 1
-            if self.init_state[2] == 0:
-                if self.nbits_w < 8:
-                    self.scale_w.data.copy_(2 * self.weight.abs().mean() / math.sqrt(Qp))
-                else:  # todo: initial value for post-training quantization
-                    self.scale_w.data.copy_(self.weight.abs().max() / Qp)
-                self.init_state[2] += 1
+            if not self.init_flags[2]:
+                self.initialize(x)
             g = 1.0 / math.sqrt(w_s.numel() * Qp)
             # Method1:
-            scale_w = grad_scale(self.scale_w, g)
-            w_q = round_pass((w_s / scale_w).clamp(Qn, Qp)) * scale_w
+            # scale_w = grad_scale(self.scale_w, g)
+            # w_q = round_pass((w_s / scale_w).clamp(Qn, Qp)) * scale_w
             # Method2:
             # w_q = FunLSQ.apply(w_s, self.scale_w, g, Qn, Qp)
+            w_q = FunLSQFused.apply(w_s, self.scale_w, g, Qn, Qp)
         return F.conv2d(x_q, w_q, self.bias, self.stride,
                         self.padding, self.dilation, self.groups)
 
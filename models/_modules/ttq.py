@@ -7,7 +7,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from models._modules import Qmodes
+from models._modules import Qmodes, _InitStateMixin
 
 __all__ = ['TTQ_CNN', 'TTQ_Linear', 'Conv2dTBQ', 'LinearTBQ']
 
@@ -114,7 +114,7 @@ class Function_binary_fc(torch.autograd.Function):
 #
 #         return grad_fp_weight.transpose(0, 1).reshape(grad_ternary_weight.shape), \
 #                grad_pos, grad_neg, None, None
-class LinearTBQ(nn.Linear):
+class LinearTBQ(_InitStateMixin, nn.Linear):
     def __init__(self, in_features, out_features, bias=True):
         super(LinearTBQ, self).__init__(in_features, out_features, bias=bias)
         self.pos = nn.Parameter(torch.rand([]))
@@ -122,6 +122,7 @@ class LinearTBQ(nn.Linear):
         self.pos_shift = nn.Parameter(torch.zeros([]))
         self.neg_shift = nn.Parameter(torch.zeros([]))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
 
         #  TODO: Split in_channel according to the size of crossbar.
         pos_num_crossbar = int(in_features / 128 / 2)
@@ -133,15 +134,18 @@ class LinearTBQ(nn.Linear):
         self.split_channel = in_features - split_channel
         print('split/in_features: {}/{}'.format(self.split_channel, in_features))
 
+    def initialize(self, x):
+        pos_indices = (self.weight > 0).to(self.weight.device).float()
+        neg_indices = (self.weight < 0).to(self.weight.device).float()
+        pos_init = (self.weight * pos_indices).mean()
+        neg_init = (self.weight * neg_indices).mean()
+        self.pos.data.copy_(pos_init)
+        self.neg.data.copy_(neg_init)
+        self.set_init_state()
+
     def forward(self, x):
-        if self.training and self.init_state == 0:
-            pos_indices = (self.weight > 0).to(self.weight.device).float()
-            neg_indices = (self.weight < 0).to(self.weight.device).float()
-            pos_init = (self.weight * pos_indices).mean()
-            neg_init = (self.weight * neg_indices).mean()
-            self.pos.data.copy_(pos_init)
-            self.neg.data.copy_(neg_init)
-            self.init_state.fill_(1)
+        if self.training and not self.initialized:
+            self.initialize(x)
 
         weight_pos = self.weight[:, :self.split_channel]
         weight_neg = self.weight[:, self.split_channel:]
@@ -151,7 +155,7 @@ class LinearTBQ(nn.Linear):
         return F.linear(x, binary_weight, self.bias)
 
 
-class Conv2dTBQ(nn.Conv2d):
+class Conv2dTBQ(_InitStateMixin, nn.Conv2d):
 
     def __init__(self, in_channels, out_channels, kernel_size,
                  stride=1, padding=0, dilation=1, groups=1, bias=True, mode=Qmodes.kernel_wise):
@@ -167,6 +171,7 @@ class Conv2dTBQ(nn.Conv2d):
             self.pos = nn.Parameter(torch.rand([]))
             self.neg = nn.Parameter(-torch.rand([]))
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
 
         #  TODO: Split in_channel according to the size of crossbar.
         pos_num_crossbar = int(in_channels * (kernel_size ** 2) / 128 / 2)
@@ -177,18 +182,23 @@ class Conv2dTBQ(nn.Conv2d):
         self.split_channel = split_channel
         print('split channel / in channel: {}/{}'.format(split_channel, in_channels))
 
+    def initialize(self, x):
+        if self.mode != Qmodes.kernel_wise:
+            raise NotImplementedError
+        # init running scale
+        w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
+        pos_indices = (w_reshape > 0).to(w_reshape.device).float()
+        neg_indices = (w_reshape < 0).to(w_reshape.device).float()
+        pos_init = (w_reshape * pos_indices).mean(dim=0)
+        neg_init = (w_reshape * neg_indices).mean(dim=0)
+        self.pos.data.copy_(pos_init)
+        self.neg.data.copy_(neg_init)
+        self.set_init_state()
+
     def forward(self, x):
         if self.mode == Qmodes.kernel_wise:
-            if self.training and self.init_state == 0:
-                # init running scale
-                w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
-                pos_indices = (w_reshape > 0).to(w_reshape.device).float()
-                neg_indices = (w_reshape < 0).to(w_reshape.device).float()
-                pos_init = (w_reshape * pos_indices).mean(dim=0)
-                neg_init = (w_reshape * neg_indices).mean(dim=0)
-                self.pos.data.copy_(pos_init)
-                self.neg.data.copy_(neg_init)
-                self.init_state.fill_(1)
+            if self.training and not self.initialized:
+                self.initialize(x)
 
             weight_pos = self.weight[:, :self.split_channel, :, :]
             weight_neg = self.weight[:, self.split_channel:, :, :]
@@ -269,7 +279,7 @@ class Function_ternary_kernel(torch.autograd.Function):
                grad_pos, grad_neg, None
 
 
-class TTQ_CNN(nn.Conv2d):
+class TTQ_CNN(_InitStateMixin, nn.Conv2d):
 
     def __init__(self, in_channels, out_channels, kernel_size,
                  stride=1, padding=0, dilation=1, groups=1, bias=True, thresh_factor=0.05, mode=Qmodes.kernel_wise):
@@ -285,30 +295,31 @@ class TTQ_CNN(nn.Conv2d):
         self.thresh_factor = thresh_factor
         self.ternary_weight = None
         self.register_buffer('init_state', torch.zeros(1))
+        self._init_state_flag()
+
+    def initialize(self, x):
+        # init running scale
+        if self.mode == Qmodes.kernel_wise:
+            w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
+            pos_indices = (w_reshape > 0).to(w_reshape.device).float()
+            neg_indices = (w_reshape < 0).to(w_reshape.device).float()
+            pos_init = (w_reshape * pos_indices).mean(dim=0)
+            neg_init = (w_reshape * neg_indices).mean(dim=0)
+        else:
+            pos_indices = (self.weight > 0).to(self.weight.device).float()
+            neg_indices = (self.weight < 0).to(self.weight.device).float()
+            pos_init = (self.weight * pos_indices).mean()
+            neg_init = (self.weight * neg_indices).mean()
+        self.pos.data.copy_(pos_init)
+        self.neg.data.copy_(neg_init)
+        self.set_init_state()
 
     def forward(self, x):
+        if self.training and not self.initialized:
+            self.initialize(x)
         if self.mode == Qmodes.kernel_wise:
-            if self.training and self.init_state == 0:
-                # init running scale
-                w_reshape = self.weight.reshape([self.weight.shape[0], -1]).transpose(0, 1)
-                pos_indices = (w_reshape > 0).to(w_reshape.device).float()
-                neg_indices = (w_reshape < 0).to(w_reshape.device).float()
-                pos_init = (w_reshape * pos_indices).mean(dim=0)
-                neg_init = (w_reshape * neg_indices).mean(dim=0)
-                self.pos.data.copy_(pos_init)
-                self.neg.data.copy_(neg_init)
-                self.init_state.fill_(1)
             self.ternary_weight = Function_ternary_kernel.apply(self.weight, self.pos, self.neg, self.thresh_factor)
         else:
-            if self.training and self.init_state == 0:
-                # init running scale
-                pos_indices = (self.weight > 0).to(self.weight.device).float()
-                neg_indices = (self.weight < 0).to(self.weight.device).float()
-                pos_init = (self.weight * pos_indices).mean()
-                neg_init = (self.weight * neg_indices).mean()
-                self.pos.data.copy_(pos_init)
-                self.neg.data.copy_(neg_init)
-                self.init_state.fill_(1)
             self.ternary_weight = Function_ternary.apply(self.weight, self.pos, self.neg, self.thresh_factor)
 
         return F.conv2d(x, self.ternary_weight, self.bias, self.stride,
@@ -118,7 +118,7 @@ class _AlexNetQ(nn.Module):
 
     def forward(self, x):
         x = self.features(x)
-        if len(x) == 2:
+        if isinstance(x, (list, tuple)):  # [output, scale]
             x[0] = x[0].view(x[0].size(0), 256 * 6 * 6)
         else:
             x = x.view(x.size(0), 256 * 6 * 6)
@@ -164,7 +164,7 @@ class AlexNetQ(nn.Module):
 
     def forward(self, x):
         x = self.features(x)
-        if len(x) == 2:
+        if isinstance(x, (list, tuple)):  # [output, scale]
             x[0] = x[0].view(x[0].size(0), 256 * 6 * 6)
         else:
             x = x.view(x.size(0), 256 * 6 * 6)
@@ -213,7 +213,7 @@ class AlexNetQv2(nn.Module):
 
     def forward(self, x):
         x = self.features(x)
-        if len(x) == 2:
+        if isinstance(x, (list, tuple)):  # [output, scale]
             x[0] = x[0].view(x[0].size(0), 256 * 6 * 6)
         else:
             x = x.view(x.size(0), 256 * 6 * 6)
@@ -259,7 +259,7 @@ class AlexNetQPACT(nn.Module):
 
     def forward(self, x):
         x = self.features(x)
-        if len(x) == 2:
+        if isinstance(x, (list, tuple)):  # [output, scale]
             x[0] = x[0].view(x[0].size(0), 256 * 6 * 6)
         else:
             x = x.view(x.size(0), 256 * 6 * 6)
@@ -306,7 +306,7 @@ class AlexNetQFN(nn.Module):
 
     def forward(self, x):
         x = self.features(x)
-        if len(x) == 2:
+        if isinstance(x, (list, tuple)):  # [output, scale]
             x[0] = x[0].view(x[0].size(0), 256 * 6 * 6)
         else:
             x = x.view(x.size(0), 256 * 6 * 6)
@@ -353,7 +353,7 @@ class AlexNetQFNv2(nn.Module):
 
     def forward(self, x):
         x = self.features(x)
-        if len(x) == 2:
+        if isinstance(x, (list, tuple)):  # [output, scale]
             x[0] = x[0].view(x[0].size(0), 256 * 6 * 6)
         else:
             x = x.view(x.size(0), 256 * 6 * 6)
@@ -0,0 +1,217 @@
+"""
+Training/inference throughput of the model zoo on CPU with synthetic data.
+
+    python -m test.bench_models run -a resnet18_lsq resnet18_llsq resnet18_qv2 --bits 4,4 --out bench.json
+    python -m test.bench_models run -a mobilenetv2_q --bits 4,4 8,8 --batch-size 16
+    python -m test.bench_models run -a cifar10_vggsmall_lsq --dataset cifar10 --bits 2,2
+    python -m test.bench_models compare baseline.json bench.json [--threshold 0.2]
+
+Every configuration (arch, qw, qa) runs in a fresh process: the peak RSS is the peak of that configuration only.
+The models are built as in examples/classifier_<dataset>/main.py.
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import models.cifar10 as cifar10_models
+import models.imagenet as imagenet_models
+import models.mnist as mnist_models
+import models.svhn as svhn_models
+from models._modules import Qmodes
+
+__all__ = ['DATASETS', 'build_model', 'bench_model', 'run', 'compare', 'print_table']
+
+# models, input (C, H, W), keyword arguments of the quantized models
+DATASETS = {
+    'imagenet': (imagenet_models, (3, 224, 224), ('nbits_w', 'nbits_a', 'q_mode')),
+    'cifar10': (cifar10_models, (3, 32, 32), ('nbits_w', 'nbits_a', 'q_mode')),
+    'mnist': (mnist_models, (1, 32, 32), ('nbits_w', 'nbits_a', 'q_mode')),
+    'svhn': (svhn_models, (3, 32, 32), ('nbits_w', 'nbits_a')),
+}
+# lower is better
+METRICS = ('train_ms_p50', 'eval_ms_p50', 'peak_rss_mb')
+
+
+def build_model(arch, dataset='imagenet', qw=-1, qa=-1, q_mode=Qmodes.kernel_wise):
+    models, _, quant_keys = DATASETS[dataset]
+    if arch not in models.__dict__:
+        raise KeyError('{} is not a {} model'.format(arch, dataset))
+    kwargs = {}
+    if dataset != 'imagenet' or ('q' in arch and 'seq' not in arch):
+        values = {'nbits_w': qw, 'nbits_a': qa, 'q_mode': q_mode}
+        kwargs = {k: values[k] for k in quant_keys}
+    return models.__dict__[arch](pretrained=False, **kwargs)
+
+
+def _peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def _percentiles(times):
+    return {'p50': float(np.percentile(times, 50)), 'p90': float(np.percentile(times, 90)),
+            'p99': float(np.percentile(times, 99))}
+
+
+def bench_model(arch, dataset='imagenet', qw=-1, qa=-1, batch_size=8, steps=10, warmup=3, threads=None):
+    """
+    :param warmup: untimed steps first (lazy initialization of the quantizers, allocator warmup)
+    :return: dict, throughput in images/s, latencies in ms per step
+    """
+    if threads is not None:
+        torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    model = build_model(arch, dataset, qw, qa)
+    input_res = DATASETS[dataset][1]
+    inputs = torch.randn(batch_size, *input_res)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-4, momentum=0.9)
+    rss_model_mb = _peak_rss_mb()
+
+    def train_step():
+        output = model(inputs)
+        loss = criterion(output, torch.zeros(batch_size, dtype=torch.long))
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    def eval_step():
+        with torch.no_grad():
+            model(inputs)
+
+    result = {'arch': arch, 'dataset': dataset, 'qw': qw, 'qa': qa, 'batch_size': batch_size,
+              'params': sum(p.numel() for p in model.parameters())}
+    for stage, step in (('train', train_step), ('eval', eval_step)):
+        model.train(stage == 'train')
+        for _ in range(warmup):
+            step()
+        times = []
+        for _ in range(steps):
+            begin = time.perf_counter()
+            step()
+            times.append((time.perf_counter() - begin) * 1e3)
+        result['{}_images_per_s'.format(stage)] = batch_size * steps / (sum(times) / 1e3)
+        for k, v in _percentiles(times).items():
+            result['{}_ms_{}'.format(stage, k)] = v
+    result['model_rss_mb'] = rss_model_mb
+    result['peak_rss_mb'] = _peak_rss_mb()
+    return result
+
+
+def _bench_model_kwargs(kwargs):
+    return bench_model(**kwargs)
+
+
+def config_key(result):
+    return '{}/w{}a{}/bs{}'.format(result['arch'], result['qw'], result['qa'], result['batch_size'])
+
+
+def run(archs, dataset='imagenet', bits=((-1, -1),), batch_size=8, steps=10, warmup=3, threads=None,
+        isolate=True):
+    """
+    :param bits: [(qw, qa)]
+    :param isolate: every configuration in a new process (peak RSS per configuration)
+    """
+    results = {}
+    for arch in archs:
+        for qw, qa in bits:
+            kwargs = {'arch': arch, 'dataset': dataset, 'qw': qw, 'qa': qa, 'batch_size': batch_size,
+                      'steps': steps, 'warmup': warmup, 'threads': threads}
+            if isolate:
+                with multiprocessing.get_context('spawn').Pool(1) as pool:
+                    result = pool.apply(_bench_model_kwargs, (kwargs,))
+            else:
+                result = bench_model(**kwargs)
+            results[config_key(result)] = result
+    return {
+        'env': {'torch': torch.__version__, 'threads': threads if threads is not None else torch.get_num_threads(),
+                'machine': platform.machine(), 'processor': platform.processor(), 'steps': steps},
+        'results': results,
+    }
+
+
+def print_table(report, baseline=None):
+    columns = ('train_images_per_s', 'train_ms_p50', 'train_ms_p90', 'eval_images_per_s', 'eval_ms_p50',
+               'eval_ms_p90', 'peak_rss_mb')
+    print('{:<36}'.format('config') + ''.join('{:>20}'.format(c) for c in columns))
+    for key, result in report['results'].items():
+        line = '{:<36}'.format(key)
+        for c in columns:
+            cell = '{:.1f}'.format(result[c])
+            if baseline is not None and key in baseline['results']:
+                cell += ' ({:+.0%})'.format(result[c] / max(baseline['results'][key][c], 1e-9) - 1)
+            line += '{:>20}'.format(cell)
+        print(line)
+
+
+def compare(baseline, current, threshold=0.2, verbose=True):
+    """
+    :return: the regressions, [(key, metric, baseline, current)]
+    """
+    regressions = []
+    for key, cur in current['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        for metric in METRICS:
+            if cur[metric] > base[metric] * (1 + threshold):
+                regressions.append((key, metric, base[metric], cur[metric]))
+    if verbose:
+        print_table(current, baseline)
+        if baseline['env'] != current['env']:
+            print('=> different environments: {} vs {}'.format(baseline['env'], current['env']))
+        for key, metric, base, cur in regressions:
+            print('=> regression {} {}: {:.2f} -> {:.2f}'.format(key, metric, base, cur))
+    return regressions
+
+
+def _bits(s):
+    qw, qa = s.split(',')
+    return int(qw), int(qa)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Model zoo throughput benchmark (CPU, synthetic data)')
+    subparsers = parser.add_subparsers(dest='command')
+    parser_run = subparsers.add_parser('run')
+    parser_run.add_argument('-a', '--arch', nargs='+', required=True)
+    parser_run.add_argument('--dataset', choices=list(DATASETS), default='imagenet')
+    parser_run.add_argument('--bits', nargs='+', type=_bits, default=[(-1, -1)], metavar='QW,QA',
+                            help='weight,activation bit-widths of every run (default: -1,-1, full precision)')
+    parser_run.add_argument('-b', '--batch-size', default=8, type=int)
+    parser_run.add_argument('--steps', default=10, type=int)
+    parser_run.add_argument('--warmup', default=3, type=int)
+    parser_run.add_argument('--threads', default=None, type=int)
+    parser_run.add_argument('--out', default='bench_models.json', type=str)
+    parser_cmp = subparsers.add_parser('compare')
+    parser_cmp.add_argument('baseline', type=str)
+    parser_cmp.add_argument('current', type=str)
+    parser_cmp.add_argument('--threshold', default=0.2, type=float, help='allowed relative increase')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        report = run(args.arch, args.dataset, args.bits, args.batch_size, args.steps, args.warmup, args.threads)
+        print_table(report)
+        with open(args.out, 'w') as wf:
+            json.dump(report, wf, indent=2)
+        return 0
+    if args.command == 'compare':
+        with open(args.baseline) as rf:
+            baseline = json.load(rf)
+        with open(args.current) as rf:
+            current = json.load(rf)
+        return 1 if compare(baseline, current, args.threshold) else 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -52,5 +52,35 @@ def test_get_sparsity_mask():
     print(mask)
 
 
+def test_average_meter_on_device():
+    meter = AverageMeter('Acc@1', ':6.2f')
+    meter.update(torch.tensor([50.]), 2)
+    meter.update(torch.tensor(80.), 1)
+    assert torch.is_tensor(meter.avg)
+    synchronize_meters(meter)
+    assert meter.avg == 60 and meter.val == 80 and isinstance(meter.sum, float)
+    assert str(meter) == 'Acc@1  80.00 ( 60.00)'
+
+
+class _Writer(object):
+    def __init__(self):
+        self.scalars = []
+
+    def add_scalar(self, tag, value, global_step):
+        self.scalars.append((tag, value, global_step))
+
+
+def test_scalar_buffer():
+    writer = _Writer()
+    scalars = ScalarBuffer(writer)
+    scalars.add_scalar('train/lr', 0.1, 0)
+    scalars.add_scalar('train/acc1', torch.tensor(12.5), 0)
+    assert writer.scalars == []
+    scalars.flush()
+    assert writer.scalars == [('train/lr', 0.1, 0), ('train/acc1', 12.5, 0)]
+    scalars.flush()
+    assert len(writer.scalars) == 2
+
+
 if __name__ == '__main__':
     test_get_sparsity_mask()
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from test.bench_models import bench_model, compare, run
+
+
+def test_bench_model():
+    result = bench_model('mnist_lenet', dataset='mnist', batch_size=2, steps=2, warmup=1)
+    for stage in ('train', 'eval'):
+        assert result['{}_images_per_s'.format(stage)] > 0
+        assert 0 < result['{}_ms_p50'.format(stage)] <= result['{}_ms_p99'.format(stage)]
+    assert result['peak_rss_mb'] >= result['model_rss_mb'] > 0
+
+
+def test_compare():
+    baseline = run(['cifar10_vggsmall_lsq'], dataset='cifar10', bits=[(4, 4)], batch_size=2, steps=2, warmup=1,
+                   isolate=False)
+    key, = baseline['results']
+    assert key == 'cifar10_vggsmall_lsq/w4a4/bs2'
+    assert compare(baseline, baseline, verbose=False) == []
+    current = {'env': baseline['env'], 'results': {key: dict(baseline['results'][key])}}
+    current['results'][key]['peak_rss_mb'] *= 2
+    assert [r[:2] for r in compare(baseline, current, verbose=False)] == [(key, 'peak_rss_mb')]
+
+
+@pytest.mark.skipif(os.environ.get('MODEL_BENCH') is None, reason='set MODEL_BENCH=1 to run the resnet18 comparison')
+def test_resnet18_quantizers():
+    report = run(['resnet18', 'resnet18_lsq', 'resnet18_llsq', 'resnet18_qv2'], bits=[(4, 4)], steps=5)
+    assert len(report['results']) == 4
@@ -0,0 +1,38 @@
+import copy
+import os
+
+import pytest
+import torch
+
+from benchmarks.quantizers import CASES, QUICK_SHAPES, compare, iter_cases, run
+
+# saved_tensors_hooks: torch >= 1.10
+pytestmark = pytest.mark.skipif(not hasattr(torch.autograd, 'graph'), reason='torch.autograd.graph is not available')
+
+
+def test_every_case_runs():
+    report = run(QUICK_SHAPES, iters=1, warmup=1, verbose=False)
+    families = set(result['family'] for result in report['results'].values())
+    assert families == set(case[0] for case in CASES)
+    assert len(report['results']) == len(list(iter_cases(QUICK_SHAPES)))
+    for result in report['results'].values():
+        assert result['median_ms'] > 0 and result['saved_bytes'] > 0
+
+
+def test_compare():
+    baseline = run(QUICK_SHAPES, families=['LSQ'], iters=1, warmup=1, verbose=False)
+    assert compare(baseline, baseline, verbose=False) == []
+    current = copy.deepcopy(baseline)
+    key = next(iter(current['results']))
+    current['results'][key]['median_ms'] *= 2
+    assert compare(baseline, current, verbose=False) == [
+        (key, 'median_ms', baseline['results'][key]['median_ms'], current['results'][key]['median_ms'])]
+
+
+@pytest.mark.skipif(os.environ.get('QUANT_BENCH') is None,
+                    reason='set QUANT_BENCH=<baseline.json> to compare all the quantizers with a baseline')
+def test_against_baseline():
+    import json
+    with open(os.environ['QUANT_BENCH']) as rf:
+        baseline = json.load(rf)
+    assert compare(baseline, run()) == []
@@ -0,0 +1,52 @@
+import pytest
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from utils.ptflops import get_model_complexity_info
+
+
+def complexity(model, input_res):
+    torch.manual_seed(0)
+    model.train()
+    my_nn.calibrate(model, torch.randn(2, *input_res))
+    model.eval()
+    return get_model_complexity_info(model, input_res, as_strings=False, print_per_layer_stat=False,
+                                     with_bops=True)
+
+
+def test_bops():
+    torch.manual_seed(0)
+    model = nn.Sequential(
+        nn.Conv2d(3, 8, 3, padding=1),
+        my_nn.ActLSQ(nbits=4), nn.ReLU(),
+        my_nn.Conv2dLSQ(8, 8, 3, padding=1, nbits=2),
+        my_nn.TTQ_CNN(8, 8, 1),
+        nn.Flatten(), my_nn.LinearBWN(8 * 4 * 4, 10, nbits=1))
+    flops, params, bops = complexity(model, (3, 4, 4))
+    density = (model[4].ternary_weight != 0).float().mean().item()
+    assert 0 < density < 1
+    # float input: 32 bits; quantized input of the Conv2dLSQ through the ReLU: 4 bits;
+    # the later layers: the last activation quantizer
+    expected = [(3456, 32, 32, 1.), (9216, 2, 4, 1.), (1024, 2, 4, density), (1280, 1, 4, 1.)]
+    assert bops == sum(int(macs * d * nbits_w * nbits_a) for macs, nbits_w, nbits_a, d in expected)
+    # effective MACs + bias + ReLU
+    assert flops == 3456 + 128 + 128 + 9216 + 128 + int(1024 * density + 128) + 1280
+
+
+def test_bops_mask_density():
+    model = nn.Sequential(my_nn.Conv2dNPU(64, 64, 3, padding=1, non_zero_num=8),
+                          my_nn.Conv2dSQ(64, 16, 1, nbits_w=4, nbits_a=8, sparsity=0.5))
+    flops, params, bops = complexity(model, (64, 4, 4))
+    npu_macs = 9 * 64 * 64 * 16 / 4
+    sq_macs = 64 * 16 * 16 * (model[1].mask != 0).float().mean().item()
+    assert bops == int(npu_macs * 32 * 32) + int(sq_macs * 4 * 8)
+    assert flops == int(npu_macs + 64 * 16) + int(sq_macs + 16 * 16)
+
+
+@pytest.mark.parametrize('with_bops', [False, True])
+def test_complexity_strings(with_bops):
+    model = nn.Sequential(nn.Conv2d(3, 8, 3), nn.ReLU())
+    result = get_model_complexity_info(model, (3, 8, 8), print_per_layer_stat=False, with_bops=with_bops)
+    assert len(result) == (3 if with_bops else 2)
+    assert not hasattr(model[0], '__nbits_a_handle__') and not hasattr(model, '__act_bits_handles__')
@@ -0,0 +1,119 @@
+import copy
+
+import pytest
+import torch
+import torch.nn as nn
+
+from models._modules import calibrate, Conv2dLSQ, ActLSQ, Conv2dLLSQ, ActLLSQS, Conv2dBWNS, LinearBWNS, Qmodes
+from models._modules import Conv2dQ, ActQ, ActDNQ, Conv2dNPU, Conv2dSQ
+
+
+def make_model():
+    return nn.Sequential(
+        ActLLSQS(nbits=4, signed=True), Conv2dLSQ(3, 8, 3, nbits=4), nn.BatchNorm2d(8), nn.ReLU(),
+        ActLSQ(nbits=4, signed=False), Conv2dLLSQ(8, 8, 3, nbits=4), nn.ReLU(),
+        ActQ(nbits=4, signed=False), Conv2dQ(8, 8, 3, nbits=4, mode=Qmodes.layer_wise),
+        Conv2dBWNS(8, 8, 1, nbits=1, mode=Qmodes.kernel_wise), nn.Flatten(), LinearBWNS(8 * 6 * 6, 10, nbits=1))
+
+
+def test_calibrate_matches_lazy_init():
+    torch.manual_seed(0)
+    lazy = make_model()
+    model = copy.deepcopy(lazy)
+    x = torch.randn(4, 3, 12, 12)
+    lazy.train()
+    lazy(x)
+    model.train()
+    calibrate(model, x)
+    for m_lazy, m in zip(lazy.modules(), model.modules()):
+        if hasattr(m, 'initialized'):
+            assert m.initialized and m.init_state.item() == 1
+            scale = 'running_scale' if hasattr(m, 'running_scale') else 'alpha'
+            assert torch.allclose(getattr(m, scale), getattr(m_lazy, scale))
+    # in eval mode BN running stats are untouched
+    model = make_model().eval()
+    calibrate(model, x)
+    assert all(m.initialized for m in model.modules() if hasattr(m, 'initialized'))
+    assert torch.equal(model[2].running_mean, torch.zeros(8))
+
+
+def _replica(m):
+    # as nn.parallel.replicate: shallow copy of __dict__, own buffer tensors (replica 0 aliases the storage)
+    replica = m._replicate_for_data_parallel()
+    replica._buffers = {k: v.view_as(v) for k, v in m._buffers.items()}
+    return replica
+
+
+def test_init_state_in_replicas():
+    m = Conv2dLSQ(3, 8, 3, nbits=4)
+    replica = _replica(m)
+    assert not replica.initialized
+    replica.train()
+    replica(torch.randn(2, 3, 6, 6))
+    assert replica.initialized
+    # the flag and the buffer of the wrapped module
+    assert m.initialized and m.init_state.item() == 1
+    replica = _replica(m)
+    assert replica.initialized
+    m.set_init_state(False)
+    assert not _replica(m).initialized
+
+
+def test_calibrate_data_parallel():
+    model = nn.DataParallel(make_model())
+    calibrate(model, torch.randn(4, 3, 12, 12))
+    assert 'forward' not in model.__dict__
+    assert all(m.initialized for m in model.module.modules() if hasattr(m, 'initialized'))
+
+
+def test_init_state_from_state_dict():
+    torch.manual_seed(0)
+    m = Conv2dLSQ(3, 8, 3, nbits=4)
+    m(torch.randn(2, 3, 6, 6))
+    assert m.initialized
+    m2 = Conv2dLSQ(3, 8, 3, nbits=4)
+    assert not m2.initialized
+    m2.load_state_dict(m.state_dict())
+    assert m2.initialized
+    alpha = m2.alpha.detach().clone()
+    m2(torch.randn(2, 3, 6, 6) * 10)
+    assert torch.equal(m2.alpha, alpha)
+
+
+def test_nbits_constants():
+    m = Conv2dLSQ(3, 8, 3, nbits=4)
+    assert (m.Qn, m.Qp) == (-8, 7)
+    m.nbits = 3
+    assert (m.Qn, m.Qp) == (-4, 3)
+    assert m.g == 1.0 / (m.weight.numel() * 3) ** 0.5
+    a = ActLSQ(nbits=4, signed=False)
+    assert (a.Qn, a.Qp) == (0, 15)
+
+
+@pytest.mark.parametrize('act', [ActLLSQS, ActDNQ])
+def test_zero_input_pass_through(act):
+    m = act(nbits=4, signed=False)
+    x = torch.zeros(2, 4, 3, 3, requires_grad=True)
+    y = m(x)
+    assert torch.equal(y, x)
+    assert not m.initialized
+    # the alpha of the skipped initialization is finite
+    y.sum().backward()
+    assert torch.isfinite(x.grad).all() and (m.alpha.grad is None or torch.isfinite(m.alpha.grad).all())
+    x = torch.rand(2, 4, 3, 3)
+    m(x)
+    assert m.initialized
+
+
+def test_npu_and_sq_state():
+    torch.manual_seed(0)
+    m = Conv2dNPU(64, 8, 3, non_zero_num=16)
+    calibrate(m, torch.randn(1, 64, 5, 5))
+    assert m.initialized
+    assert ((m.weight != 0).float().reshape(8, 64, -1).sum(dim=1) <= 2 * 16).all()
+    m = Conv2dSQ(4, 8, 3, nbits_a=4, nbits_w=4)
+    calibrate(m, torch.randn(2, 4, 5, 5))
+    assert m.initialized and m.signed_a
+    m2 = Conv2dSQ(4, 8, 3, nbits_a=4, nbits_w=4)
+    m2.load_state_dict(m.state_dict())
+    assert m2.initialized and m2.signed_a
@@ -0,0 +1,53 @@
+import pytest
+import torch
+
+import models._modules as my_nn
+from benchmarks.torch_compile import cases, get_compile_ready
+
+# torch.compile needs torch >= 2.0
+counters = pytest.importorskip('torch._dynamo.utils').counters
+
+
+@pytest.mark.parametrize('name', list(cases))
+def test_compile_no_graph_breaks(name):
+    model, x = get_compile_ready(name)
+    torch._dynamo.reset()
+    counters.clear()
+    compiled = torch.compile(model, backend='eager')
+    for _ in range(3):
+        compiled(x).sum().backward()
+    model.eval()
+    with torch.no_grad():
+        compiled(x)
+        compiled(x)
+    assert sum(counters['graph_break'].values()) == 0
+    # one graph for train and one for eval: no recompilation between steps
+    assert counters['stats']['unique_graphs'] == 2
+
+
+def test_set_compile_mode_warns(capsys):
+    my_nn.set_compile_mode(my_nn.Conv2dLSQ(4, 8, 3))
+    assert 'not initialized' in capsys.readouterr().out
+    m = my_nn.Conv2dSQ(4, 8, 3, sparsity=0.5, INS=True, total_iter=100)
+    my_nn.set_compile_mode(m)
+    assert 'not initialized' in capsys.readouterr().out
+
+
+def test_set_compile_mode_warns_search_interval(capsys):
+    for m in [my_nn.Conv2dQ(4, 8, 3, search_interval=3), my_nn.ActLLSQ(nbits=4, search_interval=2)]:
+        my_nn.set_compile_mode(m)
+        assert 'search_interval is ignored' in capsys.readouterr().out
+    my_nn.set_compile_mode(my_nn.Conv2dQ(4, 8, 3))
+    assert 'search_interval' not in capsys.readouterr().out
+
+
+def test_scale_grad_v2():
+    torch.manual_seed(0)
+    m = my_nn.Conv2dQv2(4, 8, 3, nbits=4, mode=my_nn.Qmodes.layer_wise)
+    x = torch.randn(2, 4, 6, 6)
+    m(x)
+    # a far too small scale: the simulated gradient makes it grow
+    m.running_scale.data.fill_(1e-4)
+    m.zero_grad()
+    m(x).sum().backward()
+    assert (m.running_scale.grad < 0).all()
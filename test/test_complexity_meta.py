@@ -0,0 +1,57 @@
+import pytest
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from utils.ptflops import get_model_complexity_info, get_model_complexity_info_meta
+
+
+def meta_supported():
+    try:
+        torch.nn.functional.conv2d(torch.empty(1, 3, 4, 4, device='meta'), torch.empty(8, 3, 3, 3, device='meta'))
+        return True
+    except Exception:
+        return False
+
+
+pytestmark = pytest.mark.skipif(not meta_supported(), reason='meta tensors are not supported by this torch')
+
+
+def make_model():
+    return nn.Sequential(
+        nn.Conv2d(3, 64, 3, padding=1),
+        my_nn.ActLSQ(nbits=4), nn.ReLU(),
+        my_nn.Conv2dNPU(64, 64, 3, padding=1, non_zero_num=8),
+        my_nn.Conv2dLSQ(64, 8, 3, padding=1, nbits=2),
+        my_nn.TTQ_CNN(8, 8, 1),
+        nn.Flatten(), my_nn.LinearBWN(8 * 4 * 4, 10, nbits=1))
+
+
+def test_meta_equals_forward():
+    torch.manual_seed(0)
+    model = make_model()
+    model.train()
+    my_nn.calibrate(model, torch.randn(2, 3, 4, 4))
+    flops, params, bops, act_memory = get_model_complexity_info_meta(model, (3, 4, 4), as_strings=False,
+                                                                     print_per_layer_stat=False)
+    assert act_memory > 0
+    assert (flops, params, bops) == get_model_complexity_info(model, (3, 4, 4), as_strings=False,
+                                                              print_per_layer_stat=False, with_bops=True)
+
+
+def test_meta_no_init():
+    torch.manual_seed(0)
+    model = make_model()
+    state = {k: v.clone() for k, v in model.state_dict().items()}
+    get_model_complexity_info_meta(model, (3, 4, 4), print_per_layer_stat=False)
+    assert not any(m.initialized for m in model.modules() if isinstance(m, my_nn._InitStateMixin))
+    assert all(torch.equal(v, state[k]) for k, v in model.state_dict().items())
+    assert all(not p.is_meta for p in model.parameters())
+
+
+def test_activation_memory():
+    model = nn.Sequential(nn.Conv2d(3, 8, 3, padding=1), my_nn.ActLSQ(nbits=4), nn.ReLU())
+    _, _, _, act_memory = get_model_complexity_info_meta(model, (3, 4, 4), as_strings=False,
+                                                         print_per_layer_stat=False)
+    # float conv and ReLU outputs, 4 bits quantizer output
+    assert act_memory == 8 * 16 * 4 + 8 * 16 / 2 + 8 * 16 * 4
@@ -0,0 +1,60 @@
+import torch
+
+from utils.event_writer import AsyncSummaryWriter, parse_sample_rates
+
+
+class _Recorder(object):
+    def __init__(self):
+        self.calls = []
+
+    def add_scalar(self, *args):
+        self.calls.append(('add_scalar',) + args)
+
+    def add_histogram(self, *args):
+        self.calls.append(('add_histogram',) + args)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_parse_sample_rates():
+    assert parse_sample_rates(['train/*=10', 'a=b=2']) == {'train/*': 10, 'a=b': 2}
+    assert parse_sample_rates(None) == {}
+
+
+def test_async_summary_writer(tmpdir):
+    writer = AsyncSummaryWriter(str(tmpdir), sample_rates={'train/*/alpha': 3}, histogram_samples=100)
+    recorder = _Recorder()
+    writer.writer.close()
+    writer.writer = recorder
+    alpha = torch.ones(1)
+    for step in range(7):
+        writer.add_scalar('train/conv1/alpha', alpha, step)
+        # the queued value is a copy
+        alpha += 1
+        writer.add_scalar('val/acc1', float(step), step)
+    writer.add_histogram('train/conv1/weight', torch.randn(1000), 0)
+    writer.flush()
+    alphas = [c for c in recorder.calls if c[1] == 'train/conv1/alpha']
+    assert [(c[2], c[3]) for c in alphas] == [(1., 0), (4., 3), (7., 6)]
+    assert len([c for c in recorder.calls if c[1] == 'val/acc1']) == 7
+    histogram = [c for c in recorder.calls if c[0] == 'add_histogram'][0]
+    assert histogram[2].shape == (100,)
+    writer.close()
+    writer.add_scalar('val/acc1', 0., 8)
+    assert writer.dropped == 0
+
+
+def test_max_bytes(tmpdir):
+    writer = AsyncSummaryWriter(str(tmpdir), max_bytes=2000, check_every=10)
+    for step in range(1000):
+        writer.add_scalar('train/loss', float(step), step)
+    writer.close()
+    assert writer.over_size
+    size = sum(f.size() for f in tmpdir.listdir())
+    # at most check_every events after the cap, out of ~40 KB
+    assert 2000 <= size < 2000 + 10 * 100
+
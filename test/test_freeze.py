@@ -0,0 +1,71 @@
+import copy
+
+import pytest
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from models._modules import Qmodes
+from models.cifar10 import cifar10_vggtiny_llsqs_bwns
+from models.imagenet import resnet18_lsq
+from utils.wrapper import freeze_quantized
+
+
+def make_model():
+    return nn.Sequential(
+        my_nn.ActLLSQS(nbits=4, signed=True), my_nn.Conv2dLSQ(3, 8, 3, nbits=4, mode=Qmodes.kernel_wise),
+        nn.BatchNorm2d(8), nn.ReLU(),
+        my_nn.ActLSQ(nbits=4, signed=False), my_nn.Conv2dLLSQ(8, 8, 3, nbits=4), nn.ReLU(),
+        my_nn.ActDNQv2(nbits=4), my_nn.Conv2dDNQv2(8, 8, 1, nbits=4), my_nn.Conv2dBN(8, 8, 1),
+        my_nn.Conv2dSQ(8, 64, 3, padding=1, nbits_a=4, nbits_w=4, sparsity=0.5),
+        my_nn.Conv2dNPU(64, 8, 1, non_zero_num=16), my_nn.Conv2dBNBWNS(8, 8, 1, nbits=1),
+        my_nn.TTQ_CNN(8, 8, 1), my_nn.Conv2dBWNS(8, 8, 1, nbits=1),
+        nn.Flatten(), my_nn.LinearBWNS(8 * 6 * 6, 10, nbits=1))
+
+
+def make_model_q():
+    return nn.Sequential(
+        my_nn.Conv2dQ(3, 8, 3, nbits=4), nn.ReLU(), my_nn.ActQ(nbits=4), my_nn.Conv2dQv2(8, 8, 3, nbits=4),
+        my_nn.ActQv2(nbits=4, signed=True), nn.Flatten(), my_nn.LinearQ(8 * 6 * 6, 10, nbits=4))
+
+
+cases = {
+    'modules': (make_model, (4, 3, 10, 10)),
+    'resnet18_lsq': (lambda: resnet18_lsq(nbits_w=4, nbits_a=4), (2, 3, 224, 224)),
+    'cifar10_vggtiny_llsqs_bwns': (lambda: cifar10_vggtiny_llsqs_bwns(nbits_w=1, nbits_a=4), (2, 3, 32, 32)),
+}
+
+
+def get_frozen(model_fn, shape):
+    torch.manual_seed(0)
+    model = model_fn()
+    x = torch.randn(shape)
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
+    for _ in range(2):
+        optimizer.zero_grad()
+        model(x).sum().backward()
+        optimizer.step()
+    model.eval()
+    with torch.no_grad():
+        out = model(x)
+        frozen = freeze_quantized(copy.deepcopy(model))
+        return out, frozen(x), frozen
+
+
+@pytest.mark.parametrize('name', list(cases))
+def test_freeze_round_trip(name):
+    out, out_frozen, frozen = get_frozen(*cases[name])
+    assert torch.equal(out, out_frozen)
+    for m in frozen.modules():
+        assert type(m) not in my_nn.__dict__.values() or type(m) is my_nn.ActFixedQ
+    keys = frozen.state_dict().keys()
+    assert not any(k.endswith(('init_state', 'labels', 'mask', 'alpha')) for k in keys)
+
+
+def test_freeze_straight_through_act():
+    # ActQ computes its output with straight-through float ops: equal up to rounding
+    out, out_frozen, frozen = get_frozen(make_model_q, (2, 3, 10, 10))
+    assert torch.allclose(out, out_frozen, rtol=1e-4, atol=1e-5)
+    assert all(type(m) in (nn.Sequential, nn.Conv2d, nn.ReLU, nn.Flatten, nn.Linear, my_nn.ActFixedQ)
+               for m in frozen.modules())
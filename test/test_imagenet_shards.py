@@ -0,0 +1,101 @@
+import threading
+
+import numpy as np
+import pytest
+import torch
+import torchvision
+import torchvision.transforms as transforms
+from PIL import Image
+
+from utils.custom_datasets.imagenet_shards import (IMAGENET_MEAN_STD, ImageNetShards, ShardLoader, ShardSampler,
+                                                   convert_imagenet, get_shard_loaders)
+
+
+def make_image_folder(root, num_per_class=5):
+    rng = np.random.RandomState(0)
+    for split in ('train', 'val'):
+        for c in ('a', 'b', 'c'):
+            folder = root.join(split).join(c)
+            folder.ensure(dir=True)
+            for i in range(num_per_class):
+                h, w = rng.randint(200, 300, size=2)
+                image = Image.fromarray(rng.randint(0, 256, (h, w, 3), dtype=np.uint8))
+                image.save(str(folder.join('{}.png'.format(i))))
+
+
+def test_shards(tmpdir):
+    make_image_folder(tmpdir.join('imagenet'))
+    out = str(tmpdir.join('shards'))
+    convert_imagenet(str(tmpdir.join('imagenet')), out, train_size=64, shard_size=4, workers=1)
+    train_set = ImageNetShards(out, 'train')
+    assert len(train_set) == 15 and len(train_set.shards) == 4 and train_set.classes == ['a', 'b', 'c']
+    # the val images as Resize(256) + CenterCrop(224) + ToTensor + Normalize
+    reference = torchvision.datasets.ImageFolder(str(tmpdir.join('imagenet').join('val')), transforms.Compose([
+        transforms.Resize(256), transforms.CenterCrop(224), transforms.ToTensor(),
+        transforms.Normalize(*IMAGENET_MEAN_STD)]))
+    train_loader, val_loader, train_sampler = get_shard_loaders(out, batch_size=4, val_batch_size=4)
+    assert train_sampler is None
+    x = torch.cat([b[0] for b in val_loader])
+    y = torch.cat([b[1] for b in val_loader])
+    for i in range(len(reference)):
+        assert torch.allclose(x[i], reference[i][0], atol=1e-5) and y[i] == reference[i][1]
+    batches = list(train_loader)
+    assert len(batches) == len(train_loader) == 4
+    assert all(b[0].shape[1:] == (3, 224, 224) for b in batches)
+    assert sorted(torch.cat([b[1] for b in batches]).tolist()) == sorted(train_set.labels.tolist())
+
+
+def test_shard_sampler(tmpdir):
+    class Dataset(object):
+        offsets = [0, 4, 8, 12, 15]
+
+    samplers = [ShardSampler(Dataset(), num_replicas=2, rank=r, window=2) for r in range(2)]
+    for s in samplers:
+        s.set_epoch(3)
+    parts = [list(s) for s in samplers]
+    assert len(parts[0]) == len(parts[1]) == 8
+    assert set(parts[0] + parts[1]) == set(range(15))
+    # the first replica reads the first window of 2 shards
+    assert len(set(i // 4 for i in parts[0])) == 2
+    assert parts == [list(s) for s in samplers]
+
+
+def test_shard_loader_stops_early():
+    class Dataset(object):
+        size = 2
+
+        def __len__(self):
+            return 100
+
+        def get_batch(self, indices):
+            return torch.zeros(len(indices), 3, 2, 2, dtype=torch.uint8), torch.zeros(len(indices))
+
+    threads = threading.active_count()
+    batches = iter(ShardLoader(Dataset(), batch_size=1, prefetch=1))
+    next(batches)
+    # as a break out of the loop: the producer stops instead of blocking on the full queue
+    batches.close()
+    assert threading.active_count() == threads
+
+
+def test_shard_loader_producer_error():
+    class Dataset(object):
+        size = 2
+
+        def __len__(self):
+            return 4
+
+        def get_batch(self, indices):
+            if indices[0] == 2:
+                raise IOError('truncated shard')
+            return torch.zeros(len(indices), 3, 2, 2, dtype=torch.uint8), torch.zeros(len(indices))
+
+    threads = threading.active_count()
+    batches = iter(ShardLoader(Dataset(), batch_size=1, prefetch=2))
+    next(batches)
+    next(batches)
+    # raised in the training loop instead of waiting for the next batch forever
+    with pytest.raises(IOError, match='truncated shard'):
+        next(batches)
+    assert threading.active_count() == threads
+
@@ -0,0 +1,55 @@
+import pytest
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from benchmarks.int_gemm import cases, get_converted
+
+
+def test_pack_int4():
+    codes = torch.randint(-8, 8, (5, 27), dtype=torch.int8)
+    packed = my_nn.pack_int4(codes)
+    assert packed.shape == (5, 14)
+    assert torch.equal(my_nn.unpack_int4(packed, 27), codes)
+
+
+@pytest.mark.parametrize('name', list(cases))
+def test_int_equivalence(name):
+    model_fn, shape, num_int = cases[name]
+    model, model_int, x = get_converted(model_fn, shape)
+    layers = {n: m for n, m in model_int.named_modules() if isinstance(m, (my_nn.Conv2dInt, my_nn.LinearInt))}
+    assert len(layers) == num_int
+    # the input and output of every converted layer in the fake-quant model
+    captured = {}
+    modules = dict(model.named_modules())
+    for n in layers:
+        modules[n].register_forward_hook(lambda m, i, o, n=n: captured.__setitem__(n, (i[0].clone(), o.clone())))
+    with torch.no_grad():
+        out, out_int = model(x), model_int(x)
+        for n, m in layers.items():
+            x_q, y = captured[n]
+            # the same codes: the integer sums are exact, the float sums within one step of the accumulator
+            step = m.scale.view(-1, 1, 1) if isinstance(m, my_nn.Conv2dInt) else m.scale
+            assert ((m(x_q) - y).abs() <= step).all()
+    # the codes of the two models may round the other way where the float sums differ by less than a step
+    assert torch.equal(out.argmax(dim=1), out_int.argmax(dim=1))
+
+
+def test_int_quantize_once():
+    model, model_int, x = get_converted(*cases['a4'][:2])
+    # every activation quantizer only feeds integer layers: the layers quantize their input themselves
+    assert not any(isinstance(m, my_nn.ActFixedQ) for m in model_int.modules())
+    assert sum(isinstance(m, nn.Identity) for m in model_int.modules()) == 3
+    m = model_int[3]
+    assert m.weight_codes() is m.weight_codes()
+    with torch.no_grad():
+        assert torch.equal(model_int(x).argmax(dim=1), model(x).argmax(dim=1))
+
+
+@pytest.mark.skipif(not my_nn.HAS_INT_MM, reason='torch._int_mm is not available')
+def test_int_mm_matches_fallback(monkeypatch):
+    model, model_int, x = get_converted(cases['a8'][0], cases['a8'][1])
+    with torch.no_grad():
+        out = model_int(x)
+        monkeypatch.setattr('models._modules.int_gemm.HAS_INT_MM', False)
+        assert torch.equal(model_int(x), out)
@@ -0,0 +1,68 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from models._modules import Qmodes, round_cus
+from models.cifar10 import cifar10_vggtiny_llsqs_bwns
+from utils.wrapper import convert_to_shift, quantize_scale_and_bias, save_inner_hooks
+
+
+def test_shift_round():
+    x = torch.arange(-64, 64)
+    for shift in (-3, -1, 0, 2):
+        expected = x * 2. ** shift
+        assert torch.equal(my_nn.shift_round(x, shift), expected.round().long())
+        assert torch.equal(my_nn.shift_round(x, shift, 'floor'), expected.floor().long())
+        assert torch.equal(my_nn.shift_round(x, shift, 'round_cus'), round_cus(expected).long())
+
+
+def make_model():
+    return nn.Sequential(
+        my_nn.ActLLSQS(nbits=4, signed=True), my_nn.Conv2dBWNS(3, 8, 3, padding=1, nbits=1, mode=Qmodes.kernel_wise),
+        nn.ReLU(), nn.MaxPool2d(2),
+        my_nn.ActLLSQS(nbits=8, floor=True), my_nn.Conv2dBNBWNS(8, 8, 3, nbits=1), nn.ReLU(inplace=True),
+        my_nn.ActLLSQS(nbits=4, custom=True), nn.Flatten(), my_nn.LinearBWNS(8 * 3 * 3, 10, nbits=1))
+
+
+cases = {
+    'modules': (make_model, (2, 3, 10, 10)),
+    'cifar10_vggtiny_llsqs_bwns': (lambda: cifar10_vggtiny_llsqs_bwns(nbits_w=1, nbits_a=4), (2, 3, 32, 32)),
+}
+
+
+@pytest.mark.parametrize('name', list(cases))
+def test_shift_inner_data(name, tmp_path, monkeypatch):
+    model_fn, shape = cases[name]
+    torch.manual_seed(0)
+    model = model_fn()
+    x = torch.randn(shape)
+    model.train()
+    my_nn.calibrate(model, x)
+    model.eval()
+    quantize_scale_and_bias(model)
+    model_int = convert_to_shift(copy.deepcopy(model))
+
+    outputs = {}
+    for name, m in model_int.named_modules():
+        if isinstance(m, (my_nn.ActShift, my_nn.Conv2dShift, my_nn.LinearShift)):
+            m.register_forward_hook(lambda m, i, o, name=name: outputs.__setitem__(name, o.clone()))
+    # the dumps of --extract-inner-data
+    monkeypatch.chdir(tmp_path)
+    save_inner_hooks(model)
+    with torch.no_grad():
+        out, out_int = model(x), model_int(x)
+    assert torch.equal(out, out_int)
+
+    num_q = sum(isinstance(m, (my_nn.ActLLSQS, my_nn.Conv2dBWNS, my_nn.LinearBWNS, my_nn.Conv2dBNBWNS))
+                for m in model.modules())
+    assert len(outputs) == num_q
+    for name, o in outputs.items():
+        m = model_int.get_submodule(name)
+        if not m.out_float:
+            assert not o.is_floating_point()
+            o = o.double() * 2. ** m.scale_exp
+        assert torch.equal(torch.from_numpy(np.load('{}_out.npy'.format(name))).double(), o.double())
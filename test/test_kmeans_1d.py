@@ -0,0 +1,93 @@
+import os
+
+import pytest
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from models._modules.cluster_quant import k_means_1d
+
+
+# Lloyd's with the full [n, k] distance matrix, the same start
+def reference_k_means(x, n_clusters, max_iter=50):
+    values = x.reshape(-1).double()
+    sorted_values = values.sort()[0]
+    quantiles = (torch.arange(n_clusters, dtype=torch.float64) + 0.5) * values.numel() / n_clusters
+    centroids = sorted_values[quantiles.long().clamp_(max=values.numel() - 1)]
+    for _ in range(max_iter):
+        labels = (values.unsqueeze(1) - centroids).abs().argmin(dim=1)
+        updated = centroids.clone()
+        for j in range(n_clusters):
+            if (labels == j).any():
+                updated[j] = values[labels == j].mean()
+        updated = updated.sort()[0]
+        if torch.equal(updated, centroids):
+            break
+        centroids = updated
+    return centroids
+
+
+@pytest.mark.parametrize('nbits', [1, 2, 4])
+def test_k_means_1d(nbits):
+    torch.manual_seed(0)
+    x = torch.randn(32, 16, 3, 3)
+    centroids, labels = k_means_1d(x, 2 ** nbits)
+    assert centroids.shape == (2 ** nbits,) and labels.shape == x.shape and labels.dtype == torch.int32
+    assert torch.allclose(centroids.double(), reference_k_means(x, 2 ** nbits), atol=1e-5)
+    # every weight has the nearest centroid
+    assert torch.equal(labels.long(), (x.unsqueeze(-1) - centroids).abs().argmin(dim=-1))
+
+
+def test_k_means_1d_few_values():
+    x = torch.tensor([0.5, 0.5, -1., -1., 2.])
+    centroids, labels = k_means_1d(x, 16)
+    assert centroids.numel() == 16
+    assert torch.equal(centroids[labels.long()], x)
+
+
+def make_model():
+    return nn.Sequential(
+        my_nn.Conv2dClusterQ(3, 8, 3, padding=1, nbits=2), nn.ReLU(),
+        my_nn.Conv2dClusterQ(8, 8, 3, nbits=4), nn.ReLU(),
+        my_nn.Conv2dClusterQ(8, 8, 1, nbits=-1))
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_cluster_all_layers(workers, tmp_path):
+    torch.manual_seed(0)
+    model = make_model()
+    reference = [k_means_1d(model[i].weight, 2 ** model[i].nbits) for i in (0, 2)]
+    my_nn.cluster_all_layers(model, workers=workers, cache_dir=str(tmp_path))
+    for i, (centroids, labels) in zip((0, 2), reference):
+        assert model[i].initialized
+        assert torch.equal(model[i].centroids.data, centroids)
+        assert torch.equal(model[i].labels.int(), labels)
+        assert torch.equal(model[i].weight.data, centroids[labels.long()])
+    assert len(os.listdir(str(tmp_path))) == 2
+    # the lazy init is skipped
+    state = [p.clone() for p in model.parameters()]
+    model.train()
+    model(torch.randn(2, 3, 8, 8))
+    assert all(torch.equal(p, q) for p, q in zip(state, model.parameters()))
+
+
+def test_cluster_all_layers_cache(tmp_path, monkeypatch):
+    torch.manual_seed(0)
+    model = make_model()
+    my_nn.cluster_all_layers(model, cache_dir=str(tmp_path))
+    torch.manual_seed(0)
+    model_restart = make_model()
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the cache is not used')
+
+    monkeypatch.setattr('models._modules.cluster_quant.k_means_1d', fail)
+    my_nn.cluster_all_layers(model_restart, cache_dir=str(tmp_path))
+    assert all(torch.equal(p, q) for p, q in zip(model.parameters(), model_restart.parameters()))
+
+
+def test_cluster_all_layers_nbits():
+    model = make_model()
+    my_nn.cluster_all_layers(model, nbits=3)
+    assert model[0].nbits == model[2].nbits == 3 and model[0].centroids.numel() == 8
+    assert model[4].centroids is None
@@ -0,0 +1,56 @@
+import pytest
+import torch
+
+from models._modules.cluster_quant import FuncKmeansSTE, FuncKmeansActSTE, cluster_mean, \
+    reconstruct_weight_from_k_means_result
+from benchmarks.kmeans_ste import get_data, reference_backward
+
+
+def reference_act_forward(activation, centroids):
+    centroid_sort, index = centroids.sort()
+    centroid_thresh = [-10000] + [(centroid_sort[i] + centroid_sort[i + 1]) / 2
+                                  for i in range(len(centroid_sort) - 1)] + [10000]
+    label = torch.zeros_like(activation)
+    for i in range(len(centroid_sort)):
+        case = (centroid_thresh[i] <= activation) * (activation < centroid_thresh[i + 1])
+        activation = torch.where(case, torch.zeros_like(activation).fill_(centroid_sort[i]), activation)
+        label = torch.where(case, torch.zeros_like(activation).fill_(index[i]), label)
+    return activation, label
+
+
+@pytest.mark.parametrize('nbits', [2, 4, 8])
+def test_kmeans_ste(nbits):
+    centroids, labels = get_data(nbits)
+    assert torch.equal(reconstruct_weight_from_k_means_result(centroids, labels), centroids[labels.long()])
+    grad = torch.randn(labels.shape)
+    ref_weight, ref_centroids = reference_backward(grad, centroids, labels)
+    mean = cluster_mean(grad, labels, centroids.numel())
+    assert torch.allclose(mean, ref_centroids, atol=1e-6)
+    assert torch.allclose(mean[labels.long()], ref_weight, atol=1e-6)
+
+
+def test_kmeans_ste_grad():
+    centroids, labels = get_data(4)
+    weight = torch.randn(labels.shape, requires_grad=True)
+    centroids.requires_grad_(True)
+    grad = torch.randn(labels.shape)
+    FuncKmeansSTE.apply(weight, centroids, labels).backward(grad)
+    ref_weight, ref_centroids = reference_backward(grad, centroids.detach(), labels)
+    assert torch.allclose(weight.grad, ref_weight, atol=1e-6)
+    assert torch.allclose(centroids.grad, ref_centroids, atol=1e-6)
+
+
+def test_kmeans_act_ste():
+    torch.manual_seed(0)
+    centroids = torch.randn(16, requires_grad=True)
+    x = torch.randn(8, 4, 6, 6) * 2
+    x[0, 0, 0, 0] = 20000.
+    x.requires_grad_(True)
+    y = FuncKmeansActSTE.apply(x, centroids)
+    ref_y, ref_label = reference_act_forward(x.detach(), centroids.detach())
+    assert torch.equal(y, ref_y)
+    grad = torch.randn_like(x)
+    y.backward(grad)
+    assert torch.equal(x.grad, grad)
+    ref_centroids = torch.stack([(grad * (ref_label == j)).sum() / (ref_label == j).sum() for j in range(16)])
+    assert torch.allclose(centroids.grad, ref_centroids, atol=1e-6)
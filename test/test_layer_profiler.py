@@ -0,0 +1,62 @@
+import json
+import threading
+
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from utils.wrapper import LayerProfiler
+
+
+def make_model():
+    return nn.Sequential(
+        nn.Conv2d(3, 8, 3, padding=1),
+        my_nn.ActLSQ(nbits=4), nn.ReLU(),
+        my_nn.Conv2dLSQ(8, 8, 3, padding=1, nbits=2),
+        nn.Flatten(), nn.Linear(8 * 4 * 4, 10))
+
+
+def test_layer_profiler(tmpdir):
+    torch.manual_seed(0)
+    model = make_model()
+    model.train()
+    prefix = str(tmpdir.join('profile'))
+    profiler = LayerProfiler(model, steps=2, skip=1, prefix=prefix).start()
+    for _ in range(4):
+        model(torch.randn(2, 3, 4, 4)).sum().backward()
+        profiler.step()
+    profiler.stop()
+    with open(prefix + '.json') as rf:
+        report = json.load(rf)
+    assert report == json.loads(json.dumps(profiler.report))
+    with open(prefix + '_trace.json') as rf:
+        json.load(rf)
+    stats = report['modules']
+    assert stats['1']['kind'] == 'quantizer' and stats['1']['quant_ms'] == stats['1']['forward_ms']
+    for name in ('0', '3', '5'):
+        assert stats[name]['kind'] == 'layer'
+        assert stats[name]['calls'] == 2
+        assert 0 < stats[name]['compute_ms'] <= stats[name]['forward_ms']
+        assert stats[name]['backward_ms'] > 0
+    assert stats['Sequential']['kind'] == 'container'
+    # the hooks are removed
+    assert all(len(m._forward_hooks) == 0 and len(m._forward_pre_hooks) == 0 for m in model.modules())
+
+
+def test_scopes_per_thread(tmpdir):
+    profiler = LayerProfiler(make_model(), steps=1, skip=0, prefix=str(tmpdir.join('p')))
+    profiler._enter('a')(None, None)
+    inner = []
+
+    def replica():
+        profiler._enter('b')(None, None)
+        inner.append(len(profiler._scopes()))
+        profiler._exit(None, None, None)
+        inner.append(len(profiler._scopes()))
+
+    thread = threading.Thread(target=replica)
+    thread.start()
+    thread.join()
+    # the scope of the other thread was neither seen nor closed
+    assert inner == [1, 0] and len(profiler._scopes()) == 1
+    profiler._exit(None, None, None)
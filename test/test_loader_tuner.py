@@ -0,0 +1,36 @@
+import multiprocessing
+
+import torch
+
+from utils.loader_tuner import load_tuned, measure_loader, save_tuned, sweep_configs, tune_loader
+
+
+def test_sweep_configs():
+    configs = sweep_configs(max_workers=6)
+    assert configs[0] == {'num_workers': 0}
+    assert sorted(set(c['num_workers'] for c in configs)) == [0, 1, 2, 4, 6]
+    assert len(configs) == 1 + 4 * 4
+
+
+def test_tune_loader(tmpdir):
+    dataset = torch.utils.data.TensorDataset(torch.randn(64, 3, 8, 8), torch.arange(64))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=8, shuffle=True)
+    configs = [{'num_workers': 0}, {'num_workers': 2, 'prefetch_factor': 2, 'persistent_workers': True}]
+    settings, results = tune_loader(loader, configs, batches=4, epochs=2, verbose=False)
+    assert len(results) == 2 and all(r['samples_per_s'] > 0 and r['cpu_util'] >= 0 for r in results)
+    assert settings in [dict(c, pin_memory=False) for c in configs]
+    path = str(tmpdir.join('tune.json'))
+    assert load_tuned('cifar10', path) is None
+    save_tuned('cifar10', settings, results, path=path, batch_size=8)
+    assert load_tuned('cifar10', path) == settings
+    torch.utils.data.DataLoader(dataset, batch_size=8, **load_tuned('cifar10', path))
+
+
+def test_measure_loader_shuts_workers_down():
+    dataset = torch.utils.data.TensorDataset(torch.randn(32, 3, 8, 8), torch.arange(32))
+    samples_per_s, _ = measure_loader(lambda: torch.utils.data.DataLoader(dataset, batch_size=8, num_workers=2,
+                                                                          persistent_workers=True), batches=2)
+    assert samples_per_s > 0
+    # the persistent workers are gone before their CPU time is read
+    assert not multiprocessing.active_children()
+
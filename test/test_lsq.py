@@ -0,0 +1,110 @@
+import copy
+import math
+
+import torch
+
+from models._modules import Conv2dLSQ, LinearLSQ, ActLSQ, Conv2dSQ, Qmodes
+from models._modules.lsq import grad_scale, round_pass
+
+
+def lsq_method1(x, alpha, nbits, signed=True):
+    if signed:
+        Qn, Qp = -2 ** (nbits - 1), 2 ** (nbits - 1) - 1
+    else:
+        Qn, Qp = 0, 2 ** nbits - 1
+    g = 1.0 / math.sqrt(x.numel() * Qp)
+    alpha = grad_scale(alpha, g)
+    return round_pass((x / alpha).clamp(Qn, Qp)) * alpha
+
+
+def saved_bytes(fn):
+    total = [0]
+
+    def pack(t):
+        total[0] += t.numel() * t.element_size()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        fn()
+    return total[0]
+
+
+def check_module(m, x, weight=True, signed=True):
+    m.train()
+    y = m(x)
+    y.sum().backward()
+    # same alpha, Method1 on the same inputs
+    alpha = m.alpha.detach().clone().requires_grad_(True)
+    x_ref = x.detach().clone().requires_grad_(True)
+    if weight:
+        w_ref = m.weight.detach().clone().requires_grad_(True)
+        w_q = lsq_method1(w_ref, alpha, m.nbits)
+        if isinstance(m, Conv2dLSQ):
+            y_ref = torch.nn.functional.conv2d(x_ref, w_q, m.bias, m.stride, m.padding)
+        else:
+            y_ref = torch.nn.functional.linear(x_ref, w_q, m.bias)
+        y_ref.sum().backward()
+        assert torch.allclose(m.weight.grad, w_ref.grad, atol=1e-5)
+    else:
+        y_ref = lsq_method1(x_ref, alpha, m.nbits, signed)
+        y_ref.sum().backward()
+    assert torch.allclose(y, y_ref, atol=1e-5)
+    assert torch.allclose(m.alpha.grad, alpha.grad, rtol=1e-4, atol=1e-6)
+
+
+def test_conv2d_lsq_fused():
+    torch.manual_seed(0)
+    check_module(Conv2dLSQ(8, 16, 3, padding=1, nbits=4), torch.randn(2, 8, 6, 6, requires_grad=True))
+
+
+def test_linear_lsq_fused():
+    torch.manual_seed(0)
+    check_module(LinearLSQ(32, 10, nbits=3), torch.randn(4, 32, requires_grad=True))
+
+
+def test_act_lsq_fused():
+    torch.manual_seed(0)
+    check_module(ActLSQ(nbits=4, signed=False), torch.randn(4, 8, 5, 5).relu().requires_grad_(True),
+                 weight=False, signed=False)
+    check_module(ActLSQ(nbits=2, signed=True), torch.randn(4, 8, 5, 5, requires_grad=True),
+                 weight=False, signed=True)
+
+
+def test_conv2d_lsq_kernel_wise():
+    torch.manual_seed(0)
+    m = Conv2dLSQ(4, 6, 3, nbits=4, mode=Qmodes.kernel_wise)
+    m.set_init_state()
+    m.alpha.data.copy_(torch.rand(6) * 0.1 + 0.05)
+    m(torch.randn(2, 4, 5, 5)).sum().backward()
+    assert m.alpha.grad.shape == m.alpha.shape
+
+
+def test_conv2d_sq_fused():
+    torch.manual_seed(0)
+    m = Conv2dSQ(8, 8, 3, padding=1, nbits_w=4, nbits_a=4)
+    x = torch.randn(2, 8, 6, 6).relu()
+    m.train()
+    m(x).sum().backward()
+    m_ref = copy.deepcopy(m)
+    m.zero_grad()
+    y = m(x)
+    y.sum().backward()
+    x_q = lsq_method1(x, m_ref.scale_a, 4, signed=False)
+    w_q = lsq_method1(m_ref.weight, m_ref.scale_w, 4)
+    m_ref.zero_grad()
+    y_ref = torch.nn.functional.conv2d(x_q, w_q, m_ref.bias, m_ref.stride, m_ref.padding)
+    y_ref.sum().backward()
+    assert torch.allclose(y, y_ref, atol=1e-5)
+    assert torch.allclose(m.scale_w.grad, m_ref.scale_w.grad, rtol=1e-4)
+    assert torch.allclose(m.scale_a.grad, m_ref.scale_a.grad, rtol=1e-4)
+
+
+def test_fused_saves_less_memory():
+    torch.manual_seed(0)
+    x = torch.randn(16, 64, 16, 16, requires_grad=True)
+    m = ActLSQ(nbits=4, signed=True)
+    m.train()
+    m(x)
+    fused = saved_bytes(lambda: m(x))
+    method1 = saved_bytes(lambda: lsq_method1(x, m.alpha, 4))
+    assert fused < method1
@@ -0,0 +1,56 @@
+import copy
+
+import pytest
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from utils.wrapper import convert_to_lut
+from benchmarks.lut_gemm import cases, get_model
+
+
+@pytest.mark.parametrize('nbits', [2, 3, 4, 8])
+def test_pack_codes(nbits):
+    codes = torch.randint(0, 2 ** nbits, (5, 27))
+    packed = my_nn.pack_codes(codes, nbits)
+    assert packed.shape == (5, -(-27 // (8 // nbits))) and packed.dtype == torch.uint8
+    assert torch.equal(my_nn.unpack_codes(packed, nbits, 27).long(), codes)
+
+
+@pytest.mark.parametrize('name', list(cases))
+def test_lut_equivalence(name):
+    model_fn, shape, num_lut = cases[name]
+    model, x = get_model(model_fn, shape)
+    model_lut = convert_to_lut(copy.deepcopy(model))
+    model_acc = convert_to_lut(copy.deepcopy(model), accumulate=True)
+    assert sum(isinstance(m, my_nn.Conv2dLUT) for m in model_lut.modules()) == num_lut
+    with torch.no_grad():
+        out = model(x)
+        # the same weights
+        assert torch.equal(out, model_lut(x))
+        # the centroids are multiplied after the sums
+        assert torch.allclose(out, model_acc(x), rtol=1e-4, atol=1e-5)
+
+
+def test_lut_share():
+    torch.manual_seed(0)
+    m = my_nn.Conv2dShareQ(3, 8, 3, padding=1, nbits=2, share_num=2)
+    x = [torch.randn(2, 3, 6, 6), torch.randn(2, 3, 6, 6)]
+    m.train()
+    my_nn.calibrate(m, x)
+    m.eval()
+    with torch.no_grad():
+        out = m(x)
+        out_lut = convert_to_lut(nn.Sequential(copy.deepcopy(m)))(x)
+    assert all(torch.equal(o, o_lut) for o, o_lut in zip(out, out_lut))
+
+
+def test_lut_weight_cache():
+    torch.manual_seed(0)
+    labels, centroids = torch.randint(0, 4, (8, 3, 3, 3)), torch.randn(4)
+    m = my_nn.Conv2dLUT(3, 8, (3, 3), (1, 1), (1, 1), (1, 1), 1, labels, centroids, 2)
+    assert m.decoded_weight() is m.decoded_weight()
+    assert set(m.state_dict()) == {'labels_packed', 'centroids'}
+    # loading other labels drops the decoded weight
+    m.load_state_dict(my_nn.Conv2dLUT(3, 8, (3, 3), (1, 1), (1, 1), (1, 1), 1, 3 - labels, centroids, 2).state_dict())
+    assert torch.equal(m.decoded_weight(), centroids[3 - labels])
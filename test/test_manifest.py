@@ -0,0 +1,40 @@
+import numpy as np
+import torchvision
+from PIL import Image
+
+from utils.custom_datasets.manifest import (ManifestDataset, load_manifest, save_manifest, scan_image_folder,
+                                            split_samples)
+
+
+def make_image_folder(root, sizes):
+    for c, n in sizes.items():
+        root.join(c).ensure(dir=True)
+        for i in range(n):
+            Image.new('RGB', (8, 8), (i, 0, 0)).save(str(root.join(c).join('{}.png'.format(i))))
+    root.join('a').join('notes.txt').write('not an image')
+
+
+def test_manifest(tmpdir):
+    root = tmpdir.join('data')
+    make_image_folder(root, {'a': 10, 'b': 5, 'c': 7})
+    classes, paths, labels = scan_image_folder(str(root), workers=2)
+    reference = torchvision.datasets.ImageFolder(str(root))
+    assert classes == reference.classes
+    assert [str(root.join(p)) for p in paths] == [p for p, _ in reference.samples]
+    assert labels.tolist() == reference.targets
+
+    split = split_samples(labels, ratio=5, seed=0)
+    # every class: 1/5 of the images, rounded up
+    assert [int(split[labels == c].sum()) for c in range(3)] == [2, 1, 2]
+    assert not np.array_equal(split, split_samples(labels, ratio=5, seed=1))
+    assert np.array_equal(split, split_samples(labels, ratio=5, seed=0))
+
+    file_name = str(tmpdir.join('split.npz'))
+    save_manifest(file_name, str(root), classes, paths, labels, split, seed=0)
+    manifest = load_manifest(file_name)
+    assert manifest['meta'] == {'seed': 0} and manifest['split_names'] == ['train', 'val']
+    train, val = ManifestDataset(file_name, 'train'), ManifestDataset(manifest, 'val')
+    assert len(train) + len(val) == 22 and len(val) == 5
+    assert sorted(train.samples + val.samples) == sorted(reference.samples)
+    image, target = val[0]
+    assert image.size == (8, 8) and target == val.targets[0]
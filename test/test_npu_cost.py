@@ -0,0 +1,78 @@
+import json
+import math
+
+import pytest
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from utils.ptflops import get_npu_cost, group_cycles
+
+
+# the loops over the 32x32 groups of get_model_parameters_number
+def reference_cycles(mask, pe_size=32):
+    (out_channel, in_channel, k, k) = mask.shape
+    cycles_all = []
+    for i in range(math.ceil(out_channel / pe_size)):
+        for j in range(math.ceil(in_channel / pe_size)):
+            mask_part = mask[i * pe_size:(i + 1) * pe_size, j * pe_size: (j + 1) * pe_size, :, :]
+            cycles = mask_part.sum(axis=1).max(axis=0)[0]
+            cycles_all.append(torch.where(cycles < 7, torch.zeros_like(cycles).fill_(7), cycles))
+    return torch.stack(cycles_all)
+
+
+@pytest.mark.parametrize('shape', [(64, 64, 3, 3), (40, 72, 1, 1), (8, 3, 3, 3)])
+def test_group_cycles(shape):
+    torch.manual_seed(0)
+    mask = (torch.rand(shape) > 0.6).float()
+    cycles = group_cycles(mask)
+    assert cycles.shape == (math.ceil(shape[0] / 32), math.ceil(shape[1] / 32), *shape[2:])
+    assert torch.equal(cycles.reshape(-1, *shape[2:]).float(), reference_cycles(mask))
+
+
+def make_model():
+    return nn.Sequential(
+        nn.Conv2d(3, 64, 3, padding=1), nn.ReLU(),
+        my_nn.Conv2dNPU(64, 64, 3, padding=1, non_zero_num=8), nn.ReLU(),
+        nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(64, 10))
+
+
+def test_npu_cost():
+    torch.manual_seed(0)
+    model = make_model()
+    model.train()
+    model(torch.randn(2, 3, 8, 8))
+    report = get_npu_cost(model, (3, 8, 8), config={'num_arrays': 2})
+    json.dumps(report)
+    assert model.training
+    assert list(report['layers']) == ['0', '2', '6']
+    npu = report['layers']['2']
+    # 8 of every 32 input channels are kept: every group takes the minimum of 8 cycles
+    assert npu['avg_group_cycles'] == 8
+    assert npu['cycles'] == 2 * 2 * 9 * 8 * 8 * 8 / 2
+    assert npu['weight_bytes'] == 64 * 16 * 9 + 64 * 4
+    assert npu['act_bytes'] == 64 * 8 * 8 * 2
+    assert npu['output_shape'] == [1, 64, 8, 8]
+    dense = report['layers']['0']
+    assert dense['avg_group_cycles'] == 7 and dense['sparsity'] == 0
+    total = report['total']
+    assert total['cycles'] == sum(layer['cycles'] for layer in report['layers'].values())
+    assert total['latency'] == pytest.approx(sum(max(layer['compute_latency'], layer['memory_latency'])
+                                                 for layer in report['layers'].values()))
+
+
+def test_npu_cost_without_meta(monkeypatch):
+    torch.manual_seed(0)
+    model = make_model()
+    model.train()
+    model(torch.randn(2, 3, 8, 8))
+    report = get_npu_cost(model, (3, 8, 8))
+
+    def meta_copy(model):
+        raise NotImplementedError('no meta kernel')
+
+    monkeypatch.setattr('utils.ptflops.flops_counter.meta_copy', meta_copy)
+    # the same shapes from a real forward
+    assert get_npu_cost(model, (3, 8, 8)) == report
+    assert model.training
+
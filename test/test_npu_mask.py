@@ -0,0 +1,30 @@
+import pytest
+import torch
+
+from models._modules.npu_structured_pruner import get_npu_structured_sparsity_mask
+from benchmarks.npu_mask import reference_mask
+
+
+@pytest.mark.parametrize('shape', [(16, 64, 3, 3), (8, 96, 1, 1), (4, 32, 5, 5)])
+@pytest.mark.parametrize('non_zero_num', [7, 16, 31])
+def test_npu_mask(shape, non_zero_num):
+    torch.manual_seed(0)
+    weight = torch.randn(shape)
+    mask = get_npu_structured_sparsity_mask(weight, non_zero_num)
+    assert mask.dtype == torch.bool and mask.shape == weight.shape
+    assert torch.equal(mask.float(), reference_mask(weight, non_zero_num))
+    assert (mask.view(shape[0], -1, 32, *shape[2:]).sum(dim=2) == non_zero_num).all()
+
+
+def test_npu_mask_padded():
+    # 48 input channels: the last partition has 16, at most non_zero_num of them are kept
+    torch.manual_seed(0)
+    weight = torch.randn(8, 48, 3, 3)
+    mask = get_npu_structured_sparsity_mask(weight, 20)
+    assert torch.equal(mask[:, :32].float(), reference_mask(weight[:, :32], 20))
+    assert mask[:, 32:].all()
+    assert torch.equal(get_npu_structured_sparsity_mask(weight, 12)[:, 32:].float(), reference_mask(weight[:, 32:], 12))
+
+
+def test_npu_mask_dense():
+    assert get_npu_structured_sparsity_mask(torch.randn(8, 64, 3, 3), 32).all()
@@ -0,0 +1,82 @@
+import torch
+
+from models._modules import Qmodes, search_scale, ln_error, update_running_scale, Conv2dQ, ActQ, ActLLSQ
+from models._modules import quantize
+
+
+def reference_factor(x, scale, Qn, Qp, qmode, is_l2):
+    error = ln_error(x, scale, Qn, Qp, qmode, is_l2)
+    b, s = update_running_scale(x, scale, error, Qn, Qp, qmode, is_l2)
+    factor = torch.ones_like(scale)
+    factor = torch.where(b, factor * 2, factor)
+    return torch.where(s, factor / 2, factor)
+
+
+def test_search_scale_layer_wise():
+    torch.manual_seed(0)
+    for is_l2 in (True, False):
+        for scale in (0.001, 0.05, 0.3, 5.):
+            x = torch.randn(16, 8, 4, 4)
+            scale = torch.Tensor([scale])
+            ref = reference_factor(x, scale, -8, 7, Qmodes.layer_wise, is_l2)
+            assert torch.equal(search_scale(x, scale, -8, 7, Qmodes.layer_wise, is_l2), ref)
+
+
+def test_search_scale_kernel_wise():
+    torch.manual_seed(0)
+    for is_l2 in (True, False):
+        x = torch.randn(72, 16)
+        scale = torch.rand(16) * 0.5 + 1e-3
+        ref = reference_factor(x, scale, -8, 7, Qmodes.kernel_wise, is_l2)
+        assert torch.equal(search_scale(x, scale, -8, 7, Qmodes.kernel_wise, is_l2), ref)
+
+
+def test_search_running_scale_quantize():
+    torch.manual_seed(0)
+    w = torch.randn(36, 8)
+    scale = torch.rand(8) * 0.5 + 1e-3
+    error, _, _ = quantize.ln_error(w, 4, scale, is_act=False)
+    b, s = quantize.update_running_scale(w, 4, scale, error, is_act=False)
+    factor = quantize.search_running_scale(w, 4, scale, is_act=False)
+    assert torch.equal(factor == 2, b)
+    assert torch.equal(factor == 0.5, s)
+
+
+def test_search_interval():
+    torch.manual_seed(0)
+    m = Conv2dQ(4, 8, 3, search_interval=3)
+    # a far too small scale keeps growing on every search
+    m.set_init_state()
+    m.running_scale.fill_(1e-4)
+    x = torch.randn(2, 4, 6, 6)
+    scales = []
+    for _ in range(6):
+        m(x)
+        scales.append(m.running_scale.clone())
+    # the scale only moves on the search steps (0, 3)
+    assert torch.equal(scales[0], scales[1]) and torch.equal(scales[1], scales[2])
+    assert torch.equal(scales[3], scales[4]) and torch.equal(scales[4], scales[5])
+    assert not torch.equal(scales[2], scales[3])
+    assert m.n_iter == 6
+    m.eval()
+    m(x)
+    assert m.n_iter == 6
+
+
+def test_act_q_search():
+    torch.manual_seed(0)
+    m = ActQ(nbits=4, search_factors=(0.5, 0.75, 1.5, 2.))
+    x = torch.randn(4, 8, 5, 5).relu()
+    m(x)
+    assert m.running_scale.shape == (1,)
+
+
+def test_act_llsq_search_interval():
+    torch.manual_seed(0)
+    m = ActLLSQ(nbits=4, search_interval=2)
+    x = torch.randn(4, 8, 5, 5).relu()
+    for i in range(4):
+        m.zero_grad()
+        m(x).sum().backward()
+        if i % 2 == 1:
+            assert (m.alpha.grad == 0).all()
@@ -0,0 +1,37 @@
+import pytest
+import torch
+
+import models._modules as my_nn
+from benchmarks.sign_gemm import cases, get_converted
+
+
+def test_pack_sign():
+    codes = torch.randint(0, 2, (5, 27)).float() * 2 - 1
+    packed = my_nn.pack_sign(codes)
+    assert packed.shape == (5, 4) and packed.dtype == torch.uint8
+    assert torch.equal(my_nn.unpack_sign(packed, 27), codes)
+
+
+@pytest.mark.parametrize('name', list(cases))
+def test_sign_equivalence(name):
+    model_fn, shape, num_sign = cases[name]
+    model, model_sign, x = get_converted(model_fn, shape)
+    assert sum(isinstance(m, (my_nn.Conv2dSign, my_nn.LinearSign)) for m in model_sign.modules()) == num_sign
+    with torch.no_grad():
+        out, out_sign = model(x), model_sign(x)
+    # alpha is applied after the sum instead of to every weight
+    assert torch.allclose(out, out_sign, rtol=1e-4, atol=1e-5)
+
+
+def test_sign_weight_not_kept():
+    torch.manual_seed(0)
+    codes = torch.randint(0, 2, (4, 12)).float() * 2 - 1
+    m = my_nn.LinearSign(12, 4, codes, torch.ones(4))
+    x = torch.randn(3, 12)
+    assert torch.allclose(m(x), x @ codes.t())
+    # only the bits and alpha are resident, no float weight after the forward
+    assert [(name, t.dtype) for name, t in m.named_buffers()] == [('weight_bits', torch.uint8),
+                                                                  ('alpha', torch.float32)]
+    assert not any(torch.is_tensor(v) for v in vars(m).values())
+    m.load_state_dict(my_nn.LinearSign(12, 4, -codes, torch.ones(4)).state_dict())
+    assert torch.allclose(m(x), -x @ codes.t())
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import torch
+import torchvision
+import torchvision.transforms as transforms
+from PIL import Image
+
+from utils.custom_datasets.tensor_loader import (CIFAR_MEAN_STD, RaggedTensorLoader, TensorLoader, dense_images,
+                                                 load_image_folder)
+
+
+def make_loader(n=10, **kwargs):
+    torch.manual_seed(0)
+    data = torch.randint(0, 256, (n, 3, 8, 8), dtype=torch.uint8)
+    targets = torch.arange(n)
+    return TensorLoader(data, targets, 4, *CIFAR_MEAN_STD, **kwargs)
+
+
+def test_val_matches_torchvision():
+    loader = make_loader()
+    transform = transforms.Compose([transforms.ToTensor(), transforms.Normalize(*CIFAR_MEAN_STD)])
+    batches = list(loader)
+    assert len(batches) == len(loader) == 3
+    x = torch.cat([b[0] for b in batches])
+    y = torch.cat([b[1] for b in batches])
+    assert torch.equal(y, torch.arange(10))
+    for i in range(10):
+        image = Image.fromarray(loader.data[i].permute(1, 2, 0).numpy())
+        assert torch.allclose(x[i], transform(image), atol=1e-5)
+
+
+def test_crop_flip():
+    loader = make_loader(shuffle=True, crop=8, padding=2, flip=True, drop_last=True)
+    padded = torch.nn.functional.pad(loader.data.float(), (2, 2, 2, 2))
+    assert len(loader) == 2
+    seen = set()
+    for x, y in loader:
+        assert x.shape == (4, 3, 8, 8)
+        # every image is a crop of the padded image, flipped or not
+        x = x * loader.std + loader.mean
+        for xi, yi in zip(x, y):
+            seen.add(yi.item())
+            windows = padded[yi].unfold(1, 8, 1).unfold(2, 8, 1).permute(1, 2, 0, 3, 4).reshape(-1, 3, 8, 8)
+            candidates = torch.cat([windows, windows.flip(3)])
+            assert ((candidates - xi).abs().amax(dim=(1, 2, 3)) < 1e-3).any()
+    assert len(seen) == 8
+
+
+def make_image_folder(root):
+    rng = np.random.RandomState(0)
+    for c in ('a', 'b'):
+        root.join(c).ensure(dir=True)
+        for i in range(3):
+            image = Image.fromarray(rng.randint(0, 256, (rng.randint(40, 60), 50, 3), dtype=np.uint8))
+            image.save(str(root.join(c).join('{}.png'.format(i))))
+    return str(root)
+
+
+def test_image_folder_cache(tmpdir):
+    root = make_image_folder(tmpdir.join('val'))
+    cache_dir = str(tmpdir.join('cache'))
+    data, index, targets = load_image_folder(root, [32, 32], cache_dir=cache_dir, workers=1)
+    images = dense_images(data, index)
+    assert images.shape == (6, 3, 32, 32) and targets.tolist() == [0, 0, 0, 1, 1, 1]
+    reference = torchvision.datasets.ImageFolder(root, transforms.Compose([
+        transforms.Resize([32, 32]), transforms.PILToTensor()]))
+    assert all(torch.equal(images[i], reference[i][0]) for i in range(6))
+    assert len(os.listdir(cache_dir)) == 3
+    # served from the cache; a new key for other parameters
+    assert torch.equal(load_image_folder(root, [32, 32], cache_dir=cache_dir)[0], data)
+    load_image_folder(root, 36, cache_dir=cache_dir, workers=1)
+    assert len(os.listdir(cache_dir)) == 6
+
+
+def test_ragged_random_crop(tmpdir):
+    root = make_image_folder(tmpdir.join('train'))
+    data, index, _ = load_image_folder(root, 36, cache_dir=str(tmpdir.join('cache')), workers=1)
+    # Resize(36) keeps the aspect ratio
+    assert (index[:, 1:].min(dim=1)[0] == 36).all() and (index[:, 1:].max(dim=1)[0] > 36).any()
+    reference = torchvision.datasets.ImageFolder(root, transforms.Compose([
+        transforms.Resize(36), transforms.PILToTensor()]))
+    # the sample index as the target
+    loader = RaggedTensorLoader(data, index, torch.arange(6), 4, *CIFAR_MEAN_STD, crop=32, shuffle=True, flip=True)
+    assert len(loader) == 2
+    crops = set()
+    for _ in range(5):
+        for x, y in loader:
+            assert x.shape[1:] == (3, 32, 32)
+            x = x * loader.std + loader.mean
+            for xi, yi in zip(x, y.tolist()):
+                # a window of the whole Resize(36) image, flipped or not
+                windows = reference[yi][0].float().unfold(1, 32, 1).unfold(2, 32, 1)
+                windows = windows.permute(1, 2, 0, 3, 4).reshape(-1, 3, 32, 32)
+                match = ((torch.cat([windows, windows.flip(3)]) - xi).abs().amax(dim=(1, 2, 3)) < 1e-3).nonzero()
+                assert match.numel() > 0
+                crops.add((yi, match[0, 0].item() % windows.shape[0]))
+    # not only the center square
+    assert len(crops) > 6
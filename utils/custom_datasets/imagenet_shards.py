@@ -0,0 +1,288 @@
+"""
+ImageNet as pre-decoded, memory-mapped shards: no open() and JPEG decoding per sample and epoch.
+
+Conversion (once):
+    python -m utils.custom_datasets.imagenet_shards /data/imagenet /data/imagenet_shards --train-size 160 -j 32
+<out>/<split>_<i>.npy: uint8 images [n, H, W, 3] (np.save format, opened with mmap_mode='r');
+<out>/<split>_labels.npy: int64 labels of all the shards; <out>/<split>.json: the shards, sizes, classes.
+    train: Resize(train_size) + CenterCrop(train_size), in a random order (every shard mixes the classes);
+    val: Resize(256) + CenterCrop(224), the evaluation reads the images as they are.
+Training: RandomResizedCrop(224) + RandomHorizontalFlip of the stored images, on the whole batch (roi_align).
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+import queue
+import threading
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+import torchvision
+from PIL import Image
+from torchvision.ops import roi_align
+
+__all__ = ['convert_imagenet', 'ImageNetShards', 'ShardSampler', 'ShardLoader', 'get_shard_loaders']
+
+IMAGENET_MEAN_STD = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
+
+
+def _load_resized(args):
+    path, resize, crop = args
+    with open(path, 'rb') as f:
+        image = Image.open(f).convert('RGB')
+    image = torchvision.transforms.CenterCrop(crop)(torchvision.transforms.Resize(resize)(image))
+    return np.asarray(image, dtype=np.uint8)
+
+
+def convert_split(image_root, out_dir, split, resize, crop, shard_size=10000, workers=16, seed=0):
+    dataset = torchvision.datasets.ImageFolder(image_root)
+    samples = list(dataset.samples)
+    if split == 'train':
+        np.random.RandomState(seed).shuffle(samples)
+    labels = np.array([label for _, label in samples], dtype=np.int64)
+    np.save(os.path.join(out_dir, '{}_labels.npy'.format(split)), labels)
+    shards = []
+    with Pool(workers) as pool:
+        for i, begin in enumerate(range(0, len(samples), shard_size)):
+            part = samples[begin:begin + shard_size]
+            file_name = '{}_{}.npy'.format(split, i)
+            shard = np.lib.format.open_memmap(os.path.join(out_dir, file_name), mode='w+', dtype=np.uint8,
+                                              shape=(len(part), crop, crop, 3))
+            for j, image in enumerate(pool.imap(_load_resized, [(path, resize, crop) for path, _ in part],
+                                                chunksize=64)):
+                shard[j] = image
+            shard.flush()
+            del shard
+            shards.append({'file': file_name, 'num': len(part)})
+            print('=> {} shard {}: {}/{}'.format(split, i, begin + len(part), len(samples)))
+    with open(os.path.join(out_dir, '{}.json'.format(split)), 'w') as wf:
+        json.dump({'size': crop, 'resize': resize, 'num': len(samples), 'shards': shards,
+                   'classes': dataset.classes}, wf, indent=2)
+
+
+def convert_imagenet(root, out_dir, train_size=160, shard_size=10000, workers=16):
+    """
+    :param root: the ImageFolder root of ImageNet, with train/ and val/
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    convert_split(os.path.join(root, 'val'), out_dir, 'val', 256, 224, shard_size, workers)
+    convert_split(os.path.join(root, 'train'), out_dir, 'train', train_size, train_size, shard_size, workers)
+
+
+class ImageNetShards(object):
+    """
+    The images of a split, memory-mapped: dataset[i] -> (uint8 [H, W, 3] array view, label)
+    """
+
+    def __init__(self, root, split):
+        with open(os.path.join(root, '{}.json'.format(split))) as rf:
+            meta = json.load(rf)
+        self.size = meta['size']
+        self.classes = meta['classes']
+        self.shards = [np.load(os.path.join(root, shard['file']), mmap_mode='r') for shard in meta['shards']]
+        self.labels = torch.from_numpy(np.load(os.path.join(root, '{}_labels.npy'.format(split))))
+        # first index of every shard
+        self.offsets = [0]
+        for shard in self.shards:
+            self.offsets.append(self.offsets[-1] + shard.shape[0])
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, index):
+        i = bisect.bisect_right(self.offsets, index) - 1
+        return self.shards[i][index - self.offsets[i]], self.labels[index]
+
+    def get_batch(self, indices):
+        """
+        :return: uint8 [n, 3, H, W], labels; one fancy-indexed read per shard, the indices sorted in a shard
+        """
+        indices = np.asarray(indices)
+        shard_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        batch = np.empty((len(indices), self.size, self.size, 3), dtype=np.uint8)
+        for i in np.unique(shard_ids):
+            where = np.nonzero(shard_ids == i)[0]
+            local = indices[where] - self.offsets[i]
+            order = np.argsort(local)
+            batch[where[order]] = self.shards[i][local[order]]
+        return torch.from_numpy(batch).permute(0, 3, 1, 2), self.labels[torch.from_numpy(indices)]
+
+
+class ShardSampler(object):
+    """
+    Shard-aware shuffling, optionally distributed (same interface as DistributedSampler: set_epoch).
+    Every epoch: the shards in a random order, the samples shuffled within windows of `window` consecutive
+    shards; every replica reads a contiguous part of that order, i.e. a few shards.
+    Without set_epoch calls, every iteration is the next epoch.
+    """
+
+    def __init__(self, dataset, num_replicas=None, rank=None, shuffle=True, window=4, seed=0):
+        if num_replicas is None:
+            num_replicas = torch.distributed.get_world_size() if torch.distributed.is_initialized() else 1
+        if rank is None:
+            rank = torch.distributed.get_rank() if torch.distributed.is_initialized() else 0
+        self.offsets = dataset.offsets
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.window = window
+        self.seed = seed
+        self.epoch = 0
+        self._epoch_set = False
+        self.num_samples = math.ceil(self.offsets[-1] / num_replicas)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self._epoch_set = True
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        shards = [torch.arange(b, e) for b, e in zip(self.offsets[:-1], self.offsets[1:])]
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            if not self._epoch_set:
+                self.epoch += 1
+            shards = [shards[i] for i in torch.randperm(len(shards), generator=g)]
+            windows = [torch.cat(shards[i:i + self.window]) for i in range(0, len(shards), self.window)]
+            shards = [w[torch.randperm(len(w), generator=g)] for w in windows]
+        indices = torch.cat(shards)
+        total = self.num_samples * self.num_replicas
+        if total > len(indices):
+            indices = torch.cat([indices, indices[:total - len(indices)]])
+        return iter(indices[self.rank * self.num_samples:(self.rank + 1) * self.num_samples].tolist())
+
+
+class ShardLoader(object):
+    """
+    Batches of an ImageNetShards split, normalized float [n, 3, 224, 224], read by a background thread.
+    train: RandomResizedCrop(crop, scale, ratio) + horizontal flip of the whole batch with one roi_align.
+    """
+
+    def __init__(self, dataset, batch_size, train=False, sampler=None, crop=224, scale=(0.08, 1.0),
+                 ratio=(3. / 4., 4. / 3.), prefetch=2):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.train = train
+        self.sampler = sampler
+        self.crop = crop
+        self.scale = scale
+        self.log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+        self.prefetch = prefetch
+        mean, std = IMAGENET_MEAN_STD
+        self.mean = torch.tensor(mean).view(1, 3, 1, 1) * 255
+        self.std = torch.tensor(std).view(1, 3, 1, 1) * 255
+
+    def __len__(self):
+        num = len(self.sampler) if self.sampler is not None else len(self.dataset)
+        return math.ceil(num / self.batch_size)
+
+    def random_boxes(self, n):
+        """
+        RandomResizedCrop boxes of n images, [n, 5] (index, x1, y1, x2, y2): the 10 attempts of torchvision
+        for all the images at once, the center crop of the largest in-range box when none fits
+        """
+        size = self.dataset.size
+        area = size * size * torch.empty(n, 10).uniform_(*self.scale)
+        aspect = torch.exp(torch.empty(n, 10).uniform_(*self.log_ratio))
+        w = torch.sqrt(area * aspect).round()
+        h = torch.sqrt(area / aspect).round()
+        fits = (w > 0) & (h > 0) & (w <= size) & (h <= size)
+        first = torch.where(fits.any(dim=1), fits.float().argmax(dim=1), torch.full((n,), -1, dtype=torch.long))
+        full = torch.full((n,), float(size))
+        w = torch.where(first >= 0, w.gather(1, first.clamp(min=0).view(-1, 1)).view(-1), full)
+        h = torch.where(first >= 0, h.gather(1, first.clamp(min=0).view(-1, 1)).view(-1), full)
+        x1 = (torch.rand(n) * (size - w + 1)).floor()
+        y1 = (torch.rand(n) * (size - h + 1)).floor()
+        return torch.stack([torch.arange(n, dtype=torch.float), x1, y1, x1 + w, y1 + h], dim=1)
+
+    def transform(self, x):
+        x = x.float()
+        if self.train:
+            x = roi_align(x, self.random_boxes(x.size(0)), output_size=self.crop, sampling_ratio=2, aligned=True)
+            flip = torch.rand(x.size(0)) < 0.5
+            x = torch.where(flip.view(-1, 1, 1, 1), x.flip(3), x)
+        return ((x - self.mean) / self.std).contiguous()
+
+    def _batches(self):
+        indices = list(self.sampler) if self.sampler is not None else list(range(len(self.dataset)))
+        for i in range(0, len(indices), self.batch_size):
+            x, y = self.dataset.get_batch(indices[i:i + self.batch_size])
+            yield self.transform(x), y
+
+    def __iter__(self):
+        if self.prefetch <= 0:
+            yield from self._batches()
+            return
+        batches = queue.Queue(self.prefetch)
+        done = object()
+        stop = threading.Event()
+
+        def put(item):
+            # a consumer that stopped early (break, exception) would leave put() blocked forever
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for batch in self._batches():
+                    if not put(batch):
+                        return
+            except Exception as e:
+                # raised again by the consumer, which would otherwise wait for done forever
+                put(e)
+                return
+            put(done)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            # free the decoded batches, unblock the producer
+            while thread.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+
+def get_shard_loaders(root, batch_size, distributed=False, val_batch_size=64):
+    """
+    :return: train_loader, val_loader, train_sampler
+    """
+    train_set = ImageNetShards(root, 'train')
+    val_set = ImageNetShards(root, 'val')
+    train_sampler = ShardSampler(train_set) if distributed else ShardSampler(train_set, num_replicas=1, rank=0)
+    train_loader = ShardLoader(train_set, batch_size, train=True, sampler=train_sampler)
+    val_loader = ShardLoader(val_set, val_batch_size)
+    return train_loader, val_loader, train_sampler if distributed else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert ImageNet (ImageFolder) to memory-mapped shards')
+    parser.add_argument('root', help='ImageNet root, with train/ and val/')
+    parser.add_argument('out', help='output directory')
+    parser.add_argument('--train-size', default=160, type=int,
+                        help='the train images are stored as Resize(N) + CenterCrop(N) (default: 160)')
+    parser.add_argument('--shard-size', default=10000, type=int, help='images per shard')
+    parser.add_argument('-j', '--workers', default=16, type=int, help='decoding processes')
+    args = parser.parse_args()
+    convert_imagenet(args.root, args.out, args.train_size, args.shard_size, args.workers)
@@ -0,0 +1,107 @@
+"""
+Dataset manifest: the images of an ImageFolder tree and their split, in one .npz file (columns).
+    root: the image root; classes; paths: relative to root; labels: int32; split: int8, index of split_names;
+    meta: json (seed, ratio, stratify ...)
+Written by utils/split_dataset.py; ManifestDataset reads a split without walking the tree.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from torchvision.datasets.folder import IMG_EXTENSIONS, default_loader
+
+__all__ = ['scan_image_folder', 'split_samples', 'save_manifest', 'load_manifest', 'ManifestDataset']
+
+
+def _scan_class(args):
+    root, cls = args
+    paths = []
+    stack = [cls]
+    while stack:
+        rel = stack.pop()
+        for entry in os.scandir(os.path.join(root, rel)):
+            if entry.is_dir():
+                stack.append(os.path.join(rel, entry.name))
+            elif entry.name.lower().endswith(IMG_EXTENSIONS):
+                paths.append(os.path.join(rel, entry.name))
+    return sorted(paths)
+
+
+def scan_image_folder(root, workers=16):
+    """
+    root/<class>/**/<image>, the class directories in parallel.
+    :return: classes, paths relative to root, labels
+    """
+    classes = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+    with ThreadPoolExecutor(max(workers, 1)) as pool:
+        class_paths = list(pool.map(_scan_class, [(root, cls) for cls in classes]))
+    paths = [p for ps in class_paths for p in ps]
+    labels = np.concatenate([np.full(len(ps), i, dtype=np.int32) for i, ps in enumerate(class_paths)])
+    return classes, paths, labels
+
+
+def split_samples(labels, ratio=5, stratify=True, seed=None):
+    """
+    1/ratio of the samples go to the validation split (1), of every class when stratify.
+    :param seed: random samples; None: every ratio-th sample (of a class)
+    :return: int8 split ids
+    """
+    split = np.zeros(len(labels), dtype=np.int8)
+    groups = [np.nonzero(labels == c)[0] for c in np.unique(labels)] if stratify else [np.arange(len(labels))]
+    rng = np.random.RandomState(seed) if seed is not None else None
+    for index in groups:
+        if rng is not None:
+            index = index[rng.permutation(len(index))]
+        split[index[::ratio]] = 1
+    return split
+
+
+def save_manifest(file_name, root, classes, paths, labels, split, split_names=('train', 'val'), **meta):
+    np.savez_compressed(file_name, root=np.array(os.path.abspath(root)), classes=np.array(classes),
+                        paths=np.array(paths), labels=np.asarray(labels, dtype=np.int32),
+                        split=np.asarray(split, dtype=np.int8), split_names=np.array(split_names),
+                        meta=np.array(json.dumps(meta)))
+
+
+def load_manifest(file_name):
+    with np.load(file_name) as manifest:
+        result = {k: manifest[k] for k in manifest.files}
+    result['root'] = str(result['root'])
+    result['classes'] = result['classes'].tolist()
+    result['split_names'] = result['split_names'].tolist()
+    result['meta'] = json.loads(str(result['meta']))
+    return result
+
+
+class ManifestDataset(torch.utils.data.Dataset):
+    """
+    A split of a manifest, with the attributes of ImageFolder (classes, class_to_idx, samples, targets).
+    """
+
+    def __init__(self, manifest, split='train', transform=None, target_transform=None, loader=default_loader):
+        if not isinstance(manifest, dict):
+            manifest = load_manifest(manifest)
+        split_id = manifest['split_names'].index(split)
+        index = np.nonzero(manifest['split'] == split_id)[0]
+        root = manifest['root']
+        self.classes = manifest['classes']
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        self.targets = manifest['labels'][index].tolist()
+        self.samples = [(os.path.join(root, p), t) for p, t in zip(manifest['paths'][index].tolist(), self.targets)]
+        self.transform = transform
+        self.target_transform = target_transform
+        self.loader = loader
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        path, target = self.samples[index]
+        sample = self.loader(path)
+        if self.transform is not None:
+            sample = self.transform(sample)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return sample, target
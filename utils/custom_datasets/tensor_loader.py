@@ -0,0 +1,259 @@
+"""
+Small-image datasets (CIFAR, SVHN, MNIST) held in memory as one uint8 tensor, with the augmentation of
+the whole mini-batch as tensor operations: no worker processes, no per-sample PIL transforms.
+
+The batches match the torchvision pipelines of the example scripts:
+Resize (once, when loading) -> RandomCrop(size, padding) -> RandomHorizontalFlip -> ToTensor -> Normalize.
+
+Image folders (Caltech101, Flower102) are decoded and resized once into a cache file per split, keyed by the
+modification times of the folder and the resize parameters. Resize(36) keeps the aspect ratio, so the images are
+stored as one flat uint8 array with an (offset, height, width) index, and RandomCrop(32) draws its window in the
+whole resized image, as the JPEG pipeline.
+"""
+import hashlib
+import json
+import math
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torchvision
+from PIL import Image
+
+__all__ = ['TensorLoader', 'RaggedTensorLoader', 'load_tensor_dataset', 'get_tensor_loaders', 'TENSOR_DATASETS',
+           'load_image_folder', 'get_image_folder_loaders', 'IMAGE_FOLDER_DATASETS']
+
+CIFAR_MEAN_STD = ((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010))
+# name: mean, std, stored size of the train/test images, train augmentation (crop, padding, flip)
+TENSOR_DATASETS = {
+    'cifar10': (CIFAR_MEAN_STD, (32, 32), {'crop': 32, 'padding': 4, 'flip': True}),
+    'cifar10_positive_shift': (((0, 0, 0), (0.25, 0.25, 0.25)), (32, 32), {'crop': 32, 'padding': 4, 'flip': True}),
+    'cifar100': (CIFAR_MEAN_STD, (32, 32), {'crop': 32, 'padding': 4, 'flip': True}),
+    'svhn': (CIFAR_MEAN_STD, (36, 32), {'crop': 32, 'padding': 0, 'flip': True}),
+    'mnist': (((0.1307,), (0.3081,)), (32, 32), {}),
+}
+# name: train and val folders, train resize (Resize(36), the shorter side), val resize (Resize([32, 32])),
+# train augmentation
+IMAGE_FOLDER_DATASETS = {
+    'caltech101': (('train', 'val'), 36, [32, 32], {'crop': 32, 'flip': True}),
+    'flower102': (('train', 'test'), 36, [32, 32], {'crop': 32, 'flip': True}),
+}
+DEFAULT_IMAGE_CACHE = '~/.cache/image_folder_cache'
+
+
+def load_tensor_dataset(name, root, train, size=None, download=True):
+    """
+    :param size: the images are resized once to size x size (bilinear, antialiased as PIL)
+    :return: uint8 images [N, C, H, W] in shared memory, int64 targets [N]
+    """
+    if name in ('cifar10', 'cifar10_positive_shift', 'cifar100'):
+        dataset_type = torchvision.datasets.CIFAR100 if name == 'cifar100' else torchvision.datasets.CIFAR10
+        dataset = dataset_type(root=root, train=train, download=download)
+        data = torch.from_numpy(dataset.data).permute(0, 3, 1, 2)
+        targets = torch.tensor(dataset.targets)
+    elif name == 'svhn':
+        dataset = torchvision.datasets.SVHN(root, split='train' if train else 'test', download=download)
+        data = torch.from_numpy(dataset.data)
+        targets = torch.from_numpy(dataset.labels)
+    elif name == 'mnist':
+        dataset = torchvision.datasets.MNIST(root, train=train, download=download)
+        data = dataset.data.unsqueeze(1)
+        targets = dataset.targets
+    else:
+        raise NotImplementedError(name)
+    if size is not None and tuple(data.shape[2:]) != (size, size):
+        resized = []
+        for chunk in data.split(4096):
+            chunk = F.interpolate(chunk.float(), size=(size, size), mode='bilinear', align_corners=False,
+                                  antialias=True)
+            resized.append(chunk.round_().clamp_(0, 255).to(torch.uint8))
+        data = torch.cat(resized)
+    return data.contiguous().share_memory_(), targets.long().contiguous().share_memory_()
+
+
+def _folder_mtime(root):
+    # adding/removing an image changes the mtime of its class folder
+    return max(os.path.getmtime(d) for d in [root] + [e.path for e in os.scandir(root) if e.is_dir()])
+
+
+def _load_resized(args):
+    path, resize = args
+    with open(path, 'rb') as f:
+        image = torchvision.transforms.Resize(resize)(Image.open(f).convert('RGB'))
+    return np.asarray(image, dtype=np.uint8)
+
+
+def load_image_folder(root, resize, cache_dir=DEFAULT_IMAGE_CACHE, workers=8):
+    """
+    ImageFolder images after Resize(resize), decoded once and cached as <cache_dir>/<key>.npy (the HWC bytes of
+    all the images, one after the other), <key>_index.npy and <key>_targets.npy.
+    :return: flat uint8 images, int64 index [N, 3] (offset, height, width), int64 targets [N], in shared memory
+    """
+    root = os.path.abspath(root)
+    cache_dir = os.path.expanduser(cache_dir)
+    key = hashlib.sha1(json.dumps({'root': root, 'mtime': _folder_mtime(root), 'resize': resize,
+                                   'layout': 'flat'}).encode()).hexdigest()
+    files = [os.path.join(cache_dir, key + suffix) for suffix in ('.npy', '_index.npy', '_targets.npy')]
+    if not all(os.path.exists(f) for f in files):
+        print('=> resizing {} into {}'.format(root, files[0]))
+        dataset = torchvision.datasets.ImageFolder(root)
+        with Pool(workers) as pool:
+            images = pool.map(_load_resized, [(path, resize) for path, _ in dataset.samples], chunksize=64)
+        shapes = np.array([image.shape[:2] for image in images], dtype=np.int64).reshape(-1, 2)
+        sizes = shapes.prod(axis=1) * 3
+        index = np.concatenate([(np.cumsum(sizes) - sizes).reshape(-1, 1), shapes], axis=1)
+        os.makedirs(cache_dir, exist_ok=True)
+        # write then rename, the images last: a concurrent or killed run never reads a partial cache
+        for file_name, array in zip(files[::-1], (np.array(dataset.targets, dtype=np.int64), index,
+                                                  np.concatenate([image.reshape(-1) for image in images]))):
+            with open(file_name + '.tmp', 'wb') as wf:
+                np.save(wf, array)
+            os.replace(file_name + '.tmp', file_name)
+    data, index, targets = [torch.from_numpy(np.load(f)) for f in files]
+    return data.share_memory_(), index.share_memory_(), targets.share_memory_()
+
+
+def dense_images(data, index):
+    """:return: uint8 [N, C, H, W] of images of the same size"""
+    assert (index[:, 1:] == index[0, 1:]).all(), 'The images have different sizes'
+    h, w = index[0, 1:].tolist()
+    return data.view(-1, h, w, 3).permute(0, 3, 1, 2).contiguous()
+
+
+class TensorLoader(object):
+    """
+    Iterates (input, target) batches of an in-memory uint8 dataset, like a DataLoader.
+    Augmentation of a batch, one random draw per image:
+        zero padding + random crop (as transforms.RandomCrop(crop, padding)), horizontal flip (p=0.5),
+    then x / 255, normalized.
+    """
+
+    def __init__(self, data, targets, batch_size, mean, std, shuffle=False, crop=None, padding=0, flip=False,
+                 drop_last=False, sampler=None, generator=None):
+        """
+        :param data: uint8 [N, C, H, W]
+        :param sampler: e.g. DistributedSampler, replaces shuffle
+        """
+        self.data = data
+        self.targets = targets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.crop = crop
+        self.padding = padding
+        self.flip = flip
+        self.drop_last = drop_last
+        self.sampler = sampler
+        self.generator = generator
+        self.mean = torch.tensor(mean, dtype=torch.float).view(1, -1, 1, 1) * 255
+        self.std = torch.tensor(std, dtype=torch.float).view(1, -1, 1, 1) * 255
+
+    def _num_samples(self):
+        return len(self.sampler) if self.sampler is not None else self.targets.size(0)
+
+    def __len__(self):
+        if self.drop_last:
+            return self._num_samples() // self.batch_size
+        return math.ceil(self._num_samples() / self.batch_size)
+
+    def _indices(self):
+        if self.sampler is not None:
+            return torch.tensor(list(self.sampler), dtype=torch.long)
+        if self.shuffle:
+            return torch.randperm(self.targets.size(0), generator=self.generator)
+        return torch.arange(self.targets.size(0))
+
+    def _random_crop(self, x):
+        (n, c, h, w) = x.shape
+        if self.padding > 0:
+            x = F.pad(x, (self.padding,) * 4)
+        crop = self.crop
+        top = torch.randint(0, x.size(2) - crop + 1, (n, 1), generator=self.generator) + torch.arange(crop)
+        left = torch.randint(0, x.size(3) - crop + 1, (n, 1), generator=self.generator) + torch.arange(crop)
+        # [n, crop, crop, c] -> [n, c, crop, crop]
+        x = x.permute(0, 2, 3, 1)[torch.arange(n).view(n, 1, 1), top.view(n, crop, 1), left.view(n, 1, crop)]
+        return x.permute(0, 3, 1, 2)
+
+    def transform(self, x):
+        """
+        :param x: uint8 batch
+        """
+        x = x.float()
+        if self.crop is not None:
+            x = self._random_crop(x)
+        if self.flip:
+            flip = torch.rand(x.size(0), generator=self.generator) < 0.5
+            x = torch.where(flip.view(-1, 1, 1, 1), x.flip(3), x)
+        return ((x - self.mean) / self.std).contiguous()
+
+    def batch(self, index):
+        """:return: the uint8 images of index"""
+        return self.data[index]
+
+    def __iter__(self):
+        indices = self._indices()
+        for i in range(len(self)):
+            index = indices[i * self.batch_size:(i + 1) * self.batch_size]
+            yield self.transform(self.batch(index)), self.targets[index]
+
+
+class RaggedTensorLoader(TensorLoader):
+    """
+    TensorLoader of images of different sizes (see load_image_folder): the random crop (transforms.RandomCrop(crop),
+    no padding) of every image is gathered from the flat array, then flip and normalization as TensorLoader.
+    """
+
+    def __init__(self, data, index, targets, batch_size, mean, std, crop, **kwargs):
+        """
+        :param data: flat uint8 HWC images
+        :param index: [N, 3] (offset, height, width) of every image, height and width >= crop
+        """
+        super(RaggedTensorLoader, self).__init__(data, targets, batch_size, mean, std, **kwargs)
+        self.index = index
+        self.crop_size = crop
+
+    def batch(self, index):
+        offset, h, w = self.index[index].unbind(1)
+        n, crop = index.numel(), self.crop_size
+        top = (torch.rand(n, generator=self.generator) * (h - crop + 1)).long()
+        left = (torch.rand(n, generator=self.generator) * (w - crop + 1)).long()
+        rows = (top.view(n, 1) + torch.arange(crop)).view(n, crop, 1)
+        columns = (left.view(n, 1) + torch.arange(crop)).view(n, 1, crop)
+        # [n, crop, crop, 3] byte positions
+        pixels = offset.view(n, 1, 1) + (rows * w.view(n, 1, 1) + columns) * 3
+        return self.data[pixels.unsqueeze(-1) + torch.arange(3)].permute(0, 3, 1, 2)
+
+
+def get_tensor_loaders(name, root, batch_size, distributed=False, download=True):
+    """
+    The in-memory counterpart of the train/val DataLoaders of the example scripts.
+    :return: train_loader, val_loader, train_sampler
+    """
+    (mean, std), (train_size, test_size), augment = TENSOR_DATASETS[name]
+    train_data, train_targets = load_tensor_dataset(name, root, True, train_size, download)
+    val_data, val_targets = load_tensor_dataset(name, root, False, test_size, download)
+    train_sampler = None
+    if distributed:
+        train_sampler = torch.utils.data.distributed.DistributedSampler(train_targets)
+    train_loader = TensorLoader(train_data, train_targets, batch_size, mean, std, shuffle=(train_sampler is None),
+                                sampler=train_sampler, **augment)
+    val_loader = TensorLoader(val_data, val_targets, batch_size, mean, std)
+    return train_loader, val_loader, train_sampler
+
+
+def get_image_folder_loaders(name, root, batch_size, cache_dir=DEFAULT_IMAGE_CACHE, workers=8):
+    """
+    The cached counterpart of the caltech101/flower102 DataLoaders of DataloaderFactory.
+    :return: train_loader, val_loader
+    """
+    (train_dir, val_dir), train_resize, val_resize, augment = IMAGE_FOLDER_DATASETS[name]
+    mean, std = CIFAR_MEAN_STD
+    train_data, train_index, train_targets = load_image_folder(os.path.join(root, train_dir), train_resize,
+                                                               cache_dir=cache_dir, workers=workers)
+    val_data, val_index, val_targets = load_image_folder(os.path.join(root, val_dir), val_resize,
+                                                         cache_dir=cache_dir, workers=workers)
+    train_loader = RaggedTensorLoader(train_data, train_index, train_targets, batch_size, mean, std, shuffle=True,
+                                      **augment)
+    val_loader = TensorLoader(dense_images(val_data, val_index), val_targets, batch_size, mean, std)
+    return train_loader, val_loader
@@ -0,0 +1,163 @@
+"""
+A SummaryWriter that writes on a background thread, behind a bounded queue:
+    per-tag sampling (every n-th call of the tags matching a pattern), histograms of at most
+    `histogram_samples` random values, and a cap of the event file size (nothing is written above it).
+The training thread never waits for the host copy of a tensor or the file writes; events are dropped
+(and counted) when the queue is full.
+"""
+import atexit
+import fnmatch
+import glob
+import os
+import queue
+import threading
+
+import torch
+from tensorboardX import SummaryWriter
+
+__all__ = ['AsyncSummaryWriter', 'parse_sample_rates']
+
+_UNTAGGED = ('add_graph', 'add_onnx_graph', 'add_hparams', 'add_custom_scalars', 'add_custom_scalars_marginchart',
+             'add_custom_scalars_multilinechart')
+
+
+def parse_sample_rates(specs):
+    """
+    :param specs: ['train/*=10', 'profile/*=5'], fnmatch pattern = every n-th call
+    """
+    rates = {}
+    for spec in specs or []:
+        pattern, every = spec.rsplit('=', 1)
+        rates[pattern] = int(every)
+    return rates
+
+
+def _detach(value):
+    # the tensor may change in place before the background thread reads it
+    if torch.is_tensor(value):
+        return value.detach().clone()
+    return value
+
+
+def _to_host(value):
+    if torch.is_tensor(value):
+        value = value.cpu()
+        return value.item() if value.numel() == 1 else value.numpy()
+    return value
+
+
+class AsyncSummaryWriter(object):
+    """
+    add_* calls as SummaryWriter (tensorboardX), other attributes of the underlying writer.
+    max_bytes: above it, every event is dropped (checked every `check_every` writes, the files may exceed it by
+    that many events).
+    """
+
+    def __init__(self, log_dir, queue_size=1000, sample_rates=None, histogram_samples=10000, max_bytes=None,
+                 check_every=200, **kwargs):
+        # the size cap counts the event files of this writer only
+        self._existing = set(glob.glob(os.path.join(log_dir, 'events.out.tfevents.*')))
+        self.writer = SummaryWriter(log_dir, **kwargs)
+        self.log_dir = log_dir
+        self.sample_rates = sample_rates or {}
+        self.histogram_samples = histogram_samples
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self.calls = {}
+        self.dropped = 0
+        self.over_size = False
+        self._written = 0
+        self._queue = queue.Queue(queue_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _keep(self, tag):
+        for pattern, every in self.sample_rates.items():
+            if fnmatch.fnmatch(tag, pattern):
+                count = self.calls.get(tag, 0)
+                self.calls[tag] = count + 1
+                return count % every == 0
+        return True
+
+    def _put(self, item):
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def add_scalar(self, tag, scalar_value, global_step=None, walltime=None):
+        if self._keep(tag) and not self.over_size:
+            self._put(('add_scalar', (tag, _detach(scalar_value), global_step, walltime), {}))
+
+    def add_histogram(self, tag, values, global_step=None, bins='tensorflow', walltime=None, max_bins=None):
+        if not self._keep(tag) or self.over_size:
+            return
+        if torch.is_tensor(values):
+            values = values.detach().flatten()
+            if self.histogram_samples is not None and values.numel() > self.histogram_samples:
+                values = values[torch.randint(values.numel(), (self.histogram_samples,), device=values.device)]
+            else:
+                values = values.clone()
+        self._put(('add_histogram', (tag, values, global_step, bins, walltime, max_bins), {}))
+
+    def __getattr__(self, name):
+        if name == 'writer':
+            raise AttributeError(name)
+        attr = getattr(self.writer, name)
+        # add_graph, add_hparams ...: no tag, written on the calling thread
+        if not name.startswith('add_') or name in _UNTAGGED:
+            return attr
+
+        def add(tag, *args, **kwargs):
+            if self._keep(tag) and not self.over_size:
+                self._put((name, (tag,) + tuple(_detach(a) for a in args), kwargs))
+
+        return add
+
+    def _size(self):
+        self.writer.flush()
+        files = set(glob.glob(os.path.join(self.log_dir, 'events.out.tfevents.*'))) - self._existing
+        return sum(os.path.getsize(f) for f in files)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            name, args, kwargs = item
+            try:
+                if self.over_size:
+                    continue
+                getattr(self.writer, name)(*[_to_host(a) for a in args], **kwargs)
+                self._written += 1
+                if self.max_bytes is not None and self._written % self.check_every == 0:
+                    if self._size() >= self.max_bytes:
+                        self.over_size = True
+                        print('=> {}: the event files reached {} bytes, no more events are written'.format(
+                            self.log_dir, self.max_bytes))
+            except Exception as e:
+                print('=> {} {} failed: {}'.format(name, args[0], e))
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """
+        waits for the queued events and flushes the event file
+        """
+        self._queue.join()
+        self.writer.flush()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.close()
+        if self.dropped > 0:
+            print('=> {}: {} events dropped (queue full)'.format(self.log_dir, self.dropped))
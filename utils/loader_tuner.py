@@ -0,0 +1,112 @@
+"""
+Data loading throughput of a DataLoader (no model) for several num_workers/prefetch_factor/persistent_workers,
+and the best settings per host and dataset in ~/.cache/loader_tune.json (see --tune-loader).
+"""
+import json
+import os
+import resource
+import socket
+import time
+
+import torch
+
+__all__ = ['DEFAULT_TUNE_FILE', 'sweep_configs', 'measure_loader', 'tune_loader', 'load_tuned', 'save_tuned']
+
+DEFAULT_TUNE_FILE = '~/.cache/loader_tune.json'
+
+
+def sweep_configs(max_workers=None, prefetch_factors=(2, 4)):
+    """
+    num_workers: 0 and the powers of 2 up to the CPU count; prefetch_factor and persistent_workers with workers
+    """
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    workers = [0]
+    while workers[-1] * 2 <= max_workers:
+        workers.append(max(workers[-1] * 2, 1))
+    if workers[-1] != max_workers:
+        workers.append(max_workers)
+    configs = [{'num_workers': 0}]
+    for w in workers[1:]:
+        for prefetch_factor in prefetch_factors:
+            for persistent_workers in (False, True):
+                configs.append({'num_workers': w, 'prefetch_factor': prefetch_factor,
+                                'persistent_workers': persistent_workers})
+    return configs
+
+
+def _cpu_time():
+    # the workers are children; they are counted once joined
+    return sum(getattr(resource.getrusage(who), k) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+               for k in ('ru_utime', 'ru_stime'))
+
+
+def measure_loader(make_loader, batches=50, epochs=2):
+    """
+    `epochs` passes of `batches` batches, worker startup included (persistent_workers saves it after the first).
+    :param make_loader: returns a new DataLoader, dropped after the measurement
+    :return: samples/s, CPU utilization (1: all the cores busy)
+    """
+    cpu_begin, begin = _cpu_time(), time.perf_counter()
+    loader = make_loader()
+    samples = 0
+    for _ in range(epochs):
+        for i, data in enumerate(loader):
+            samples += len(data[0])
+            if i + 1 >= batches:
+                break
+    wall = time.perf_counter() - begin
+    # the last reference: the (persistent) workers shut down before their CPU time is read
+    del loader
+    return samples / wall, (_cpu_time() - cpu_begin) / (wall * os.cpu_count())
+
+
+def tune_loader(loader, configs=None, batches=50, epochs=2, pin_memory=None, verbose=True):
+    """
+    :param loader: a DataLoader, its dataset, batch size, sampler and collate_fn are kept
+    :return: the best settings (DataLoader keyword arguments), the results of all the configs
+    """
+    configs = sweep_configs() if configs is None else configs
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    results = []
+    for config in configs:
+        kwargs = dict(config, pin_memory=pin_memory)
+        samples_per_s, cpu_util = measure_loader(
+            lambda: torch.utils.data.DataLoader(loader.dataset, batch_size=loader.batch_size, sampler=loader.sampler,
+                                                collate_fn=loader.collate_fn, drop_last=loader.drop_last, **kwargs),
+            batches, epochs)
+        results.append(dict(kwargs, samples_per_s=samples_per_s, cpu_util=cpu_util))
+        if verbose:
+            print('workers {:>3} prefetch {:>2} persistent {:<5}: {:>10.1f} samples/s, CPU {:>5.1%}'.format(
+                config['num_workers'], config.get('prefetch_factor', '-'), str(config.get('persistent_workers', '-')),
+                samples_per_s, cpu_util))
+    best = max(results, key=lambda r: r['samples_per_s'])
+    settings = {k: v for k, v in best.items() if k not in ('samples_per_s', 'cpu_util')}
+    return settings, results
+
+
+def _read(path):
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as rf:
+        return json.load(rf)
+
+
+def load_tuned(dataset, path=DEFAULT_TUNE_FILE):
+    """
+    :return: the saved DataLoader settings of dataset on this host, or None
+    """
+    entry = _read(path).get(socket.gethostname(), {}).get(dataset)
+    return None if entry is None else entry['settings']
+
+
+def save_tuned(dataset, settings, results=None, path=DEFAULT_TUNE_FILE, **info):
+    tuned = _read(path)
+    tuned.setdefault(socket.gethostname(), {})[dataset] = dict(info, settings=settings, results=results,
+                                                               cpu_count=os.cpu_count())
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as wf:
+        json.dump(tuned, wf, indent=2)
+    os.replace(path + '.tmp', path)
@@ -1 +1,2 @@
-from .flops_counter import get_model_complexity_info
+from .flops_counter import get_model_complexity_info, get_model_complexity_info_meta
+from .npu_cost import get_npu_cost, get_default_npu_config, group_cycles
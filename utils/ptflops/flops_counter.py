@@ -7,6 +7,8 @@ Copyright (C) 2019 Sovrasov V. - All Rights Reserved
 '''
 
 import sys
+import copy
+import itertools
 import math
 from functools import partial
 
@@ -14,6 +16,7 @@ import torch
 import torch.nn as nn
 import numpy as np
 import models._modules as my_nn
+from .npu_cost import group_cycles
 
 
 def get_model_complexity_info(model, input_res,
@@ -21,7 +24,14 @@ def get_model_complexity_info(model, input_res,
                               as_strings=True,
                               input_constructor=None, ost=sys.stdout,
                               verbose=False, ignore_modules=[],
-                              custom_modules_hooks={}):
+                              custom_modules_hooks={}, with_bops=False):
+    """
+    MACs of the conv/linear/rnn layers are effective MACs: scaled by the density of the kept weights
+    (the mask of Conv2dSQ/Conv2dNPU, the zeros of the ternary weights).
+    BOPs (bit operations) = effective MACs * weight bits * input activation bits,
+    32 bits for what is not quantized.
+    :param with_bops: also return the BOPs
+    """
     assert type(input_res) is tuple
     assert len(input_res) >= 1
     assert isinstance(model, nn.Module)
@@ -43,17 +53,84 @@ def get_model_complexity_info(model, input_res,
 
         _ = flops_model(batch)
     flops_count, params_count = flops_model.compute_average_flops_cost()
+    bops_count = flops_model.compute_average_bops_cost()
     if print_per_layer_stat:
         print_model_with_flops(flops_model, flops_count, params_count, ost=ost)
     flops_model.stop_flops_count()
     CUSTOM_MODULES_MAPPING = {}
 
     if as_strings:
+        if with_bops:
+            return flops_to_string(flops_count), params_to_string(params_count), bops_to_string(bops_count)
         return flops_to_string(flops_count), params_to_string(params_count)
 
+    if with_bops:
+        return flops_count, params_count, bops_count
     return flops_count, params_count
 
 
+def meta_copy(model):
+    """
+    A copy of model on the meta device: its parameters, buffers and tensor attributes only have shapes,
+    no memory is allocated and no data is copied. The quantizers of the copy are marked initialized, so their
+    lazy init does not run. Every module of the copy refers to its source module (masks, ternary weights).
+    """
+    memo = {}
+    for m in model.modules():
+        for t in itertools.chain(m._parameters.values(), m._buffers.values(), vars(m).values()):
+            if isinstance(t, torch.Tensor) and id(t) not in memo:
+                meta = torch.empty_like(t, device='meta')
+                memo[id(t)] = nn.Parameter(meta, t.requires_grad) if isinstance(t, nn.Parameter) else meta
+    meta_model = copy.deepcopy(model, memo)
+    for src, m in zip(model.modules(), meta_model.modules()):
+        # not a submodule
+        m.__dict__['_ptflops_source'] = src
+        if isinstance(m, my_nn._InitStateMixin):
+            m.initialized = True
+        if hasattr(m, 'init_flags'):  # Conv2dSQ
+            m.init_flags = [True] * len(m.init_flags)
+        if isinstance(m, my_nn.TSVDLinear) and m.U is None:
+            k = int(m.weight.size(0) * m.preserve_ratio)
+            m.U = torch.empty(m.out_features, k, device='meta')
+            m.SV = torch.empty(k, m.in_features, device='meta')
+    return meta_model
+
+
+def _source(module):
+    return module.__dict__.get('_ptflops_source', module)
+
+
+def get_model_complexity_info_meta(model, input_res, print_per_layer_stat=True, as_strings=True, ost=sys.stdout,
+                                   verbose=False, ignore_modules=[], custom_modules_hooks={}):
+    """
+    get_model_complexity_info without a real forward: the forward of a meta_copy of model only propagates the shapes.
+    model is not modified (no lazy init of the quantizers) and no feature map is allocated.
+    :return: flops, params, bops, activation memory (the outputs of all leaf modules, quantized outputs at their bits)
+    """
+    meta_model = meta_copy(model)
+    act_bytes = [0]
+
+    def act_memory_hook(module, input, output):
+        nbits = act_quantizer_bits(_source(module)) or 32
+        for out in (output if isinstance(output, (list, tuple)) else [output]):
+            if isinstance(out, torch.Tensor):
+                act_bytes[0] += out.numel() * nbits / 8
+
+    handles = [m.register_forward_hook(act_memory_hook) for m in meta_model.modules() if len(m._modules) == 0]
+    try:
+        with torch.no_grad():
+            result = get_model_complexity_info(meta_model, input_res, print_per_layer_stat=print_per_layer_stat,
+                                               as_strings=as_strings, ost=ost, verbose=verbose,
+                                               ignore_modules=ignore_modules, custom_modules_hooks=custom_modules_hooks,
+                                               with_bops=True)
+    finally:
+        for handle in handles:
+            handle.remove()
+    if as_strings:
+        return (*result, str(round(act_bytes[0] / 2 ** 20, 2)) + ' MB')
+    return (*result, act_bytes[0])
+
+
 def flops_to_string(flops, units='GMac', precision=2):
     if units is None:
         if flops // 10 ** 9 > 0:
@@ -75,6 +152,10 @@ def flops_to_string(flops, units='GMac', precision=2):
             return str(flops) + ' Mac'
 
 
+def bops_to_string(bops, precision=2):
+    return str(round(bops / 10. ** 9, precision)) + ' GBOPs'
+
+
 def params_to_string(params_num, units=None, precision=2):
     if units is None:
         if params_num // 10 ** 6 > 0:
@@ -112,6 +193,15 @@ def print_model_with_flops(model, total_flops, total_params, units='GMac',
                 sum += m.accumulate_flops()
             return sum
 
+    def accumulate_bops(self):
+        if is_supported_instance(self):
+            return self.__bops__ / model.__batch_counter__
+        else:
+            sum = 0
+            for m in self.children():
+                sum += m.accumulate_bops()
+            return sum
+
     def flops_repr(self):
         accumulated_params_num = self.accumulate_params()
         accumulated_flops_cost = self.accumulate_flops()
@@ -119,10 +209,12 @@ def print_model_with_flops(model, total_flops, total_params, units='GMac',
                           '{:.3%} Params'.format(accumulated_params_num / total_params),
                           flops_to_string(accumulated_flops_cost, units=units, precision=precision),
                           '{:.3%} MACs'.format(accumulated_flops_cost / total_flops),
+                          bops_to_string(self.accumulate_bops(), precision=precision),
                           self.original_extra_repr()])
 
     def add_extra_repr(m):
         m.accumulate_flops = accumulate_flops.__get__(m)
+        m.accumulate_bops = accumulate_bops.__get__(m)
         m.accumulate_params = accumulate_params.__get__(m)
         flops_extra_repr = flops_repr.__get__(m)
         if m.extra_repr != flops_extra_repr:
@@ -136,6 +228,8 @@ def print_model_with_flops(model, total_flops, total_params, units='GMac',
             del m.original_extra_repr
         if hasattr(m, 'accumulate_flops'):
             del m.accumulate_flops
+        if hasattr(m, 'accumulate_bops'):
+            del m.accumulate_bops
 
     model.apply(add_extra_repr)
     print(model, file=ost)
@@ -153,38 +247,23 @@ def get_model_parameters_number(model):
             params_num += module.weight.numel() * (1 - module.sparsity) * nbits_w / 8
             if module.bias is not None:
                 params_num += module.bias.numel()
-            mask = module.mask
-            (out_channel, in_channel, k, k) = mask.shape
-            part_out_channel = math.ceil(out_channel / pe_size)
-            part_in_channel = math.ceil(in_channel / pe_size)
-            for i in range(part_out_channel):
-                for j in range(part_in_channel):
-                    mask_part = mask[i * pe_size:(i + 1) * pe_size, j * pe_size: (j + 1) * pe_size, :, :]
-                    # out, in, k, k
-                    cycles = mask_part.sum(axis=1).max(axis=0)[0]
-                    cycles = torch.where(cycles < 7, torch.zeros_like(cycles).fill_(7), cycles)
-                    group_cycle += cycles.sum().item()
-                    group_num += cycles.numel()
+            mask = _source(module).mask
+            if mask is not None and not mask.is_meta:
+                cycles = group_cycles(mask, pe_size)
+                group_cycle += cycles.sum().item()
+                group_num += cycles.numel()
 
         elif isinstance(module, my_nn.Conv2dNPU):
-            mask = module.mask
-            (out_channel, in_channel, k, k) = mask.shape
-            part_out_channel = math.ceil(out_channel / pe_size)
-            part_in_channel = math.ceil(in_channel / pe_size)
-            for i in range(part_out_channel):
-                for j in range(part_in_channel):
-                    mask_part = mask[i * pe_size:(i + 1) * pe_size, j * pe_size: (j + 1) * pe_size, :, :]
-                    # out, in, k, k
-                    cycles = mask_part.sum(axis=1).max(axis=0)[0]
-                    cycles = torch.where(cycles < 7, torch.zeros_like(cycles).fill_(7), cycles)
-                    group_cycle += cycles.sum().item()
-                    group_num += cycles.numel()
+            if not _source(module).mask.is_meta:
+                cycles = group_cycles(_source(module).mask, pe_size)
+                group_cycle += cycles.sum().item()
+                group_num += cycles.numel()
             params_num += module.weight.numel()
             if module.bias is not None:
                 params_num += module.bias.numel()
         elif isinstance(module, nn.Conv2d) or isinstance(module, nn.BatchNorm2d) or isinstance(module, nn.Linear):
             params_num += sum(p.numel() for p in module.parameters() if p.requires_grad)
-    # todo: return cycle
+    # per-layer cycles and latency: get_npu_cost
     if group_num > 0:
         print('group_cycle: {} group_num: {}, ave: {}'.format(group_cycle, group_num, group_cycle / group_num))
     return params_num
@@ -197,6 +276,7 @@ def add_flops_counting_methods(net_main_module):
     net_main_module.stop_flops_count = stop_flops_count.__get__(net_main_module)
     net_main_module.reset_flops_count = reset_flops_count.__get__(net_main_module)
     net_main_module.compute_average_flops_cost = compute_average_flops_cost.__get__(net_main_module)
+    net_main_module.compute_average_bops_cost = compute_average_bops_cost.__get__(net_main_module)
 
     net_main_module.reset_flops_count()
 
@@ -219,6 +299,19 @@ def compute_average_flops_cost(self):
     return flops_sum / batches_count, params_sum
 
 
+def compute_average_bops_cost(self):
+    """
+    A method that will be available after add_flops_counting_methods() is called
+    on a desired net object.
+    Returns current mean bit operations per image.
+    """
+    bops_sum = 0
+    for module in self.modules():
+        if is_supported_instance(module):
+            bops_sum += module.__bops__
+    return bops_sum / self.__batch_counter__
+
+
 def start_flops_count(self, **kwargs):
     """
     A method that will be available after add_flops_counting_methods() is called
@@ -229,6 +322,8 @@ def start_flops_count(self, **kwargs):
     add_batch_counter_hook_function(self)
 
     seen_types = set()
+    # the bits of the last activation quantizer of the current forward
+    state = {'nbits_a': 32}
 
     def add_flops_counter_hook_function(module, ost, verbose, ignore_list):
         if type(module) in ignore_list:
@@ -238,11 +333,9 @@ def start_flops_count(self, **kwargs):
         elif is_supported_instance(module):
             if hasattr(module, '__flops_handle__'):
                 return
-            if type(module) in CUSTOM_MODULES_MAPPING:
-                handle = module.register_forward_hook(CUSTOM_MODULES_MAPPING[type(module)])
-            else:
-                handle = module.register_forward_hook(MODULES_MAPPING[type(module)])
+            handle = module.register_forward_hook(get_flops_hook(module))
             module.__flops_handle__ = handle
+            module.__nbits_a_handle__ = module.register_forward_pre_hook(partial(input_bits_pre_hook, state=state))
             seen_types.add(type(module))
         else:
             if verbose and not type(module) in (nn.Sequential, nn.ModuleList) and not type(module) in seen_types:
@@ -250,6 +343,7 @@ def start_flops_count(self, **kwargs):
             seen_types.add(type(module))
 
     self.apply(partial(add_flops_counter_hook_function, **kwargs))
+    self.apply(partial(add_act_bits_hook_function, state=state))
 
 
 def stop_flops_count(self):
@@ -261,6 +355,7 @@ def stop_flops_count(self):
     """
     remove_batch_counter_hook_function(self)
     self.apply(remove_flops_counter_hook_function)
+    self.apply(remove_act_bits_hook_function)
 
 
 def reset_flops_count(self):
@@ -274,6 +369,117 @@ def reset_flops_count(self):
 
 
 # ---- Internal functions
+# the output of these modules is still on the grid of their input
+GRID_MODULES = (nn.ReLU, nn.ReLU6, nn.MaxPool1d, nn.MaxPool2d, nn.MaxPool3d, nn.Dropout, my_nn.DropoutScale,
+                nn.Flatten, nn.Identity)
+
+
+def act_quantizer_bits(module):
+    """Bits of the output of an activation quantizer, None if module is not one or does not quantize."""
+    if isinstance(module, my_nn.ActFixedQ):
+        return math.ceil(math.log2(module.Qp - module.Qn + 1))
+    if not isinstance(module, (my_nn._ActQ, my_nn.ActQ, my_nn.ActQv2, my_nn.PACT)):
+        return None
+    nbits = getattr(module, 'nbits', -1)
+    if nbits > 0 and isinstance(module, (my_nn.ActQ, my_nn.ActQv2)) and not module.signed:
+        # unsigned inputs are stored as nbits + 1 signed bits
+        nbits -= 1
+    return nbits if nbits > 0 else None
+
+
+def _get_nbits_a(x):
+    if isinstance(x, (list, tuple)):
+        x = x[0] if len(x) > 0 else None
+    return getattr(x, '_ptflops_nbits_a', None)
+
+
+def _set_nbits_a(x, nbits):
+    if isinstance(x, (list, tuple)):
+        x = x[0]
+    if isinstance(x, torch.Tensor):
+        x._ptflops_nbits_a = nbits
+
+
+def act_quantizer_hook(module, input, output, state):
+    nbits = act_quantizer_bits(module)
+    if nbits is not None:
+        state['nbits_a'] = nbits
+        _set_nbits_a(output, nbits)
+
+
+def grid_hook(module, input, output):
+    nbits = _get_nbits_a(input[0]) if len(input) > 0 else None
+    if nbits is not None:
+        _set_nbits_a(output, nbits)
+
+
+def reset_act_bits_pre_hook(module, input, state):
+    state['nbits_a'] = 32
+
+
+def input_bits_pre_hook(module, input, state):
+    """
+    The bits of the input: the quantizer of the layer itself (Conv2dSQ, LSTMCellQ), else the activation quantizer
+    that produced the input (through ReLU, max pooling, dropout, flatten), else the last one that ran.
+    """
+    nbits = getattr(module, 'nbits_a', None)
+    if not (isinstance(nbits, int) and nbits > 0):
+        nbits = _get_nbits_a(input[0]) if len(input) > 0 else None
+        if nbits is None:
+            nbits = state['nbits_a']
+    module.__nbits_a__ = nbits
+
+
+def add_act_bits_hook_function(module, state):
+    handles = []
+    if act_quantizer_bits(module) is not None:
+        handles.append(module.register_forward_hook(partial(act_quantizer_hook, state=state)))
+    elif isinstance(module, GRID_MODULES):
+        handles.append(module.register_forward_hook(grid_hook))
+    if hasattr(module, '__batch_counter_handle__'):
+        # a new forward of the whole model
+        handles.append(module.register_forward_pre_hook(partial(reset_act_bits_pre_hook, state=state)))
+    module.__act_bits_handles__ = handles
+
+
+def remove_act_bits_hook_function(module):
+    if hasattr(module, '__act_bits_handles__'):
+        for handle in module.__act_bits_handles__:
+            handle.remove()
+        del module.__act_bits_handles__
+
+
+def weight_density(module):
+    """The fraction of the weights that are kept: pruning masks and ternary zeros."""
+    module = _source(module)
+    mask = getattr(module, 'mask', None)
+    if isinstance(mask, torch.Tensor) and not mask.is_meta:
+        return (mask != 0).float().mean().item()
+    ternary_weight = getattr(module, 'ternary_weight', None)
+    if isinstance(ternary_weight, torch.Tensor) and not ternary_weight.is_meta:
+        return (ternary_weight != 0).float().mean().item()
+    return 1.
+
+
+def weight_bits(module):
+    if isinstance(module, (my_nn.TTQ_CNN, my_nn.TTQ_Linear)):
+        return 2
+    nbits = getattr(module, 'nbits_w', None)
+    if nbits is None:
+        nbits = getattr(module, 'nbits', None)
+    return nbits if isinstance(nbits, int) and nbits > 0 else 32
+
+
+def count_macs(module, macs, other_flops=0):
+    """
+    :param macs: the multiply-accumulates with the weights, before pruning
+    :param other_flops: bias, elementwise ops ..., not scaled
+    """
+    macs = macs * weight_density(module)
+    module.__flops__ += int(macs + other_flops)
+    module.__bops__ += int(macs * weight_bits(module) * getattr(module, '__nbits_a__', 32))
+
+
 def empty_flops_counter_hook(module, input, output):
     module.__flops__ += 0
 
@@ -295,7 +501,14 @@ def relu_flops_counter_hook(module, input, output):
 def linear_flops_counter_hook(module, input, output):
     input = input[0]
     output_last_dim = output.shape[-1]  # pytorch checks dimensions, so here we don't care much
-    module.__flops__ += int(np.prod(input.shape) * output_last_dim)
+    count_macs(module, int(np.prod(input.shape) * output_last_dim))
+
+
+def tsvd_flops_counter_hook(module, input, output):
+    # x @ SV^T @ U^T
+    input = input[0]
+    rows = input.numel() // module.in_features
+    count_macs(module, rows * (module.SV.numel() + module.U.numel()))
 
 
 def pool_flops_counter_hook(module, input, output):
@@ -334,9 +547,8 @@ def deconv_flops_counter_hook(conv_module, input, output):
     if conv_module.bias is not None:
         output_height, output_width = output.shape[2:]
         bias_flops = out_channels * batch_size * output_height * output_height
-    overall_flops = overall_conv_flops + bias_flops
 
-    conv_module.__flops__ += int(overall_flops)
+    count_macs(conv_module, overall_conv_flops, bias_flops)
 
 
 def conv_flops_counter_hook(conv_module, input, output):
@@ -363,42 +575,7 @@ def conv_flops_counter_hook(conv_module, input, output):
     if conv_module.bias is not None:
         bias_flops = out_channels * active_elements_count
 
-    overall_flops = overall_conv_flops + bias_flops
-
-    conv_module.__flops__ += int(overall_flops)
-
-
-def conv_sq_flops_counter_hook(conv_module, input, output):
-    # Can have multiple inputs, getting the first one
-    input = input[0]
-
-    batch_size = input.shape[0]
-    output_dims = list(output.shape[2:])
-
-    kernel_dims = list(conv_module.kernel_size)
-    in_channels = conv_module.in_channels
-    out_channels = conv_module.out_channels
-    groups = conv_module.groups
-
-    filters_per_channel = out_channels // groups
-    conv_per_position_flops = int(np.prod(kernel_dims)) * in_channels * filters_per_channel
-
-    active_elements_count = batch_size * int(np.prod(output_dims))
-
-    overall_conv_flops = conv_per_position_flops * active_elements_count
-    nbits_a = conv_module.nbits_a if 0 < conv_module.nbits_a <= 8 else 8
-    nbits_w = conv_module.nbits_w if 0 < conv_module.nbits_w <= 8 else 8
-    bit22 = nbits_a * nbits_w
-    overall_conv_flops = overall_conv_flops * (1 - conv_module.sparsity) * bit22 / 64
-
-    bias_flops = 0
-
-    if conv_module.bias is not None:
-        bias_flops = out_channels * active_elements_count
-
-    overall_flops = overall_conv_flops + bias_flops
-
-    conv_module.__flops__ += int(overall_flops)
+    count_macs(conv_module, overall_conv_flops, bias_flops)
 
 
 def batch_counter_hook(module, input, output):
@@ -445,6 +622,7 @@ def rnn_flops_counter_hook(rnn_module, input, output):
     IF sigmoid and tanh are made hard, only a comparison FLOPS should be accurate
     """
     flops = 0
+    macs = 0
     inp = input[0]  # input is a tuble containing a sequence to process and (optionally) hidden state
     batch_size = inp.shape[0]
     seq_length = inp.shape[1]
@@ -453,6 +631,7 @@ def rnn_flops_counter_hook(rnn_module, input, output):
     for i in range(num_layers):
         w_ih = rnn_module.__getattr__('weight_ih_l' + str(i))
         w_hh = rnn_module.__getattr__('weight_hh_l' + str(i))
+        macs += w_ih.numel() + w_hh.numel()
         if i == 0:
             input_size = rnn_module.input_size
         else:
@@ -463,11 +642,12 @@ def rnn_flops_counter_hook(rnn_module, input, output):
             b_hh = rnn_module.__getattr__('bias_hh_l' + str(i))
             flops += b_ih.shape[0] + b_hh.shape[0]
 
-    flops *= batch_size
-    flops *= seq_length
+    flops *= batch_size * seq_length
+    macs *= batch_size * seq_length
     if rnn_module.bidirectional:
         flops *= 2
-    rnn_module.__flops__ += int(flops)
+        macs *= 2
+    count_macs(rnn_module, macs, flops - macs)
 
 
 def rnn_cell_flops_counter_hook(rnn_cell_module, input, output):
@@ -484,7 +664,8 @@ def rnn_cell_flops_counter_hook(rnn_cell_module, input, output):
         flops += b_ih.shape[0] + b_hh.shape[0]
 
     flops *= batch_size
-    rnn_cell_module.__flops__ += int(flops)
+    macs = (w_ih.numel() + w_hh.numel()) * batch_size
+    count_macs(rnn_cell_module, macs, flops - macs)
 
 
 def add_batch_counter_variables_or_reset(module):
@@ -512,6 +693,7 @@ def add_flops_counter_variable_or_reset(module):
         #           'defined for the module' + type(module).__name__ +
         #           ' ptflops can affect your code!')
         module.__flops__ = 0
+        module.__bops__ = 0
         module.__params__ = get_model_parameters_number(module)
 
 
@@ -521,7 +703,6 @@ MODULES_MAPPING = {
     # convolutions
     nn.Conv1d: conv_flops_counter_hook,
     nn.Conv2d: conv_flops_counter_hook,
-    my_nn.Conv2dSQ: conv_sq_flops_counter_hook,
     nn.Conv3d: conv_flops_counter_hook,
     # activations
     nn.ReLU: relu_flops_counter_hook,
@@ -547,6 +728,7 @@ MODULES_MAPPING = {
     nn.BatchNorm2d: bn_flops_counter_hook,
     nn.BatchNorm3d: bn_flops_counter_hook,
     # FC
+    my_nn.TSVDLinear: tsvd_flops_counter_hook,
     nn.Linear: linear_flops_counter_hook,
     # Upscale
     nn.Upsample: upsample_flops_counter_hook,
@@ -562,10 +744,23 @@ MODULES_MAPPING = {
 }
 
 
+def get_flops_hook(module):
+    """
+    The hook of the type of module, else of its first base class in MODULES_MAPPING:
+    the quantized layers (Conv2dLSQ, LinearBWN, TTQ_CNN, LSTMCellQ ...) are counted as their float layers.
+    """
+    if type(module) in CUSTOM_MODULES_MAPPING:
+        return CUSTOM_MODULES_MAPPING[type(module)]
+    if type(module) in MODULES_MAPPING:
+        return MODULES_MAPPING[type(module)]
+    for module_type, hook in MODULES_MAPPING.items():
+        if isinstance(module, module_type):
+            return hook
+    return None
+
+
 def is_supported_instance(module):
-    if type(module) in MODULES_MAPPING or type(module) in CUSTOM_MODULES_MAPPING:
-        return True
-    return False
+    return get_flops_hook(module) is not None
 
 
 def remove_flops_counter_hook_function(module):
@@ -573,3 +768,6 @@ def remove_flops_counter_hook_function(module):
         if hasattr(module, '__flops_handle__'):
             module.__flops_handle__.remove()
             del module.__flops_handle__
+        if hasattr(module, '__nbits_a_handle__'):
+            module.__nbits_a_handle__.remove()
+            del module.__nbits_a_handle__
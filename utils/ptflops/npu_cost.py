@@ -0,0 +1,150 @@
+"""
+Cost model of the custom NPU (see models/_modules/npu_structured_pruner.py).
+
+A pe_size x pe_size PE array runs one group of the weight (pe_size output channels x pe_size input channels)
+at one kernel position for one output pixel. Every PE row skips the pruned weights, so the group takes as many
+cycles as its densest row, and at least min_cycles.
+Memory traffic: the non-zero weights and the input/output feature maps at their bit-widths.
+Compute and memory transfers overlap: the latency of a layer is the larger of the two.
+"""
+import math
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+__all__ = ['get_default_npu_config', 'group_cycles', 'get_npu_cost']
+
+
+def get_default_npu_config(config=None):
+    default = {
+        'pe_size': 32,
+        'num_arrays': 1,  # PE arrays running different groups in parallel
+        'min_cycles': 7,
+        'frequency': 500e6,  # Hz
+        'bandwidth': 12.8e9,  # bytes/s
+        'nbits_a': 8,  # input of the layers without quantized activations
+        'nbits_w': 8,  # weight of the layers without quantized weights
+        'nbits_o': 8,  # output feature maps
+        'nbits_bias': 32,
+    }
+    config = {} if config is None else dict(config)
+    for k, v in default.items():
+        if k not in config:
+            config[k] = v
+    return config
+
+
+def group_cycles(mask, pe_size=32, min_cycles=7):
+    """
+    :param mask: [out, in, kh, kw], non-zero where the weight is kept
+    :return: cycles of every group at every kernel position, [ceil(out / pe_size), ceil(in / pe_size), kh, kw]
+    """
+    (out_channel, in_channel, kh, kw) = mask.shape
+    part_out = math.ceil(out_channel / pe_size)
+    part_in = math.ceil(in_channel / pe_size)
+    mask = F.pad((mask != 0).int(),
+                 (0, 0, 0, 0, 0, part_in * pe_size - in_channel, 0, part_out * pe_size - out_channel))
+    # the non-zeros of every PE row, the densest row of every group
+    cycles = mask.view(part_out, pe_size, part_in, pe_size, kh, kw).sum(dim=3).max(dim=1)[0]
+    return cycles.clamp(min=min_cycles)
+
+
+def _weight_mask(module):
+    mask = getattr(module, 'mask', None)
+    if mask is None:
+        mask = module.weight.detach() != 0
+    if mask.dim() == 2:  # linear: a 1x1 conv
+        mask = mask.view(*mask.shape, 1, 1)
+    return mask
+
+
+def _nbits(module, names, default):
+    for name in names:
+        nbits = getattr(module, name, None)
+        if isinstance(nbits, int) and 0 < nbits <= 8:
+            return nbits
+    return default
+
+
+def layer_cost(module, in_shape, out_shape, config):
+    mask = _weight_mask(module)
+    cycles = group_cycles(mask, config['pe_size'], config['min_cycles'])
+    # output pixels (conv) or rows (linear)
+    positions = int(np.prod(out_shape)) // mask.shape[0]
+    compute_cycles = math.ceil(cycles.sum().item() * positions / config['num_arrays'])
+    nbits_a = _nbits(module, ('nbits_a',), config['nbits_a'])
+    nbits_w = _nbits(module, ('nbits_w', 'nbits'), config['nbits_w'])
+    weight_bytes = int(mask.sum().item()) * nbits_w / 8
+    if getattr(module, 'bias', None) is not None:
+        weight_bytes += module.bias.numel() * config['nbits_bias'] / 8
+    act_bytes = int(np.prod(in_shape)) * nbits_a / 8 + int(np.prod(out_shape)) * config['nbits_o'] / 8
+    compute_latency = compute_cycles / config['frequency']
+    memory_latency = (weight_bytes + act_bytes) / config['bandwidth']
+    return {
+        'type': type(module).__name__,
+        'input_shape': list(in_shape),
+        'output_shape': list(out_shape),
+        'nbits_a': nbits_a,
+        'nbits_w': nbits_w,
+        'sparsity': 1 - mask.sum().item() / mask.numel(),
+        'group_num': cycles.numel(),
+        'avg_group_cycles': cycles.float().mean().item(),
+        'cycles': compute_cycles,
+        'weight_bytes': weight_bytes,
+        'act_bytes': act_bytes,
+        'compute_latency': compute_latency,
+        'memory_latency': memory_latency,
+        'latency': max(compute_latency, memory_latency),
+        'bound': 'compute' if compute_latency >= memory_latency else 'memory',
+    }
+
+
+def _record_shapes(model, x, hook):
+    handles = [m.register_forward_hook(hook) for m in model.modules() if isinstance(m, (nn.Conv2d, nn.Linear))]
+    try:
+        with torch.no_grad():
+            model(x)
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+def get_npu_cost(model, input_res, config=None):
+    """
+    Predicted cycles, memory traffic and latency of every Conv2d/Linear layer for one input.
+    :param input_res: (C, H, W), a forward pass on the meta device records the feature map sizes (a real forward
+        in eval mode when an op has no meta kernel)
+    :param config: the PE array, see get_default_npu_config
+    :return: {'config', 'layers': {name: per-layer dict}, 'total'}, JSON-serializable
+    """
+    from .flops_counter import meta_copy, _source
+    config = get_default_npu_config(config)
+    shapes = {}
+
+    def hook(module, input, output):
+        shapes[_source(module)] = (tuple(input[0].shape), tuple(output.shape))
+
+    try:
+        # only the shapes are needed: no real forward, model is not modified
+        _record_shapes(meta_copy(model).eval(), torch.empty((1, *input_res), device='meta'), hook)
+    except Exception as e:
+        print('=> npu cost: meta forward failed ({}), run a real forward'.format(e))
+        shapes.clear()
+        modes = [(m, m.training) for m in model.modules()]
+        try:
+            param = next(model.parameters(), None)
+            x = torch.zeros((1, *input_res), device=None if param is None else param.device)
+            _record_shapes(model.eval(), x, hook)
+        finally:
+            for m, training in modes:
+                m.training = training
+    layers = {}
+    for name, module in model.named_modules():
+        if module in shapes:
+            layers[name] = layer_cost(module, *shapes[module], config)
+    total = {k: sum(layer[k] for layer in layers.values())
+             for k in ('cycles', 'weight_bytes', 'act_bytes', 'compute_latency', 'memory_latency', 'latency')}
+    total['fps'] = 1 / total['latency'] if total['latency'] > 0 else 0
+    return {'config': config, 'layers': layers, 'total': total}
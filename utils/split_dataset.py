@@ -2,22 +2,37 @@ import argparse
 import os
 import shutil
 
-parser = argparse.ArgumentParser(description='Sparsity Analysis')
+import numpy as np
+
+from utils.custom_datasets.manifest import save_manifest, scan_image_folder, split_samples
+
+parser = argparse.ArgumentParser(description='Split an image folder into train/val')
 parser.add_argument('src', metavar='DIR',
                     help='the source directory')
-parser.add_argument('dst', metavar='DIR', help='destination directory')
+parser.add_argument('dst', metavar='PATH', help='the manifest file (.npz), the destination directory with --move')
 parser.add_argument('-s', '--split', type=int, default=5,
                     help='the split ratio, default: (1/5)')
+parser.add_argument('--seed', type=int, default=None,
+                    help='random validation samples (default: every split-th image of a class)')
+parser.add_argument('--no-stratify', dest='stratify', action='store_false', default=True,
+                    help='split the whole dataset, not every class')
+parser.add_argument('--existing-splits', nargs='+', default=None, metavar='NAME',
+                    help='src/<NAME>/<class>/... are the splits already, e.g. train val: only index them')
+parser.add_argument('-j', '--workers', type=int, default=16,
+                    help='class directories scanned in parallel')
+parser.add_argument('--move', action='store_true', default=False,
+                    help='move the validation images to dst instead of writing a manifest')
 
 """
     root/dog/xxxx.jpgs
     root/dog/xxxx.jpgs
+    python -m utils.split_dataset root split.npz -s 5 --seed 0
+    python -m utils.split_dataset /data/imagenet imagenet.npz --existing-splits train val
+    then --manifest split.npz in the example scripts
 """
 
 
-def main():
-    args = parser.parse_args()
-    assert os.path.exists(args.src), '{} does not exists'.format(args.src)
+def move(args):
     if not os.path.exists(args.dst):
         print('mkdir {}'.format(args.dst))
         os.makedirs(args.dst)
@@ -33,5 +48,30 @@ def main():
                 shutil.move(os.path.join(args.src, cls_dir, img), os.path.join(args.dst, cls_dir, img))
 
 
+def main():
+    args = parser.parse_args()
+    assert os.path.exists(args.src), '{} does not exists'.format(args.src)
+    if args.move:
+        move(args)
+        return
+    if args.existing_splits is not None:
+        classes, paths, labels, split = None, [], [], []
+        for i, name in enumerate(args.existing_splits):
+            split_classes, split_paths, split_labels = scan_image_folder(os.path.join(args.src, name), args.workers)
+            assert classes is None or split_classes == classes, 'the classes of {} differ'.format(name)
+            classes = split_classes
+            paths += [os.path.join(name, p) for p in split_paths]
+            labels.append(split_labels)
+            split.append(np.full(len(split_paths), i, dtype=np.int8))
+        labels, split = np.concatenate(labels), np.concatenate(split)
+        save_manifest(args.dst, args.src, classes, paths, labels, split, split_names=args.existing_splits)
+    else:
+        classes, paths, labels = scan_image_folder(args.src, args.workers)
+        split = split_samples(labels, args.split, args.stratify, args.seed)
+        save_manifest(args.dst, args.src, classes, paths, labels, split, ratio=args.split, seed=args.seed,
+                      stratify=args.stratify)
+    print('=> {}: {} classes, {} images, {} val'.format(args.dst, len(classes), len(paths), int((split > 0).sum())))
+
+
 if __name__ == '__main__':
     main()
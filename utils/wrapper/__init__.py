@@ -1,3 +1,9 @@
 from .bn_fusion import *
 from .hook_function import *
 from .replace_conv import *
+from .freeze import *
+from .convert_int import *
+from .convert_shift import *
+from .convert_sign import *
+from .convert_lut import *
+from .layer_profiler import *
@@ -0,0 +1,134 @@
+r"""
+    Convert a trained LSQ/LLSQ model for integer inference on CPU.
+    A Conv2dLSQ/LinearLSQ/Conv2dLLSQ/LinearLLSQ whose input comes from an ActLSQ/ActLLSQ
+    (directly or through ReLU, max pooling, dropout, view ...) becomes a Conv2dInt/LinearInt.
+    Everything else is frozen (see freeze_quantized).
+"""
+import operator
+
+import torch
+import torch.fx
+import torch.nn as nn
+import torch.nn.functional as F
+
+import models._modules as my_nn
+from models._modules import Conv2dInt, LinearInt, DropoutScale
+from utils.wrapper.freeze import freeze_quantized
+
+__all__ = ['convert_to_int']
+
+# the output of these ops is still on the grid of their input
+grid_modules = (nn.ReLU, nn.MaxPool2d, nn.Dropout, DropoutScale, nn.Flatten, nn.Identity)
+grid_functions = (F.relu, F.max_pool2d, torch.flatten, operator.getitem)
+grid_methods = ('view', 'reshape', 'flatten', 'contiguous')
+
+act_types = (my_nn.ActLSQ, my_nn.ActLLSQ)
+layer_types = (my_nn.Conv2dLSQ, my_nn.LinearLSQ, my_nn.Conv2dLLSQ, my_nn.LinearLLSQ)
+
+
+class _LeafTracer(torch.fx.Tracer):
+    # the quantizers have Python-side state in forward: only trace through containers
+    def is_leaf_module(self, m, module_qualified_name):
+        return len(m._modules) == 0
+
+
+def _on_grid(node, modules):
+    return (node.op == 'call_module' and isinstance(modules[node.target], grid_modules)) or \
+        (node.op == 'call_function' and node.target in grid_functions) or \
+        (node.op == 'call_method' and node.target in grid_methods)
+
+
+def _shape_only(node):
+    return (node.op == 'call_method' and node.target in ('size', 'dim')) or \
+        (node.op == 'call_function' and node.target is getattr)
+
+
+def find_input_quantizers(model):
+    """
+    :return: {name of a quantized layer: name of its input activation quantizer}, the traced graph
+    """
+    modules = dict(model.named_modules())
+    graph = _LeafTracer().trace(model)
+    result = {}
+    for node in graph.nodes:
+        if node.op != 'call_module' or not isinstance(modules[node.target], layer_types):
+            continue
+        src = node.args[0]
+        while isinstance(src, torch.fx.Node):
+            if src.op == 'call_module' and isinstance(modules[src.target], act_types):
+                result[node.target] = src.target
+                break
+            if _on_grid(src, modules):
+                src = src.args[0]
+            else:
+                break
+    return result, graph
+
+
+def quantizers_feeding_only(graph, modules, act_names, layer_names):
+    """
+    :return: the activation quantizers of act_names whose outputs only reach the layers of layer_names
+        (through grid ops, or read for their shape)
+    """
+    kept = set()
+    for node in graph.nodes:
+        if node.op != 'call_module' or node.target not in act_names:
+            continue
+        users = list(node.users)
+        while users:
+            user = users.pop()
+            if _on_grid(user, modules):
+                users.extend(user.users)
+            elif not (user.op == 'call_module' and user.target in layer_names) and not _shape_only(user):
+                kept.add(node.target)
+                break
+    return set(act_names) - kept
+
+
+def _weight_codes(m):
+    alpha = m.alpha.view(-1, 1, 1, 1) if isinstance(m, nn.Conv2d) else m.alpha
+    if isinstance(m, (my_nn.Conv2dLSQ, my_nn.LinearLSQ)):
+        # the same ops as FunLSQFused
+        return (m.weight / alpha).clamp(m.Qn, m.Qp).round()
+    return (m.weight / alpha).round().clamp(m.Qn, m.Qp)
+
+
+def to_int(m, act, pack):
+    codes = _weight_codes(m)
+    pack = pack and m.nbits <= 4
+    if isinstance(m, nn.Conv2d):
+        return Conv2dInt(m.in_channels, m.out_channels, m.kernel_size, m.stride, m.padding,
+                         codes, m.alpha, act.alpha, act.Qn, act.Qp, bias=m.bias, pack=pack)
+    return LinearInt(m.in_features, m.out_features, codes, m.alpha, act.alpha, act.Qn, act.Qp,
+                     bias=m.bias, pack=pack)
+
+
+def _set_submodule(model, name, module):
+    parent_name, _, child_name = name.rpartition('.')
+    setattr(model.get_submodule(parent_name), child_name, module)
+
+
+def convert_to_int(model, pack=True):
+    """
+    In place, like freeze_quantized. Only for evaluation.
+    Grouped or dilated convolutions and layers whose input is not quantized stay float.
+    The integer layers quantize their input: an activation quantizer whose output only goes to them
+    (through ReLU, max pooling ..., which commute with the quantization) is removed, so the input is quantized once.
+    :param model: a trained (initialized) model that torch.fx can trace
+    :param pack: store 4 bits weights as two codes per byte
+    :return: the model
+    """
+    modules = dict(model.named_modules())
+    input_quantizers, graph = find_input_quantizers(model)
+    converted = {}
+    with torch.no_grad():
+        for name, act_name in input_quantizers.items():
+            m, act = modules[name], modules[act_name]
+            if m.alpha is None or act.alpha is None or \
+                    (isinstance(m, nn.Conv2d) and (m.groups != 1 or m.dilation != (1, 1))):
+                continue
+            converted[name] = act_name
+            _set_submodule(model, name, to_int(m, act, pack))
+        for act_name in quantizers_feeding_only(graph, modules, set(converted.values()), set(converted)):
+            _set_submodule(model, act_name, nn.Identity())
+    return freeze_quantized(model)
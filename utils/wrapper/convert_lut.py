@@ -0,0 +1,46 @@
+r"""
+    Convert the k-means cluster-quantized convolutions of a trained model (Conv2dClusterQ, Conv2dShareQ)
+    to Conv2dLUT/Conv2dShareLUT: nbits per weight (the packed labels) plus the centroid table.
+"""
+import torch
+
+import models._modules as my_nn
+from models._modules import Conv2dLUT, Conv2dShareLUT
+
+__all__ = ['convert_to_lut']
+
+
+def _lut(conv, labels, centroids, nbits, accumulate):
+    return Conv2dLUT(conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride, conv.padding,
+                     conv.dilation, conv.groups, labels, centroids, nbits, bias=conv.bias, accumulate=accumulate)
+
+
+def to_lut(m, accumulate):
+    if m.centroids is None:
+        return m
+    if isinstance(m, my_nn.Conv2dClusterQ):
+        return _lut(m, m.labels, m.centroids, m.nbits, accumulate)
+    # Conv2dShareQ: the labels of all convs are concatenated along the output channels
+    labels = m.labels.split([conv.out_channels for conv in m.convs])
+    return Conv2dShareLUT([_lut(conv, labels_i, m.centroids, m.nbits, accumulate)
+                           for conv, labels_i in zip(m.convs, labels)])
+
+
+def convert_to_lut(model, accumulate=False):
+    """
+    In place, like freeze_quantized. Only for evaluation.
+    :param model: a trained (initialized) model
+    :param accumulate: sum the inputs per centroid and do 2^nbits multiplies per output
+        instead of decoding the weights (see Conv2dLUT)
+    :return: the model
+    """
+    with torch.no_grad():
+        for module_name in model._modules:
+            m = model._modules[module_name]
+            if type(m) in (my_nn.Conv2dClusterQ, my_nn.Conv2dShareQ):
+                converted = to_lut(m, accumulate)
+                converted.train(m.training)
+                model._modules[module_name] = converted
+            elif len(m._modules) > 0:
+                convert_to_lut(m, accumulate)
+    return model
@@ -0,0 +1,108 @@
+r"""
+    Convert a trained LLSQS/BWNS model (e.g. cifar10_vggtiny_llsqs_bwns) for integer-only inference on CPU.
+    The step sizes of ActLLSQS and Conv2dBWNS/LinearBWNS/Conv2dBNBWNS are powers of two: after the first
+    activation quantizer the model runs on integer tensors and every rescale is an arithmetic shift
+    (see models._modules.int_shift). The output of every converted module times 2^scale_exp is bit-exact
+    with the fake-quant model, i.e. with its --extract-inner-data dumps.
+"""
+import torch
+import torch.fx
+import torch.nn as nn
+
+import models._modules as my_nn
+from models._modules import ActShift, Conv2dShift, LinearShift, MaxPool2dInt, FunSign, truncation
+from utils.wrapper.convert_int import _LeafTracer, grid_modules, grid_functions, grid_methods
+from utils.wrapper.freeze import _bn_fold, _reshape, _reshape_back, llsqs_rounding
+
+__all__ = ['convert_to_shift']
+
+shift_layer_types = (my_nn.Conv2dBWNS, my_nn.LinearBWNS, my_nn.Conv2dBNBWNS)
+# no tensor output
+shape_methods = ('size', 'dim')
+
+
+def _exponent(alpha):
+    exp = torch.log2(alpha.detach()).round()
+    assert torch.equal(2 ** exp, alpha.detach()), 'The step sizes have to be powers of two'
+    return exp.long()
+
+
+def to_shift_act(m, exp_in):
+    return ActShift(exp_in, int(_exponent(m.alpha)), m.Qn, m.Qp, rounding=llsqs_rounding(m))
+
+
+def to_shift_layer(m, act, bias_bits):
+    weight = _bn_fold(m)[0] if isinstance(m, my_nn.Conv2dBNBWNS) else m.weight
+    # the same ops as the forward, alpha > 0
+    codes = _reshape_back(FunSign.apply(_reshape(weight) / m.alpha.detach()), weight)
+    bias_codes = exp_b = None
+    if m.bias is not None:
+        if m.bias_bits <= 0:
+            print('Warning: {} quantize the bias with {} bits (see quantize_scale_and_bias)'.format(
+                type(m).__name__, bias_bits))
+            m.set_bias_bits(bias_bits)
+        bias_q, qcode = truncation(m.bias, m.bias_bits)
+        bias_codes = (bias_q * 2 ** qcode).round()
+        exp_b = -int(qcode)
+    if isinstance(m, nn.Conv2d):
+        return Conv2dShift(m.in_channels, m.out_channels, m.kernel_size, m.stride, m.padding,
+                           codes, _exponent(m.alpha), act.scale_exp, act.Qn, act.Qp, bias_codes, exp_b)
+    return LinearShift(m.in_features, m.out_features, codes, _exponent(m.alpha), act.scale_exp, act.Qn, act.Qp,
+                       bias_codes, exp_b)
+
+
+def convert_to_shift(model, bias_bits=8):
+    """
+    In place, like convert_to_int. Only for evaluation.
+    Everything from the first ActLLSQS on has to run on integers: shift layers, ActLLSQS and the ops in
+    `grid_modules`/`grid_functions`/`grid_methods` (MaxPool2d becomes MaxPool2dInt), otherwise
+    NotImplementedError is raised (e.g. LSTMCellQ). The output of the model is dequantized by its last module.
+    :param model: a trained (initialized) model that torch.fx can trace
+    :param bias_bits: for the shift layers whose bias is not quantized yet
+    :return: the model
+    """
+    modules = dict(model.named_modules())
+    graph = _LeafTracer().trace(model)
+    # node ==> the converted module whose integer output it carries (through grid ops)
+    sources = {}
+    with torch.no_grad():
+        for node in graph.nodes:
+            src = node.args[0] if len(node.args) > 0 else None
+            src_module = sources.get(src) if isinstance(src, torch.fx.Node) else None
+            if node.op == 'output':
+                if src_module is not None:
+                    src_module.out_float = True
+                continue
+            if node.op in ('call_function', 'call_method'):
+                if src_module is None or node.target in shape_methods:
+                    continue
+                if node.target not in grid_functions and node.target not in grid_methods:
+                    raise NotImplementedError('{} can not run on integers'.format(node.target))
+                sources[node] = src_module
+                continue
+            if node.op != 'call_module':
+                continue
+            m = modules[node.target]
+            if isinstance(m, my_nn.ActLLSQS) and m.alpha is not None:
+                new = to_shift_act(m, None if src_module is None else src_module.scale_exp)
+                sources[node] = new
+            elif src_module is None:
+                # float ops in front of the input layer
+                continue
+            elif isinstance(m, shift_layer_types) and m.alpha is not None:
+                if not isinstance(src_module, ActShift) or \
+                        (isinstance(m, nn.Conv2d) and (m.groups != 1 or m.dilation != (1, 1))):
+                    raise NotImplementedError('{}: only ungrouped layers after an ActLLSQS'.format(node.target))
+                new = to_shift_layer(m, src_module, bias_bits)
+                sources[node] = new
+            elif isinstance(m, grid_modules):
+                sources[node] = src_module
+                if not isinstance(m, nn.MaxPool2d):
+                    continue
+                assert m.dilation == 1 and not m.ceil_mode
+                new = MaxPool2dInt(m.kernel_size, m.stride, m.padding)
+            else:
+                raise NotImplementedError('{} ({}) can not run on integers'.format(node.target, type(m).__name__))
+            parent_name, _, child_name = node.target.rpartition('.')
+            setattr(model.get_submodule(parent_name), child_name, new)
+    return model
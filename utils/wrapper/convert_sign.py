@@ -0,0 +1,49 @@
+r"""
+    Convert the binary-weight layers of a trained model (Conv2dBWN, Conv2dBWNS, LinearBWN, LinearBWNS)
+    to Conv2dSign/LinearSign: the weights are stored as packed sign bits, 1 bit instead of 32 per weight.
+"""
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from models._modules import Conv2dSign, LinearSign, FunSign, shift_bias
+from utils.wrapper.freeze import _reshape, _reshape_back
+
+__all__ = ['convert_to_sign']
+
+
+def to_sign(m):
+    if m.alpha is None:
+        return m
+    # the same ops as the forward
+    codes = _reshape_back(FunSign.apply(_reshape(m.weight) / m.alpha.detach()), m.weight)
+    num_zeros = int((codes == 0).sum())
+    if num_zeros > 0:
+        print('Warning: {} weights of {} are 0, stored as -1'.format(num_zeros, type(m).__name__))
+    bias = shift_bias(m) if isinstance(m, (my_nn.Conv2dBWNS, my_nn.LinearBWNS)) else m.bias
+    if isinstance(m, nn.Conv2d):
+        return Conv2dSign(m.in_channels, m.out_channels, m.kernel_size, m.stride, m.padding, m.dilation, m.groups,
+                          codes, m.alpha, bias=bias)
+    return LinearSign(m.in_features, m.out_features, codes, m.alpha, bias=bias)
+
+
+sign_types = (my_nn.Conv2dBWN, my_nn.Conv2dBWNS, my_nn.LinearBWN, my_nn.LinearBWNS)
+
+
+def convert_to_sign(model):
+    """
+    In place, like freeze_quantized. Only for evaluation, e.g. at the end of training (--sign-inference).
+    The other modules are kept.
+    :param model: a trained (initialized) model
+    :return: the model
+    """
+    with torch.no_grad():
+        for module_name in model._modules:
+            m = model._modules[module_name]
+            if type(m) in sign_types:
+                converted = to_sign(m)
+                converted.train(m.training)
+                model._modules[module_name] = converted
+            elif len(m._modules) > 0:
+                convert_to_sign(m)
+    return model
@@ -0,0 +1,273 @@
+r"""
+    Freeze a trained fake-quant model for inference.
+    The quantized (or pruned) weights are computed once and baked into plain `nn.Conv2d`/`nn.Linear` modules,
+    activation quantizers become fixed-scale `ActFixedQ` ops. init_state, labels, mask buffers
+    and the float weights are dropped.
+"""
+
+import torch
+import torch.nn as nn
+
+import models._modules as my_nn
+from models._modules import ActFixedQ, FunLSQFused, FunSign, Qmodes, log_shift
+from models._modules.bwn import Conv2dBWV, shift_bias
+from models._modules.dnq import FunLLSQS, grad_shift_scale, round_pass
+from models._modules.llsq import FunLLSQ
+from models._modules.quantize import clip_quantize, truncation
+from models._modules.ttq import Function_binary, Function_binary_fc, Function_ternary_kernel
+
+__all__ = ['freeze_quantized']
+
+
+def _reshape(w):
+    return w.reshape([w.shape[0], -1]).transpose(0, 1)
+
+
+def _reshape_back(w_reshape, w):
+    return w_reshape.transpose(0, 1).reshape(w.shape)
+
+
+def _conv2d(m, weight, bias):
+    conv = nn.Conv2d(m.in_channels, m.out_channels, m.kernel_size, m.stride,
+                     m.padding, m.dilation, m.groups, bias is not None).to(weight.device)
+    conv.weight.data.copy_(weight)
+    if bias is not None:
+        conv.bias.data.copy_(bias)
+    return conv
+
+
+def _linear(m, weight, bias):
+    fc = nn.Linear(m.in_features, m.out_features, bias is not None).to(weight.device)
+    fc.weight.data.copy_(weight)
+    if bias is not None:
+        fc.bias.data.copy_(bias)
+    return fc
+
+
+def _frozen(m, weight, bias=None):
+    """Plain module of the same kind as `m` with the given weight; `m.bias` by default."""
+    if bias is None:
+        bias = m.bias
+    if isinstance(m, nn.Conv2d):
+        return _conv2d(m, weight, bias)
+    return _linear(m, weight, bias)
+
+
+def _sign_weight(weight, alpha):
+    # the same as the forward of the BWN family
+    return _reshape_back(alpha * FunSign.apply(_reshape(weight) / alpha), weight)
+
+
+def _bn_fold(m):
+    """Eval-mode BN folding of Conv2dBN and Conv2dBNBWNS."""
+    bn = m._bn
+    mu, var = bn.running_mean, bn.running_var
+    if bn.affine:
+        gamma, beta = bn.weight, bn.bias
+    else:
+        gamma = torch.ones(m.out_channels).to(var.device)
+        beta = torch.zeros(m.out_channels).to(var.device)
+    A = gamma.div(torch.sqrt(var + bn.eps))
+    A_expand = A.expand_as(m.weight.transpose(0, -1)).transpose(0, -1)
+    weight_fold = m.weight * A_expand
+    if m.bias is None:
+        bias_fold = (- mu) * A + beta
+    else:
+        bias_fold = (m.bias - mu) * A + beta
+    return weight_fold, bias_fold
+
+
+def freeze_lsq(m):
+    if m.alpha is None:
+        return _frozen(m, m.weight)
+    alpha = m.alpha.view(-1, 1, 1, 1) if isinstance(m, nn.Conv2d) and m.q_mode == Qmodes.kernel_wise else m.alpha
+    return _frozen(m, FunLSQFused.apply(m.weight, alpha, m.g, m.Qn, m.Qp))
+
+
+def freeze_llsq(m):
+    if m.alpha is None:
+        return _frozen(m, m.weight)
+    w_reshape_q = FunLLSQ.apply(_reshape(m.weight), m.alpha, m.Qn, m.Qp, Qmodes.layer_wise, True, False, False)
+    return _frozen(m, _reshape_back(w_reshape_q, m.weight))
+
+
+def freeze_dnq(m):
+    if m.alpha is None:
+        return _frozen(m, m.weight)
+    alpha = grad_shift_scale(m.alpha, m.g)
+    return _frozen(m, round_pass((m.weight / alpha).clamp(m.Qn, m.Qp)) * alpha)
+
+
+def freeze_dnqv2(m):
+    if m.alpha is None:
+        return _frozen(m, m.weight)
+    w_reshape_q = FunLLSQS.apply(_reshape(m.weight), m.alpha, m.Qn, m.Qp, Qmodes.layer_wise, True, False)
+    return _frozen(m, _reshape_back(w_reshape_q, m.weight))
+
+
+def freeze_bwn(m):
+    if m.alpha is None:
+        return _frozen(m, m.weight)
+    return _frozen(m, _sign_weight(m.weight, m.alpha))
+
+
+def freeze_bwns(m):
+    if m.alpha is None:
+        return _frozen(m, m.weight)
+    return _frozen(m, _sign_weight(m.weight, m.alpha), shift_bias(m))
+
+
+def freeze_bn_bwns(m):
+    weight_fold, bias_fold = _bn_fold(m)
+    if m.alpha is None:
+        return _conv2d(m, weight_fold, bias_fold)
+    # the quantized forward adds the unfolded bias
+    return _conv2d(m, _sign_weight(weight_fold, m.alpha), shift_bias(m))
+
+
+def freeze_conv_bn(m):
+    return _conv2d(m, *_bn_fold(m))
+
+
+def freeze_q(m):
+    if m.running_scale is None:
+        return _frozen(m, m.weight)
+    if m.bias_bits > 0:
+        # the input is [x, scale_a], the bias is quantized per batch: keep the module
+        return m
+    scale = m.running_scale
+    if m.scale_bits > 0:
+        scale, _ = truncation(scale, m.scale_bits)
+    _, y = clip_quantize(_reshape(m.weight), m.nbits, scale)
+    # the same float ops as the straight-through `y.detach() + w - w.detach()` of the forward
+    return _frozen(m, _reshape_back(y, m.weight) + m.weight - m.weight)
+
+
+def freeze_cluster(m):
+    if m.centroids is None:
+        return _frozen(m, m.weight)
+    return _frozen(m, m.centroids[m.labels.long()])
+
+
+def freeze_ttq(m):
+    if getattr(m, 'mode', Qmodes.layer_wise) == Qmodes.kernel_wise:
+        return _frozen(m, Function_ternary_kernel.apply(m.weight, m.pos, m.neg, m.thresh_factor))
+    # Function_ternary is cuda only
+    thresh = m.thresh_factor * torch.max(torch.abs(m.weight))
+    w_t = m.pos * (m.weight > thresh).float() + m.neg * (m.weight < -thresh).float()
+    return _frozen(m, w_t)
+
+
+def freeze_tbq(m):
+    if isinstance(m, nn.Conv2d):
+        weight_pos, weight_neg = m.weight[:, :m.split_channel, :, :], m.weight[:, m.split_channel:, :, :]
+        fun = Function_binary
+    else:
+        weight_pos, weight_neg = m.weight[:, :m.split_channel], m.weight[:, m.split_channel:]
+        fun = Function_binary_fc
+    binary_weight = torch.cat([fun.apply(weight_pos, m.pos, m.pos_shift, True),
+                               fun.apply(weight_neg, m.neg, m.neg_shift, False)], dim=1)
+    return _frozen(m, binary_weight)
+
+
+def freeze_sq(m):
+    w_q = m.weight * m.mask if m.sparsity > 1e-5 else m.weight
+    if m.nbits_w > 0:
+        Qp = 2 ** (m.nbits_w - 1) - 1
+        w_q = FunLSQFused.apply(w_q, m.scale_w, 0., -Qp - 1, Qp)
+    conv = _conv2d(m, w_q, m.bias)
+    if m.nbits_a <= 0:
+        return conv
+    if m.signed_a:
+        Qn, Qp = -2 ** (m.nbits_a - 1), 2 ** (m.nbits_a - 1) - 1
+    else:
+        Qn, Qp = 0, 2 ** m.nbits_a - 1
+    return nn.Sequential(ActFixedQ(m.scale_a, Qn, Qp), conv)
+
+
+def freeze_npu(m):
+    return _conv2d(m, m.weight * m.mask, m.bias)
+
+
+def freeze_act_lsq(m):
+    if m.alpha is None:
+        return nn.Identity()
+    return ActFixedQ(m.alpha, m.Qn, m.Qp)
+
+
+def llsqs_rounding(m):
+    if m.kwargs_q['floor']:
+        return 'floor'
+    if m.kwargs_q['custom']:
+        return 'round_cus'
+    return 'round'
+
+
+def freeze_act_llsqs(m):
+    if m.alpha is None:
+        return nn.Identity()
+    return ActFixedQ(m.alpha, m.Qn, m.Qp, rounding=llsqs_rounding(m), zero_pass=True)
+
+
+def freeze_act_dnq(m):
+    if m.alpha is None:
+        return nn.Identity()
+    # the forward scales the gradient by the input size, the value is log_shift(alpha)
+    return ActFixedQ(log_shift(m.alpha), m.Qn, m.Qp, zero_pass=isinstance(m, my_nn.ActDNQ))
+
+
+def freeze_act_q(m):
+    if m.running_scale is None:
+        return nn.Identity()
+    if m.expand or m.split:
+        return m
+    scale = m.running_scale
+    if m.scale_bits > 0:
+        scale, _ = truncation(scale, nbits=m.scale_bits)
+    return ActFixedQ(scale, - 2 ** (m.nbits - 1), 2 ** (m.nbits - 1) - 1, out_scale=m.out_scale)
+
+
+freeze_functions = {
+    my_nn.Conv2dLSQ: freeze_lsq, my_nn.LinearLSQ: freeze_lsq,
+    my_nn.Conv2dLLSQ: freeze_llsq, my_nn.LinearLLSQ: freeze_llsq,
+    my_nn.Conv2dDNQ: freeze_dnq, my_nn.LinearDNQ: freeze_dnq,
+    my_nn.Conv2dDNQv2: freeze_dnqv2, my_nn.LinearDNQv2: freeze_dnqv2,
+    my_nn.Conv2dBWN: freeze_bwn, my_nn.Conv2dBWNS: freeze_bwns, Conv2dBWV: freeze_bwn,
+    my_nn.LinearBWN: freeze_bwn, my_nn.LinearBWNS: freeze_bwns,
+    my_nn.Conv2dBNBWNS: freeze_bn_bwns, my_nn.Conv2dBN: freeze_conv_bn,
+    my_nn.Conv2dQ: freeze_q, my_nn.Conv2dQv2: freeze_q, my_nn.LinearQ: freeze_q, my_nn.LinearQv2: freeze_q,
+    my_nn.Conv2dClusterQ: freeze_cluster,
+    my_nn.TTQ_CNN: freeze_ttq, my_nn.TTQ_Linear: freeze_ttq,
+    my_nn.Conv2dTBQ: freeze_tbq, my_nn.LinearTBQ: freeze_tbq,
+    my_nn.Conv2dSQ: freeze_sq,
+    my_nn.Conv2dNPU: freeze_npu,
+    my_nn.ActLSQ: freeze_act_lsq, my_nn.ActLLSQ: freeze_act_lsq,
+    my_nn.ActLLSQS: freeze_act_llsqs,
+    my_nn.ActDNQ: freeze_act_dnq, my_nn.ActDNQv2: freeze_act_dnq,
+    my_nn.ActQ: freeze_act_q, my_nn.ActQv2: freeze_act_q,
+}
+
+
+def freeze_quantized(model):
+    """
+    Replace every fake-quant module with its inference form, in place (like fuse_bn_recursively).
+    The eval-mode output is unchanged: the frozen weights are computed with the same ops as the forward.
+    ActQ/ActQv2/ActDNQ compute their output through straight-through float ops, so the frozen
+    activation may differ from them in the last bit.
+    Modules that cannot be frozen (e.g. bias_bits > 0, ActQ with expand/split, LSTMCellQ) are kept.
+    Only for evaluation: the quantizers are not trainable any more.
+    :param model: a trained (initialized) model
+    :return: the model
+    """
+    with torch.no_grad():
+        for module_name in model._modules:
+            m = model._modules[module_name]
+            if type(m) in freeze_functions:
+                frozen = freeze_functions[type(m)](m)
+                if frozen is not m:
+                    frozen.train(m.training)
+                    model._modules[module_name] = frozen
+                    continue
+            if len(m._modules) > 0:
+                freeze_quantized(m)
+    return model
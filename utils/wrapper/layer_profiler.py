@@ -0,0 +1,196 @@
+r"""
+    Per-module runtime and memory profile of a few training/evaluation iterations (see --profile-layers).
+    Every module forward is a `module::<name>` scope in a torch.profiler trace. From the trace:
+    - forward time, net allocated bytes and calls of every module;
+    - the time of the conv/linear ops inside a layer (compute) and the rest (quant: weight/input quantization,
+      masks ...); the whole forward of an activation quantizer is quant;
+    - backward time: the autograd nodes are matched to the module whose forward created them (sequence numbers).
+"""
+import json
+import threading
+
+import torch
+
+import models._modules as my_nn
+
+__all__ = ['LayerProfiler']
+
+MODULE_SCOPE = 'module::'
+COMPUTE_OPS = ('aten::conv1d', 'aten::conv2d', 'aten::convolution', 'aten::_convolution', 'aten::linear',
+               'aten::addmm', 'aten::mm', 'aten::bmm', 'aten::matmul', 'aten::einsum', 'aten::_int_mm',
+               'aten::lstm_cell')
+# RecordScope::BACKWARD_FUNCTION
+BACKWARD_SCOPE = 1
+
+act_quantizer_types = (my_nn._ActQ, my_nn.ActQ, my_nn.ActQv2, my_nn.PACT, my_nn.ActFixedQ, my_nn.ActShareQ)
+
+
+def _event_time(event, use_cuda):
+    """us"""
+    if use_cuda:
+        return getattr(event, 'device_time_total', getattr(event, 'cuda_time_total', 0))
+    return event.cpu_time_total
+
+
+def _event_memory(event):
+    return event.cpu_memory_usage + getattr(event, 'device_memory_usage', getattr(event, 'cuda_memory_usage', 0))
+
+
+def _walk_scope(event, name, sequence_owner, use_cuda):
+    """
+    The ops of a module scope, without the scopes of its submodules.
+    :return: the time of the outermost compute ops
+    """
+    compute = 0
+    stack = list(event.cpu_children)
+    while stack:
+        child = stack.pop()
+        if child.name.startswith(MODULE_SCOPE):
+            continue
+        if child.sequence_nr >= 0:
+            sequence_owner[child.sequence_nr] = name
+        if child.name in COMPUTE_OPS:
+            compute += _event_time(child, use_cuda)
+            # still collect the sequence numbers of the ops below
+            stack.extend(c for c in child.cpu_children if not c.name.startswith(MODULE_SCOPE))
+            continue
+        stack.extend(child.cpu_children)
+    return compute
+
+
+def summarize(events, modules, use_cuda):
+    """
+    :param events: torch.profiler events, with the module scopes
+    :param modules: {name: module}
+    :return: {name: stats}, times in ms (sum over the profiled iterations)
+    """
+    stats = {}
+    sequence_owner = {}
+    for event in events:
+        if not event.name.startswith(MODULE_SCOPE):
+            continue
+        name = event.name[len(MODULE_SCOPE):]
+        st = stats.setdefault(name, {'calls': 0, 'forward_ms': 0., 'compute_ms': 0., 'backward_ms': 0.,
+                                     'allocated_bytes': 0})
+        st['calls'] += 1
+        st['forward_ms'] += _event_time(event, use_cuda) / 1e3
+        st['allocated_bytes'] += _event_memory(event)
+        st['compute_ms'] += _walk_scope(event, name, sequence_owner, use_cuda) / 1e3
+    # the outermost backward nodes of the forward ops of every module
+    backward = [e for e in events if getattr(e, 'scope', None) == BACKWARD_SCOPE and e.sequence_nr in sequence_owner]
+    backward_ids = set(id(e) for e in backward)
+    for event in backward:
+        if id(event.cpu_parent) not in backward_ids:
+            stats[sequence_owner[event.sequence_nr]]['backward_ms'] += _event_time(event, use_cuda) / 1e3
+    for name, st in stats.items():
+        m = modules.get(name)
+        st['type'] = type(m).__name__
+        if isinstance(m, act_quantizer_types):
+            st['kind'] = 'quantizer'
+            st['quant_ms'] = st['forward_ms']
+        elif m is not None and len(m._modules) > 0:
+            st['kind'] = 'container'
+            st['quant_ms'] = 0.
+        elif st['compute_ms'] > 0:
+            st['kind'] = 'layer'
+            st['quant_ms'] = max(st['forward_ms'] - st['compute_ms'], 0.)
+        else:
+            st['kind'] = 'other'
+            st['quant_ms'] = 0.
+    return stats
+
+
+class LayerProfiler(object):
+    """
+    profiler = LayerProfiler(model, steps=10, skip=5, prefix='logger/x/profile_train', writer=writer)
+    profiler.start()
+    for ...:
+        train step
+        profiler.step()
+    profiler.stop()
+    The report is written when the `steps` profiled iterations are done: prefix + '.json',
+    the Chrome trace prefix + '_trace.json' and the TensorBoard scalars 'profile/<kind>/<name>/...'.
+    """
+
+    def __init__(self, model, steps, skip=2, prefix='profile', writer=None, global_step=0):
+        """
+        :param steps: the number of profiled iterations
+        :param skip: the iterations before them, not profiled (lazy init, cudnn benchmark ...)
+        """
+        self.model = model
+        self.steps = steps
+        self.prefix = prefix
+        self.writer = writer
+        self.global_step = global_step
+        self.report = None
+        self.modules = {name if name else type(model).__name__: m for name, m in model.named_modules()}
+        self.use_cuda = any(p.is_cuda for p in model.parameters())
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.use_cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=max(skip - 1, 0), warmup=min(skip, 1), active=steps, repeat=1),
+            on_trace_ready=self._on_trace_ready, profile_memory=True)
+        self._handles = []
+        # DataParallel runs the replicas (and their hooks) in concurrent threads: one scope stack per thread
+        self._local = threading.local()
+
+    def _scopes(self):
+        if not hasattr(self._local, 'scopes'):
+            self._local.scopes = []
+        return self._local.scopes
+
+    def _enter(self, name):
+        def hook(module, input):
+            scope = torch.autograd.profiler.record_function(MODULE_SCOPE + name)
+            scope.__enter__()
+            self._scopes().append(scope)
+
+        return hook
+
+    def _exit(self, module, input, output):
+        scopes = self._scopes()
+        if scopes:
+            scopes.pop().__exit__(None, None, None)
+
+    def start(self):
+        for name, m in self.modules.items():
+            self._handles.append(m.register_forward_pre_hook(self._enter(name)))
+            self._handles.append(m.register_forward_hook(self._exit))
+        self.profiler.start()
+        return self
+
+    def step(self):
+        if self.report is None:
+            self.profiler.step()
+
+    def stop(self):
+        if self.report is None:
+            self.profiler.stop()
+        self._remove_hooks()
+
+    def _remove_hooks(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def _on_trace_ready(self, prof):
+        self._remove_hooks()
+        prof.export_chrome_trace(self.prefix + '_trace.json')
+        stats = summarize(prof.events(), self.modules, self.use_cuda)
+        self.report = {'steps': self.steps, 'device': 'cuda' if self.use_cuda else 'cpu', 'modules': stats}
+        with open(self.prefix + '.json', 'w') as wf:
+            json.dump(self.report, wf, indent=2)
+        if self.writer is not None:
+            for name, st in stats.items():
+                if st['kind'] == 'container':
+                    continue
+                for k in ('forward_ms', 'backward_ms', 'quant_ms', 'allocated_bytes'):
+                    self.writer.add_scalar('profile/{}/{}/{}'.format(st['kind'], name, k), st[k] / self.steps,
+                                           self.global_step)
+        total = sum(st['forward_ms'] + st['backward_ms'] for st in stats.values() if st['kind'] != 'container')
+        quant = sum(st['quant_ms'] for st in stats.values())
+        print('=> layer profile of {} iterations in {}.json: {:.1f} ms/iter in the modules, '
+              '{:.1f} ms/iter quantizer overhead'.format(self.steps, self.prefix, total / self.steps,
+                                                         quant / self.steps))
@@ -19,6 +19,9 @@ def quantize_scale_and_bias(model, bias_bits=8, scale_bits=8):
         elif isinstance(module, LinearQv2) or isinstance(module, Conv2dQv2):
             module.set_scale_bits(nbits=scale_bits)
             module.set_bias_bits(nbits=bias_bits)
+        elif isinstance(module, (my_nn.Conv2dBWNS, my_nn.LinearBWNS, my_nn.Conv2dBNBWNS)):
+            # the scales are powers of two already, only the bias is quantized (see shift_bias)
+            module.set_bias_bits(nbits=bias_bits)
     return model
 
 is_first = True